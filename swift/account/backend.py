@@ -479,52 +479,53 @@ class AccountBroker(DatabaseBroker):
         def _really_merge_items(conn):
             max_rowid = -1
             curs = conn.cursor()
-            for rec in item_list:
-                rec.setdefault('storage_policy_index', 0)  # legacy
-                record = [rec['name'], rec['put_timestamp'],
-                          rec['delete_timestamp'], rec['object_count'],
-                          rec['bytes_used'], rec['deleted'],
-                          rec['storage_policy_index']]
-                query = '''
-                    SELECT name, put_timestamp, delete_timestamp,
-                           object_count, bytes_used, deleted,
-                           storage_policy_index
-                    FROM container WHERE name = ?
-                '''
-                if self.get_db_version(conn) >= 1:
-                    query += ' AND deleted IN (0, 1)'
-                curs_row = curs.execute(query, (rec['name'],))
-                curs_row.row_factory = None
-                row = curs_row.fetchone()
-                if row:
-                    row = list(row)
-                    for i in range(5):
-                        if record[i] is None and row[i] is not None:
-                            record[i] = row[i]
-                    if Timestamp(row[1]) > \
-                       Timestamp(record[1]):  # Keep newest put_timestamp
-                        record[1] = row[1]
-                    if Timestamp(row[2]) > \
-                       Timestamp(record[2]):  # Keep newest delete_timestamp
-                        record[2] = row[2]
-                    # If deleted, mark as such
-                    if Timestamp(record[2]) > Timestamp(record[1]) and \
-                            record[3] in (None, '', 0, '0'):
-                        record[5] = 1
-                    else:
-                        record[5] = 0
-                curs.execute('''
-                    DELETE FROM container WHERE name = ? AND
-                                                deleted IN (0, 1)
-                ''', (record[0],))
-                curs.execute('''
-                    INSERT INTO container (name, put_timestamp,
-                        delete_timestamp, object_count, bytes_used,
-                        deleted, storage_policy_index)
-                    VALUES (?, ?, ?, ?, ?, ?, ?)
-                ''', record)
-                if source:
-                    max_rowid = max(max_rowid, rec['ROWID'])
+            with self._batched_hash_updates(conn):
+                for rec in item_list:
+                    rec.setdefault('storage_policy_index', 0)  # legacy
+                    record = [rec['name'], rec['put_timestamp'],
+                              rec['delete_timestamp'], rec['object_count'],
+                              rec['bytes_used'], rec['deleted'],
+                              rec['storage_policy_index']]
+                    query = '''
+                        SELECT name, put_timestamp, delete_timestamp,
+                               object_count, bytes_used, deleted,
+                               storage_policy_index
+                        FROM container WHERE name = ?
+                    '''
+                    if self.get_db_version(conn) >= 1:
+                        query += ' AND deleted IN (0, 1)'
+                    curs_row = curs.execute(query, (rec['name'],))
+                    curs_row.row_factory = None
+                    row = curs_row.fetchone()
+                    if row:
+                        row = list(row)
+                        for i in range(5):
+                            if record[i] is None and row[i] is not None:
+                                record[i] = row[i]
+                        # Keep newest put_timestamp
+                        if Timestamp(row[1]) > Timestamp(record[1]):
+                            record[1] = row[1]
+                        # Keep newest delete_timestamp
+                        if Timestamp(row[2]) > Timestamp(record[2]):
+                            record[2] = row[2]
+                        # If deleted, mark as such
+                        if Timestamp(record[2]) > Timestamp(record[1]) and \
+                                record[3] in (None, '', 0, '0'):
+                            record[5] = 1
+                        else:
+                            record[5] = 0
+                    curs.execute('''
+                        DELETE FROM container WHERE name = ? AND
+                                                    deleted IN (0, 1)
+                    ''', (record[0],))
+                    curs.execute('''
+                        INSERT INTO container (name, put_timestamp,
+                            delete_timestamp, object_count, bytes_used,
+                            deleted, storage_policy_index)
+                        VALUES (?, ?, ?, ?, ?, ?, ?)
+                    ''', record)
+                    if source:
+                        max_rowid = max(max_rowid, rec['ROWID'])
             if source:
                 try:
                     curs.execute('''
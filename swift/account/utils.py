@@ -18,7 +18,7 @@ import time
 from xml.sax import saxutils
 
 from swift.common.swob import HTTPOk, HTTPNoContent
-from swift.common.utils import Timestamp
+from swift.common.utils import Timestamp, coalesced_app_iter
 from swift.common.storage_policy import POLICIES
 
 
@@ -69,6 +69,40 @@ def get_response_headers(broker):
     return resp_headers
 
 
+def _json_listing_iter(account_list):
+    """
+    Serialize an account listing to JSON one record at a time, producing the
+    same output as ``json.dumps`` of the complete list.
+    """
+    yield '['
+    separator = ''
+    for (name, object_count, bytes_used, is_subdir) in account_list:
+        if is_subdir:
+            data = {'subdir': name}
+        else:
+            data = {'name': name, 'count': object_count,
+                    'bytes': bytes_used}
+        yield separator + json.dumps(data)
+        separator = ', '
+    yield ']'
+
+
+def _xml_listing_iter(account, account_list):
+    """
+    Serialize an account listing to XML one record at a time.
+    """
+    yield '<?xml version="1.0" encoding="UTF-8"?>\n'
+    yield '<account name=%s>' % saxutils.quoteattr(account)
+    for (name, object_count, bytes_used, is_subdir) in account_list:
+        if is_subdir:
+            yield '\n<subdir name=%s />' % saxutils.quoteattr(name)
+        else:
+            yield '\n<container><name>%s</name><count>%s</count>' \
+                  '<bytes>%s</bytes></container>' % \
+                  (saxutils.escape(name), object_count, bytes_used)
+    yield '\n</account>'
+
+
 def account_listing_response(account, req, response_content_type, broker=None,
                              limit='', marker='', end_marker='', prefix='',
                              delimiter='', reverse=False):
@@ -80,36 +114,18 @@ def account_listing_response(account, req, response_content_type, broker=None,
     account_list = broker.list_containers_iter(limit, marker, end_marker,
                                                prefix, delimiter, reverse)
     if response_content_type == 'application/json':
-        data = []
-        for (name, object_count, bytes_used, is_subdir) in account_list:
-            if is_subdir:
-                data.append({'subdir': name})
-            else:
-                data.append({'name': name, 'count': object_count,
-                             'bytes': bytes_used})
-        account_list = json.dumps(data)
+        app_iter = coalesced_app_iter(_json_listing_iter(account_list))
     elif response_content_type.endswith('/xml'):
-        output_list = ['<?xml version="1.0" encoding="UTF-8"?>',
-                       '<account name=%s>' % saxutils.quoteattr(account)]
-        for (name, object_count, bytes_used, is_subdir) in account_list:
-            if is_subdir:
-                output_list.append(
-                    '<subdir name=%s />' % saxutils.quoteattr(name))
-            else:
-                item = '<container><name>%s</name><count>%s</count>' \
-                       '<bytes>%s</bytes></container>' % \
-                       (saxutils.escape(name), object_count, bytes_used)
-                output_list.append(item)
-        output_list.append('</account>')
-        account_list = '\n'.join(output_list)
+        app_iter = coalesced_app_iter(
+            _xml_listing_iter(account, account_list))
     else:
         if not account_list:
             resp = HTTPNoContent(request=req, headers=resp_headers)
             resp.content_type = response_content_type
             resp.charset = 'utf-8'
             return resp
-        account_list = '\n'.join(r[0] for r in account_list) + '\n'
-    ret = HTTPOk(body=account_list, request=req, headers=resp_headers)
+        app_iter = ['\n'.join(r[0] for r in account_list) + '\n']
+    ret = HTTPOk(app_iter=app_iter, request=req, headers=resp_headers)
     ret.content_type = response_content_type
     ret.charset = 'utf-8'
     return ret
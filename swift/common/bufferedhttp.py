@@ -28,6 +28,7 @@ BufferedHTTPResponse.
 
 from swift import gettext_ as _
 from swift.common import constraints
+from collections import deque
 import logging
 import time
 import socket
@@ -72,6 +73,8 @@ class BufferedHTTPResponse(HTTPResponse):
         self.length = _UNKNOWN          # number of bytes left in response
         self.will_close = _UNKNOWN      # conn will close at end of response
         self._readline_buffer = ''
+        # set when the connection came from a ConnectionPool
+        self._pooled_conn = None
 
     def expect_response(self):
         if self.fp:
@@ -139,6 +142,8 @@ class BufferedHTTPResponse(HTTPResponse):
         has references to it. Use this when you are certain that nobody else
         you care about has a reference to this socket.
         """
+        # the socket is going away, so the connection can't be reused
+        self._pooled_conn = None
         if self._real_socket:
             # this is idempotent; see sock_close in Modules/socketmodule.c in
             # the Python source for details.
@@ -146,10 +151,25 @@ class BufferedHTTPResponse(HTTPResponse):
         self._real_socket = None
         self.close()
 
+    @property
+    def reusable(self):
+        """
+        True if this response came over a pooled connection, has been read
+        to its end and the backend will keep the connection open, so that
+        closing the response can return the connection to its pool.
+        """
+        return bool(self._pooled_conn and not self.will_close and
+                    not self.chunked and self.length == 0 and
+                    not self._readline_buffer)
+
     def close(self):
+        pooled_conn = self._pooled_conn if self.reusable else None
+        self._pooled_conn = None
         HTTPResponse.close(self)
         self.sock = None
         self._real_socket = None
+        if pooled_conn:
+            pooled_conn.pool.put(pooled_conn)
 
 
 class BufferedHTTPConnection(HTTPConnection):
@@ -175,7 +195,22 @@ class BufferedHTTPConnection(HTTPConnection):
         return response
 
     def getresponse(self):
-        response = HTTPConnection.getresponse(self)
+        try:
+            response = HTTPConnection.getresponse(self)
+        except (httplib.BadStatusLine, socket.error):
+            if not getattr(self, '_reused', False) or \
+                    self._method not in ('GET', 'HEAD'):
+                raise
+            # The backend most likely closed the idle connection before our
+            # request reached it. We can't be sure that it wasn't acted
+            # upon, so only a GET or HEAD is sent again on a fresh
+            # connection.
+            self.close()
+            conn = self.pool.connect(*self._pool_key)
+            _send_request(conn, *self._request)
+            return conn.getresponse()
+        if getattr(self, 'pool', None):
+            response._pooled_conn = self
         logging.debug("HTTP PERF: %(time).5f seconds to %(method)s "
                       "%(host)s:%(port)s %(path)s)",
                       {'time': time.time() - self._connected_time,
@@ -184,8 +219,105 @@ class BufferedHTTPConnection(HTTPConnection):
         return response
 
 
+class ConnectionPool(object):
+    """
+    Keeps idle keep-alive connections to backend servers so that they can be
+    reused by later requests to the same (ip, port), saving the TCP set up
+    and slow start of a new connection.
+
+    A connection is returned to the pool when a response read from it to the
+    end is closed. Connections that have been idle for longer than
+    ``idle_timeout`` seconds are closed rather than reused.
+
+    :param max_idle_per_node: the most idle connections to keep per (ip, port)
+    :param idle_timeout: seconds an idle connection may be kept
+    :param logger: if given, a logger to count pool hits and misses with
+    """
+
+    def __init__(self, max_idle_per_node=8, idle_timeout=30.0, logger=None):
+        self.max_idle_per_node = max_idle_per_node
+        self.idle_timeout = idle_timeout
+        self.logger = logger
+        # (ip, port) -> deque of (time released, connection), oldest first
+        self._idle = {}
+        self._next_reap = 0
+        self.hits = self.misses = 0
+
+    def _count(self, metric):
+        if self.logger:
+            self.logger.increment('backend_pool.%s' % metric)
+
+    def reap(self, now=None):
+        """Close every connection that has been idle for too long."""
+        now = time.time() if now is None else now
+        self._next_reap = now + self.idle_timeout
+        for key, idle in list(self._idle.items()):
+            while idle and now - idle[0][0] >= self.idle_timeout:
+                idle.popleft()[1].close()
+            if not idle:
+                del self._idle[key]
+
+    def connect(self, ipaddr, port):
+        """
+        Make a new connection that will be returned to this pool once done
+        with.
+        """
+        conn = BufferedHTTPConnection('%s:%s' % (ipaddr, port))
+        conn.pool = self
+        conn._pool_key = (ipaddr, port)
+        conn._reused = False
+        return conn
+
+    def get(self, ipaddr, port):
+        """
+        Get an idle connection to (ipaddr, port), or a new one if there is
+        none.
+        """
+        now = time.time()
+        if now >= self._next_reap:
+            self.reap(now)
+        idle = self._idle.get((ipaddr, port))
+        while idle:
+            # the most recently used connection has the warmest window
+            released, conn = idle.pop()
+            if now - released < self.idle_timeout:
+                self.hits += 1
+                self._count('hit')
+                conn._reused = True
+                return conn
+            conn.close()
+        self.misses += 1
+        self._count('miss')
+        return self.connect(ipaddr, port)
+
+    def put(self, conn):
+        """Return a connection that is ready for another request."""
+        conn._reused = False
+        idle = self._idle.setdefault(conn._pool_key, deque())
+        if conn.sock is None or len(idle) >= self.max_idle_per_node:
+            conn.close()
+            return
+        idle.append((time.time(), conn))
+
+    def close(self):
+        """Close every idle connection."""
+        for idle in self._idle.values():
+            for _released, conn in idle:
+                conn.close()
+        self._idle.clear()
+
+
+def _send_request(conn, method, path, headers):
+    conn.path = path
+    conn.putrequest(method, path, skip_host=(headers and 'Host' in headers))
+    if headers:
+        for header, value in headers.items():
+            conn.putheader(header, str(value))
+    conn.endheaders()
+
+
 def http_connect(ipaddr, port, device, partition, method, path,
-                 headers=None, query_string=None, ssl=False):
+                 headers=None, query_string=None, ssl=False, pool=None):
     """
     Helper function to create an HTTPConnection object. If ssl is set True,
     HTTPSConnection will be used. However, if ssl=False, BufferedHTTPConnection
@@ -200,6 +332,8 @@ def http_connect(ipaddr, port, device, partition, method, path,
     :param headers: dictionary of headers
     :param query_string: request query string
     :param ssl: set True if SSL should be used (default: False)
+    :param pool: a ConnectionPool to take the connection from; only for
+                 requests without a body
     :returns: HTTPConnection object
     """
     if isinstance(path, six.text_type):
@@ -213,12 +347,15 @@ def http_connect(ipaddr, port, device, partition, method, path,
         except UnicodeError as e:
             logging.exception(_('Error encoding to UTF-8: %s'), str(e))
     path = quote('/' + device + '/' + str(partition) + path)
+    if pool:
+        return http_connect_raw(ipaddr, port, method, path, headers,
+                                query_string, ssl, pool=pool)
     return http_connect_raw(
         ipaddr, port, method, path, headers, query_string, ssl)
 
 
 def http_connect_raw(ipaddr, port, method, path, headers=None,
-                     query_string=None, ssl=False):
+                     query_string=None, ssl=False, pool=None):
     """
     Helper function to create an HTTPConnection object. If ssl is set True,
     HTTPSConnection will be used. However, if ssl=False, BufferedHTTPConnection
@@ -231,20 +368,35 @@ def http_connect_raw(ipaddr, port, method, path, headers=None,
     :param headers: dictionary of headers
     :param query_string: request query string
     :param ssl: set True if SSL should be used (default: False)
+    :param pool: a ConnectionPool to take the connection from; only for
+                 requests without a body
     :returns: HTTPConnection object
     """
     if not port:
         port = 443 if ssl else 80
+    if query_string:
+        path += '?' + query_string
+    if pool and not ssl:
+        # the connection is to be kept alive for the next request
+        if headers:
+            headers = dict((k, v) for k, v in headers.items()
+                           if k.lower() != 'connection')
+        conn = pool.get(ipaddr, port)
+        conn._request = (method, path, headers)
+        try:
+            _send_request(conn, method, path, headers)
+        except socket.error:
+            if not conn._reused:
+                raise
+            # the backend has closed the idle connection; use a new one
+            conn.close()
+            conn = pool.connect(ipaddr, port)
+            conn._request = (method, path, headers)
+            _send_request(conn, method, path, headers)
+        return conn
     if ssl:
         conn = HTTPSConnection('%s:%s' % (ipaddr, port))
     else:
         conn = BufferedHTTPConnection('%s:%s' % (ipaddr, port))
-    if query_string:
-        path += '?' + query_string
-    conn.path = path
-    conn.putrequest(method, path, skip_host=(headers and 'Host' in headers))
-    if headers:
-        for header, value in headers.items():
-            conn.putheader(header, str(value))
-    conn.endheaders()
+    _send_request(conn, method, path, headers)
     return conn
@@ -21,6 +21,7 @@ import json
 import logging
 import os
 from uuid import uuid4
+import struct
 import sys
 import time
 import errno
@@ -161,6 +162,35 @@ def chexor(old, name, timestamp):
     return '%032x' % (int(old, 16) ^ int(new, 16))
 
 
+_unpack_md5 = struct.Struct('>QQ').unpack
+
+
+def chexor_batch(old, items):
+    """
+    Fold a batch of entries into a rolling DB hash in one go. The result is
+    the same as calling :func:`chexor` for each entry in turn, but the hash
+    is only converted from and to hex once, and each entry's md5 is XORed in
+    as a pair of 64-bit integers, which is much cheaper for large batches.
+
+    :param old: hex representation of the current DB hash
+    :param items: an iterable of (name, timestamp) pairs
+    :returns: a hex representation of the new hash value
+    """
+    old = int(old, 16)
+    high, low = old >> 64, old & 0xffffffffffffffff
+    md5 = hashlib.md5
+    for name, timestamp in items:
+        if name is None:
+            raise Exception('name is None!')
+        entry = '%s-%s' % (name, timestamp)
+        if isinstance(entry, six.text_type):
+            entry = entry.encode('utf8')
+        entry_high, entry_low = _unpack_md5(md5(entry).digest())
+        high ^= entry_high
+        low ^= entry_low
+    return '%016x%016x' % (high, low)
+
+
 def get_db_connection(path, timeout=30, okay_to_create=False):
     """
     Returns a properly configured SQLite database connection.
@@ -479,6 +509,35 @@ class DatabaseBroker(object):
 
             conn.commit()
 
+    @contextmanager
+    def _batched_hash_updates(self, conn):
+        """
+        Use within a transaction that inserts or deletes many rows. The DB's
+        triggers normally fold each row into the DB's hash as it is inserted
+        or deleted; within this context their hash updates are deferred and
+        then folded into the hash in one go with :func:`chexor_batch`.
+
+        :param conn: the connection of the transaction
+        """
+        pending = []
+
+        def defer_chexor(old, name, timestamp):
+            if name is None:
+                raise Exception('name is None!')
+            pending.append((name, timestamp))
+            return old
+
+        conn.create_function('chexor', 3, defer_chexor)
+        try:
+            yield
+        finally:
+            conn.create_function('chexor', 3, chexor)
+        if pending:
+            old = conn.execute('SELECT hash FROM %s_stat' %
+                               self.db_type).fetchone()[0]
+            conn.execute('UPDATE %s_stat SET hash = ?' % self.db_type,
+                         (chexor_batch(old, pending),))
+
     def get_items_since(self, start, count):
         """
         Get a list of objects in the database between start and end.
@@ -495,6 +554,122 @@ class DatabaseBroker(object):
             curs.row_factory = dict_factory
             return [r for r in curs]
 
+    def _name_range_query(self, columns, lower, upper, suffix=''):
+        """
+        Build a query over the rows whose names fall in the namespace
+        ``lower < name <= upper``; an empty ``upper`` is unbounded.
+
+        :returns: a tuple of (query, args)
+        """
+        query = 'SELECT %s FROM %s WHERE name > ?' % (
+            columns, self.db_contains_type)
+        args = [lower]
+        if upper:
+            query += ' AND name <= ?'
+            args.append(upper)
+        return query + ' ' + suffix, args
+
+    def get_range_digests(self, ranges, chunk_size=1000):
+        """
+        Compute a digest of the rows in each of a list of name ranges. A
+        range's digest is the XOR of an md5 of each of its rows' columns, so
+        replicas holding the same rows agree on it regardless of the order in
+        which the rows were added.
+
+        Each range is read in chunks of ``chunk_size`` rows, in ROWID order
+        since the digest doesn't depend on the order of the rows, and the db
+        connection is given up between chunks so that hashing a big range
+        doesn't starve other requests.
+
+        :param ranges: a list of (lower, upper) name ranges, each the
+                       namespace ``lower < name <= upper`` with an empty
+                       ``upper`` being unbounded
+        :param chunk_size: the number of rows to read at a time
+        :returns: a list of [hex digest, row count], one per range
+        """
+        self._commit_puts_stale_ok()
+        digests = []
+        for lower, upper in ranges:
+            digest = 0
+            count = 0
+            last_rowid = -1
+            while True:
+                with self.get() as conn:
+                    query, args = self._name_range_query(
+                        '*', lower, upper,
+                        'AND ROWID > ? ORDER BY ROWID LIMIT ?')
+                    curs = conn.execute(query, args + [last_rowid,
+                                                       chunk_size])
+                    rows = curs.fetchall()
+                    columns = [col[0] for col in curs.description]
+                if not rows:
+                    break
+                rowid_index = columns.index('ROWID')
+                keys = sorted((key, i) for i, key in enumerate(columns)
+                              if i != rowid_index)
+                for row in rows:
+                    row_hash = hashlib.md5('\x00'.join(
+                        '%s=%s' % (key, row[i]) for key, i in keys))
+                    digest ^= int(row_hash.hexdigest(), 16)
+                count += len(rows)
+                last_rowid = rows[-1][rowid_index]
+                if len(rows) < chunk_size:
+                    break
+                sleep()
+            digests.append(['%032x' % digest, count])
+        return digests
+
+    def split_name_range(self, lower, upper, parts, max_rows=None):
+        """
+        Split a name range into sub-ranges holding roughly equal numbers of
+        local rows.
+
+        :param lower: the exclusive lower bound of the range
+        :param upper: the inclusive upper bound of the range; empty means
+                      unbounded
+        :param parts: the number of sub-ranges to split the range into
+        :param max_rows: if given, split the range into more sub-ranges if
+                         need be so that none holds more than this many rows
+        :returns: a list of (lower, upper) name ranges covering the range
+        """
+        self._commit_puts_stale_ok()
+        with self.get() as conn:
+            query, args = self._name_range_query(
+                'COUNT(*)', lower, upper)
+            count = conn.execute(query, args).fetchone()[0]
+            if max_rows:
+                parts = max(parts, -(-count // max_rows))
+            if count < parts:
+                return [(lower, upper)]
+            # round up, so the last sub-range doesn't get the remainder
+            step = -(-count // parts)
+            query, args = self._name_range_query(
+                'name', lower, upper, 'ORDER BY name')
+            bounds = [lower]
+            for i, row in enumerate(conn.execute(query, args), 1):
+                if i % step == 0 and i < count:
+                    bounds.append(row[0])
+        return list(zip(bounds, bounds[1:] + [upper]))
+
+    def get_items_in_range(self, lower, upper, count):
+        """
+        Get the rows whose names fall in a name range, in name order.
+
+        :param lower: the exclusive lower bound of the range
+        :param upper: the inclusive upper bound of the range; empty means
+                      unbounded
+        :param count: number to get
+        :returns: list of rows in the form returned by
+                  :meth:`get_items_since`
+        """
+        self._commit_puts_stale_ok()
+        with self.get() as conn:
+            query, args = self._name_range_query(
+                '*', lower, upper, 'ORDER BY name LIMIT ?')
+            curs = conn.execute(query, args + [count])
+            curs.row_factory = dict_factory
+            return [r for r in curs]
+
     def get_sync(self, id, incoming=True):
         """
         Gets the most recent sync point for a server from the sync table.
@@ -818,10 +993,11 @@ class DatabaseBroker(object):
                                        self.pending_timeout):
                 self._commit_puts()
         with self.get() as conn:
-            conn.execute('''
-                DELETE FROM %s WHERE deleted = 1 AND %s < ?
-            ''' % (self.db_contains_type, self.db_reclaim_timestamp),
-                (age_timestamp,))
+            with self._batched_hash_updates(conn):
+                conn.execute('''
+                    DELETE FROM %s WHERE deleted = 1 AND %s < ?
+                ''' % (self.db_contains_type, self.db_reclaim_timestamp),
+                    (age_timestamp,))
             try:
                 conn.execute('''
                     DELETE FROM outgoing_sync WHERE updated_at < ?
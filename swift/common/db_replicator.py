@@ -163,6 +163,8 @@ class Replicator(Daemon):
         self._local_device_ids = set()
         self.per_diff = int(conf.get('per_diff', 1000))
         self.max_diffs = int(conf.get('max_diffs') or 100)
+        self.digest_sync = config_true_value(conf.get('digest_sync', 'no'))
+        self.digest_fanout = max(2, int(conf.get('digest_fanout', 16)))
         self.interval = int(conf.get('interval') or
                             conf.get('run_pause') or 30)
         self.node_timeout = float(conf.get('node_timeout', 10))
@@ -198,7 +200,7 @@ class Replicator(Daemon):
                       'no_change': 0, 'hashmatch': 0, 'rsync': 0, 'diff': 0,
                       'remove': 0, 'empty': 0, 'remote_merge': 0,
                       'start': time.time(), 'diff_capped': 0,
-                      'failure_nodes': {}}
+                      'digest': 0, 'failure_nodes': {}}
 
     def _report_stats(self):
         """Report the current stats to the logs."""
@@ -221,7 +223,7 @@ class Replicator(Daemon):
         self.logger.info(' '.join(['%s:%s' % item for item in
                          self.stats.items() if item[0] in
                          ('no_change', 'hashmatch', 'rsync', 'diff', 'ts_repl',
-                          'empty', 'diff_capped')]))
+                          'empty', 'diff_capped', 'digest')]))
 
     def _add_failure_stats(self, failure_devs_info):
         for node, dev in failure_devs_info:
@@ -348,6 +350,143 @@ class Replicator(Daemon):
                 return True
         return False
 
+    def _digest_sync_db(self, broker, http, remote_id, local_id):
+        """
+        Sync a db by comparing digests of name ranges with the remote
+        replica and sending only the rows of the ranges that differ. A range
+        that differs and holds more than per_diff local rows is split into
+        digest_fanout sub-ranges that are compared in turn, so replicas that
+        have diverged in a few places are repaired without sending the whole
+        db.
+
+        The db is first split into at least digest_fanout ranges, and no
+        request asks the remote for the digests of more than about
+        per_diff * max_diffs local rows, so that each request can be
+        answered within node_timeout however big the db is.
+
+        :param broker: database broker object
+        :param http: ReplConnection object for the remote server
+        :param remote_id: database id for the remote replica
+        :param local_id: database id for the local replica
+
+        :returns: True if the remote replica now has every local row, False
+                  on failure, or None if the remote server doesn't support
+                  digest requests or didn't answer the first of them
+        """
+        self.stats['digest'] += 1
+        self.logger.increment('digest_syncs')
+        self.logger.debug('Syncing %s with %s by range digests',
+                          broker, http.host)
+        return self._sync_range_digests(broker, http, remote_id, local_id)
+
+    def _digest_batches(self, ranges, local_digests, max_rows):
+        """
+        Group name ranges into batches of consecutive ranges that hold no
+        more than max_rows local rows between them, except where a single
+        range holds more.
+        """
+        batch = []
+        rows = 0
+        for name_range, (_junk, count) in zip(ranges, local_digests):
+            if batch and rows + count > max_rows:
+                yield batch
+                batch = []
+                rows = 0
+            batch.append(name_range)
+            rows += count
+        if batch:
+            yield batch
+
+    def _sync_range_digests(self, broker, http, remote_id, local_id):
+        sync_table = broker.get_syncs()
+        point = broker.get_max_row()
+        max_rows = self.per_diff * self.max_diffs
+        ranges = broker.split_name_range('', '', self.digest_fanout,
+                                         max_rows=max_rows)
+        diffs = 0
+        first = True
+        while ranges:
+            local_digests = broker.get_range_digests(ranges)
+            remote_digests = []
+            for batch in self._digest_batches(ranges, local_digests,
+                                              max_rows):
+                with Timeout(self.node_timeout):
+                    response = http.replicate('get_range_digests', batch)
+                if not response:
+                    # the request failed or timed out, and the response may
+                    # still arrive; close the connection so that whatever
+                    # comes next is sent on a new one
+                    http.close()
+                    if first:
+                        # leave the db to the diff or rsync fallback
+                        self.logger.warning(
+                            _('No response syncing %(db)s with %(host)s by '
+                              'range digests'),
+                            {'db': broker, 'host': http.host})
+                        return None
+                    return False
+                if not 200 <= response.status < 300:
+                    return None if first else False
+                first = False
+                batch_digests = json.loads(response.data)
+                if len(batch_digests) != len(batch):
+                    return False
+                remote_digests.extend(batch_digests)
+            next_ranges = []
+            for (lower, upper), (digest, count), (remote_digest, _junk) in \
+                    zip(ranges, local_digests, remote_digests):
+                if digest == remote_digest:
+                    continue
+                if count > self.per_diff:
+                    sub_ranges = broker.split_name_range(
+                        lower, upper, self.digest_fanout)
+                    if len(sub_ranges) > 1:
+                        next_ranges.extend(sub_ranges)
+                        continue
+                marker = lower
+                while True:
+                    if diffs >= self.max_diffs:
+                        self.logger.debug(
+                            'Synchronization for %s by range digests has '
+                            'sent %s rows; moving on and will try again next '
+                            'pass.', broker, self.max_diffs * self.per_diff)
+                        self.stats['diff_capped'] += 1
+                        self.logger.increment('diff_caps')
+                        return False
+                    objects = broker.get_items_in_range(
+                        marker, upper, self.per_diff)
+                    if not objects:
+                        break
+                    diffs += 1
+                    # the rows aren't sent in ROWID order, so don't let the
+                    # remote move its sync point for us
+                    with Timeout(self.node_timeout):
+                        response = http.replicate('merge_items', objects,
+                                                  None)
+                    if not response or \
+                            not 200 <= response.status < 300:
+                        if response:
+                            self.logger.error(
+                                _('ERROR Bad response %(status)s from '
+                                  '%(host)s'),
+                                {'status': response.status,
+                                 'host': http.host})
+                        return False
+                    if len(objects) < self.per_diff:
+                        break
+                    marker = objects[-1]['name']
+            ranges = next_ranges
+        # every row up to point is now on the remote
+        sync_table.append({'remote_id': local_id, 'sync_point': point})
+        with Timeout(self.node_timeout):
+            response = http.replicate('merge_syncs', sync_table)
+        if response and 200 <= response.status < 300:
+            broker.merge_syncs([{'remote_id': remote_id,
+                                 'sync_point': point}],
+                               incoming=False)
+            return True
+        return False
+
     def _in_sync(self, rinfo, info, broker, local_sync):
         """
         Determine whether or not two replicas of a databases are considered
@@ -433,13 +572,24 @@ class Replicator(Daemon):
             local_sync = broker.get_sync(rinfo['id'], incoming=False)
             if self._in_sync(rinfo, info, broker, local_sync):
                 return True
+            remote_merge = rinfo['max_row'] / float(info['max_row']) < 0.5 \
+                and info['max_row'] - rinfo['max_row'] > self.per_diff
+            # when there are more rows to send than diffs can send in one
+            # pass, or the remote has so few rows that we'd rsync, compare
+            # range digests and send only the rows the remote is missing
+            if self.digest_sync and (remote_merge or (
+                    info['max_row'] - max(rinfo['point'], local_sync) >
+                    self.per_diff * self.max_diffs)):
+                success = self._digest_sync_db(broker, http, rinfo['id'],
+                                               info['id'])
+                if success is not None:
+                    return success
             # if the difference in rowids between the two differs by
             # more than 50% and the difference is greater than per_diff,
             # rsync then do a remote merge.
             # NOTE: difference > per_diff stops us from dropping to rsync
             # on smaller containers, who have only a few rows to sync.
-            if rinfo['max_row'] / float(info['max_row']) < 0.5 and \
-                    info['max_row'] - rinfo['max_row'] > self.per_diff:
+            if remote_merge:
                 self.stats['remote_merge'] += 1
                 self.logger.increment('remote_merges')
                 return self._rsync_db(broker, node, http, info['id'],
@@ -798,6 +948,13 @@ class ReplicatorRpc(object):
         broker.merge_items(args[0], args[1])
         return HTTPAccepted()
 
+    def get_range_digests(self, broker, args):
+        ranges = args[0] if args else None
+        if not isinstance(ranges, list) or not all(
+                isinstance(r, (list, tuple)) and len(r) == 2 for r in ranges):
+            return HTTPBadRequest(body='Invalid name ranges')
+        return Response(json.dumps(broker.get_range_digests(ranges)))
+
     def complete_rsync(self, drive, db_file, args):
         old_filename = os.path.join(self.root, drive, 'tmp', args[0])
         if os.path.exists(db_file):
@@ -248,6 +248,77 @@ def direct_delete_container(node, part, account, container, conn_timeout=5,
               'Container', conn_timeout, response_timeout)
 
 
+def direct_get_container_shard_ranges(node, part, account, container,
+                                      includes=None, conn_timeout=5,
+                                      response_timeout=15):
+    """
+    Get the shard ranges of a container directly from the container server.
+
+    :param node: node dictionary from the ring
+    :param part: partition the container is on
+    :param account: account name
+    :param container: container name
+    :param includes: only get the shard range that includes this object name
+    :param conn_timeout: timeout in seconds for establishing the connection
+    :param response_timeout: timeout in seconds for getting the response
+    :returns: a tuple of (response headers, a list of shard range dicts)
+    :raises ClientException: HTTP GET request failed
+    """
+    path = '/%s/%s' % (account, container)
+    qs = 'format=json'
+    if includes is not None:
+        qs += '&includes=%s' % quote(includes)
+    headers = gen_headers({'X-Backend-Record-Type': 'shard'})
+    with Timeout(conn_timeout):
+        conn = http_connect(node['ip'], node['port'], node['device'], part,
+                            'GET', path, query_string=qs, headers=headers)
+    with Timeout(response_timeout):
+        resp = conn.getresponse()
+        body = resp.read()
+    if not is_success(resp.status):
+        raise DirectClientException('Container', 'GET', node, part, path,
+                                    resp)
+    resp_headers = HeaderKeyDict(resp.getheaders())
+    if resp_headers.get('X-Backend-Record-Type') != 'shard':
+        # an older container server ignored the request for shard ranges
+        return resp_headers, []
+    return resp_headers, json.loads(body)
+
+
+def direct_put_container_shard_ranges(node, part, account, container,
+                                      shard_ranges, conn_timeout=5,
+                                      response_timeout=15, headers=None):
+    """
+    Merge shard ranges into a container directly on the container server.
+
+    :param node: node dictionary from the ring
+    :param part: partition the container is on
+    :param account: account name
+    :param container: container name
+    :param shard_ranges: a list of shard range dicts
+    :param conn_timeout: timeout in seconds for establishing the connection
+    :param response_timeout: timeout in seconds for getting the response
+    :param headers: additional headers to include in the request
+    :raises ClientException: HTTP PUT request failed
+    """
+    path = '/%s/%s' % (account, container)
+    body = json.dumps(shard_ranges)
+    headers = gen_headers(headers, add_ts=True)
+    headers['X-Backend-Record-Type'] = 'shard'
+    headers['Content-Type'] = 'application/json'
+    headers['Content-Length'] = str(len(body))
+    with Timeout(conn_timeout):
+        conn = http_connect(node['ip'], node['port'], node['device'], part,
+                            'PUT', path, headers=headers)
+    conn.send(body)
+    with Timeout(response_timeout):
+        resp = conn.getresponse()
+        resp.read()
+    if not is_success(resp.status):
+        raise DirectClientException('Container', 'PUT', node, part, path,
+                                    resp)
+
+
 def direct_put_container_object(node, part, account, container, obj,
                                 conn_timeout=5, response_timeout=15,
                                 headers=None):
@@ -101,6 +101,10 @@ class DiskFileDeviceUnavailable(DiskFileError):
     pass
 
 
+class DiskFileDeviceBusy(DiskFileError):
+    pass
+
+
 class DiskFileXattrNotSupported(DiskFileError):
     pass
 
@@ -45,16 +45,20 @@ http://github.com/memcached/memcached/blob/1.4.2/doc/protocol.txt
 """
 
 import six.moves.cPickle as pickle
+import binascii
 import json
 import logging
+import math
+import struct
 import time
-from bisect import bisect
+from bisect import bisect, bisect_left
+from collections import defaultdict
 from swift import gettext_ as _
 from hashlib import md5
 
 from eventlet.green import socket
 from eventlet.pools import Pool
-from eventlet import Timeout
+from eventlet import GreenPile, Timeout
 from six.moves import range
 from swift.common import utils
 
@@ -66,6 +70,7 @@ IO_TIMEOUT = 2.0
 PICKLE_FLAG = 1
 JSON_FLAG = 2
 NODE_WEIGHT = 50
+KETAMA_POINTS = 160
 PICKLE_PROTOCOL = 2
 TRY_COUNT = 3
 
@@ -136,29 +141,88 @@ class MemcacheConnPool(Pool):
 class MemcacheRing(object):
     """
     Simple, consistent-hashed memcache client.
+
+    With noreply set, sets and deletes are sent with memcached's noreply
+    option and the connection goes straight back to the pool without
+    waiting for the server to acknowledge them, so the next request on it
+    is pipelined behind them.
+
+    Keys are spread over the servers by swift's own consistent hash, or,
+    with ketama set, by the ketama continuum used by libmemcached and other
+    clients. Either way a server's share of the keys follows its weight.
     """
 
     def __init__(self, servers, connect_timeout=CONN_TIMEOUT,
                  io_timeout=IO_TIMEOUT, pool_timeout=POOL_TIMEOUT,
                  tries=TRY_COUNT, allow_pickle=False, allow_unpickle=False,
-                 max_conns=2):
-        self._ring = {}
-        self._errors = dict(((serv, []) for serv in servers))
-        self._error_limited = dict(((serv, 0) for serv in servers))
-        for server in sorted(servers):
-            for i in range(NODE_WEIGHT):
-                self._ring[md5hash('%s-%s' % (server, i))] = server
-        self._tries = tries if tries <= len(servers) else len(servers)
-        self._sorted = sorted(self._ring)
-        self._client_cache = dict(((server,
-                                    MemcacheConnPool(server, max_conns,
-                                                     connect_timeout))
-                                  for server in servers))
+                 max_conns=2, noreply=False, weights=None, ketama=False):
         self._connect_timeout = connect_timeout
         self._io_timeout = io_timeout
         self._pool_timeout = pool_timeout
+        self._max_conns = max_conns
+        self._max_tries = tries
+        self._ketama = ketama
         self._allow_pickle = allow_pickle
         self._allow_unpickle = allow_unpickle or allow_pickle
+        self._noreply = ' noreply' if noreply else ''
+        self._client_cache = {}
+        self._errors = {}
+        self._error_limited = {}
+        self.set_servers(servers, weights)
+
+    def set_servers(self, servers, weights=None):
+        """
+        Spreads keys over a new list of servers. Connections to the servers
+        that remain are kept, and so, by the consistent hash, are most of
+        the keys they hold.
+
+        :param servers: list of servers
+        :param weights: dict of each server's relative weight, if not 1
+        """
+        weights = weights or {}
+        ring = {}
+        if self._ketama:
+            total_weight = sum(weights.get(server, 1) for server in servers)
+            for server in servers:
+                share = float(weights.get(server, 1)) / total_weight
+                for i in range(int(math.floor(
+                        share * len(servers) * KETAMA_POINTS / 4))):
+                    digest = md5('%s-%d' % (server, i)).digest()
+                    for point in struct.unpack('<4I', digest):
+                        ring[point] = server
+        else:
+            for server in sorted(servers):
+                for i in range(NODE_WEIGHT * weights.get(server, 1)):
+                    ring[md5hash('%s-%s' % (server, i))] = server
+        points = sorted(ring)
+        tries = min(self._max_tries, len(servers))
+        # the servers to try, in turn, for a key that lands on each point
+        servers_at = []
+        for pos in range(len(points)):
+            to_try = []
+            for i in range(pos, pos + len(points)):
+                server = ring[points[i % len(points)]]
+                if server not in to_try:
+                    to_try.append(server)
+                    if len(to_try) == tries:
+                        break
+            servers_at.append(tuple(to_try))
+
+        for server in servers:
+            if server not in self._client_cache:
+                self._client_cache[server] = MemcacheConnPool(
+                    server, self._max_conns, self._connect_timeout)
+                self._errors[server] = []
+                self._error_limited[server] = 0
+        for server in list(self._client_cache):
+            if server not in servers:
+                del self._client_cache[server]
+                del self._errors[server]
+                del self._error_limited[server]
+        self._ring = ring
+        self._sorted = points
+        self._servers_at = servers_at
+        self._tries = tries
 
     def _exception_occurred(self, server, e, action='talking',
                             sock=None, fp=None, got_connection=True):
@@ -184,6 +248,9 @@ class MemcacheRing(object):
             # We need to return something to the pool
             # A new connection will be created the next time it is retrieved
             self._return_conn(server, None, None)
+        if server not in self._errors:
+            # the server has been dropped from the ring
+            return
         now = time.time()
         self._errors[server].append(time.time())
         if len(self._errors[server]) > ERROR_LIMIT_COUNT:
@@ -198,20 +265,17 @@ class MemcacheRing(object):
         Retrieves a server conn from the pool, or connects a new one.
         Chooses the server based on a consistent hash of "key".
         """
-        pos = bisect(self._sorted, key)
-        served = []
-        while len(served) < self._tries:
-            pos = (pos + 1) % len(self._sorted)
-            server = self._ring[self._sorted[pos]]
-            if server in served:
+        for server in self._servers_for(key):
+            if self._error_limited.get(server, 0) > time.time():
                 continue
-            served.append(server)
-            if self._error_limited[server] > time.time():
+            pool = self._client_cache.get(server)
+            if pool is None:
+                # set_servers dropped the server since we started
                 continue
             sock = None
             try:
                 with MemcachePoolTimeout(self._pool_timeout):
-                    fp, sock = self._client_cache[server].get()
+                    fp, sock = pool.get()
                 yield server, fp, sock
             except MemcachePoolTimeout as e:
                 self._exception_occurred(
@@ -224,9 +288,30 @@ class MemcacheRing(object):
                 self._exception_occurred(
                     server, e, action='connecting', sock=sock)
 
+    def _servers_for(self, key):
+        """
+        Returns the servers to try in turn for a hashed key.
+        """
+        if not self._sorted:
+            return ()
+        if self._ketama:
+            # the continuum is searched with the first four bytes of the
+            # key's md5, as an unsigned little-endian int
+            point = struct.unpack('<I', binascii.unhexlify(key[:8]))[0]
+            pos = bisect_left(self._sorted, point)
+        else:
+            pos = bisect(self._sorted, key) + 1
+        return self._servers_at[pos % len(self._sorted)]
+
     def _return_conn(self, server, fp, sock):
         """Returns a server connection to the pool."""
-        self._client_cache[server].put((fp, sock))
+        pool = self._client_cache.get(server)
+        if pool is not None:
+            pool.put((fp, sock))
+        elif sock is not None:
+            # the server has been dropped from the ring
+            fp.close()
+            sock.close()
 
     def set(self, key, value, serialize=True, time=0,
             min_compress_len=0):
@@ -256,10 +341,12 @@ class MemcacheRing(object):
         for (server, fp, sock) in self._get_conns(key):
             try:
                 with Timeout(self._io_timeout):
-                    sock.sendall('set %s %d %d %s\r\n%s\r\n' %
-                                 (key, flags, timeout, len(value), value))
-                    # Wait for the set to complete
-                    fp.readline()
+                    sock.sendall('set %s %d %d %s%s\r\n%s\r\n' %
+                                 (key, flags, timeout, len(value),
+                                  self._noreply, value))
+                    if not self._noreply:
+                        # Wait for the set to complete
+                        fp.readline()
                     self._return_conn(server, fp, sock)
                     return
             except (Exception, Timeout) as e:
@@ -374,9 +461,10 @@ class MemcacheRing(object):
         for (server, fp, sock) in self._get_conns(key):
             try:
                 with Timeout(self._io_timeout):
-                    sock.sendall('delete %s\r\n' % key)
-                    # Wait for the delete to complete
-                    fp.readline()
+                    sock.sendall('delete %s%s\r\n' % (key, self._noreply))
+                    if not self._noreply:
+                        # Wait for the delete to complete
+                        fp.readline()
                     self._return_conn(server, fp, sock)
                     return
             except (Exception, Timeout) as e:
@@ -411,31 +499,61 @@ class MemcacheRing(object):
             elif serialize:
                 value = json.dumps(value)
                 flags |= JSON_FLAG
-            msg += ('set %s %d %d %s\r\n%s\r\n' %
-                    (key, flags, timeout, len(value), value))
+            msg += ('set %s %d %d %s%s\r\n%s\r\n' %
+                    (key, flags, timeout, len(value), self._noreply, value))
         for (server, fp, sock) in self._get_conns(server_key):
             try:
                 with Timeout(self._io_timeout):
                     sock.sendall(msg)
-                    # Wait for the set to complete
-                    for line in range(len(mapping)):
-                        fp.readline()
+                    if not self._noreply:
+                        # Wait for the set to complete
+                        for line in range(len(mapping)):
+                            fp.readline()
                     self._return_conn(server, fp, sock)
                     return
             except (Exception, Timeout) as e:
                 self._exception_occurred(server, e, sock=sock, fp=fp)
 
-    def get_multi(self, keys, server_key):
+    def get_multi(self, keys, server_key=None):
         """
         Gets multiple values from memcache for the given keys.
 
         :param keys: keys for values to be retrieved from memcache
         :param servery_key: key to use in determining which server in the ring
-                            is used
+                            is used; if None, each key is read from the
+                            server get() would read it from, with the
+                            servers asked in parallel
         :returns: list of values
         """
-        server_key = md5hash(server_key)
         keys = [md5hash(key) for key in keys]
+        if server_key is not None:
+            responses = self._get_multi(keys, md5hash(server_key))
+            if responses is None:
+                return None
+        else:
+            keys_by_server = defaultdict(list)
+            for key in keys:
+                keys_by_server[self._servers_for(key)[0]].append(key)
+            if len(keys_by_server) == 1:
+                all_responses = [self._get_multi(keys, keys[0])]
+            else:
+                all_responses = GreenPile(len(keys_by_server))
+                for server_keys in keys_by_server.values():
+                    all_responses.spawn(
+                        self._get_multi, server_keys, server_keys[0])
+            responses = {}
+            for server_responses in all_responses:
+                responses.update(server_responses or {})
+        return [responses.get(key) for key in keys]
+
+    def _get_multi(self, keys, server_key):
+        """
+        Gets the values of hashed keys from the server for a hashed
+        server_key.
+
+        :returns: dict of the values found by key, or None if no server
+                  could be reached
+        """
         for (server, fp, sock) in self._get_conns(server_key):
             try:
                 with Timeout(self._io_timeout):
@@ -456,13 +574,7 @@ class MemcacheRing(object):
                             responses[line[1]] = value
                             fp.readline()
                         line = fp.readline().strip().split()
-                    values = []
-                    for key in keys:
-                        if key in responses:
-                            values.append(responses[key])
-                        else:
-                            values.append(None)
                     self._return_conn(server, fp, sock)
-                    return values
+                    return responses
             except (Exception, Timeout) as e:
                 self._exception_occurred(server, e, sock=sock, fp=fp)
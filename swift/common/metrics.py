@@ -0,0 +1,346 @@
+# Copyright (c) 2010-2016 OpenStack Foundation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+In-process metrics.
+
+With ``log_metrics`` on, every counter and timing a server's logger sends to
+StatsD is also kept in a :class:`MetricsRegistry` of the process. Timings go
+into :class:`Histogram` objects, from which quantiles can be read without a
+StatsD server.
+
+Each process writes a snapshot of its registry to its own file in
+``log_metrics_path`` every few seconds. The default path is on tmpfs, so
+these writes never touch a disk. The metrics middleware merges the snapshots
+of all the live processes on the node and serves them to Prometheus. The
+snapshots of processes that have exited are added up in a snapshot of their
+own, so that the totals served never go down.
+"""
+
+from collections import defaultdict
+import errno
+import fcntl
+import json
+import os
+import re
+import time
+
+import eventlet
+
+DEFAULT_METRICS_PATH = '/dev/shm/swift-metrics'
+# the snapshot that the snapshots of exited processes are added to
+RETIRED_SNAPSHOT = 'retired.json'
+# seconds between writes of a process's snapshot
+DUMP_INTERVAL = 5
+QUANTILES = (0.5, 0.9, 0.99, 0.999)
+
+# Histogram buckets are exact up to 2 * SUB_BUCKETS microseconds. After that
+# each power of two is split into SUB_BUCKETS equal buckets, so a bucket's
+# midpoint is within 1 / (2 * SUB_BUCKETS) of any value in it.
+SUB_BUCKET_BITS = 4
+SUB_BUCKETS = 1 << SUB_BUCKET_BITS
+
+
+def bucket_index(value):
+    """
+    Returns the index of the histogram bucket for a timing.
+
+    :param value: a timing in milliseconds
+    """
+    micros = max(int(value * 1000), 0)
+    if micros < 2 * SUB_BUCKETS:
+        return micros
+    shift = micros.bit_length() - SUB_BUCKET_BITS - 1
+    return shift * SUB_BUCKETS + (micros >> shift)
+
+
+def bucket_bounds(index):
+    """
+    Returns the lower and upper bounds, in milliseconds, of the timings in a
+    histogram bucket.
+    """
+    if index < 2 * SUB_BUCKETS:
+        return index / 1000.0, (index + 1) / 1000.0
+    shift = index // SUB_BUCKETS - 1
+    mantissa = index - shift * SUB_BUCKETS
+    return (mantissa << shift) / 1000.0, ((mantissa + 1) << shift) / 1000.0
+
+
+class Histogram(object):
+    """
+    A log-linear histogram of timings, in the style of HdrHistogram, which
+    keeps the count of timings in each bucket rather than the timings.
+    """
+
+    def __init__(self, count=0, total=0.0, buckets=None):
+        self.count = count
+        self.sum = total
+        self.buckets = defaultdict(int, buckets or {})
+
+    def record(self, value):
+        self.count += 1
+        self.sum += value
+        self.buckets[bucket_index(value)] += 1
+
+    def merge(self, other):
+        self.count += other.count
+        self.sum += other.sum
+        for index, count in other.buckets.items():
+            self.buckets[index] += count
+
+    def quantile(self, q):
+        """
+        Returns the midpoint of the bucket holding the timing at quantile q,
+        or 0 if no timings have been recorded.
+        """
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen >= rank:
+                break
+        lower, upper = bucket_bounds(index)
+        return (lower + upper) / 2
+
+    def to_dict(self):
+        # json only has string keys
+        return {'count': self.count, 'sum': self.sum,
+                'buckets': dict((str(index), count)
+                                for index, count in self.buckets.items())}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['count'], data['sum'],
+                   dict((int(index), count)
+                        for index, count in data['buckets'].items()))
+
+
+class MetricsRegistry(object):
+    """
+    The counters and timing histograms of a process, by metric name.
+
+    :param path: the directory the registry's snapshots are written to
+    """
+
+    def __init__(self, path=DEFAULT_METRICS_PATH):
+        self.path = path
+        self.pid = os.getpid()
+        self.counters = defaultdict(int)
+        self.histograms = defaultdict(Histogram)
+        self.next_dump = time.time() + DUMP_INTERVAL
+        self._dumper_pid = None
+
+    def record(self, name, value, m_type):
+        """
+        Records a metric as sent to StatsD.
+
+        :param name: the full name of the metric
+        :param value: the metric's value
+        :param m_type: the StatsD type: 'c' for counters or 'ms' for timings
+        """
+        pid = os.getpid()
+        if self.pid != pid:
+            # a forked worker starts from nothing rather than counting its
+            # parent's metrics again
+            self.pid = pid
+            self.counters.clear()
+            self.histograms.clear()
+        if self._dumper_pid != pid:
+            # an idle process still writes the metrics it last recorded
+            self._dumper_pid = pid
+            eventlet.spawn_n(self._dump_periodically, pid)
+        if m_type == 'c':
+            self.counters[name] += value
+        else:
+            self.histograms[name].record(value)
+        self._dump_if_due()
+
+    def _dump_if_due(self):
+        now = time.time()
+        if now >= self.next_dump:
+            self.next_dump = now + DUMP_INTERVAL
+            self.dump()
+
+    def _dump_periodically(self, pid):
+        while os.getpid() == pid:
+            eventlet.sleep(DUMP_INTERVAL)
+            self._dump_if_due()
+
+    def snapshot(self):
+        return _make_snapshot(self.counters, self.histograms)
+
+    def dump(self):
+        """
+        Writes the registry's snapshot to a file named for the process.
+        Errors are ignored; the snapshot will be written again later.
+        """
+        try:
+            _write_snapshot(os.path.join(self.path, '%d.json' % self.pid),
+                            self.snapshot())
+        except (IOError, OSError):
+            pass
+
+
+_registries = {}
+
+
+def get_metrics_registry(path=DEFAULT_METRICS_PATH):
+    """
+    Returns the process's registry for snapshots written to path.
+    """
+    if path not in _registries:
+        _registries[path] = MetricsRegistry(path)
+    return _registries[path]
+
+
+def _make_snapshot(counters, histograms):
+    return {'counters': dict(counters),
+            'histograms': dict((name, histogram.to_dict())
+                               for name, histogram in histograms.items())}
+
+
+def _write_snapshot(snapshot_file, snapshot):
+    try:
+        os.makedirs(os.path.dirname(snapshot_file))
+    except OSError as err:
+        if err.errno != errno.EEXIST:
+            raise
+    tmp_file = snapshot_file + '.tmp'
+    with open(tmp_file, 'w') as fp:
+        json.dump(snapshot, fp)
+    os.rename(tmp_file, snapshot_file)
+
+
+def _read_snapshot(snapshot_file):
+    try:
+        with open(snapshot_file) as fp:
+            return json.load(fp)
+    except (IOError, OSError, ValueError):
+        # the process is gone, or it's a snapshot we don't understand
+        return None
+
+
+def _pid_is_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError as err:
+        return err.errno == errno.EPERM
+    return True
+
+
+def _retire_snapshots(path, snapshot_files):
+    """
+    Adds the snapshots of processes that have exited to the retired
+    snapshot, and removes them. Errors are ignored; the snapshots will be
+    retired by a later call.
+    """
+    try:
+        with open(os.path.join(path, '.lock'), 'a') as lock_fp:
+            fcntl.flock(lock_fp, fcntl.LOCK_EX)
+            # another process may have retired some of them already
+            snapshot_files = [snapshot_file for snapshot_file in snapshot_files
+                              if os.path.exists(snapshot_file)]
+            if not snapshot_files:
+                return
+            retired_file = os.path.join(path, RETIRED_SNAPSHOT)
+            snapshots = [_read_snapshot(snapshot_file) for snapshot_file
+                         in [retired_file] + snapshot_files]
+            counters, histograms = merge_snapshots(
+                [snapshot for snapshot in snapshots if snapshot])
+            _write_snapshot(retired_file,
+                            _make_snapshot(counters, histograms))
+            for snapshot_file in snapshot_files:
+                os.unlink(snapshot_file)
+    except (IOError, OSError):
+        pass
+
+
+def load_snapshots(path):
+    """
+    Reads the snapshots of the processes still running on this node, and
+    the retired snapshot that adds up those of the processes that have
+    exited, so that the counters merged from them never go down.
+
+    :param path: the directory the snapshots were written to
+    :returns: a list of snapshot dicts
+    """
+    try:
+        filenames = os.listdir(path)
+    except OSError:
+        return []
+    snapshots = []
+    exited = []
+    for filename in filenames:
+        pid, ext = os.path.splitext(filename)
+        if ext != '.json' or not pid.isdigit():
+            continue
+        snapshot_file = os.path.join(path, filename)
+        if not _pid_is_alive(int(pid)):
+            exited.append(snapshot_file)
+            continue
+        snapshot = _read_snapshot(snapshot_file)
+        if snapshot is not None:
+            snapshots.append(snapshot)
+    if exited:
+        _retire_snapshots(path, exited)
+    retired = _read_snapshot(os.path.join(path, RETIRED_SNAPSHOT))
+    if retired is not None:
+        snapshots.append(retired)
+    return snapshots
+
+
+def merge_snapshots(snapshots):
+    """
+    Adds up the metrics of several processes.
+
+    :returns: a tuple of dicts, of counters and of
+              :class:`Histogram` objects, by metric name
+    """
+    counters = defaultdict(int)
+    histograms = defaultdict(Histogram)
+    for snapshot in snapshots:
+        for name, value in snapshot.get('counters', {}).items():
+            counters[name] += value
+        for name, data in snapshot.get('histograms', {}).items():
+            histograms[name].merge(Histogram.from_dict(data))
+    return counters, histograms
+
+
+def _metric_name(name):
+    return 'swift_' + re.sub('[^a-zA-Z0-9_]', '_', name)
+
+
+def render(counters, histograms):
+    """
+    Formats metrics in the Prometheus text exposition format. Counters are
+    exposed as counters and timing histograms as summaries, in milliseconds.
+    """
+    lines = []
+    for name in sorted(counters):
+        metric = _metric_name(name)
+        lines.append('# TYPE %s counter' % metric)
+        lines.append('%s %s' % (metric, counters[name]))
+    for name in sorted(histograms):
+        metric = _metric_name(name)
+        histogram = histograms[name]
+        lines.append('# TYPE %s summary' % metric)
+        for q in QUANTILES:
+            lines.append('%s{quantile="%s"} %.3f' % (
+                metric, q, histogram.quantile(q)))
+        lines.append('%s_sum %.3f' % (metric, histogram.sum))
+        lines.append('%s_count %d' % (metric, histogram.count))
+    return ''.join(line + '\n' for line in lines)
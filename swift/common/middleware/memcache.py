@@ -14,11 +14,36 @@
 # limitations under the License.
 
 import os
+import time
 
 from six.moves.configparser import ConfigParser, NoSectionError, NoOptionError
 
 from swift.common.memcached import (MemcacheRing, CONN_TIMEOUT, POOL_TIMEOUT,
                                     IO_TIMEOUT, TRY_COUNT)
+from swift.common.utils import config_true_value, get_logger
+
+
+def parse_servers(value):
+    """
+    Parses a comma separated list of memcached servers, each optionally
+    followed by a slash and its relative weight, as in 10.1.2.3:11211/2.
+
+    :returns: a tuple of the list of servers and a dict of the weights given
+    :raises ValueError: if a weight isn't a positive integer
+    """
+    servers = []
+    weights = {}
+    for entry in value.split(','):
+        server, _junk, weight = entry.strip().partition('/')
+        if not server:
+            continue
+        servers.append(server)
+        if weight:
+            weights[server] = int(weight)
+            if weights[server] < 1:
+                raise ValueError('Invalid weight for memcache server %s'
+                                 % server)
+    return servers, weights
 
 
 class MemcacheMiddleware(object):
@@ -28,7 +53,10 @@ class MemcacheMiddleware(object):
 
     def __init__(self, app, conf):
         self.app = app
+        self.logger = get_logger(conf, log_route='memcache')
         self.memcache_servers = conf.get('memcache_servers')
+        # set when memcache_servers is read from memcache.conf
+        self.memcache_conf_path = None
         serialization_format = conf.get('memcache_serialization_support')
         try:
             # Originally, while we documented using memcache_max_connections
@@ -56,6 +84,7 @@ class MemcacheMiddleware(object):
                     try:
                         self.memcache_servers = \
                             memcache_conf.get('memcache', 'memcache_servers')
+                        self.memcache_conf_path = path
                     except (NoSectionError, NoOptionError):
                         pass
                 if serialization_format is None:
@@ -84,6 +113,18 @@ class MemcacheMiddleware(object):
             'pool_timeout', POOL_TIMEOUT))
         tries = int(memcache_options.get('tries', TRY_COUNT))
         io_timeout = float(memcache_options.get('io_timeout', IO_TIMEOUT))
+        noreply = config_true_value(memcache_options.get('noreply', 'no'))
+        ketama = config_true_value(memcache_options.get('ketama', 'no'))
+        self.reload_interval = float(memcache_options.get(
+            'reload_interval', 0))
+        self.next_reload = time.time() + self.reload_interval
+        self.memcache_conf_mtime = None
+        if self.memcache_conf_path:
+            try:
+                self.memcache_conf_mtime = os.path.getmtime(
+                    self.memcache_conf_path)
+            except OSError:
+                pass
 
         if not self.memcache_servers:
             self.memcache_servers = '127.0.0.1:11211'
@@ -94,17 +135,53 @@ class MemcacheMiddleware(object):
         else:
             serialization_format = int(serialization_format)
 
+        servers, weights = parse_servers(self.memcache_servers)
         self.memcache = MemcacheRing(
-            [s.strip() for s in self.memcache_servers.split(',') if s.strip()],
+            servers,
             connect_timeout=connect_timeout,
             pool_timeout=pool_timeout,
             tries=tries,
             io_timeout=io_timeout,
             allow_pickle=(serialization_format == 0),
             allow_unpickle=(serialization_format <= 1),
-            max_conns=max_conns)
+            max_conns=max_conns,
+            noreply=noreply,
+            weights=weights,
+            ketama=ketama)
+
+    def reload_servers(self):
+        """
+        Spreads the cache over the memcache_servers in memcache.conf, if the
+        file has changed since it was last read.
+        """
+        self.next_reload = time.time() + self.reload_interval
+        try:
+            mtime = os.path.getmtime(self.memcache_conf_path)
+        except OSError:
+            return
+        if mtime == self.memcache_conf_mtime:
+            return
+        self.memcache_conf_mtime = mtime
+        memcache_conf = ConfigParser()
+        try:
+            memcache_conf.read(self.memcache_conf_path)
+            memcache_servers = memcache_conf.get('memcache',
+                                                 'memcache_servers')
+            servers, weights = parse_servers(memcache_servers)
+        except Exception as err:
+            self.logger.error('Unable to reload memcache servers from '
+                              '%s: %s', self.memcache_conf_path, err)
+            return
+        if servers and memcache_servers != self.memcache_servers:
+            self.memcache.set_servers(servers, weights)
+            self.memcache_servers = memcache_servers
+            self.logger.info('Reloaded memcache servers: %s',
+                             memcache_servers)
 
     def __call__(self, env, start_response):
+        if (self.reload_interval and self.memcache_conf_path and
+                time.time() >= self.next_reload):
+            self.reload_servers()
         env['swift.cache'] = self.memcache
         return self.app(env, start_response)
 
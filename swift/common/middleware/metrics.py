@@ -0,0 +1,75 @@
+# Copyright (c) 2010-2016 OpenStack Foundation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from swift.common.metrics import DEFAULT_METRICS_PATH, \
+    get_metrics_registry, load_snapshots, merge_snapshots, render
+from swift.common.swob import HTTPForbidden, Request, Response
+from swift.common.utils import config_true_value, list_from_csv
+
+
+class MetricsMiddleware(object):
+    """
+    Metrics middleware used for monitoring.
+
+    If the path is /metrics, it will respond 200 with the metrics of every
+    Swift process on the node that has ``log_metrics`` turned on, in the
+    Prometheus text format. Counters are the totals since each process
+    started. Timings are given as summaries, in milliseconds, with their
+    50th, 90th, 99th and 99.9th percentiles.
+
+    The metrics of other processes can be a few seconds old. The metrics of
+    a process that has exited are kept in the totals, so counters only go
+    down when ``log_metrics_path`` is emptied.
+
+    Set ``log_metrics`` and ``log_metrics_path`` in the [DEFAULT] section, so
+    that every process of the server and this middleware agree on them.
+
+    /metrics is answered without authentication. When ``allowed_ips`` is set
+    to a comma separated list of addresses, requests for it from any other
+    address are refused with a 403.
+    """
+
+    def __init__(self, app, conf):
+        self.app = app
+        self.metrics_path = conf.get('log_metrics_path', DEFAULT_METRICS_PATH)
+        self.log_metrics = config_true_value(conf.get('log_metrics', 'false'))
+        self.allowed_ips = set(list_from_csv(conf.get('allowed_ips')))
+
+    def GET(self, req):
+        """Returns a 200 response with the node's metrics in the body."""
+        if self.log_metrics:
+            # this process's metrics are always up to date
+            get_metrics_registry(self.metrics_path).dump()
+        counters, histograms = merge_snapshots(
+            load_snapshots(self.metrics_path))
+        return Response(request=req, body=render(counters, histograms),
+                        content_type='text/plain; version=0.0.4')
+
+    def __call__(self, env, start_response):
+        req = Request(env)
+        if req.path == '/metrics':
+            if self.allowed_ips and req.remote_addr not in self.allowed_ips:
+                return HTTPForbidden(request=req)(env, start_response)
+            return self.GET(req)(env, start_response)
+        return self.app(env, start_response)
+
+
+def filter_factory(global_conf, **local_conf):
+    conf = global_conf.copy()
+    conf.update(local_conf)
+
+    def metrics_filter(app):
+        return MetricsMiddleware(app, conf)
+    return metrics_filter
@@ -44,7 +44,9 @@ be separated with a simple .split()
   otherwise be detectable from the plain log information. Code that
   wishes to add additional log information should use code like
   ``env.setdefault('swift.log_info', []).append(your_info)`` so as to
-  not disturb others' log information.
+  not disturb others' log information. A request traced by the proxy
+  server (see ``trace_sample_rate``) adds a ``trace:`` entry listing the
+  ``name:seconds`` spans of where its time went, separated by ``/``.
 
 * Values that are missing (e.g. due to a header not being present) or zero
   are generally represented by a single hyphen ('-').
@@ -114,7 +116,9 @@ class ProxyLoggingMiddleware(object):
                     'log_udp_port', 'log_statsd_host', 'log_statsd_port',
                     'log_statsd_default_sample_rate',
                     'log_statsd_sample_rate_factor',
-                    'log_statsd_metric_prefix'):
+                    'log_statsd_metric_prefix', 'log_statsd_flush_interval',
+                    'log_statsd_max_packet_size', 'log_metrics',
+                    'log_metrics_path'):
             value = conf.get('access_' + key, conf.get(key, None))
             if value:
                 access_log_conf[key] = value
@@ -173,6 +177,10 @@ class ProxyLoggingMiddleware(object):
         start_time_str = "%.9f" % start_time
         end_time_str = "%.9f" % end_time
         policy_index = get_policy_index(req.headers, resp_headers)
+        log_info = req.environ.get('swift.log_info') or []
+        trace = req.environ.get('swift.trace')
+        if trace is not None and trace.spans:
+            log_info = log_info + ['trace:%s' % trace]
         self.access_logger.info(' '.join(
             quote(str(x) if x else '-', QUOTE_SAFE)
             for x in (
@@ -193,7 +201,7 @@ class ProxyLoggingMiddleware(object):
                 logged_headers,
                 duration_time_str,
                 req.environ.get('swift.source'),
-                ','.join(req.environ.get('swift.log_info') or ''),
+                ','.join(log_info),
                 start_time_str,
                 end_time_str,
                 policy_index
@@ -20,10 +20,12 @@ Why not swift.common.utils, you ask? Because this way we can import things
 from swob in here without creating circular imports.
 """
 
+from contextlib import contextmanager
 import hashlib
 import itertools
 import sys
 import time
+from xml.sax import saxutils
 
 import six
 from six.moves.urllib.parse import unquote
@@ -92,6 +94,75 @@ def get_listing_content_type(req):
     return out_content_type
 
 
+def _xml_text(value):
+    if isinstance(value, six.text_type):
+        return value.encode('utf-8')
+    return str(value)
+
+
+def _xml_attr(value):
+    """
+    Quote and escape a string for use as an XML attribute value, the same
+    way ``xml.etree.cElementTree`` does.
+    """
+    return '"%s"' % saxutils.escape(_xml_text(value),
+                                    {'"': '&quot;', '\n': '&#10;'})
+
+
+def _xml_element(tag, value):
+    """
+    Render a simple XML element with escaped text content, the same way
+    ``xml.etree.cElementTree`` does.
+    """
+    text = _xml_text(value)
+    if not text:
+        return '<%s />' % tag
+    return '<%s>%s</%s>' % (tag, saxutils.escape(text), tag)
+
+
+def container_listing_xml_iter(container, records):
+    """
+    Serialize container listing records to XML one record at a time.
+
+    The output is identical to what ``xml.etree.cElementTree`` would
+    generate for the whole document.
+
+    :param container: the container name
+    :param records: an iterable of listing dicts, as found in a JSON
+                    container listing; any fields of subdir records other
+                    than ``subdir`` are rendered as child elements in sorted
+                    order
+    :returns: an iterator of UTF-8 encoded strings
+    """
+    yield '<?xml version="1.0" encoding="UTF-8"?>\n'
+    container_tag = '<container name=%s' % _xml_attr(container)
+    empty = True
+    for record in records:
+        if empty:
+            yield container_tag + '>'
+            empty = False
+        record = dict(record)
+        if 'subdir' in record:
+            name = record.pop('subdir')
+            parts = ['<subdir name=%s>' % _xml_attr(name),
+                     _xml_element('name', name)]
+            end_tag = '</subdir>'
+        else:
+            parts = ['<object>']
+            for field in ["name", "hash", "bytes", "content_type",
+                          "last_modified"]:
+                parts.append(_xml_element(field, record.pop(field)))
+            end_tag = '</object>'
+        for field in sorted(record):
+            parts.append(_xml_element(field, record[field]))
+        parts.append(end_tag)
+        yield ''.join(parts)
+    if empty:
+        yield container_tag + ' />'
+    else:
+        yield '</container>'
+
+
 def get_name_and_placement(request, minsegs=1, maxsegs=None,
                            rest_with_last=False):
     """
@@ -676,3 +747,61 @@ def resolve_etag_is_at_header(req, metadata):
                 alternate_etag = metadata[name]
                 break
     return alternate_etag
+
+
+class RequestTrace(object):
+    """
+    The named timing spans of one request, kept in its WSGI environment as
+    ``swift.trace`` when the request is being traced.
+
+    A span may be recorded more than once, e.g. a connect span for every
+    node tried; spans are kept in the order they finished.
+    """
+
+    def __init__(self):
+        self.spans = []
+
+    def add(self, name, duration):
+        """
+        Record a span.
+
+        :param name: the name of the span
+        :param duration: the span's length, in seconds
+        """
+        self.spans.append((name, duration))
+
+    def __str__(self):
+        return '/'.join('%s:%.4f' % span for span in self.spans)
+
+
+def trace_span_add(env, name, duration):
+    """
+    Record a span in the request's trace, if it is being traced.
+
+    :param env: the WSGI environment of the request
+    :param name: the name of the span
+    :param duration: the span's length, in seconds
+    """
+    trace = env.get('swift.trace')
+    if trace is not None:
+        trace.add(name, duration)
+
+
+@contextmanager
+def trace_span(env, name):
+    """
+    Context manager that records the time spent in its body as a span of the
+    request's trace, if it is being traced.
+
+    :param env: the WSGI environment of the request
+    :param name: the name of the span
+    """
+    trace = env.get('swift.trace')
+    if trace is None:
+        yield
+        return
+    start = time.time()
+    try:
+        yield
+    finally:
+        trace.add(name, time.time() - start)
@@ -32,6 +32,12 @@ EC_POLICY = 'erasure_coding'
 
 DEFAULT_EC_OBJECT_SEGMENT_SIZE = 1048576
 
+# EC schemes whose first ec_ndata fragments of a segment hold the segment's
+# data as it is; decoding from just those fragments needs no arithmetic
+SYSTEMATIC_EC_TYPES = (
+    'liberasurecode_rs_vand', 'jerasure_rs_vand', 'jerasure_rs_cauchy',
+    'isa_l_rs_vand', 'isa_l_rs_cauchy', 'flat_xor_hd_3', 'flat_xor_hd_4')
+
 
 class BindPortsCache(object):
     def __init__(self, swift_dir, bind_ip):
@@ -483,6 +489,10 @@ class ECStoragePolicy(BaseStoragePolicy):
     def ec_segment_size(self):
         return self._ec_segment_size
 
+    @property
+    def ec_systematic(self):
+        return self._ec_type in SYSTEMATIC_EC_TYPES
+
     @property
     def fragment_size(self):
         """
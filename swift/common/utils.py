@@ -71,6 +71,7 @@ from swift.common.http import is_success, is_redirection, HTTP_NOT_FOUND, \
     HTTP_PRECONDITION_FAILED, HTTP_REQUESTED_RANGE_NOT_SATISFIABLE
 from swift.common.header_key_dict import HeaderKeyDict
 from swift.common.linkat import linkat
+from swift.common.metrics import DEFAULT_METRICS_PATH, get_metrics_registry
 
 if six.PY3:
     stdlib_queue = eventlet.patcher.original('queue')
@@ -776,24 +777,42 @@ def fsync_dir(dirpath):
             os.close(dirfd)
 
 
-def drop_buffer_cache(fd, offset, length):
+# see man -s 2 posix_fadvise
+POSIX_FADV_SEQUENTIAL = 2
+POSIX_FADV_WILLNEED = 3
+POSIX_FADV_DONTNEED = 4
+
+
+def fadvise(fd, offset, length, advice):
     """
-    Drop 'buffer' cache for the given range of the given file.
+    Tell the kernel how the given range of the given file will be read.
 
     :param fd: file descriptor
     :param offset: start offset
     :param length: length
+    :param advice: one of the POSIX_FADV_* constants
     """
     global _posix_fadvise
     if _posix_fadvise is None:
         _posix_fadvise = load_libc_function('posix_fadvise64')
-    # 4 means "POSIX_FADV_DONTNEED"
     ret = _posix_fadvise(fd, ctypes.c_uint64(offset),
-                         ctypes.c_uint64(length), 4)
+                         ctypes.c_uint64(length), advice)
     if ret != 0:
-        logging.warning("posix_fadvise64(%(fd)s, %(offset)s, %(length)s, 4) "
-                        "-> %(ret)s", {'fd': fd, 'offset': offset,
-                                       'length': length, 'ret': ret})
+        logging.warning("posix_fadvise64(%(fd)s, %(offset)s, %(length)s, "
+                        "%(advice)s) -> %(ret)s",
+                        {'fd': fd, 'offset': offset, 'length': length,
+                         'advice': advice, 'ret': ret})
+
+
+def drop_buffer_cache(fd, offset, length):
+    """
+    Drop 'buffer' cache for the given range of the given file.
+
+    :param fd: file descriptor
+    :param offset: start offset
+    :param length: length
+    """
+    fadvise(fd, offset, length, POSIX_FADV_DONTNEED)
 
 
 NORMAL_FORMAT = "%016.05f"
@@ -806,6 +825,44 @@ PRECISION = 1e-5
 # This isn't ideal during an upgrade when some servers might not understand
 # the new time format - but flipping it to True works great for testing.
 FORCE_INTERNAL = False  # or True
+# the number of ticks, of PRECISION seconds, in a second
+TICKS_PER_SECOND = 100000
+MAX_RAW = 10000000000 * TICKS_PER_SECOND
+
+
+def _parse_timestamp(timestamp):
+    """
+    Parses a normalized or internalized timestamp string.
+
+    :returns: a tuple of the timestamp in ticks and its offset
+    :raises ValueError: if the string isn't a timestamp
+    """
+    parts = timestamp.split('_', 1)
+    base = parts[0]
+    if len(base) == 16 and base[10] == '.' and base[:10].isdigit() and \
+            base[11:].isdigit():
+        # the normalized form is read without going through a float
+        raw = int(base[:10]) * TICKS_PER_SECOND + int(base[11:])
+    else:
+        raw = int(round(float(base) / PRECISION))
+    if len(parts) > 1:
+        return raw, int(parts[1], 16)
+    return raw, 0
+
+
+def _timestamp_from_raw(raw, offset=0):
+    """
+    Makes a :class:`Timestamp` from a time in ticks and an offset, without
+    the conversions and checks of ``Timestamp.__init__``.
+
+    :raises ValueError: if the time or offset is out of range
+    """
+    if not 0 <= raw < MAX_RAW or not 0 <= offset <= MAX_OFFSET:
+        raise ValueError('invalid timestamp %d_%x' % (raw, offset))
+    timestamp = Timestamp.__new__(Timestamp)
+    timestamp.raw = raw
+    timestamp.offset = offset
+    return timestamp
 
 
 @functools.total_ordering
@@ -844,8 +901,14 @@ class Timestamp(object):
     timestamp regardless of it's offset.  String comparison and ordering
     is guaranteed for the internalized string format, and is backwards
     compatible for normalized timestamps which do not include an offset.
+
+    A Timestamp holds only two integers, the time in ticks of PRECISION
+    seconds and the offset, so that the many Timestamps made while listing
+    a hash dir or merging container rows are small and compare quickly.
     """
 
+    __slots__ = ('raw', 'offset')
+
     def __init__(self, timestamp, offset=0, delta=0):
         """
         Create a new Timestamp.
@@ -861,14 +924,11 @@ class Timestamp(object):
                       param, an int
         """
         if isinstance(timestamp, six.string_types):
-            parts = timestamp.split('_', 1)
-            self.timestamp = float(parts.pop(0))
-            if parts:
-                self.offset = int(parts[0], 16)
-            else:
-                self.offset = 0
+            self.raw, self.offset = _parse_timestamp(timestamp)
+        elif isinstance(timestamp, Timestamp):
+            self.raw, self.offset = timestamp.raw, timestamp.offset
         else:
-            self.timestamp = float(timestamp)
+            self.raw = int(round(float(timestamp) / PRECISION))
             self.offset = getattr(timestamp, 'offset', 0)
         # increment offset
         if offset >= 0:
@@ -877,19 +937,32 @@ class Timestamp(object):
             raise ValueError('offset must be non-negative')
         if self.offset > MAX_OFFSET:
             raise ValueError('offset must be smaller than %d' % MAX_OFFSET)
-        self.raw = int(round(self.timestamp / PRECISION))
         # add delta
         if delta:
             self.raw = self.raw + delta
             if self.raw <= 0:
                 raise ValueError(
                     'delta must be greater than %d' % (-1 * self.raw))
-            self.timestamp = float(self.raw * PRECISION)
-        if self.timestamp < 0:
+        if self.raw < 0:
             raise ValueError('timestamp cannot be negative')
-        if self.timestamp >= 10000000000:
+        if self.raw >= MAX_RAW:
             raise ValueError('timestamp too large')
 
+    def __getstate__(self):
+        return self.raw, self.offset
+
+    def __setstate__(self, state):
+        if isinstance(state, dict):
+            # pickled before Timestamp had __slots__
+            state = state['raw'], state['offset']
+        self.raw, self.offset = state
+
+    @property
+    def timestamp(self):
+        # dividing gives the float nearest to the decimal form, as parsing
+        # that form would, where multiplying by PRECISION might not
+        return self.raw / float(TICKS_PER_SECOND)
+
     def __repr__(self):
         return INTERNAL_FORMAT % (self.timestamp, self.offset)
 
@@ -910,19 +983,20 @@ class Timestamp(object):
 
     @property
     def normal(self):
-        return NORMAL_FORMAT % self.timestamp
+        # the same as NORMAL_FORMAT, without the float
+        return '%010d.%05d' % divmod(self.raw, TICKS_PER_SECOND)
 
     @property
     def internal(self):
         if self.offset or FORCE_INTERNAL:
-            return INTERNAL_FORMAT % (self.timestamp, self.offset)
+            return '%s_%016x' % (self.normal, self.offset)
         else:
             return self.normal
 
     @property
     def short(self):
         if self.offset or FORCE_INTERNAL:
-            return SHORT_FORMAT % (self.timestamp, self.offset)
+            return '%s_%x' % (self.normal, self.offset)
         else:
             return self.normal
 
@@ -959,21 +1033,22 @@ class Timestamp(object):
             return False
         if not isinstance(other, Timestamp):
             other = Timestamp(other)
-        return self.internal == other.internal
+        return self.raw == other.raw and self.offset == other.offset
 
     def __ne__(self, other):
         if other is None:
             return True
         if not isinstance(other, Timestamp):
             other = Timestamp(other)
-        return self.internal != other.internal
+        return self.raw != other.raw or self.offset != other.offset
 
     def __lt__(self, other):
         if other is None:
             return False
         if not isinstance(other, Timestamp):
             other = Timestamp(other)
-        return self.internal < other.internal
+        return self.raw < other.raw or (
+            self.raw == other.raw and self.offset < other.offset)
 
     def __hash__(self):
         return hash(self.internal)
@@ -1036,6 +1111,13 @@ def decode_timestamps(encoded, explicit=False):
         ts = Timestamp(encoded)
         return ts, ts, ts
 
+    if '+' not in encoded and '-' not in encoded:
+        # most rows and files have just the one timestamp
+        t1 = Timestamp(encoded)
+        if explicit:
+            return t1, None, None
+        return t1, t1, t1
+
     parts = []
     signs = []
     pos_parts = encoded.split('+')
@@ -1054,14 +1136,14 @@ def decode_timestamps(encoded, explicit=False):
         # preserve any offset in t1 - only construct a distinct
         # timestamp if there is a non-zero delta.
         if delta:
-            t2 = Timestamp((t1.raw + delta) * PRECISION)
+            t2 = _timestamp_from_raw(t1.raw + delta)
     elif not explicit:
         t2 = t1
     if len(parts) > 2:
         t3 = t2
         delta = signs[2] * int(parts[2], 16)
         if delta:
-            t3 = Timestamp((t2.raw + delta) * PRECISION)
+            t3 = _timestamp_from_raw(t2.raw + delta)
     elif not explicit:
         t3 = t2
     return t1, t2, t3
@@ -1082,6 +1164,55 @@ def normalize_timestamp(timestamp):
     return Timestamp(timestamp).normal
 
 
+def parse_timestamps(values):
+    """
+    Parses many normalized or internalized timestamp strings, such as the
+    names of the files in a hash dir, faster than making a Timestamp of each.
+
+    :param values: an iterable of timestamp strings
+    :returns: a list of :class:`Timestamp` objects
+    :raises ValueError: if any of the strings isn't a valid timestamp
+    """
+    new = Timestamp.__new__
+    timestamps = []
+    append = timestamps.append
+    for value in values:
+        base = value[:16]
+        if len(base) == 16 and value[16:17] in ('_', '') and \
+                base[10] == '.' and base[:10].isdigit() and \
+                base[11:].isdigit():
+            # the fixed width form is parsed here, without a call for each
+            raw = int(base[:10]) * TICKS_PER_SECOND + int(base[11:])
+            offset = int(value[17:], 16) if len(value) > 16 else 0
+        else:
+            raw, offset = _parse_timestamp(value)
+        if not 0 <= raw < MAX_RAW or offset > MAX_OFFSET:
+            raise ValueError('invalid timestamp %r' % value)
+        timestamp = new(Timestamp)
+        timestamp.raw = raw
+        timestamp.offset = offset
+        append(timestamp)
+    return timestamps
+
+
+def compare_timestamps(timestamps, others):
+    """
+    Compares two sequences of timestamps, item by item.
+
+    :param timestamps: a sequence of :class:`Timestamp` objects or timestamp
+                       strings
+    :param others: a sequence of the same length
+    :returns: a list of -1, 0 or 1, for whether each of timestamps is older
+              than, the same as or newer than the one in others
+    """
+    def keys(values):
+        return [(value.raw, value.offset) if isinstance(value, Timestamp)
+                else _parse_timestamp(value) for value in values]
+
+    return [(a > b) - (a < b)
+            for a, b in zip(keys(timestamps), keys(others))]
+
+
 EPOCH = datetime.datetime(1970, 1, 1)
 
 
@@ -1122,6 +1253,165 @@ def normalize_delete_at_timestamp(timestamp):
     return '%010d' % min(max(0, float(timestamp)), 9999999999)
 
 
+#: Prefix of the hidden accounts that hold the shard containers of a sharded
+#: container; the shards of /a/c live in the account SHARD_ACCOUNT_PREFIX + a.
+SHARD_ACCOUNT_PREFIX = '.shards_'
+
+_SHARD_CONTAINER_RE = re.compile(r'^(.+)-[0-9a-f]{32}$')
+
+
+def get_shard_root(account, container):
+    """
+    Find the root container of a shard container from its name.
+
+    :param account: the account name of the container
+    :param container: the container name
+    :returns: a tuple of (root account, root container) if the given
+              container is a shard container, None otherwise
+    """
+    if not account.startswith(SHARD_ACCOUNT_PREFIX):
+        return None
+    match = _SHARD_CONTAINER_RE.match(container)
+    if not match:
+        return None
+    return account[len(SHARD_ACCOUNT_PREFIX):], match.group(1)
+
+
+class ShardRange(object):
+    """
+    A ShardRange describes one shard container of a sharded container: its
+    name (``<account>/<container>``), the namespace of object names
+    ``lower < name <= upper`` that it is responsible for, and the object
+    count and bytes used that it last reported. An empty ``lower`` or
+    ``upper`` leaves the namespace unbounded on that side.
+
+    ``timestamp`` is the time at which the bounds (or deletion) of the range
+    were last changed and ``meta_timestamp`` the time at which the stats
+    were last updated; each is used to resolve conflicting versions of the
+    corresponding attributes when shard ranges are merged.
+    """
+
+    __slots__ = ('name', 'lower', 'upper', 'timestamp', 'object_count',
+                 'bytes_used', 'meta_timestamp', 'deleted')
+
+    def __init__(self, name, timestamp, lower='', upper='', object_count=0,
+                 bytes_used=0, meta_timestamp=None, deleted=False):
+        self.name = self._encode(name)
+        self.lower = self._encode(lower or '')
+        self.upper = self._encode(upper or '')
+        if self.upper and self.lower >= self.upper:
+            raise ValueError('lower (%r) must be less than upper (%r)' %
+                             (self.lower, self.upper))
+        self.timestamp = Timestamp(timestamp)
+        self.object_count = int(object_count)
+        self.bytes_used = int(bytes_used)
+        self.meta_timestamp = Timestamp(meta_timestamp or timestamp)
+        self.deleted = bool(deleted)
+
+    @staticmethod
+    def _encode(value):
+        if isinstance(value, six.text_type):
+            return value.encode('utf-8')
+        return value
+
+    @classmethod
+    def create(cls, root_account, root_container, lower, upper, timestamp):
+        """
+        Create a new shard range for a root container, with a unique name in
+        the hidden shards account of the root container's account.
+        """
+        timestamp = Timestamp(timestamp)
+        suffix = md5('%s/%s/%s/%s/%s' % (
+            root_account, root_container, cls._encode(lower or ''),
+            cls._encode(upper or ''), timestamp.internal)).hexdigest()
+        name = '%s%s/%s-%s' % (SHARD_ACCOUNT_PREFIX, root_account,
+                               root_container, suffix)
+        return cls(name, timestamp, lower, upper)
+
+    @property
+    def account(self):
+        return self.name.split('/', 1)[0]
+
+    @property
+    def container(self):
+        return self.name.split('/', 1)[1]
+
+    def __contains__(self, item):
+        item = self._encode(item)
+        return self.lower < item and (not self.upper or item <= self.upper)
+
+    def overlaps(self, lower, upper):
+        """
+        Check whether this range shares any names with the namespace
+        ``lower < name <= upper``; an empty ``upper`` is unbounded.
+        """
+        lower = self._encode(lower or '')
+        upper = self._encode(upper or '')
+        return ((not upper or self.lower < upper) and
+                (not self.upper or lower < self.upper))
+
+    def __iter__(self):
+        yield 'name', self.name
+        yield 'lower', self.lower
+        yield 'upper', self.upper
+        yield 'timestamp', self.timestamp.internal
+        yield 'object_count', self.object_count
+        yield 'bytes_used', self.bytes_used
+        yield 'meta_timestamp', self.meta_timestamp.internal
+        yield 'deleted', 1 if self.deleted else 0
+
+    @classmethod
+    def from_dict(cls, params):
+        return cls(**params)
+
+    def copy(self, **kwargs):
+        params = dict(self)
+        params.update(kwargs)
+        return self.from_dict(params)
+
+    def __eq__(self, other):
+        # compare fields rather than classes, so that instances of a
+        # reloaded ShardRange class still compare equal
+        if not all(hasattr(other, attr) for attr in self.__slots__):
+            return NotImplemented
+        return dict(self) == dict(other)
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        if result is NotImplemented:
+            return result
+        return not result
+
+    def __repr__(self):
+        return '%s<%r to %r as of %s, (%d, %d) as of %s, %s>' % (
+            self.name, self.lower, self.upper, self.timestamp.internal,
+            self.object_count, self.bytes_used,
+            self.meta_timestamp.internal,
+            'deleted' if self.deleted else 'active')
+
+
+def sort_shard_ranges(shard_ranges):
+    """
+    Sort shard ranges into namespace order, i.e. by their upper bound with
+    the unbounded range last.
+    """
+    return sorted(shard_ranges, key=lambda sr: (not sr.upper, sr.upper))
+
+
+def find_shard_range(item, shard_ranges):
+    """
+    Find the shard range, if any, whose namespace includes the given name.
+
+    :param item: an object name
+    :param shard_ranges: an iterable of ShardRange instances
+    :returns: a ShardRange or None
+    """
+    for shard_range in shard_ranges:
+        if item in shard_range:
+            return shard_range
+    return None
+
+
 def mkdirs(path):
     """
     Ensures the path is a directory or makes it if not. Errors if the path
@@ -1471,9 +1761,30 @@ class LoggerFileObject(object):
         return self
 
 
+# Fits a UDP packet in a 1500 byte ethernet frame, with room to spare for
+# IPv6 and IP options
+STATSD_MAX_PACKET_SIZE = 1400
+
+
 class StatsdClient(object):
+    """
+    Sends metrics to a StatsD server over UDP.
+
+    By default every metric is sent in a packet of its own as soon as it is
+    emitted. With a flush_interval, metrics are instead buffered, counters of
+    the same name are summed, and the buffer is sent in newline separated
+    packets of up to max_packet_size bytes every flush_interval seconds, or
+    sooner once a packet's worth is waiting.
+
+    Given a :class:`~swift.common.metrics.MetricsRegistry`, every metric is
+    also recorded in it, whether sampled or not. With no host, metrics are
+    only recorded.
+    """
+
     def __init__(self, host, port, base_prefix='', tail_prefix='',
-                 default_sample_rate=1, sample_rate_factor=1, logger=None):
+                 default_sample_rate=1, sample_rate_factor=1, logger=None,
+                 flush_interval=0, max_packet_size=STATSD_MAX_PACKET_SIZE,
+                 metrics=None):
         self._host = host
         self._port = port
         self._base_prefix = base_prefix
@@ -1482,6 +1793,19 @@ class StatsdClient(object):
         self._sample_rate_factor = sample_rate_factor
         self.random = random
         self.logger = logger
+        self._flush_interval = flush_interval
+        self._max_packet_size = max_packet_size
+        # metrics waiting for the next flush; counters are kept by name and
+        # sample rate so that they can be summed
+        self._counters = {}
+        self._lines = []
+        self._buffered_bytes = 0
+        # the process the flushing greenthread was started in
+        self._flusher_pid = None
+        self.metrics = metrics
+        if host is None:
+            self._target = None
+            return
 
         # Determine if host is IPv4 or IPv6
         addr_info = None
@@ -1529,6 +1853,10 @@ class StatsdClient(object):
             self._prefix = ''
 
     def _send(self, m_name, m_value, m_type, sample_rate):
+        if self.metrics is not None:
+            self.metrics.record(self._prefix + m_name, m_value, m_type)
+        if self._target is None:
+            return
         if sample_rate is None:
             sample_rate = self._default_sample_rate
         sample_rate = sample_rate * self._sample_rate_factor
@@ -1538,18 +1866,83 @@ class StatsdClient(object):
                 parts.append('@%s' % (sample_rate,))
             else:
                 return
+        if self._flush_interval:
+            return self._buffer(parts, m_value)
         if six.PY3:
             parts = [part.encode('utf-8') for part in parts]
         # Ideally, we'd cache a sending socket in self, but that
         # results in a socket getting shared by multiple green threads.
         with closing(self._open_socket()) as sock:
+            return self._sendto(sock, b'|'.join(parts))
+
+    def _sendto(self, sock, payload):
+        try:
+            return sock.sendto(payload, self._target)
+        except IOError as err:
+            if self.logger:
+                self.logger.warning(
+                    _('Error sending UDP message to %(target)r: %(err)s'),
+                    {'target': self._target, 'err': err})
+
+    def _buffer(self, parts, m_value):
+        if self._flusher_pid != os.getpid():
+            # a worker forked from a parent that already had a flusher needs
+            # one of its own; any metrics it inherited are the parent's to
+            # send, and would be counted twice if it sent them too
+            self._lines = []
+            self._counters = {}
+            self._buffered_bytes = 0
+            self._flusher_pid = os.getpid()
+            eventlet.spawn_n(self._flush_periodically, self._flusher_pid)
+        if parts[1] == 'c':
+            key = (parts[0].rsplit(':', 1)[0], '|'.join(parts[1:]))
+            if key in self._counters:
+                self._counters[key] += m_value
+            else:
+                self._counters[key] = m_value
+                self._buffered_bytes += len(parts[0]) + len(key[1]) + 2
+        else:
+            line = '|'.join(parts)
+            self._lines.append(line)
+            self._buffered_bytes += len(line) + 1
+        if self._buffered_bytes >= self._max_packet_size:
+            self.flush()
+
+    def _flush_periodically(self, pid):
+        while os.getpid() == pid:
+            sleep(self._flush_interval)
             try:
-                return sock.sendto(b'|'.join(parts), self._target)
-            except IOError as err:
+                self.flush()
+            except Exception:
                 if self.logger:
-                    self.logger.warning(
-                        _('Error sending UDP message to %(target)r: %(err)s'),
-                        {'target': self._target, 'err': err})
+                    self.logger.exception(_('Error flushing StatsD metrics'))
+
+    def flush(self):
+        """
+        Sends any buffered metrics, packed into as few packets as fit.
+        """
+        lines, self._lines = self._lines, []
+        counters, self._counters = self._counters, {}
+        self._buffered_bytes = 0
+        lines.extend('%s:%s|%s' % (name, value, rest)
+                     for (name, rest), value in counters.items())
+        if not lines:
+            return
+        packets = [[]]
+        packet_size = 0
+        for line in lines:
+            if packets[-1] and (packet_size + len(line) + 1 >
+                                self._max_packet_size):
+                packets.append([])
+                packet_size = 0
+            packets[-1].append(line)
+            packet_size += len(line) + 1
+        with closing(self._open_socket()) as sock:
+            for packet in packets:
+                payload = '\n'.join(packet)
+                if six.PY3:
+                    payload = payload.encode('utf-8')
+                self._sendto(sock, payload)
 
     def _open_socket(self):
         return socket.socket(self._sock_family, socket.SOCK_DGRAM)
@@ -1880,18 +2273,29 @@ def get_logger(conf, name=None, log_to_console=False, log_route=None,
     logger.setLevel(
         getattr(logging, conf.get('log_level', 'INFO').upper(), logging.INFO))
 
-    # Setup logger with a StatsD client if so configured
-    statsd_host = conf.get('log_statsd_host')
-    if statsd_host:
+    # Setup logger with a StatsD client if so configured, or to keep metrics
+    # in-process
+    statsd_host = conf.get('log_statsd_host') or None
+    metrics = None
+    if config_true_value(conf.get('log_metrics', 'false')):
+        metrics = get_metrics_registry(
+            conf.get('log_metrics_path', DEFAULT_METRICS_PATH))
+    if statsd_host or metrics is not None:
         statsd_port = int(conf.get('log_statsd_port', 8125))
         base_prefix = conf.get('log_statsd_metric_prefix', '')
         default_sample_rate = float(conf.get(
             'log_statsd_default_sample_rate', 1))
         sample_rate_factor = float(conf.get(
             'log_statsd_sample_rate_factor', 1))
+        flush_interval = float(conf.get('log_statsd_flush_interval', 0))
+        max_packet_size = int(conf.get('log_statsd_max_packet_size',
+                                       STATSD_MAX_PACKET_SIZE))
         statsd_client = StatsdClient(statsd_host, statsd_port, base_prefix,
                                      name, default_sample_rate,
-                                     sample_rate_factor, logger=logger)
+                                     sample_rate_factor, logger=logger,
+                                     flush_interval=flush_interval,
+                                     max_packet_size=max_packet_size,
+                                     metrics=metrics)
         logger.statsd_client = statsd_client
     else:
         logger.statsd_client = None
@@ -3278,6 +3682,20 @@ class CloseableChain(object):
                 close_method()
 
 
+def prefix_upper_bound(prefix):
+    """
+    Returns the smallest string that sorts after every string starting with
+    the given prefix, or '' if there is no such string because the prefix
+    is empty or made only of '\\xff' bytes.
+
+    :param prefix: a byte string
+    """
+    prefix = prefix.rstrip('\xff')
+    if not prefix:
+        return ''
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
 def reiterate(iterable):
     """
     Consume the first item from an iterator, then re-chain it to the rest of
@@ -3299,6 +3717,50 @@ def reiterate(iterable):
             return []
 
 
+def coalesce_chunks(iterable, chunk_size=65536):
+    """
+    Join the strings yielded by an iterable into chunks of at least
+    chunk_size bytes (the last one may be shorter). This is useful for
+    generators that produce many tiny strings, such as incrementally
+    serialized listings, which would otherwise be written to the client
+    one small chunk at a time.
+
+    :param iterable: an iterable of strings
+    :param chunk_size: minimum size of each chunk yielded, except the last
+    """
+    buf = []
+    buf_len = 0
+    for piece in iterable:
+        buf.append(piece)
+        buf_len += len(piece)
+        if buf_len >= chunk_size:
+            yield ''.join(buf)
+            buf = []
+            buf_len = 0
+    if buf:
+        yield ''.join(buf)
+
+
+def coalesced_app_iter(iterable, chunk_size=65536):
+    """
+    Coalesce the strings yielded by an iterable with
+    :func:`coalesce_chunks`, for use as a response's app_iter. Output that
+    fits in a single chunk is returned as a list, which swob sends with a
+    Content-Length; anything longer is streamed, and so is sent chunked to
+    HTTP/1.1 clients.
+
+    :param iterable: an iterable of strings
+    :param chunk_size: minimum size of each chunk yielded, except the last
+    """
+    chunks = coalesce_chunks(iterable, chunk_size)
+    head = []
+    for chunk in chunks:
+        head.append(chunk)
+        if len(head) > 1:
+            return CloseableChain(head, chunks)
+    return head
+
+
 class InputProxy(object):
     """
     File-like object that counts bytes read.
@@ -3359,6 +3821,7 @@ class LRUCache(object):
         self.head[self.NEXT] = self.tail
 
     def set_cache(self, value, *key):
+        self.pop_cache(*key)
         while len(self.mapping) >= self.maxsize:
             old_next, old_key = self.head[self.NEXT][self.NEXT:self.NEXT + 2]
             self.head[self.NEXT], old_next[self.PREV] = old_next, self.head
@@ -3380,6 +3843,31 @@ class LRUCache(object):
         link[self.NEXT] = self.tail
         return value
 
+    def pop_cache(self, *key):
+        """
+        Drop the member stored under key, if there is one.
+        """
+        link = self.mapping.pop(key, None)
+        if link is not None:
+            link[self.PREV][self.NEXT] = link[self.NEXT]
+            link[self.NEXT][self.PREV] = link[self.PREV]
+
+    def get(self, *key):
+        """
+        Look up a member directly, for callers using the cache without
+        decorating a function.
+
+        :returns: the cached value, or None if it is missing or has timed out
+        """
+        link = self.mapping.get(key)
+        if link is None:
+            return None
+        try:
+            return self.get_cached(link, *key)
+        except KeyError:
+            self.pop_cache(*key)
+            return None
+
     def __call__(self, f):
 
         class LRUCacheWrapped(object):
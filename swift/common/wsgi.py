@@ -434,15 +434,19 @@ def run_server(conf, logger, sock, global_conf=None):
     app = loadapp(conf['__file__'], global_conf=global_conf)
     max_clients = int(conf.get('max_clients', '1024'))
     pool = RestrictedGreenPool(size=max_clients)
+    # HTTP/1.1 connections are kept alive between requests, e.g. for the
+    # proxy's backend connection pool, unless this is turned off
+    server_kwargs = {
+        'custom_pool': pool,
+        'keepalive': config_true_value(conf.get('keepalive', 'yes')),
+    }
     try:
         # Disable capitalizing headers in Eventlet if possible.  This is
         # necessary for the AWS SDK to work with swift3 middleware.
         argspec = inspect.getargspec(wsgi.server)
         if 'capitalize_response_headers' in argspec.args:
-            wsgi.server(sock, app, wsgi_logger, custom_pool=pool,
-                        capitalize_response_headers=False)
-        else:
-            wsgi.server(sock, app, wsgi_logger, custom_pool=pool)
+            server_kwargs['capitalize_response_headers'] = False
+        wsgi.server(sock, app, wsgi_logger, **server_kwargs)
     except socket.error as err:
         if err[0] != errno.EINVAL:
             raise
@@ -26,8 +26,9 @@ from six.moves import range
 import sqlite3
 
 from swift.common.utils import Timestamp, encode_timestamps, decode_timestamps, \
-    extract_swift_bytes
-from swift.common.db import DatabaseBroker, utf8encode
+    extract_swift_bytes, ShardRange, find_shard_range, sort_shard_ranges, \
+    get_shard_root, prefix_upper_bound
+from swift.common.db import DatabaseBroker, utf8encode, dict_factory
 
 
 SQLITE_ARG_LIMIT = 999
@@ -74,6 +75,75 @@ POLICY_STAT_TRIGGER_SCRIPT = '''
     END;
 '''
 
+# Aggregate object count and bytes used per first-level pseudo-folder, i.e.
+# the leading part of an object name up to and including the first '/'.
+# The table is only created when asked for (see
+# ContainerBroker.enable_prefix_stats) and is then kept up to date by
+# triggers, just like policy_stat.
+PREFIX_STAT_TABLE_CREATE = '''
+    CREATE TABLE prefix_stat (
+        storage_policy_index INTEGER,
+        prefix TEXT,
+        object_count INTEGER DEFAULT 0,
+        bytes_used INTEGER DEFAULT 0,
+        PRIMARY KEY (storage_policy_index, prefix)
+    );
+'''
+
+PREFIX_STAT_TRIGGER_SCRIPT = '''
+    CREATE TRIGGER object_insert_prefix_stat AFTER INSERT ON object
+    WHEN new.deleted = 0 AND instr(new.name, '/') > 0
+    BEGIN
+        INSERT OR IGNORE INTO prefix_stat (storage_policy_index, prefix)
+        VALUES (new.storage_policy_index,
+                substr(new.name, 1, instr(new.name, '/')));
+        UPDATE prefix_stat
+        SET object_count = object_count + 1,
+            bytes_used = bytes_used + new.size
+        WHERE storage_policy_index = new.storage_policy_index
+        AND prefix = substr(new.name, 1, instr(new.name, '/'));
+    END;
+
+    CREATE TRIGGER object_delete_prefix_stat AFTER DELETE ON object
+    WHEN old.deleted = 0 AND instr(old.name, '/') > 0
+    BEGIN
+        UPDATE prefix_stat
+        SET object_count = object_count - 1,
+            bytes_used = bytes_used - old.size
+        WHERE storage_policy_index = old.storage_policy_index
+        AND prefix = substr(old.name, 1, instr(old.name, '/'));
+        DELETE FROM prefix_stat
+        WHERE storage_policy_index = old.storage_policy_index
+        AND prefix = substr(old.name, 1, instr(old.name, '/'))
+        AND object_count <= 0;
+    END;
+'''
+
+PREFIX_STAT_POPULATE = '''
+    INSERT INTO prefix_stat (
+        storage_policy_index, prefix, object_count, bytes_used)
+    SELECT storage_policy_index, substr(name, 1, instr(name, '/')),
+           count(*), sum(size)
+    FROM object
+    WHERE deleted = 0 AND instr(name, '/') > 0
+    GROUP BY storage_policy_index, substr(name, 1, instr(name, '/'));
+'''
+
+# Shard ranges of a sharded (root) container. The table is created when the
+# first shard ranges are merged into the DB.
+SHARD_RANGE_TABLE_CREATE = '''
+    CREATE TABLE shard_range (
+        name TEXT PRIMARY KEY,
+        lower TEXT,
+        upper TEXT,
+        timestamp TEXT,
+        object_count INTEGER DEFAULT 0,
+        bytes_used INTEGER DEFAULT 0,
+        meta_timestamp TEXT,
+        deleted INTEGER DEFAULT 0
+    );
+'''
+
 CONTAINER_INFO_TABLE_SCRIPT = '''
     CREATE TABLE container_info (
         account TEXT,
@@ -402,7 +472,9 @@ class ContainerBroker(DatabaseBroker):
                     raise
                 row = conn.execute(
                     'SELECT object_count from container_stat').fetchone()
-            return (row[0] == 0)
+        if row[0]:
+            return False
+        return not any(sr.object_count for sr in self.get_shard_ranges())
 
     def delete_object(self, name, timestamp, storage_policy_index=0):
         """
@@ -496,6 +568,9 @@ class ContainerBroker(DatabaseBroker):
                   reported_delete_timestamp, reported_object_count,
                   reported_bytes_used, hash, id, x_container_sync_point1,
                   x_container_sync_point2, and storage_policy_index.
+                  The object_count and bytes_used of a sharded root
+                  container include those reported by its shards, and
+                  its sharding state is cached for get_sharding_state.
         """
         self._commit_puts_stale_ok()
         with self.get() as conn:
@@ -532,7 +607,18 @@ class ContainerBroker(DatabaseBroker):
             self._storage_policy_index = data['storage_policy_index']
             self.account = data['account']
             self.container = data['container']
-            return data
+        self._sharding_state = 'unsharded'
+        if get_shard_root(self.account, self.container) is None:
+            # the objects of a sharded root container are held in its
+            # shards, once the sharder has moved all of its own rows
+            shard_ranges = self.get_shard_ranges()
+            if shard_ranges:
+                self._sharding_state = \
+                    'sharding' if data['object_count'] else 'sharded'
+            for shard_range in shard_ranges:
+                data['object_count'] += shard_range.object_count
+                data['bytes_used'] += shard_range.bytes_used
+        return data
 
     def set_x_container_sync_points(self, sync_point1, sync_point2):
         with self.get() as conn:
@@ -793,6 +879,295 @@ class ContainerBroker(DatabaseBroker):
                     break
             return results
 
+    def list_prefix_stats(self, limit, marker, end_marker, prefix,
+                          storage_policy_index=0, reverse=False):
+        """
+        Get a list of first-level pseudo-folders (object name prefixes up to
+        and including the first '/') with the number of objects and bytes
+        stored below each of them, sorted by name.
+
+        The aggregates are read from the prefix_stat table so the object
+        table is not scanned. The table is created by
+        :meth:`enable_prefix_stats`.
+
+        :param limit: maximum number of entries to get
+        :param marker: marker query
+        :param end_marker: end marker query
+        :param prefix: only return pseudo-folders starting with this prefix
+        :param storage_policy_index: storage policy index for query
+        :param reverse: reverse the result order.
+
+        :returns: list of tuples of (prefix, object_count, bytes_used), or
+                  None if the database doesn't have the prefix_stat table yet
+        """
+        (marker, end_marker, prefix) = utf8encode(marker, end_marker, prefix)
+        self._commit_puts_stale_ok()
+        if reverse:
+            # Reverse the markers if we are reversing the listing.
+            marker, end_marker = end_marker, marker
+        query = '''SELECT prefix, object_count, bytes_used
+                   FROM prefix_stat WHERE storage_policy_index = ?'''
+        query_args = [storage_policy_index]
+        if marker:
+            query += ' AND prefix > ?'
+            query_args.append(marker)
+        if end_marker:
+            query += ' AND prefix < ?'
+            query_args.append(end_marker)
+        if prefix:
+            query += ' AND prefix >= ?'
+            query_args.append(prefix)
+            end_prefix = prefix_upper_bound(prefix)
+            if end_prefix:
+                query += ' AND prefix < ?'
+                query_args.append(end_prefix)
+        query += ' ORDER BY prefix %s LIMIT ?' % ('DESC' if reverse else '')
+        query_args.append(limit)
+        with self.get() as conn:
+            try:
+                curs = conn.execute(query, query_args)
+            except sqlite3.OperationalError as err:
+                if 'no such table: prefix_stat' not in str(err):
+                    raise
+                return None
+            curs.row_factory = None
+            return [tuple(row) for row in curs]
+
+    def _has_prefix_stat_table(self, conn):
+        return bool(conn.execute('''
+            SELECT name FROM sqlite_master
+            WHERE type = 'table' AND name = 'prefix_stat'
+            ''').fetchone())
+
+    def has_prefix_stats(self):
+        """
+        Check if the database keeps per pseudo-folder stats.
+
+        :returns: True if the prefix_stat table exists
+        """
+        with self.get() as conn:
+            return self._has_prefix_stat_table(conn)
+
+    def enable_prefix_stats(self):
+        """
+        Create and populate the prefix_stat table, if it doesn't exist yet.
+        This is a pass over the whole object table, so it is left to the
+        replicator rather than done while answering a request.
+
+        :returns: True if the table was created
+        """
+        with self.get() as conn:
+            if self._has_prefix_stat_table(conn):
+                return False
+            self._migrate_add_prefix_stat(conn)
+        return True
+
+    def get_shard_ranges(self, marker=None, end_marker=None, includes=None,
+                         include_deleted=False):
+        """
+        Get the shard ranges of this container, in namespace order.
+
+        :param marker: only return ranges with names after the marker
+        :param end_marker: only return ranges with names before the
+                           end_marker
+        :param includes: only return the range, if any, that includes this
+                         object name; overrides marker and end_marker
+        :param include_deleted: also return ranges that have been deleted
+        :returns: a list of ShardRange instances
+        """
+        with self.get() as conn:
+            try:
+                curs = conn.execute('''
+                    SELECT name, lower, upper, timestamp, object_count,
+                           bytes_used, meta_timestamp, deleted
+                    FROM shard_range''')
+            except sqlite3.OperationalError as err:
+                if 'no such table: shard_range' not in str(err):
+                    raise
+                return []
+            curs.row_factory = dict_factory
+            shard_ranges = [ShardRange.from_dict(row) for row in curs]
+        if not include_deleted:
+            shard_ranges = [sr for sr in shard_ranges if not sr.deleted]
+        if includes is not None:
+            shard_range = find_shard_range(includes, shard_ranges)
+            return [shard_range] if shard_range else []
+        if marker or end_marker:
+            marker, end_marker = utf8encode(marker, end_marker)
+            shard_ranges = [sr for sr in shard_ranges
+                            if sr.overlaps(marker, end_marker)]
+        return sort_shard_ranges(shard_ranges)
+
+    def merge_shard_ranges(self, shard_ranges):
+        """
+        Merge shard ranges into this container's shard_range table. For each
+        range the bounds and deleted status with the newest timestamp win,
+        as do the stats with the newest meta_timestamp.
+
+        :param shard_ranges: a list of ShardRange instances
+        """
+        if not shard_ranges:
+            return
+
+        def _really_merge_shard_ranges(conn):
+            curs = conn.cursor()
+            curs.execute('BEGIN IMMEDIATE')
+            existing = {}
+            for row in curs.execute('''
+                    SELECT name, timestamp, lower, upper, object_count,
+                           bytes_used, meta_timestamp, deleted
+                    FROM shard_range'''):
+                existing[row[0]] = ShardRange(*row)
+            to_add = []
+            for shard_range in shard_ranges:
+                current = existing.get(shard_range.name)
+                if current is None:
+                    merged = shard_range
+                else:
+                    if shard_range.timestamp > current.timestamp:
+                        merged = shard_range.copy(
+                            object_count=current.object_count,
+                            bytes_used=current.bytes_used,
+                            meta_timestamp=current.meta_timestamp)
+                    else:
+                        merged = current.copy()
+                    if shard_range.meta_timestamp > current.meta_timestamp:
+                        merged.object_count = shard_range.object_count
+                        merged.bytes_used = shard_range.bytes_used
+                        merged.meta_timestamp = shard_range.meta_timestamp
+                    if merged == current:
+                        continue
+                existing[merged.name] = merged
+                to_add.append(merged)
+            curs.executemany('''
+                INSERT OR REPLACE INTO shard_range (
+                    name, lower, upper, timestamp, object_count, bytes_used,
+                    meta_timestamp, deleted)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ''', ((sr.name, sr.lower, sr.upper, sr.timestamp.internal,
+                   sr.object_count, sr.bytes_used, sr.meta_timestamp.internal,
+                   int(sr.deleted)) for sr in to_add))
+            conn.commit()
+
+        with self.get() as conn:
+            try:
+                _really_merge_shard_ranges(conn)
+            except sqlite3.OperationalError as err:
+                if 'no such table: shard_range' not in str(err):
+                    raise
+                conn.executescript(SHARD_RANGE_TABLE_CREATE)
+                _really_merge_shard_ranges(conn)
+        if hasattr(self, '_sharding_state'):
+            del self._sharding_state
+
+    def is_root_container(self):
+        """
+        Check whether this is a root container, i.e. not a shard container.
+        """
+        if self.account is None or self.container is None:
+            self.get_info()
+        return get_shard_root(self.account, self.container) is None
+
+    def get_sharding_state(self):
+        """
+        Get the sharding state of this container: 'unsharded' if it has no
+        active shard ranges, 'sharding' if it has some but still holds
+        object rows that are yet to be moved to its shards, or 'sharded'.
+
+        The state is worked out by get_info, which reads the shard ranges
+        anyway, so asking for it after get_info costs no query.
+        """
+        if not hasattr(self, '_sharding_state'):
+            self.get_info()
+        return self._sharding_state
+
+    def is_sharded(self):
+        """
+        Check whether the objects of this container are held in shard
+        containers, i.e. whether it has any active shard ranges.
+        """
+        return self.get_sharding_state() != 'unsharded'
+
+    def find_shard_boundaries(self, rows_per_shard, lower='', upper=''):
+        """
+        Find the names that split the undeleted objects in the namespace
+        ``lower < name <= upper`` into shards of ``rows_per_shard`` objects.
+        The last shard holds whatever rows remain, so at least
+        ``rows_per_shard`` and fewer than ``2 * rows_per_shard`` of them;
+        no boundaries are returned if there are fewer than
+        ``2 * rows_per_shard`` rows in the namespace.
+
+        :returns: a list of inclusive upper bounds, in order
+        """
+        self._commit_puts_stale_ok()
+        query = '''SELECT name FROM object
+                   WHERE deleted = 0 AND name > ?%s
+                   ORDER BY name LIMIT 1 OFFSET ?''' % (
+            ' AND name <= ?' if upper else '')
+        boundaries = []
+        bound = lower
+        with self.get() as conn:
+            while True:
+                args = [bound] + ([upper] if upper else [])
+                # look far enough ahead that there are enough rows left over
+                # for the final shard
+                row = conn.execute(query, args + [2 * rows_per_shard - 1]
+                                   ).fetchone()
+                if not row:
+                    break
+                bound = conn.execute(query, args + [rows_per_shard - 1]
+                                     ).fetchone()[0]
+                boundaries.append(bound)
+        return boundaries
+
+    def get_objects(self, lower, upper, limit, include_deleted=True):
+        """
+        Get object rows in the namespace ``lower < name <= upper`` (an empty
+        ``upper`` is unbounded) in a form suitable for :meth:`merge_items`.
+
+        :param limit: maximum number of rows to return
+        :param include_deleted: also return rows for deleted objects
+        :returns: a list of dicts, including each row's ROWID
+        """
+        self._commit_puts_stale_ok()
+        query = '''SELECT ROWID, name, created_at, size, content_type, etag,
+                          deleted, storage_policy_index
+                   FROM object WHERE name > ?'''
+        args = [lower]
+        if upper:
+            query += ' AND name <= ?'
+            args.append(upper)
+        if not include_deleted:
+            query += ' AND deleted = 0'
+        query += ' ORDER BY name LIMIT ?'
+        args.append(limit)
+        with self.get() as conn:
+            try:
+                curs = conn.execute(query, args)
+            except sqlite3.OperationalError as err:
+                if 'no such column: storage_policy_index' not in str(err):
+                    raise
+                self._migrate_add_storage_policy(conn)
+                curs = conn.execute(query, args)
+            curs.row_factory = dict_factory
+            return [row for row in curs]
+
+    def remove_objects(self, rowids):
+        """
+        Remove object rows, e.g. once they have been moved to a shard
+        container. Rows are identified by ROWID so that a row that has since
+        been replaced by a newer update is left alone.
+
+        :param rowids: a list of ROWIDs
+        """
+        with self.get() as conn:
+            with self._batched_hash_updates(conn):
+                for offset in range(0, len(rowids), SQLITE_ARG_LIMIT):
+                    chunk = rowids[offset:offset + SQLITE_ARG_LIMIT]
+                    conn.execute('DELETE FROM object WHERE ROWID IN (%s)' %
+                                 ','.join('?' * len(chunk)), chunk)
+            conn.commit()
+
     def _transform_record(self, record):
         """
         Decode the created_at timestamp into separate data, content-type and
@@ -856,21 +1231,22 @@ class ContainerBroker(DatabaseBroker):
                     if item_ident in to_add:  # duplicate entries in item_list
                         update_new_item_from_existing(item, to_add[item_ident])
                     to_add[item_ident] = item
-            if to_delete:
-                curs.executemany(
-                    'DELETE FROM object WHERE ' + query_mod +
-                    'name=? AND storage_policy_index=?',
-                    ((rec['name'], rec['storage_policy_index'])
-                     for rec in to_delete.values()))
-            if to_add:
-                curs.executemany(
-                    'INSERT INTO object (name, created_at, size, content_type,'
-                    'etag, deleted, storage_policy_index)'
-                    'VALUES (?, ?, ?, ?, ?, ?, ?)',
-                    ((rec['name'], rec['created_at'], rec['size'],
-                      rec['content_type'], rec['etag'], rec['deleted'],
-                      rec['storage_policy_index'])
-                     for rec in to_add.values()))
+            with self._batched_hash_updates(conn):
+                if to_delete:
+                    curs.executemany(
+                        'DELETE FROM object WHERE ' + query_mod +
+                        'name=? AND storage_policy_index=?',
+                        ((rec['name'], rec['storage_policy_index'])
+                         for rec in to_delete.values()))
+                if to_add:
+                    curs.executemany(
+                        'INSERT INTO object (name, created_at, size, '
+                        'content_type, etag, deleted, storage_policy_index)'
+                        'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                        ((rec['name'], rec['created_at'], rec['size'],
+                          rec['content_type'], rec['etag'], rec['deleted'],
+                          rec['storage_policy_index'])
+                         for rec in to_add.values()))
             if source:
                 # for replication we rely on the remote end sending merges in
                 # order with no gaps to increment sync_points
@@ -1040,3 +1416,23 @@ class ContainerBroker(DatabaseBroker):
             ''' % (column_names, column_names) +
             CONTAINER_STAT_VIEW_SCRIPT +
             'COMMIT;')
+
+    def _migrate_add_prefix_stat(self, conn):
+        """
+        Create the 'prefix_stat' table and its triggers, and populate it from
+        the current contents of the object table.
+        """
+        try:
+            conn.executescript(
+                'BEGIN;' +
+                PREFIX_STAT_TABLE_CREATE +
+                PREFIX_STAT_TRIGGER_SCRIPT +
+                PREFIX_STAT_POPULATE +
+                'COMMIT;')
+        except sqlite3.OperationalError as err:
+            conn.execute('ROLLBACK;')
+            if 'no such column: storage_policy_index' in str(err):
+                self._migrate_add_storage_policy(conn)
+                self._migrate_add_prefix_stat(conn)
+            elif 'already exists' not in str(err):
+                raise
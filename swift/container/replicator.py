@@ -31,7 +31,8 @@ from swift.common.exceptions import DeviceUnavailable
 from swift.common.http import is_success
 from swift.common.db import DatabaseAlreadyExists
 from swift.common.utils import (Timestamp, hash_path,
-                                storage_directory, majority_size)
+                                storage_directory, majority_size,
+                                config_true_value)
 
 
 class ContainerReplicator(db_replicator.Replicator):
@@ -40,6 +41,11 @@ class ContainerReplicator(db_replicator.Replicator):
     datadir = DATADIR
     default_port = 6201
 
+    def __init__(self, conf, logger=None):
+        super(ContainerReplicator, self).__init__(conf, logger=logger)
+        self.allow_prefix_stats = config_true_value(
+            conf.get('allow_prefix_stats', 'f'))
+
     def report_up_to_date(self, full_info):
         reported_key_map = {
             'reported_put_timestamp': 'put_timestamp',
@@ -197,6 +203,13 @@ class ContainerReplicator(db_replicator.Replicator):
             self.logger.exception('Failed to update sync_store %s' %
                                   broker.db_file)
 
+        if self.allow_prefix_stats:
+            try:
+                broker.enable_prefix_stats()
+            except Exception:
+                self.logger.exception('Failed to build prefix stats %s' %
+                                      broker.db_file)
+
         point = broker.get_reconciler_sync()
         if not broker.has_multiple_policies() and info['max_row'] != point:
             broker.update_reconciler_sync(info['max_row'])
@@ -19,9 +19,10 @@ import time
 import traceback
 import math
 from swift import gettext_ as _
-from xml.etree.cElementTree import Element, SubElement, tostring
 
 from eventlet import Timeout
+import six
+from six.moves.urllib.parse import quote
 
 import swift.common.db
 from swift.container.sync_store import ContainerSyncStore
@@ -30,23 +31,25 @@ from swift.container.replicator import ContainerReplicatorRpc
 from swift.common.db import DatabaseAlreadyExists
 from swift.common.container_sync_realms import ContainerSyncRealms
 from swift.common.request_helpers import get_param, get_listing_content_type, \
-    split_and_validate_path, is_sys_or_user_meta
+    split_and_validate_path, is_sys_or_user_meta, container_listing_xml_iter
 from swift.common.utils import get_logger, hash_path, public, \
     Timestamp, storage_directory, validate_sync_to, \
     config_true_value, timing_stats, replication, \
-    override_bytes_from_content_type, get_log_line
+    override_bytes_from_content_type, get_log_line, ShardRange, \
+    coalesced_app_iter
 from swift.common.constraints import check_mount, valid_timestamp, check_utf8
 from swift.common import constraints
 from swift.common.bufferedhttp import http_connect
 from swift.common.exceptions import ConnectionTimeout
-from swift.common.http import HTTP_NOT_FOUND, is_success
+from swift.common.http import HTTP_NOT_FOUND, HTTP_BAD_REQUEST, \
+    HTTP_PRECONDITION_FAILED, HTTP_INTERNAL_SERVER_ERROR, is_success
 from swift.common.storage_policy import POLICIES
 from swift.common.base_storage_server import BaseStorageServer
 from swift.common.header_key_dict import HeaderKeyDict
 from swift.common.swob import HTTPAccepted, HTTPBadRequest, HTTPConflict, \
     HTTPCreated, HTTPInternalServerError, HTTPNoContent, HTTPNotFound, \
     HTTPPreconditionFailed, HTTPMethodNotAllowed, Request, Response, \
-    HTTPInsufficientStorage, HTTPException
+    HTTPInsufficientStorage, HTTPException, HTTPOk, HTTPServiceUnavailable
 
 
 def gen_resp_headers(info, is_deleted=False):
@@ -109,6 +112,8 @@ class ContainerController(BaseStorageServer):
             logger=self.logger)
         self.auto_create_account_prefix = \
             conf.get('auto_create_account_prefix') or '.'
+        self.allow_prefix_stats = config_true_value(
+            conf.get('allow_prefix_stats', 'f'))
         if config_true_value(conf.get('allow_versions', 'f')):
             self.save_headers.append('x-versions-location')
         swift.common.db.DB_PREALLOCATION = \
@@ -375,6 +380,9 @@ class ContainerController(BaseStorageServer):
                               req.headers.get('x-content-type-timestamp'),
                               req.headers.get('x-meta-timestamp'))
             return HTTPCreated(request=req)
+        elif req.headers.get('X-Backend-Record-Type', '').lower() == \
+                'shard':
+            return self._put_shard_ranges(req, broker)
         else:   # put container
             if requested_policy_index is None:
                 # use the default index sent by the proxy if available
@@ -412,6 +420,68 @@ class ContainerController(BaseStorageServer):
                                     headers={'x-backend-storage-policy-index':
                                              broker.storage_policy_index})
 
+    def _update_object(self, drive, part, update):
+        """
+        Makes one of the object updates of an UPDATE request, as if it had
+        come in a PUT or DELETE request of its own.
+
+        :returns: the status of the update
+        """
+        try:
+            op = update['op']
+            names = [update[key] for key in ('account', 'container', 'obj')]
+            headers = update['headers']
+            if op not in ('PUT', 'DELETE') or not all(names):
+                return HTTP_BAD_REQUEST
+            if six.PY2:
+                names = [name.encode('utf-8') for name in names]
+                headers = dict(
+                    (key.encode('utf-8'), value.encode('utf-8')
+                     if isinstance(value, six.text_type) else str(value))
+                    for key, value in headers.items())
+            path = '/'.join(['', drive, part] + names)
+        except (KeyError, TypeError, AttributeError, UnicodeError):
+            return HTTP_BAD_REQUEST
+        if not check_utf8(path):
+            return HTTP_PRECONDITION_FAILED
+        sub_req = Request.blank(quote(path), environ={'REQUEST_METHOD': op},
+                                headers=headers)
+        try:
+            return getattr(self, op)(sub_req).status_int
+        except HTTPException as error_response:
+            return error_response.status_int
+        except (Exception, Timeout):
+            self.logger.exception(_(
+                'ERROR UPDATE error with %(method)s %(path)s '),
+                {'method': op, 'path': path})
+            return HTTP_INTERNAL_SERVER_ERROR
+
+    @public
+    @timing_stats()
+    def UPDATE(self, req):
+        """
+        Handle HTTP UPDATE request: a batch of object updates, for the
+        containers in a partition, from an object server.
+
+        The body is a JSON list of updates, each a dict of the op ('PUT' or
+        'DELETE'), account, container, obj and the headers of the container
+        update. The response body is a JSON list of the status of each.
+        """
+        drive, part = split_and_validate_path(req, 2)
+        if self.mount_check and not check_mount(self.root, drive):
+            return HTTPInsufficientStorage(drive=drive, request=req)
+        try:
+            updates = json.loads(req.body)
+        except ValueError as err:
+            return HTTPBadRequest(body=str(err), content_type='text/plain')
+        if not isinstance(updates, list):
+            return HTTPBadRequest(body='Expected a list of updates',
+                                  content_type='text/plain')
+        statuses = [self._update_object(drive, part, update)
+                    for update in updates]
+        return HTTPOk(request=req, body=json.dumps(statuses),
+                      content_type='application/json')
+
     @public
     @timing_stats(sample_rate=0.1)
     def HEAD(self, req):
@@ -428,6 +498,9 @@ class ContainerController(BaseStorageServer):
         headers = gen_resp_headers(info, is_deleted=is_deleted)
         if is_deleted:
             return HTTPNotFound(request=req, headers=headers)
+        sharding_state = broker.get_sharding_state()
+        if sharding_state != 'unsharded':
+            headers['X-Backend-Sharding-State'] = sharding_state
         headers.update(
             (key, value)
             for key, (value, timestamp) in broker.metadata.items()
@@ -438,6 +511,42 @@ class ContainerController(BaseStorageServer):
         resp.last_modified = math.ceil(float(headers['X-PUT-Timestamp']))
         return resp
 
+    def _put_shard_ranges(self, req, broker):
+        """
+        Merge the JSON list of shard ranges in the request body into the
+        container's shard ranges.
+        """
+        if not os.path.exists(broker.db_file):
+            return HTTPNotFound(request=req)
+        try:
+            shard_ranges = json.loads(req.body)
+            if not isinstance(shard_ranges, list):
+                raise ValueError('expected a list')
+            shard_ranges = [ShardRange.from_dict(shard_range)
+                            for shard_range in shard_ranges]
+        except (ValueError, TypeError, KeyError) as err:
+            return HTTPBadRequest(request=req, content_type='text/plain',
+                                  body='Invalid shard ranges: %s' % err)
+        broker.merge_shard_ranges(shard_ranges)
+        return HTTPAccepted(request=req)
+
+    def _get_shard_ranges(self, req, broker, resp_headers, marker,
+                          end_marker):
+        """
+        Return the container's shard ranges as a JSON list, optionally
+        limited to those overlapping ``marker`` and ``end_marker`` or to the
+        one that includes the object name given by the ``includes`` query
+        parameter.
+        """
+        shard_ranges = broker.get_shard_ranges(
+            marker=marker, end_marker=end_marker,
+            includes=get_param(req, 'includes'),
+            include_deleted=config_true_value(get_param(req, 'deleted')))
+        resp_headers['X-Backend-Record-Type'] = 'shard'
+        return HTTPOk(request=req, headers=resp_headers,
+                      content_type='application/json', charset='utf-8',
+                      body=json.dumps([dict(sr) for sr in shard_ranges]))
+
     def update_data_record(self, record):
         """
         Perform any mutations to container listing records that are common to
@@ -492,43 +601,91 @@ class ContainerController(BaseStorageServer):
         resp_headers = gen_resp_headers(info, is_deleted=is_deleted)
         if is_deleted:
             return HTTPNotFound(request=req, headers=resp_headers)
+        if req.headers.get('X-Backend-Record-Type', '').lower() == 'shard':
+            return self._get_shard_ranges(req, broker, resp_headers, marker,
+                                          end_marker)
+        sharding_state = broker.get_sharding_state()
+        if sharding_state != 'unsharded':
+            resp_headers['X-Backend-Sharding-State'] = sharding_state
+        if self.allow_prefix_stats and \
+                config_true_value(get_param(req, 'prefix_stats')):
+            prefix_list = broker.list_prefix_stats(
+                limit, marker, end_marker, prefix,
+                storage_policy_index=info['storage_policy_index'],
+                reverse=reverse)
+            if prefix_list is None:
+                # the replicator hasn't built the stats of this DB yet
+                return HTTPServiceUnavailable(request=req)
+            return self.create_prefix_stats_listing(
+                req, out_content_type, resp_headers, broker.metadata,
+                prefix_list, container)
         container_list = broker.list_objects_iter(
             limit, marker, end_marker, prefix, delimiter, path,
             storage_policy_index=info['storage_policy_index'], reverse=reverse)
         return self.create_listing(req, out_content_type, info, resp_headers,
                                    broker.metadata, container_list, container)
 
-    def create_listing(self, req, out_content_type, info, resp_headers,
-                       metadata, container_list, container):
+    def _json_listing_iter(self, container_list):
+        """
+        Serialize a container listing to JSON one record at a time.
+
+        The output is identical to ``json.dumps`` of the whole list of
+        records, but the list of dicts and the complete JSON string are never
+        held in memory at once.
+        """
+        yield '['
+        separator = ''
+        for record in container_list:
+            yield separator + json.dumps(self.update_data_record(record))
+            separator = ', '
+        yield ']'
+
+    def _add_metadata_headers(self, resp_headers, metadata):
         for key, (value, timestamp) in metadata.items():
             if value and (key.lower() in self.save_headers or
                           is_sys_or_user_meta('container', key)):
                 resp_headers[key] = value
+
+    def create_prefix_stats_listing(self, req, out_content_type, resp_headers,
+                                    metadata, prefix_list, container):
+        """
+        Build the response to a ``prefix_stats`` listing, which has one entry
+        per first-level pseudo-folder with the aggregate object count and
+        bytes used below it.
+        """
+        self._add_metadata_headers(resp_headers, metadata)
+        # tells the proxy that the listing is of pseudo-folder stats, which
+        # have to be added up across the shards of a sharded container
+        resp_headers['X-Backend-Prefix-Stats'] = 'true'
         ret = Response(request=req, headers=resp_headers,
                        content_type=out_content_type, charset='utf-8')
         if out_content_type == 'application/json':
-            ret.body = json.dumps([self.update_data_record(record)
-                                   for record in container_list])
+            ret.body = json.dumps([
+                {'subdir': name, 'count': count, 'bytes': bytes_used}
+                for name, count, bytes_used in prefix_list])
         elif out_content_type.endswith('/xml'):
-            doc = Element('container', name=container.decode('utf-8'))
-            for obj in container_list:
-                record = self.update_data_record(obj)
-                if 'subdir' in record:
-                    name = record['subdir'].decode('utf-8')
-                    sub = SubElement(doc, 'subdir', name=name)
-                    SubElement(sub, 'name').text = name
-                else:
-                    obj_element = SubElement(doc, 'object')
-                    for field in ["name", "hash", "bytes", "content_type",
-                                  "last_modified"]:
-                        SubElement(obj_element, field).text = str(
-                            record.pop(field)).decode('utf-8')
-                    for field in sorted(record):
-                        SubElement(obj_element, field).text = str(
-                            record[field]).decode('utf-8')
-            ret.body = tostring(doc, encoding='UTF-8').replace(
-                "<?xml version='1.0' encoding='UTF-8'?>",
-                '<?xml version="1.0" encoding="UTF-8"?>', 1)
+            ret.body = ''.join(container_listing_xml_iter(container, (
+                {'subdir': name, 'count': count, 'bytes': bytes_used}
+                for name, count, bytes_used in prefix_list)))
+        else:
+            if not prefix_list:
+                return HTTPNoContent(request=req, headers=resp_headers)
+            ret.body = '\n'.join(rec[0] for rec in prefix_list) + '\n'
+        ret.last_modified = math.ceil(float(resp_headers['X-PUT-Timestamp']))
+        return ret
+
+    def create_listing(self, req, out_content_type, info, resp_headers,
+                       metadata, container_list, container):
+        self._add_metadata_headers(resp_headers, metadata)
+        ret = Response(request=req, headers=resp_headers,
+                       content_type=out_content_type, charset='utf-8')
+        if out_content_type == 'application/json':
+            ret.app_iter = coalesced_app_iter(
+                self._json_listing_iter(container_list))
+        elif out_content_type.endswith('/xml'):
+            ret.app_iter = coalesced_app_iter(container_listing_xml_iter(
+                container, (self.update_data_record(record)
+                            for record in container_list)))
         else:
             if not container_list:
                 return HTTPNoContent(request=req, headers=resp_headers)
@@ -0,0 +1,445 @@
+# Copyright (c) 2010-2012 OpenStack Foundation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import time
+from collections import defaultdict
+from swift import gettext_ as _
+from random import random
+
+from eventlet import Timeout
+
+import swift.common.db
+from swift.container.backend import ContainerBroker, DATADIR
+from swift.common.db import DatabaseAlreadyExists
+from swift.common.direct_client import direct_get_container_shard_ranges, \
+    direct_put_container_shard_ranges
+from swift.common.ring import Ring
+from swift.common.ring.utils import is_local_device
+from swift.common.utils import get_logger, audit_location_generator, \
+    config_true_value, dump_recon_cache, whataremyips, hash_path, \
+    storage_directory, majority_size, Timestamp, ShardRange, \
+    find_shard_range, get_shard_root
+from swift.common.daemon import Daemon
+
+
+class ContainerSharder(Daemon):
+    """
+    Split large containers into shard containers, and keep the objects of
+    sharded containers in the right shards.
+
+    A sharded (root) container holds the list of its shard ranges. Each
+    shard range names a shard container, in a hidden account, that holds
+    the listing of the objects whose names fall in the range. The proxy uses
+    the shard ranges to send object updates to the right shard and to
+    stitch together listings of the root container.
+
+    On each pass the sharder visits every local container DB:
+
+    * Object rows found in a sharded root container, and rows found in a
+      shard container that fall outside its range, are moved to the DB of
+      the container that now owns them. The receiving DB is created locally
+      if necessary and the container replicator pushes it to its primary
+      nodes.
+    * The first primary node of a shard container reports its object count
+      and bytes used to the root container, whose listing of shard ranges
+      thereby also serves to report its stats.
+    * If ``auto_shard`` is enabled, the first primary node of a container
+      with at least ``shard_container_threshold`` objects splits it into
+      shards of about half that many objects each, and the first primary
+      node of a root container merges a shard that has shrunk below
+      ``shard_shrink_threshold`` objects into a neighbour.
+    """
+
+    def __init__(self, conf, logger=None):
+        self.conf = conf
+        self.logger = logger or get_logger(conf, log_route='container-sharder')
+        self.devices = conf.get('devices', '/srv/node')
+        self.mount_check = config_true_value(conf.get('mount_check', 'true'))
+        self.swift_dir = conf.get('swift_dir', '/etc/swift')
+        self.interval = int(conf.get('interval', 300))
+        self.bind_ip = conf.get('bind_ip', '0.0.0.0')
+        self.port = int(conf.get('bind_port', 6201))
+        self.auto_shard = config_true_value(conf.get('auto_shard', 'false'))
+        self.shard_container_threshold = int(
+            conf.get('shard_container_threshold', 1000000))
+        self.shard_shrink_threshold = int(conf.get(
+            'shard_shrink_threshold', self.shard_container_threshold // 10))
+        self.shard_batch_size = int(conf.get('shard_batch_size', 10000))
+        self.conn_timeout = float(conf.get('conn_timeout', 5))
+        self.node_timeout = float(conf.get('node_timeout', 10))
+        self.ring = None
+        self._local_device_ids = set()
+        self.stats = defaultdict(int)
+        swift.common.db.DB_PREALLOCATION = \
+            config_true_value(conf.get('db_preallocation', 'f'))
+        self.recon_cache_path = conf.get('recon_cache_path',
+                                         '/var/cache/swift')
+        self.rcache = os.path.join(self.recon_cache_path, "container.recon")
+
+    def get_ring(self):
+        """Get the container ring.  Load it if it hasn't been yet."""
+        if not self.ring:
+            self.ring = Ring(self.swift_dir, ring_name='container')
+        return self.ring
+
+    def _find_local_devices(self):
+        ips = whataremyips(self.bind_ip)
+        self._local_device_ids = set(
+            dev['id'] for dev in self.get_ring().devs
+            if dev and is_local_device(ips, self.port,
+                                       dev['replication_ip'],
+                                       dev['replication_port']))
+
+    def _is_leader(self, account, container, device):
+        """
+        Check whether this node is the one that makes sharding decisions for
+        a container: its first primary node.
+        """
+        part, nodes = self.get_ring().get_nodes(account, container)
+        return nodes[0]['id'] in self._local_device_ids and \
+            nodes[0]['device'] == device
+
+    def _one_shard_pass(self):
+        self.stats.clear()
+        self._find_local_devices()
+        all_locs = audit_location_generator(self.devices, DATADIR, '.db',
+                                            mount_check=self.mount_check,
+                                            logger=self.logger)
+        for path, device, partition in all_locs:
+            try:
+                self._process_broker(
+                    ContainerBroker(path, logger=self.logger), device)
+            except (Exception, Timeout):
+                self.stats['errors'] += 1
+                self.logger.increment('errors')
+                self.logger.exception(_('ERROR sharding %s'), path)
+        self.logger.info(
+            _('Container sharder pass: %(visited)d containers visited, '
+              '%(moved)d objects moved, %(split)d containers split, '
+              '%(shrunk)d shards shrunk, %(errors)d errors'),
+            {'visited': self.stats['visited'],
+             'moved': self.stats['moved'], 'split': self.stats['split'],
+             'shrunk': self.stats['shrunk'], 'errors': self.stats['errors']})
+
+    def run_forever(self, *args, **kwargs):
+        """Run the container sharder until stopped."""
+        time.sleep(random() * self.interval)
+        while True:
+            self.logger.info(_('Begin container sharder pass.'))
+            begin = time.time()
+            try:
+                self._one_shard_pass()
+            except (Exception, Timeout):
+                self.logger.increment('errors')
+                self.logger.exception(_('ERROR sharding'))
+            elapsed = time.time() - begin
+            self.logger.info(
+                _('Container sharder pass completed: %.02fs'), elapsed)
+            dump_recon_cache({'container_sharder_pass_completed': elapsed},
+                             self.rcache, self.logger)
+            if elapsed < self.interval:
+                time.sleep(self.interval - elapsed)
+
+    def run_once(self, *args, **kwargs):
+        """Run the container sharder once."""
+        self.logger.info(_('Begin container sharder "once" mode'))
+        begin = time.time()
+        self._one_shard_pass()
+        elapsed = time.time() - begin
+        self.logger.info(
+            _('Container sharder "once" mode completed: %.02fs'), elapsed)
+        dump_recon_cache({'container_sharder_pass_completed': elapsed},
+                         self.rcache, self.logger)
+
+    def _process_broker(self, broker, device):
+        if broker.is_deleted():
+            return
+        info = broker.get_info()
+        self.stats['visited'] += 1
+        root = get_shard_root(info['account'], info['container'])
+        if root is None:
+            self._process_root(broker, info, device)
+        else:
+            self._process_shard(broker, info, root, device)
+
+    def _process_root(self, broker, info, device):
+        is_leader = self._is_leader(info['account'], info['container'],
+                                    device)
+        shard_ranges = broker.get_shard_ranges()
+        if not shard_ranges:
+            if self.auto_shard and is_leader and \
+                    info['object_count'] >= self.shard_container_threshold:
+                shard_ranges = self._split(broker, info, '', '')
+            if not shard_ranges:
+                return
+        elif is_leader:
+            # shard ranges aren't replicated with the object rows, so make
+            # sure every replica of the root has them
+            self._update_root(info['account'], info['container'],
+                              broker.get_shard_ranges(include_deleted=True))
+        # every object row in a sharded root belongs in one of its shards
+        self._move_objects(broker, device, info, shard_ranges, '', '')
+        if self.auto_shard and is_leader:
+            self._shrink(broker, info, shard_ranges)
+
+    def _process_shard(self, broker, info, root, device):
+        root_account, root_container = root
+        shard_ranges = self._get_root_shard_ranges(root_account,
+                                                   root_container)
+        if shard_ranges is None:
+            return
+        name = '%s/%s' % (info['account'], info['container'])
+        own_range = None
+        for shard_range in shard_ranges:
+            if shard_range.name == name:
+                own_range = shard_range
+                break
+        if own_range is None:
+            # this shard has been replaced (or was never used): hand all of
+            # its rows to the containers that now own them
+            self._move_objects(broker, device, info, shard_ranges, '', '',
+                               root=root)
+            if broker.empty():
+                broker.delete_db(Timestamp(time.time()).internal)
+            return
+        self._move_objects(broker, device, info, shard_ranges, '',
+                           own_range.lower, root=root)
+        if own_range.upper:
+            self._move_objects(broker, device, info, shard_ranges,
+                               own_range.upper, '', root=root)
+        if not self._is_leader(info['account'], info['container'], device):
+            return
+        info = broker.get_info()
+        if (info['object_count'], info['bytes_used']) != \
+                (own_range.object_count, own_range.bytes_used):
+            self._update_root(root_account, root_container, [
+                own_range.copy(object_count=info['object_count'],
+                               bytes_used=info['bytes_used'],
+                               meta_timestamp=Timestamp(time.time()))])
+        if self.auto_shard and \
+                info['object_count'] >= self.shard_container_threshold:
+            new_ranges = self._split(broker, info, own_range.lower,
+                                     own_range.upper, own_range=own_range)
+            if new_ranges:
+                self._move_objects(broker, device, info, new_ranges,
+                                   own_range.lower, own_range.upper,
+                                   root=root)
+
+    def _get_root_shard_ranges(self, root_account, root_container):
+        """
+        Fetch the shard ranges of a root container from the first of its
+        primary nodes to answer.
+
+        :returns: a list of ShardRange instances, or None on failure
+        """
+        part, nodes = self.get_ring().get_nodes(root_account, root_container)
+        for node in nodes:
+            try:
+                headers, shard_ranges = direct_get_container_shard_ranges(
+                    node, part, root_account, root_container,
+                    conn_timeout=self.conn_timeout,
+                    response_timeout=self.node_timeout)
+                return [ShardRange.from_dict(shard_range)
+                        for shard_range in shard_ranges]
+            except (Exception, Timeout) as err:
+                self.logger.warning(
+                    _('Failed to get shard ranges of %(path)s from '
+                      '%(ip)s:%(port)s/%(device)s: %(err)s'),
+                    {'path': '%s/%s' % (root_account, root_container),
+                     'ip': node['ip'], 'port': node['port'],
+                     'device': node['device'], 'err': err})
+        return None
+
+    def _update_root(self, root_account, root_container, shard_ranges):
+        """
+        Merge shard ranges into all primary replicas of a root container.
+
+        :returns: True if a majority of the replicas were updated
+        """
+        part, nodes = self.get_ring().get_nodes(root_account, root_container)
+        shard_ranges = [dict(shard_range) for shard_range in shard_ranges]
+        successes = 0
+        for node in nodes:
+            try:
+                direct_put_container_shard_ranges(
+                    node, part, root_account, root_container, shard_ranges,
+                    conn_timeout=self.conn_timeout,
+                    response_timeout=self.node_timeout)
+                successes += 1
+            except (Exception, Timeout) as err:
+                self.logger.warning(
+                    _('Failed to update shard ranges of %(path)s on '
+                      '%(ip)s:%(port)s/%(device)s: %(err)s'),
+                    {'path': '%s/%s' % (root_account, root_container),
+                     'ip': node['ip'], 'port': node['port'],
+                     'device': node['device'], 'err': err})
+        return successes >= majority_size(len(nodes))
+
+    def _split(self, broker, info, lower, upper, own_range=None):
+        """
+        Split the namespace ``lower < name <= upper`` of a container into new
+        shard ranges and record them in the root container.
+
+        :param own_range: the ShardRange of the container being split, if it
+                          is itself a shard, which is marked deleted
+        :returns: the list of new shard ranges, or an empty list if the
+                  container could not be split
+        """
+        boundaries = broker.find_shard_boundaries(
+            max(1, self.shard_container_threshold // 2), lower, upper)
+        if not boundaries:
+            return []
+        timestamp = Timestamp(time.time())
+        if own_range is None:
+            root_account, root_container = info['account'], info['container']
+        else:
+            root_account, root_container = get_shard_root(
+                info['account'], info['container'])
+        uppers = boundaries + [upper]
+        lowers = [lower] + boundaries
+        new_ranges = [
+            ShardRange.create(root_account, root_container, lo, up, timestamp)
+            for lo, up in zip(lowers, uppers)]
+        updates = list(new_ranges)
+        if own_range is not None:
+            updates.append(own_range.copy(timestamp=timestamp, deleted=True))
+        else:
+            broker.merge_shard_ranges(new_ranges)
+        if not self._update_root(root_account, root_container, updates) \
+                and own_range is not None:
+            # don't move rows to shards that the root doesn't know about
+            return []
+        self.stats['split'] += 1
+        self.logger.increment('split')
+        self.logger.info(
+            _('Split %(path)s into %(count)d shards'),
+            {'path': '%s/%s' % (info['account'], info['container']),
+             'count': len(new_ranges)})
+        return new_ranges
+
+    def _shrink(self, broker, info, shard_ranges):
+        """
+        Merge a shard that has shrunk below the shrink threshold into a
+        neighbouring shard, or, if it is the only shard, back into the root
+        container. At most one shard is shrunk per pass.
+        """
+        if any(shard_range.meta_timestamp <= shard_range.timestamp
+               for shard_range in shard_ranges):
+            # wait until every shard has reported its stats
+            return
+        timestamp = Timestamp(time.time())
+        updates = None
+        if len(shard_ranges) == 1:
+            if shard_ranges[0].object_count < self.shard_shrink_threshold:
+                updates = [shard_ranges[0].copy(timestamp=timestamp,
+                                                deleted=True)]
+        else:
+            for left, right in zip(shard_ranges, shard_ranges[1:]):
+                small = min(left.object_count, right.object_count)
+                total = left.object_count + right.object_count
+                if small < self.shard_shrink_threshold and \
+                        total < self.shard_container_threshold // 2:
+                    updates = [
+                        left.copy(timestamp=timestamp, deleted=True),
+                        right.copy(timestamp=timestamp, deleted=True),
+                        ShardRange.create(info['account'], info['container'],
+                                          left.lower, right.upper, timestamp)]
+                    updates[-1].object_count = total
+                    updates[-1].bytes_used = left.bytes_used + \
+                        right.bytes_used
+                    break
+        if not updates:
+            return
+        broker.merge_shard_ranges(updates)
+        self._update_root(info['account'], info['container'], updates)
+        self.stats['shrunk'] += 1
+        self.logger.increment('shrunk')
+
+    def _get_target_broker(self, device, account, container, info,
+                           prefix_stats=False):
+        """
+        Get a broker for the local DB of a container on the given device,
+        creating the DB if necessary. The container replicator moves the DB
+        to the container's primary nodes if this isn't one of them.
+
+        :param prefix_stats: if True, a DB that is created keeps per
+                             pseudo-folder stats from the start, so that
+                             its prefix_stats listings don't wait for the
+                             replicator to build them
+        """
+        part = self.get_ring().get_part(account, container)
+        hsh = hash_path(account, container)
+        db_dir = storage_directory(DATADIR, part, hsh)
+        db_path = os.path.join(self.devices, device, db_dir, hsh + '.db')
+        broker = ContainerBroker(db_path, account=account,
+                                 container=container, logger=self.logger)
+        if not os.path.exists(db_path):
+            # the timestamp of an auto-created container never beats that of
+            # the DB created when its shard range was first used
+            try:
+                broker.initialize(Timestamp(0).internal,
+                                  info['storage_policy_index'])
+            except DatabaseAlreadyExists:
+                pass
+            else:
+                if prefix_stats:
+                    broker.enable_prefix_stats()
+        return broker
+
+    def _move_objects(self, broker, device, info, shard_ranges, lower, upper,
+                      root=None):
+        """
+        Move the object rows of a container in the namespace ``lower < name
+        <= upper`` to the shard containers that own them.
+
+        :param shard_ranges: the shard ranges of the root container
+        :param root: the (account, container) of the root container, which
+                     owns any rows not covered by a shard range, if the
+                     container is itself a shard; rows not covered by a
+                     shard range are otherwise left in place
+        """
+        own_name = '%s/%s' % (info['account'], info['container'])
+        prefix_stats = broker.has_prefix_stats()
+        marker = lower
+        while True:
+            rows = broker.get_objects(marker, upper, self.shard_batch_size)
+            if not rows:
+                break
+            marker = rows[-1]['name']
+            targets = defaultdict(list)
+            for row in rows:
+                shard_range = find_shard_range(row['name'], shard_ranges)
+                if shard_range is not None:
+                    target = (shard_range.account, shard_range.container)
+                elif root is not None:
+                    target = root
+                else:
+                    continue
+                if '%s/%s' % target != own_name:
+                    targets[target].append(row)
+            for (account, container), target_rows in targets.items():
+                target_broker = self._get_target_broker(
+                    device, account, container, info,
+                    prefix_stats=prefix_stats)
+                target_broker.merge_items([
+                    dict((key, value) for key, value in row.items()
+                         if key != 'ROWID')
+                    for row in target_rows])
+                broker.remove_objects([row['ROWID'] for row in target_rows])
+                self.stats['moved'] += len(target_rows)
+                self.logger.update_stats('moved', len(target_rows))
+            if len(rows) < self.shard_batch_size:
+                break
@@ -31,7 +31,7 @@ from swift.common.bufferedhttp import http_connect
 from swift.common.exceptions import ConnectionTimeout
 from swift.common.ring import Ring
 from swift.common.utils import get_logger, config_true_value, ismount, \
-    dump_recon_cache, majority_size, Timestamp
+    dump_recon_cache, majority_size, Timestamp, get_shard_root
 from swift.common.daemon import Daemon
 from swift.common.http import is_success, HTTP_INTERNAL_SERVER_ERROR
 
@@ -221,6 +221,9 @@ class ContainerUpdater(Daemon):
         # definitely doesn't have up to date statistics.
         if Timestamp(info['put_timestamp']) <= 0:
             return
+        # Shard containers report their stats to their root container.
+        if get_shard_root(info['account'], info['container']) is not None:
+            return
         if self.account_suppressions.get(info['account'], 0) > time.time():
             return
         if info['put_timestamp'] > info['reported_put_timestamp'] or \
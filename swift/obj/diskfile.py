@@ -50,6 +50,7 @@ from collections import defaultdict
 
 from eventlet import Timeout
 from eventlet.hubs import trampoline
+from eventlet.semaphore import Semaphore
 import six
 from pyeclib.ec_iface import ECDriverError, ECInvalidFragmentMetadata, \
     ECBadFragmentChecksum, ECInvalidParameter
@@ -63,12 +64,14 @@ from swift.common.utils import mkdirs, Timestamp, \
     config_true_value, listdir, split_path, ismount, remove_file, \
     get_md5_socket, F_SETPIPE_SZ, decode_timestamps, encode_timestamps, \
     tpool_reraise, MD5_OF_EMPTY_STRING, link_fd_to_path, o_tmpfile_supported, \
-    O_TMPFILE, makedirs_count
+    O_TMPFILE, makedirs_count, fadvise, POSIX_FADV_SEQUENTIAL, \
+    POSIX_FADV_WILLNEED
 from swift.common.splice import splice, tee
 from swift.common.exceptions import DiskFileQuarantined, DiskFileNotExist, \
     DiskFileCollision, DiskFileNoSpace, DiskFileDeviceUnavailable, \
     DiskFileDeleted, DiskFileError, DiskFileNotOpen, PathNotDir, \
-    ReplicationLockTimeout, DiskFileExpired, DiskFileXattrNotSupported
+    ReplicationLockTimeout, DiskFileExpired, DiskFileXattrNotSupported, \
+    DiskFileDeviceBusy
 from swift.common.swob import multi_range_iterator
 from swift.common.storage_policy import (
     get_policy_string, split_policy_string, PolicyError, POLICIES,
@@ -490,6 +493,51 @@ def strip_self(f):
     return wrapper
 
 
+class DeviceIOExecutor(object):
+    """
+    Runs the disk I/O of one device in eventlet's native thread pool, so that
+    a slow disk only holds up the requests for that disk.
+
+    No more than ``threads`` calls run at once. Once they are all busy, up to
+    ``max_queued`` more calls wait for one of them, and any others fail with
+    :class:`~swift.common.exceptions.DiskFileDeviceBusy`.
+
+    :param threads: how many calls may run at once
+    :param max_queued: how many calls may wait for a thread
+    """
+
+    def __init__(self, threads, max_queued):
+        self.max_queued = max_queued
+        self.queued = 0
+        self._semaphore = Semaphore(threads)
+
+    def force_run_in_thread(self, func, *args, **kwargs):
+        """
+        Runs func in a thread and returns its result, waiting for a thread
+        however many calls are already waiting.
+        """
+        self.queued += 1
+        try:
+            self._semaphore.acquire()
+        finally:
+            self.queued -= 1
+        try:
+            return tpool_reraise(func, *args, **kwargs)
+        finally:
+            self._semaphore.release()
+
+    def run_in_thread(self, func, *args, **kwargs):
+        """
+        Runs func in a thread and returns its result.
+
+        :raises DiskFileDeviceBusy: if all the threads are busy and
+                                    max_queued calls are already waiting
+        """
+        if self._semaphore.locked() and self.queued >= self.max_queued:
+            raise DiskFileDeviceBusy()
+        return self.force_run_in_thread(func, *args, **kwargs)
+
+
 class DiskFileRouter(object):
 
     policy_type_to_manager_cls = {}
@@ -554,6 +602,13 @@ class BaseDiskFileManager(object):
         self.devices = conf.get('devices', '/srv/node')
         self.disk_chunk_size = int(conf.get('disk_chunk_size', 65536))
         self.keep_cache_size = int(conf.get('keep_cache_size', 5242880))
+        self.disk_read_ahead_size = int(conf.get('disk_read_ahead_size', 0))
+        self.disk_threadpool_read_size = int(
+            conf.get('disk_threadpool_read_size', 0))
+        self.disk_io_threads_per_device = int(
+            conf.get('disk_io_threads_per_device', 0))
+        self.disk_io_max_queued = int(conf.get('disk_io_max_queued', 32))
+        self._io_executors = {}
         self.bytes_per_sync = int(conf.get('mb_per_sync', 512)) * 1024 * 1024
         self.mount_check = config_true_value(conf.get('mount_check', 'true'))
         self.reclaim_age = int(conf.get('reclaim_age', ONE_WEEK))
@@ -592,6 +647,20 @@ class BaseDiskFileManager(object):
                 self.pipe_size = min(max_pipe_size, self.disk_chunk_size)
         self.use_linkat = o_tmpfile_supported()
 
+    def get_io_executor(self, device_path):
+        """
+        Returns the :class:`DeviceIOExecutor` for a device, or None if disk
+        I/O is not offloaded to per-device threads.
+
+        :param device_path: the path to the device
+        """
+        if self.disk_io_threads_per_device <= 0:
+            return None
+        if device_path not in self._io_executors:
+            self._io_executors[device_path] = DeviceIOExecutor(
+                self.disk_io_threads_per_device, self.disk_io_max_queued)
+        return self._io_executors[device_path]
+
     def make_on_disk_filename(self, timestamp, ext=None,
                               ctype_timestamp=None, *a, **kw):
         """
@@ -1413,9 +1482,12 @@ class BaseDiskFileWriter(object):
     :param tmppath: full path name of the opened file descriptor
     :param bytes_per_sync: number bytes written between sync calls
     :param diskfile: the diskfile creating this DiskFileWriter instance
+    :param io_executor: the :class:`DeviceIOExecutor` to write with, or None
+                        to write in the calling greenthread
     """
 
-    def __init__(self, name, datadir, fd, tmppath, bytes_per_sync, diskfile):
+    def __init__(self, name, datadir, fd, tmppath, bytes_per_sync, diskfile,
+                 io_executor=None):
         # Parameter tracking
         self._name = name
         self._datadir = datadir
@@ -1423,6 +1495,7 @@ class BaseDiskFileWriter(object):
         self._tmppath = tmppath
         self._bytes_per_sync = bytes_per_sync
         self._diskfile = diskfile
+        self._io_executor = io_executor
 
         # Internal attributes
         self._upload_size = 0
@@ -1448,8 +1521,18 @@ class BaseDiskFileWriter(object):
         :param chunk: the chunk of data to write as a string object
 
         :returns: the total number of bytes written to an object
-        """
-
+        :raises DiskFileDeviceBusy: if this is the first write and the
+                                    device's I/O threads are saturated
+        """
+        if self._io_executor:
+            if self._upload_size:
+                # don't fail an upload part way through
+                return self._io_executor.force_run_in_thread(
+                    self._write, chunk)
+            return self._io_executor.run_in_thread(self._write, chunk)
+        return self._write(chunk)
+
+    def _write(self, chunk):
         while chunk:
             written = os.write(self._fd, chunk)
             self._upload_size += written
@@ -1521,7 +1604,13 @@ class BaseDiskFileWriter(object):
         metadata['name'] = self._name
         target_path = join(self._datadir, filename)
 
-        tpool_reraise(self._finalize_put, metadata, target_path, cleanup)
+        if self._io_executor:
+            # the data has been written, so wait for a thread however busy
+            # the device is
+            self._io_executor.force_run_in_thread(
+                self._finalize_put, metadata, target_path, cleanup)
+        else:
+            tpool_reraise(self._finalize_put, metadata, target_path, cleanup)
 
     def put(self, metadata):
         """
@@ -1573,11 +1662,19 @@ class BaseDiskFileReader(object):
     :param pipe_size: size of pipe buffer used in zero-copy operations
     :param diskfile: the diskfile creating this DiskFileReader instance
     :param keep_cache: should resulting reads be kept in the buffer cache
+    :param read_ahead_size: for reads of more than disk_chunk_size, how far
+                            ahead of the reads to ask the kernel to read; 0
+                            leaves read-ahead to the kernel's heuristics
+    :param threadpool_read_size: for reads of more than disk_chunk_size, the
+                                 size of the reads to make in the thread pool;
+                                 0 reads in the calling greenthread
+    :param io_executor: the :class:`DeviceIOExecutor` to read with, or None
     """
     def __init__(self, fp, data_file, obj_size, etag,
                  disk_chunk_size, keep_cache_size, device_path, logger,
                  quarantine_hook, use_splice, pipe_size, diskfile,
-                 keep_cache=False):
+                 keep_cache=False, read_ahead_size=0, threadpool_read_size=0,
+                 io_executor=None):
         # Parameter tracking
         self._fp = fp
         self._data_file = data_file
@@ -1590,6 +1687,9 @@ class BaseDiskFileReader(object):
         self._quarantine_hook = quarantine_hook
         self._use_splice = use_splice
         self._pipe_size = pipe_size
+        self._read_ahead_size = read_ahead_size
+        self._threadpool_read_size = threadpool_read_size
+        self._io_executor = io_executor
         if keep_cache:
             # Caller suggests we keep this in cache, only do it if the
             # object's size is less than the maximum.
@@ -1605,6 +1705,8 @@ class BaseDiskFileReader(object):
         self._md5_of_sent_bytes = None
         self._suppress_file_closing = False
         self._quarantined_dir = None
+        # where app_iter_range wants the reads to stop
+        self._read_stop = None
 
     @property
     def manager(self):
@@ -1619,6 +1721,17 @@ class BaseDiskFileReader(object):
         if self._iter_etag:
             self._iter_etag.update(chunk)
 
+    def _get_read_stop(self, stop):
+        """
+        Returns where the reads for a range ending at stop should end. They
+        go on to the end of the object when little of it is left after the
+        range, so that a data file shorter than its metadata says is still
+        noticed.
+        """
+        if stop is None or self._obj_size - stop < self._disk_chunk_size:
+            return self._obj_size
+        return stop
+
     def __iter__(self):
         """Returns an iterator over the data file."""
         try:
@@ -1627,11 +1740,50 @@ class BaseDiskFileReader(object):
             self._started_at_0 = False
             self._read_to_eof = False
             self._init_checks()
+            # reads are sized to what's left of the object or the range, so
+            # a small object is read in a single read()
+            position = self._fp.tell()
+            stop = self._get_read_stop(self._read_stop)
+            read_size = self._disk_chunk_size
+            read = self._fp.read
+            if self._io_executor:
+                # the response has started by now, so the reads wait for a
+                # thread rather than fail when the device is busy
+                read = partial(self._io_executor.force_run_in_thread,
+                               self._fp.read)
+            read_ahead_to = None
+            if stop - position > self._disk_chunk_size:
+                if self._threadpool_read_size:
+                    read_size = self._threadpool_read_size
+                    if not self._io_executor:
+                        read = partial(tpool_reraise, self._fp.read)
+                if self._read_ahead_size:
+                    fadvise(self._fp.fileno(), position, stop - position,
+                            POSIX_FADV_SEQUENTIAL)
+                    read_ahead_to = position
             while True:
-                chunk = self._fp.read(self._disk_chunk_size)
+                if position >= stop:
+                    # the object's size was verified when it was opened, so
+                    # this is the end of the file
+                    self._read_to_eof = stop == self._obj_size
+                    self._drop_cache(self._fp.fileno(), dropped_cache,
+                                     self._bytes_read - dropped_cache)
+                    break
+                if read_ahead_to is not None and (
+                        read_ahead_to - position < self._read_ahead_size // 2):
+                    # keep the kernel a read-ahead's worth ahead of us,
+                    # without a hint for every read
+                    new_read_ahead_to = min(
+                        stop, position + self._read_ahead_size)
+                    fadvise(self._fp.fileno(), read_ahead_to,
+                            new_read_ahead_to - read_ahead_to,
+                            POSIX_FADV_WILLNEED)
+                    read_ahead_to = new_read_ahead_to
+                chunk = read(min(read_size, stop - position))
                 if chunk:
                     self._update_checks(chunk)
                     self._bytes_read += len(chunk)
+                    position += len(chunk)
                     if self._bytes_read - dropped_cache > DROP_CACHE_WINDOW:
                         self._drop_cache(self._fp.fileno(), dropped_cache,
                                          self._bytes_read - dropped_cache)
@@ -1764,6 +1916,7 @@ class BaseDiskFileReader(object):
         else:
             length = None
         try:
+            self._read_stop = stop
             for chunk in self:
                 if length is not None:
                     length -= len(chunk)
@@ -1773,6 +1926,7 @@ class BaseDiskFileReader(object):
                         break
                 yield chunk
         finally:
+            self._read_stop = None
             if not self._suppress_file_closing:
                 self.close()
 
@@ -1894,6 +2048,7 @@ class BaseDiskFile(object):
         self._use_splice = use_splice
         self._pipe_size = pipe_size
         self._use_linkat = use_linkat
+        self._io_executor = mgr.get_io_executor(device_path)
         # This might look a lttle hacky i.e tracking number of newly created
         # dirs to fsync only those many later. If there is a better way,
         # please suggest.
@@ -2233,8 +2388,11 @@ class BaseDiskFile(object):
         :param quarantine_filename: full path of file to load the metadata from
         """
         try:
+            if self._io_executor:
+                return self._io_executor.run_in_thread(read_metadata, source)
             return read_metadata(source)
-        except (DiskFileXattrNotSupported, DiskFileNotExist):
+        except (DiskFileXattrNotSupported, DiskFileNotExist,
+                DiskFileDeviceBusy):
             raise
         except Exception as err:
             raise self._quarantine(
@@ -2389,7 +2547,10 @@ class BaseDiskFile(object):
             self._metadata['ETag'], self._disk_chunk_size,
             self._manager.keep_cache_size, self._device_path, self._logger,
             use_splice=self._use_splice, quarantine_hook=_quarantine_hook,
-            pipe_size=self._pipe_size, diskfile=self, keep_cache=keep_cache)
+            pipe_size=self._pipe_size, diskfile=self, keep_cache=keep_cache,
+            read_ahead_size=self._manager.disk_read_ahead_size,
+            threadpool_read_size=self._manager.disk_threadpool_read_size,
+            io_executor=self._io_executor)
         # At this point the reader object is now responsible for closing
         # the file pointer.
         self._fp = None
@@ -2451,7 +2612,8 @@ class BaseDiskFile(object):
                     raise
             dfw = self.writer_cls(self._name, self._datadir, fd, tmppath,
                                   bytes_per_sync=self._bytes_per_sync,
-                                  diskfile=self)
+                                  diskfile=self,
+                                  io_executor=self._io_executor)
             yield dfw
         finally:
             try:
@@ -2597,11 +2759,13 @@ class ECDiskFileReader(BaseDiskFileReader):
     def __init__(self, fp, data_file, obj_size, etag,
                  disk_chunk_size, keep_cache_size, device_path, logger,
                  quarantine_hook, use_splice, pipe_size, diskfile,
-                 keep_cache=False):
+                 keep_cache=False, read_ahead_size=0, threadpool_read_size=0,
+                 io_executor=None):
         super(ECDiskFileReader, self).__init__(
             fp, data_file, obj_size, etag,
             disk_chunk_size, keep_cache_size, device_path, logger,
-            quarantine_hook, use_splice, pipe_size, diskfile, keep_cache)
+            quarantine_hook, use_splice, pipe_size, diskfile, keep_cache,
+            read_ahead_size, threadpool_read_size, io_executor)
         self.frag_buf = None
         self.frag_offset = 0
         self.frag_size = self._diskfile.policy.fragment_size
@@ -2617,6 +2781,12 @@ class ECDiskFileReader(BaseDiskFileReader):
         else:
             self.frag_buf = None
 
+    def _get_read_stop(self, stop):
+        if stop is not None:
+            # read whole frags, so that they can be checked
+            stop = -(-stop // self.frag_size) * self.frag_size
+        return super(ECDiskFileReader, self)._get_read_stop(stop)
+
     def _check_frag(self, frag):
         if not frag:
             return
@@ -2721,8 +2891,12 @@ class ECDiskFileWriter(BaseDiskFileWriter):
         durable_data_file_path = os.path.join(
             self._datadir, self.manager.make_on_disk_filename(
                 timestamp, '.data', self._diskfile._frag_index, durable=True))
-        tpool_reraise(
-            self._finalize_durable, data_file_path, durable_data_file_path)
+        if self._io_executor:
+            self._io_executor.force_run_in_thread(
+                self._finalize_durable, data_file_path, durable_data_file_path)
+        else:
+            tpool_reraise(self._finalize_durable, data_file_path,
+                          durable_data_file_path)
 
     def put(self, metadata):
         """
@@ -27,20 +27,22 @@ from swift import gettext_ as _
 from hashlib import md5
 
 from eventlet import sleep, wsgi, Timeout
-from eventlet.greenthread import spawn
+from eventlet.event import Event
+from eventlet.greenthread import spawn, spawn_after
 
 from swift.common.utils import public, get_logger, \
     config_true_value, timing_stats, replication, \
     normalize_delete_at_timestamp, get_log_line, Timestamp, \
     get_expirer_container, parse_mime_headers, \
-    iter_multipart_mime_documents, extract_swift_bytes, safe_json_loads
+    iter_multipart_mime_documents, extract_swift_bytes, safe_json_loads, \
+    split_path
 from swift.common.bufferedhttp import http_connect
 from swift.common.constraints import check_object_creation, \
     valid_timestamp, check_utf8
 from swift.common.exceptions import ConnectionTimeout, DiskFileQuarantined, \
     DiskFileNotExist, DiskFileCollision, DiskFileNoSpace, DiskFileDeleted, \
     DiskFileDeviceUnavailable, DiskFileExpired, ChunkReadTimeout, \
-    ChunkReadError, DiskFileXattrNotSupported
+    ChunkReadError, DiskFileXattrNotSupported, DiskFileDeviceBusy
 from swift.obj import ssync_receiver
 from swift.common.http import is_success
 from swift.common.base_storage_server import BaseStorageServer
@@ -53,7 +55,7 @@ from swift.common.swob import HTTPAccepted, HTTPBadRequest, HTTPCreated, \
     HTTPPreconditionFailed, HTTPRequestTimeout, HTTPUnprocessableEntity, \
     HTTPClientDisconnect, HTTPMethodNotAllowed, Request, Response, \
     HTTPInsufficientStorage, HTTPForbidden, HTTPException, HTTPConflict, \
-    HTTPServerError
+    HTTPServerError, HTTPServiceUnavailable
 from swift.obj.diskfile import DATAFILE_SYSTEM_META, DiskFileRouter
 
 
@@ -123,6 +125,12 @@ class ObjectController(BaseStorageServer):
         self.node_timeout = float(conf.get('node_timeout', 3))
         self.container_update_timeout = float(
             conf.get('container_update_timeout', 1))
+        self.container_update_batch_window = float(
+            conf.get('container_update_batch_window', 0))
+        self.container_update_batch_size = int(
+            conf.get('container_update_batch_size', 100))
+        # pending batches of container updates, by (host, partition, device)
+        self._update_batches = {}
         self.conn_timeout = float(conf.get('conn_timeout', 0.5))
         self.client_timeout = int(conf.get('client_timeout', 60))
         self.disk_chunk_size = int(conf.get('disk_chunk_size', 65536))
@@ -215,7 +223,9 @@ class ObjectController(BaseStorageServer):
                      contdevice, headers_out, objdevice, policy,
                      logger_thread_locals=None):
         """
-        Sends or saves an async update.
+        Sends or saves an async update. With container_update_batch_window
+        set, the update is sent in a batch with the other updates for the
+        same container server partition.
 
         :param op: operation performed (ex: 'PUT', or 'DELETE')
         :param account: account name for the object
@@ -236,7 +246,13 @@ class ObjectController(BaseStorageServer):
             self.logger.thread_locals = logger_thread_locals
         headers_out['user-agent'] = 'object-server %s' % os.getpid()
         full_path = '/%s/%s/%s' % (account, container, obj)
-        if all([host, partition, contdevice]):
+        if self.container_update_batch_window and \
+                all([host, partition, contdevice]):
+            data = {'op': op, 'account': account, 'container': container,
+                    'obj': obj, 'headers': headers_out}
+            if self._batch_update(host, partition, contdevice, data):
+                return
+        elif all([host, partition, contdevice]):
             try:
                 with ConnectionTimeout(self.conn_timeout):
                     ip, port = host.rsplit(':', 1)
@@ -266,6 +282,75 @@ class ObjectController(BaseStorageServer):
         self._diskfile_router[policy].pickle_async_update(
             objdevice, account, container, obj, data, timestamp, policy)
 
+    def _batch_update(self, host, partition, contdevice, data):
+        """
+        Adds a container update to the batch for a container server's
+        partition, and waits for the batch to be sent.
+
+        :param host: host that the container is on
+        :param partition: partition that the container is on
+        :param contdevice: device name that the container is on
+        :param data: the update, as it would be saved for async update
+        :returns: True if the container server made the update
+        """
+        key = (host, partition, contdevice)
+        batch = self._update_batches.get(key)
+        if batch is None:
+            batch = self._update_batches[key] = []
+            spawn_after(self.container_update_batch_window,
+                        self._send_update_batch, key, batch)
+        sent = Event()
+        batch.append((data, sent))
+        if len(batch) >= self.container_update_batch_size:
+            self._send_update_batch(key, batch)
+        return sent.wait()
+
+    def _send_update_batch(self, key, batch):
+        """
+        Sends a batch of container updates in one UPDATE request, and tells
+        the waiting updates which of them were made.
+
+        :param key: a tuple of the host, partition and device the batch is
+                    for
+        :param batch: a list of tuples of an update and the Event to send
+                      its result to
+        """
+        if self._update_batches.get(key) is not batch:
+            # it's full, and has already been sent
+            return
+        del self._update_batches[key]
+        host, partition, contdevice = key
+        statuses = []
+        try:
+            body = json.dumps([data for data, _junk in batch])
+            headers = {'Content-Type': 'application/json',
+                       'Content-Length': str(len(body)),
+                       'user-agent': 'object-server %s' % os.getpid()}
+            with ConnectionTimeout(self.conn_timeout):
+                ip, port = host.rsplit(':', 1)
+                conn = http_connect(ip, port, contdevice, partition,
+                                    'UPDATE', '', headers)
+            with Timeout(self.node_timeout):
+                conn.send(body)
+                response = conn.getresponse()
+                response_body = response.read()
+            if is_success(response.status):
+                statuses = json.loads(response_body)
+            else:
+                self.logger.error(_(
+                    'ERROR Container update batch failed '
+                    '(saving for async update later): %(status)d '
+                    'response from %(ip)s:%(port)s/%(dev)s'),
+                    {'status': response.status, 'ip': ip, 'port': port,
+                     'dev': contdevice})
+        except (Exception, Timeout):
+            self.logger.exception(_(
+                'ERROR container update batch failed with '
+                '%(host)s/%(dev)s (saving for async update later)'),
+                {'host': host, 'dev': contdevice})
+        for i, (data, sent) in enumerate(batch):
+            sent.send(i < len(statuses) and is_success(statuses[i]))
+
     def container_update(self, op, account, container, obj, request,
                          headers_out, objdevice, policy):
         """
@@ -304,6 +389,17 @@ class ObjectController(BaseStorageServer):
         else:
             updates = []
 
+        container_path = headers_in.get('X-Backend-Container-Path')
+        if container_path:
+            # the proxy has directed the update to a shard of the container
+            try:
+                account, container = split_path('/' + container_path, 2, 2)
+            except ValueError:
+                self.logger.error(_(
+                    'ERROR Container update failed: invalid container path '
+                    '"%s"'), container_path)
+                return
+
         headers_out['x-trans-id'] = headers_in.get('x-trans-id', '-')
         headers_out['referer'] = request.as_referer()
         headers_out['X-Backend-Storage-Policy-Index'] = int(policy)
@@ -1102,6 +1198,8 @@ class ObjectController(BaseStorageServer):
                     res = getattr(self, req.method)(req)
             except DiskFileCollision:
                 res = HTTPForbidden(request=req)
+            except DiskFileDeviceBusy:
+                res = HTTPServiceUnavailable(request=req)
             except HTTPException as error_response:
                 res = error_response
             except (Exception, Timeout):
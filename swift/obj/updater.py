@@ -14,14 +14,16 @@
 # limitations under the License.
 
 import six.moves.cPickle as pickle
+import json
 import os
 import signal
 import sys
 import time
+from collections import defaultdict
 from swift import gettext_ as _
 from random import random
 
-from eventlet import spawn, patcher, Timeout
+from eventlet import spawn, patcher, sleep, Timeout, GreenPool
 
 from swift.common.bufferedhttp import http_connect
 from swift.common.exceptions import ConnectionTimeout
@@ -33,7 +35,7 @@ from swift.common.header_key_dict import HeaderKeyDict
 from swift.common.storage_policy import split_policy_string, PolicyError
 from swift.obj.diskfile import get_tmp_dir, ASYNCDIR_BASE
 from swift.common.http import is_success, HTTP_NOT_FOUND, \
-    HTTP_INTERNAL_SERVER_ERROR
+    HTTP_INTERNAL_SERVER_ERROR, HTTP_METHOD_NOT_ALLOWED
 
 
 class ObjectUpdater(Daemon):
@@ -51,8 +53,21 @@ class ObjectUpdater(Daemon):
         self.slowdown = float(conf.get('slowdown', 0.01))
         self.node_timeout = float(conf.get('node_timeout', 10))
         self.conn_timeout = float(conf.get('conn_timeout', 0.5))
+        self.updates_per_request = int(conf.get('updates_per_request', 0))
+        self.batch_concurrency = int(conf.get('batch_concurrency', 8))
+        self.update_concurrency = int(conf.get('update_concurrency', 1))
+        self.max_objects_per_container_per_second = float(
+            conf.get('max_objects_per_container_per_second', 0))
         self.successes = 0
         self.failures = 0
+        self.skips = 0
+        # when each container may next be sent an update, if they're rate
+        # limited
+        self._container_next_update = {}
+        # updates read but not yet sent, by container partition, when they
+        # are sent in batches
+        self._batches = defaultdict(list)
+        self._batched = 0
         self.recon_cache_path = conf.get('recon_cache_path',
                                          '/var/cache/swift')
         self.rcache = os.path.join(self.recon_cache_path, 'object.recon')
@@ -149,6 +164,11 @@ class ObjectUpdater(Daemon):
         :param device: path to device
         """
         start_time = time.time()
+        start_successes, start_failures = self.successes, self.failures
+        start_skips = self.skips
+        found = 0
+        self._container_next_update = {}
+        pool = GreenPool(self.update_concurrency)
         # loop through async pending dirs for all policies
         for asyncdir in self._listdir(device):
             # we only care about directories
@@ -165,10 +185,16 @@ class ObjectUpdater(Daemon):
                                       'to a valid policy (%(error)s)') % {
                                     'directory': asyncdir, 'error': e})
                 continue
+            prefix_paths = []
             for prefix in self._listdir(async_pending):
                 prefix_path = os.path.join(async_pending, prefix)
                 if not os.path.isdir(prefix_path):
                     continue
+                prefix_paths.append(prefix_path)
+                # Only the newest update for an object is sent; the older
+                # ones are removed here, before any of them could be handed
+                # to the pool, so that the latest update wins however many
+                # are in flight.
                 last_obj_hash = None
                 for update in sorted(self._listdir(prefix_path), reverse=True):
                     update_path = os.path.join(prefix_path, update)
@@ -183,19 +209,35 @@ class ObjectUpdater(Daemon):
                               'name %s')
                             % (update_path))
                         continue
+                    found += 1
                     if obj_hash == last_obj_hash:
                         self.logger.increment("unlinks")
                         os.unlink(update_path)
+                    elif self.updates_per_request > 0:
+                        self.batch_object_update(update_path, device, policy)
+                        last_obj_hash = obj_hash
                     else:
-                        self.process_object_update(update_path, device,
-                                                   policy)
+                        pool.spawn(self._process_object_update_slowly,
+                                   update_path, device, policy)
                         last_obj_hash = obj_hash
-                    time.sleep(self.slowdown)
+            pool.waitall()
+            for prefix_path in prefix_paths:
                 try:
                     os.rmdir(prefix_path)
                 except OSError:
                     pass
+            self.send_batches()
             self.logger.timing_since('timing', start_time)
+        elapsed = time.time() - start_time
+        successes = self.successes - start_successes
+        dump_recon_cache({'object_updater_stats': {
+            os.path.basename(device): {
+                'pending': found,
+                'successes': successes,
+                'failures': self.failures - start_failures,
+                'skips': self.skips - start_skips,
+                'drain_rate': successes / elapsed if elapsed else 0.0,
+                'last_sweep': time.time()}}}, self.rcache, self.logger)
 
     def process_object_update(self, update_path, device, policy):
         """
@@ -205,37 +247,91 @@ class ObjectUpdater(Daemon):
         :param device: path to device
         :param policy: storage policy of object update
         """
-        try:
-            update = pickle.load(open(update_path, 'rb'))
-        except Exception:
-            self.logger.exception(
-                _('ERROR Pickle problem, quarantining %s'), update_path)
-            self.logger.increment('quarantines')
-            target_path = os.path.join(device, 'quarantined', 'objects',
-                                       os.path.basename(update_path))
-            renamer(update_path, target_path, fsync=False)
+        update = self._load_update(update_path, device)
+        if update is None or self._container_rate_limited(update):
             return
         successes = update.get('successes', [])
         part, nodes = self.get_container_ring().get_nodes(
             update['account'], update['container'])
         obj = '/%s/%s/%s' % \
               (update['account'], update['container'], update['obj'])
-        headers_out = HeaderKeyDict(update['headers'])
-        headers_out['user-agent'] = 'object-updater %s' % os.getpid()
-        headers_out.setdefault('X-Backend-Storage-Policy-Index',
-                               str(int(policy)))
+        headers_out = self._headers_out(update, policy)
         events = [spawn(self.object_update,
                         node, part, update['op'], obj, headers_out)
                   for node in nodes if node['id'] not in successes]
-        success = True
-        new_successes = False
+        new_successes = []
         for event in events:
             event_success, node_id = event.wait()
             if event_success is True:
-                successes.append(node_id)
-                new_successes = True
-            else:
-                success = False
+                new_successes.append(node_id)
+        self._finish_update(update_path, device, policy, update,
+                            len(new_successes) == len(events), new_successes)
+
+    def _process_object_update_slowly(self, update_path, device, policy):
+        """
+        Process an update, then wait slowdown seconds before the pool can
+        hand the next update to this greenthread, so that each of the
+        update_concurrency greenthreads is slowed down on its own rather
+        than all of them waiting on the loop that feeds the pool.
+        """
+        self.process_object_update(update_path, device, policy)
+        sleep(self.slowdown)
+
+    def _load_update(self, update_path, device):
+        """
+        Reads an async pending, or quarantines it if it can't be read.
+
+        :returns: the update, or None
+        """
+        try:
+            return pickle.load(open(update_path, 'rb'))
+        except Exception:
+            self.logger.exception(
+                _('ERROR Pickle problem, quarantining %s'), update_path)
+            self.logger.increment('quarantines')
+            target_path = os.path.join(device, 'quarantined', 'objects',
+                                       os.path.basename(update_path))
+            renamer(update_path, target_path, fsync=False)
+
+    def _container_rate_limited(self, update):
+        """
+        Checks whether an update's container has been sent as many updates
+        as max_objects_per_container_per_second allows. If it has, the
+        update is skipped, and left for the next sweep.
+
+        :returns: True if the update should be skipped
+        """
+        if self.max_objects_per_container_per_second <= 0:
+            return False
+        key = (update['account'], update['container'])
+        now = time.time()
+        next_update = self._container_next_update.get(key, now)
+        if next_update > now:
+            self.skips += 1
+            self.logger.increment('skips')
+            return True
+        self._container_next_update[key] = \
+            now + 1.0 / self.max_objects_per_container_per_second
+        return False
+
+    def _headers_out(self, update, policy):
+        headers_out = HeaderKeyDict(update['headers'])
+        headers_out['user-agent'] = 'object-updater %s' % os.getpid()
+        headers_out.setdefault('X-Backend-Storage-Policy-Index',
+                               str(int(policy)))
+        return headers_out
+
+    def _finish_update(self, update_path, device, policy, update, success,
+                       new_successes):
+        """
+        Removes an async pending that has been sent to every container
+        replica, or records which replicas it has been sent to.
+
+        :param success: True if every replica has the update now
+        :param new_successes: ids of the nodes the update was just sent to
+        """
+        obj = '/%s/%s/%s' % \
+              (update['account'], update['container'], update['obj'])
         if success:
             self.successes += 1
             self.logger.increment('successes')
@@ -249,10 +345,121 @@ class ObjectUpdater(Daemon):
             self.logger.debug('Update failed for %(obj)s %(path)s',
                               {'obj': obj, 'path': update_path})
             if new_successes:
-                update['successes'] = successes
+                update['successes'] = \
+                    update.get('successes', []) + new_successes
                 write_pickle(update, update_path, os.path.join(
                     device, get_tmp_dir(policy)))
 
+    def batch_object_update(self, update_path, device, policy):
+        """
+        Reads an async pending and adds it to the batch for its container
+        partition. The batches are sent once there are enough updates to
+        keep batch_concurrency requests of updates_per_request updates busy.
+
+        :param update_path: path to pickled object update file
+        :param device: path to device
+        :param policy: storage policy of object update
+        """
+        update = self._load_update(update_path, device)
+        if update is None or self._container_rate_limited(update):
+            return
+        part = self.get_container_ring().get_part(
+            update['account'], update['container'])
+        self._batches[part].append((update_path, device, policy, update))
+        self._batched += 1
+        if self._batched >= self.updates_per_request * self.batch_concurrency:
+            self.send_batches()
+
+    def send_batches(self):
+        """
+        Sends the batched updates to each of their container replicas, with
+        no more than batch_concurrency requests at once, and removes the
+        async pendings that every replica now has.
+        """
+        if not self._batches:
+            return
+        batches, self._batches = self._batches, defaultdict(list)
+        self._batched = 0
+        new_successes = defaultdict(list)
+        failed = set()
+
+        def send(node, part, items):
+            for (update_path, _junk, _junk, _junk), success in zip(
+                    items, self.batch_update(node, part, items)):
+                if success:
+                    new_successes[update_path].append(node['id'])
+                else:
+                    failed.add(update_path)
+
+        pool = GreenPool(self.batch_concurrency)
+        for part, items in batches.items():
+            for node in self.get_container_ring().get_part_nodes(part):
+                todo = [item for item in items
+                        if node['id'] not in item[3].get('successes', [])]
+                for i in range(0, len(todo), self.updates_per_request):
+                    pool.spawn(send, node, part,
+                               todo[i:i + self.updates_per_request])
+        pool.waitall()
+        prefix_paths = set()
+        for items in batches.values():
+            for update_path, device, policy, update in items:
+                self._finish_update(update_path, device, policy, update,
+                                    update_path not in failed,
+                                    new_successes[update_path])
+                prefix_paths.add(os.path.dirname(update_path))
+        for prefix_path in prefix_paths:
+            try:
+                os.rmdir(prefix_path)
+            except OSError:
+                pass
+        time.sleep(self.slowdown)
+
+    def batch_update(self, node, part, items):
+        """
+        Sends a batch of updates to a container server in one UPDATE request.
+        If the container server doesn't support UPDATE, they're sent one at a
+        time instead.
+
+        :param node: node dictionary from the container ring
+        :param part: partition that holds the containers
+        :param items: a list of tuples of the update path, device, policy
+                      and update
+        :returns: a list of True or False, for whether each update was made
+        """
+        updates = []
+        for _junk, _junk, policy, update in items:
+            updates.append({
+                'op': update['op'], 'account': update['account'],
+                'container': update['container'], 'obj': update['obj'],
+                'headers': dict(self._headers_out(update, policy))})
+        try:
+            body = json.dumps(updates)
+            headers = {'Content-Type': 'application/json',
+                       'Content-Length': str(len(body)),
+                       'user-agent': 'object-updater %s' % os.getpid()}
+            with ConnectionTimeout(self.conn_timeout):
+                conn = http_connect(node['ip'], node['port'], node['device'],
+                                    part, 'UPDATE', '', headers)
+            with Timeout(self.node_timeout):
+                conn.send(body)
+                resp = conn.getresponse()
+                resp_body = resp.read()
+            if resp.status == HTTP_METHOD_NOT_ALLOWED:
+                return [self.object_update(
+                    node, part, update['op'], '/%s/%s/%s' % (
+                        update['account'], update['container'],
+                        update['obj']), update['headers'])[0] is True
+                    for update in updates]
+            if is_success(resp.status):
+                statuses = json.loads(resp_body)
+                return [i < len(statuses) and (
+                    is_success(statuses[i]) or statuses[i] == HTTP_NOT_FOUND)
+                    for i in range(len(updates))]
+        except (Exception, Timeout):
+            self.logger.exception(_('ERROR with remote server '
+                                    '%(ip)s:%(port)s/%(device)s'), node)
+        return [False] * len(updates)
+
     def object_update(self, node, part, op, obj, headers_out):
         """
         Perform the object update to the container
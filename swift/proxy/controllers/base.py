@@ -24,8 +24,9 @@
 #   These shenanigans are to ensure all related objects can be garbage
 # collected. We've seen objects hang around forever otherwise.
 
-from six.moves.urllib.parse import quote
+from six.moves.urllib.parse import quote, urlencode
 
+import json
 import os
 import time
 import functools
@@ -36,7 +37,8 @@ from copy import deepcopy
 from sys import exc_info
 from swift import gettext_ as _
 
-from eventlet import sleep
+from eventlet import greenthread, sleep, spawn
+from eventlet.event import Event
 from eventlet.timeout import Timeout
 import six
 
@@ -44,28 +46,32 @@ from swift.common.wsgi import make_pre_authed_env
 from swift.common.utils import Timestamp, config_true_value, \
     public, split_path, list_from_csv, GreenthreadSafeIterator, \
     GreenAsyncPile, quorum_size, parse_content_type, \
-    document_iters_to_http_response_body
-from swift.common.bufferedhttp import http_connect
+    document_iters_to_http_response_body, ShardRange
+from swift.common.bufferedhttp import http_connect, BufferedHTTPResponse
 from swift.common.exceptions import ChunkReadTimeout, ChunkWriteTimeout, \
     ConnectionTimeout, RangeAlreadyComplete
 from swift.common.header_key_dict import HeaderKeyDict
 from swift.common.http import is_informational, is_success, is_redirection, \
     is_server_error, HTTP_OK, HTTP_PARTIAL_CONTENT, HTTP_MULTIPLE_CHOICES, \
     HTTP_BAD_REQUEST, HTTP_NOT_FOUND, HTTP_SERVICE_UNAVAILABLE, \
-    HTTP_INSUFFICIENT_STORAGE, HTTP_UNAUTHORIZED, HTTP_CONTINUE, HTTP_GONE
+    HTTP_INSUFFICIENT_STORAGE, HTTP_UNAUTHORIZED, HTTP_CONTINUE, HTTP_GONE, \
+    HTTP_NO_CONTENT
 from swift.common.swob import Request, Response, Range, \
     HTTPException, HTTPRequestedRangeNotSatisfiable, HTTPServiceUnavailable, \
     status_map
 from swift.common.request_helpers import strip_sys_meta_prefix, \
     strip_user_meta_prefix, is_user_meta, is_sys_meta, is_sys_or_user_meta, \
     http_response_to_document_iters, is_object_transient_sysmeta, \
-    strip_object_transient_sysmeta_prefix
+    strip_object_transient_sysmeta_prefix, trace_span, trace_span_add
 from swift.common.storage_policy import POLICIES
 
 
 DEFAULT_RECHECK_ACCOUNT_EXISTENCE = 60  # seconds
 DEFAULT_RECHECK_CONTAINER_EXISTENCE = 60  # seconds
 
+# account and container info fetches in progress in this process, by cache key
+_info_fetches = {}
+
 
 def update_headers(response, headers):
     """
@@ -166,6 +172,8 @@ def headers_to_container_info(headers, status_int=HTTP_OK):
         'bytes': headers.get('x-container-bytes-used'),
         'versions': headers.get('x-versions-location'),
         'storage_policy': headers.get('x-backend-storage-policy-index', '0'),
+        'sharding_state': headers.get('x-backend-sharding-state',
+                                      'unsharded'),
         'cors': {
             'allow_origin': meta.get('access-control-allow-origin'),
             'expose_headers': meta.get('access-control-expose-headers'),
@@ -311,7 +319,7 @@ def get_container_info(env, app, swift_source=None):
     (version, account, container, unused) = \
         split_path(env['PATH_INFO'], 3, 4, True)
 
-    # Check in environment cache and in memcache (in that order)
+    # Check in environment cache, local cache and memcache (in that order)
     info = _get_info_from_caches(app, env, account, container)
 
     if not info:
@@ -330,17 +338,22 @@ def get_container_info(env, app, swift_source=None):
             if not account_info or not is_success(account_info['status']):
                 return headers_to_container_info({}, 0)
 
-        req = _prepare_pre_auth_info_request(
-            env, ("/%s/%s/%s" % (version, account, container)),
-            (swift_source or 'GET_CONTAINER_INFO'))
-        resp = req.get_response(app)
-        # Check in infocache to see if the proxy (or anyone else) already
-        # populated the cache for us. If they did, just use what's there.
-        #
-        # See similar comment in get_account_info() for justification.
-        info = _get_info_from_infocache(env, account, container)
-        if info is None:
-            info = set_info_cache(app, env, account, container, resp)
+        def fetch_info():
+            req = _prepare_pre_auth_info_request(
+                env, ("/%s/%s/%s" % (version, account, container)),
+                (swift_source or 'GET_CONTAINER_INFO'))
+            with trace_span(env, 'get_info.container'):
+                resp = req.get_response(app)
+            # Check in infocache to see if the proxy (or anyone else) already
+            # populated the cache for us. If they did, just use what's there.
+            #
+            # See similar comment in get_account_info() for justification.
+            info = _get_info_from_infocache(env, account, container)
+            if info is None:
+                info = set_info_cache(app, env, account, container, resp)
+            return info
+
+        info = _fetch_info_once(app, env, account, container, fetch_info)
 
     if info:
         info = deepcopy(info)  # avoid mutating what's in swift.infocache
@@ -376,33 +389,39 @@ def get_account_info(env, app, swift_source=None):
     (version, account, _junk, _junk) = \
         split_path(env['PATH_INFO'], 2, 4, True)
 
-    # Check in environment cache and in memcache (in that order)
+    # Check in environment cache, local cache and memcache (in that order)
     info = _get_info_from_caches(app, env, account)
 
     # Cache miss; go HEAD the account and populate the caches
     if not info:
         env.setdefault('swift.infocache', {})
-        req = _prepare_pre_auth_info_request(
-            env, "/%s/%s" % (version, account),
-            (swift_source or 'GET_ACCOUNT_INFO'))
-        resp = req.get_response(app)
-        # Check in infocache to see if the proxy (or anyone else) already
-        # populated the cache for us. If they did, just use what's there.
-        #
-        # The point of this is to avoid setting the value in memcached
-        # twice. Otherwise, we're needlessly sending requests across the
-        # network.
-        #
-        # If the info didn't make it into the cache, we'll compute it from
-        # the response and populate the cache ourselves.
-        #
-        # Note that this is taking "exists in infocache" to imply "exists in
-        # memcache". That's because we're trying to avoid superfluous
-        # network traffic, and checking in memcache prior to setting in
-        # memcache would defeat the purpose.
-        info = _get_info_from_infocache(env, account)
-        if info is None:
-            info = set_info_cache(app, env, account, None, resp)
+
+        def fetch_info():
+            req = _prepare_pre_auth_info_request(
+                env, "/%s/%s" % (version, account),
+                (swift_source or 'GET_ACCOUNT_INFO'))
+            with trace_span(env, 'get_info.account'):
+                resp = req.get_response(app)
+            # Check in infocache to see if the proxy (or anyone else) already
+            # populated the cache for us. If they did, just use what's there.
+            #
+            # The point of this is to avoid setting the value in memcached
+            # twice. Otherwise, we're needlessly sending requests across the
+            # network.
+            #
+            # If the info didn't make it into the cache, we'll compute it
+            # from the response and populate the cache ourselves.
+            #
+            # Note that this is taking "exists in infocache" to imply "exists
+            # in memcache". That's because we're trying to avoid superfluous
+            # network traffic, and checking in memcache prior to setting in
+            # memcache would defeat the purpose.
+            info = _get_info_from_infocache(env, account)
+            if info is None:
+                info = set_info_cache(app, env, account, None, resp)
+            return info
+
+        info = _fetch_info_once(app, env, account, None, fetch_info)
 
     if info:
         info = info.copy()  # avoid mutating what's in swift.infocache
@@ -448,7 +467,7 @@ def get_cache_key(account, container=None, obj=None):
 
 def set_info_cache(app, env, account, container, resp):
     """
-    Cache info in both memcache and env.
+    Cache info in memcache, the proxy's local info cache (if enabled) and env.
 
     :param  app: the application object
     :param  account: the unquoted account name
@@ -477,10 +496,13 @@ def set_info_cache(app, env, account, container, resp):
         elif not is_success(resp.status_int):
             cache_time = None
 
-    # Next actually set both memcache and the env cache
+    # Next actually set memcache, the proxy's local cache and the env cache
     memcache = getattr(app, 'memcache', None) or env.get('swift.cache')
+    info_cache = getattr(app, 'info_cache', None)
     if cache_time is None:
         infocache.pop(cache_key, None)
+        if info_cache is not None:
+            info_cache.pop_cache(cache_key)
         if memcache:
             memcache.delete(cache_key)
         return
@@ -491,6 +513,8 @@ def set_info_cache(app, env, account, container, resp):
         info = headers_to_account_info(resp.headers, resp.status_int)
     if memcache:
         memcache.set(cache_key, info, time=cache_time)
+    if info_cache is not None:
+        info_cache.set_cache(info, cache_key)
     infocache[cache_key] = info
     return info
 
@@ -524,7 +548,7 @@ def set_object_info_cache(app, env, account, container, obj, resp):
 
 def clear_info_cache(app, env, account, container=None):
     """
-    Clear the cached info in both memcache and env
+    Clear the cached info in memcache, the proxy's local info cache and env
 
     :param  app: the application object
     :param  env: the WSGI environment
@@ -575,15 +599,44 @@ def _get_info_from_memcache(app, env, account, container=None):
                     for subkey, value in info[key].items():
                         if isinstance(value, six.text_type):
                             info[key][subkey] = value.encode("utf-8")
+            info_cache = getattr(app, 'info_cache', None)
+            if info_cache is not None:
+                info_cache.set_cache(info, cache_key)
             env.setdefault('swift.infocache', {})[cache_key] = info
         return info
     return None
 
 
+def _get_info_from_local_cache(app, env, account, container=None):
+    """
+    Get cached account or container information from the proxy worker's
+    local info cache, and count the hit or miss.
+
+    :param  app: the application object
+    :param  env: the environment used by the current request
+    :param  account: the account name
+    :param  container: the container name
+
+    :returns: a dictionary of cached info on cache hit, None on miss. Also
+      returns None if the local info cache is not in use.
+    """
+    info_cache = getattr(app, 'info_cache', None)
+    if info_cache is None:
+        return None
+    cache_key = get_cache_key(account, container)
+    info = info_cache.get(cache_key)
+    app.logger.increment('info_cache.%s.%s' % (
+        'container' if container else 'account',
+        'miss' if info is None else 'hit'))
+    if info is not None:
+        env.setdefault('swift.infocache', {})[cache_key] = info
+    return info
+
+
 def _get_info_from_caches(app, env, account, container=None):
     """
-    Get the cached info from env or memcache (if used) in that order.
-    Used for both account and container info.
+    Get the cached info from env, the proxy's local info cache or memcache
+    (if used) in that order. Used for both account and container info.
 
     :param  app: the application object
     :param  env: the environment used by the current request
@@ -592,7 +645,60 @@ def _get_info_from_caches(app, env, account, container=None):
 
     info = _get_info_from_infocache(env, account, container)
     if info is None:
-        info = _get_info_from_memcache(app, env, account, container)
+        info = _get_info_from_local_cache(app, env, account, container)
+    if info is None:
+        with trace_span(env, 'info_memcache'):
+            info = _get_info_from_memcache(app, env, account, container)
+    return info
+
+
+def _fetch_info_once(app, env, account, container, fetch_info):
+    """
+    Fetch account or container info from the backend, coalescing concurrent
+    cache misses for the same account or container within this process.
+
+    The first greenthread to miss calls fetch_info(); any others that miss
+    while it is running wait for its result instead of sending their own
+    HEAD. If fetch_info() raises, the waiters fall back to fetching the info
+    themselves.
+
+    :param  app: the application object
+    :param  env: the environment used by the current request
+    :param  account: the account name
+    :param  container: the container name or None
+    :param  fetch_info: a callable taking no arguments that sends the HEAD
+                        and returns the info that was cached, or None
+
+    :returns: the info returned by fetch_info()
+    """
+    cache_key = get_cache_key(account, container)
+    current = greenthread.getcurrent()
+    in_flight = _info_fetches.get(cache_key)
+    if in_flight is not None:
+        fetcher, event = in_flight
+        if fetcher is current:
+            # a nested lookup made while handling our own HEAD
+            return fetch_info()
+        logger = getattr(app, 'logger', None)
+        if logger:
+            logger.increment('info_fetch.%s.coalesced' % (
+                'container' if container else 'account'))
+        fetched, info = event.wait()
+        if not fetched:
+            return fetch_info()
+        if info is not None:
+            env.setdefault('swift.infocache', {})[cache_key] = info
+        return info
+
+    event = Event()
+    _info_fetches[cache_key] = (current, event)
+    fetched = info = None
+    try:
+        info = fetch_info()
+        fetched = True
+    finally:
+        del _info_fetches[cache_key]
+        event.send((fetched, info))
     return info
 
 
@@ -684,6 +790,17 @@ def _get_object_info(app, env, account, container, obj, swift_source=None):
     return info
 
 
+def backend_connect(app, *args, **kwargs):
+    """
+    Connect to a backend server with :func:`http_connect`, taking the
+    connection from the app's backend connection pool if it has one. Only
+    for requests without a body.
+    """
+    if app.backend_pool:
+        kwargs['pool'] = app.backend_pool
+    return http_connect(*args, **kwargs)
+
+
 def close_swift_conn(src):
     """
     Force close the http connection to the backend.
@@ -701,7 +818,14 @@ def close_swift_conn(src):
         # close the underlying socket but only decrement some
         # reference-counter, we have a special method here that really,
         # really kills the underlying socket with a close() syscall.
-        src.nuke_from_orbit()  # it's the only way to be sure
+        #
+        # The exception is a response read to its end from a pooled
+        # keep-alive connection: closing it returns the connection to the
+        # pool for another request.
+        if isinstance(src, BufferedHTTPResponse) and src.reusable:
+            src.close()
+        else:
+            src.nuke_from_orbit()  # it's the only way to be sure
     except Exception:
         pass
 
@@ -728,7 +852,7 @@ def bytes_to_skip(record_size, range_start):
 class ResumingGetter(object):
     def __init__(self, app, req, server_type, node_iter, partition, path,
                  backend_headers, concurrency=1, client_chunk_size=None,
-                 newest=None, header_provider=None):
+                 newest=None, header_provider=None, hedge=False):
         self.app = app
         self.node_iter = node_iter
         self.server_type = server_type
@@ -741,10 +865,12 @@ class ResumingGetter(object):
         self.used_nodes = []
         self.used_source_etag = ''
         self.concurrency = concurrency
+        self.hedge = hedge
         self.node = None
         self.header_provider = header_provider
 
         # stuff from request
+        self.req_env = req.environ
         self.req_method = req.method
         self.req_path = req.path
         self.req_query_string = req.query_string
@@ -1106,27 +1232,47 @@ class ResumingGetter(object):
         # a request may be specialised with specific backend headers
         if self.header_provider:
             req_headers.update(self.header_provider())
+        self.app.start_node_request(node)
         start_node_timing = time.time()
         try:
             with ConnectionTimeout(self.app.conn_timeout):
-                conn = http_connect(
-                    node['ip'], node['port'], node['device'],
+                conn = backend_connect(
+                    self.app, node['ip'], node['port'], node['device'],
                     self.partition, self.req_method, self.path,
                     headers=req_headers,
                     query_string=self.req_query_string)
-            self.app.set_node_timing(node, time.time() - start_node_timing)
+            connected = time.time()
+            self.app.set_node_timing(node, connected - start_node_timing)
+            trace_span_add(self.req_env, 'connect.%(ip)s:%(port)s' % node,
+                           connected - start_node_timing)
 
             with Timeout(node_timeout):
                 possible_source = conn.getresponse()
                 # See NOTE: swift_conn at top of file about this.
                 possible_source.swift_conn = conn
+            trace_span_add(self.req_env, 'first_byte.%(ip)s:%(port)s' % node,
+                           time.time() - connected)
         except (Exception, Timeout):
+            # a failed request counts as a slow one, however quickly it
+            # failed, so the node isn't mistaken for a fast one
+            self.app.end_node_request(
+                node, max(node_timeout, time.time() - start_node_timing))
             self.app.exception_occurred(
                 node, self.server_type,
                 _('Trying to %(method)s %(path)s') %
                 {'method': self.req_method, 'path': self.req_path})
             return False
-        if self.is_good_source(possible_source):
+        elapsed = time.time() - start_node_timing
+        good_source = self.is_good_source(possible_source)
+        if good_source:
+            self.app.end_node_request(node, elapsed)
+        else:
+            # so does an error response, or a failing device that answers
+            # quickly would be sent more requests than the healthy ones
+            self.app.end_node_request(node, max(node_timeout, elapsed))
+        if self.hedge:
+            self.app.record_get_timing(elapsed)
+        if good_source:
             # 404 if we know we don't have a synced copy
             if not float(possible_source.getheader('X-PUT-Timestamp', 1)):
                 self.statuses.append(HTTP_NOT_FOUND)
@@ -1186,14 +1332,27 @@ class ResumingGetter(object):
             node_timeout = self.app.recoverable_node_timeout
 
         pile = GreenAsyncPile(self.concurrency)
+        # when hedging, the next node is only tried once the requests in
+        # flight are slower than most recent ones
+        concurrency_timeout = self.app.get_hedge_delay() if self.hedge \
+            else self.app.concurrency_timeout
+        first_node = None
+        timed_out = hedged = False
 
         for node in nodes:
+            if first_node is None:
+                first_node = node
+            elif self.hedge and timed_out:
+                self.app.logger.increment('hedge.issued')
+                hedged = True
             pile.spawn(self._make_node_request, node, node_timeout,
                        self.app.logger.thread_locals)
-            _timeout = self.app.concurrency_timeout \
+            _timeout = concurrency_timeout \
                 if pile.inflight < self.concurrency else None
-            if pile.waitfirst(_timeout):
+            result = pile.waitfirst(_timeout)
+            if result:
                 break
+            timed_out = result is None
         else:
             # ran out of nodes, see if any stragglers will finish
             any(pile)
@@ -1203,6 +1362,12 @@ class ResumingGetter(object):
             source, node = self.sources.pop()
             for src, _junk in self.sources:
                 close_swift_conn(src)
+            if hedged:
+                if node is not first_node:
+                    self.app.logger.increment('hedge.won')
+                if pile.inflight:
+                    # don't leave the losing requests' connections open
+                    spawn(self._close_stragglers, pile, self.sources)
             self.used_nodes.append(node)
             src_headers = dict(
                 (k.lower(), v) for k, v in
@@ -1221,6 +1386,16 @@ class ResumingGetter(object):
             return source, node
         return None, None
 
+    def _close_stragglers(self, pile, sources):
+        """
+        Wait for the requests still in flight after a source was chosen and
+        close the connections of any that turn out to be good sources too.
+        """
+        for _junk in pile:
+            pass
+        for src, _junk in sources:
+            close_swift_conn(src)
+
 
 class GetOrHeadHandler(ResumingGetter):
     def _make_app_iter(self, req, node, source):
@@ -1558,9 +1733,10 @@ class Controller(object):
             try:
                 start_node_timing = time.time()
                 with ConnectionTimeout(self.app.conn_timeout):
-                    conn = http_connect(node['ip'], node['port'],
-                                        node['device'], part, method, path,
-                                        headers=headers, query_string=query)
+                    conn = backend_connect(
+                        self.app, node['ip'], node['port'], node['device'],
+                        part, method, path, headers=headers,
+                        query_string=query)
                     conn.node = node
                 self.app.set_node_timing(node, time.time() - start_node_timing)
                 with Timeout(self.app.node_timeout):
@@ -1610,18 +1786,19 @@ class Controller(object):
         start_nodes = ring.get_part_nodes(part)
         nodes = GreenthreadSafeIterator(self.app.iter_nodes(ring, part))
         pile = GreenAsyncPile(len(start_nodes))
-        for head in headers:
-            pile.spawn(self._make_request, nodes, part, method, path,
-                       head, query_string, self.app.logger.thread_locals)
-        response = []
-        statuses = []
-        for resp in pile:
-            if not resp:
-                continue
-            response.append(resp)
-            statuses.append(resp[0])
-            if self.have_quorum(statuses, len(start_nodes)):
-                break
+        with trace_span(req.environ, 'quorum.%s' % method):
+            for head in headers:
+                pile.spawn(self._make_request, nodes, part, method, path,
+                           head, query_string, self.app.logger.thread_locals)
+            response = []
+            statuses = []
+            for resp in pile:
+                if not resp:
+                    continue
+                response.append(resp)
+                statuses.append(resp[0])
+                if self.have_quorum(statuses, len(start_nodes)):
+                    break
         # give any pending requests *some* chance to finish
         finished_quickly = pile.waitall(self.app.post_quorum_timeout)
         for resp in finished_quickly:
@@ -1786,7 +1963,7 @@ class Controller(object):
                                     path)
 
     def GETorHEAD_base(self, req, server_type, node_iter, partition, path,
-                       concurrency=1, client_chunk_size=None):
+                       concurrency=1, client_chunk_size=None, hedge=False):
         """
         Base handler for HTTP GET or HEAD requests.
 
@@ -1797,6 +1974,8 @@ class Controller(object):
         :param path: path for the request
         :param concurrency: number of requests to run concurrently
         :param client_chunk_size: chunk size for response body iterator
+        :param hedge: if True, only send a request to another node once the
+                      requests in flight are slower than most recent ones
         :returns: swob.Response object
         """
         backend_headers = self.generate_request_headers(
@@ -1805,7 +1984,8 @@ class Controller(object):
         handler = GetOrHeadHandler(self.app, req, self.server_type, node_iter,
                                    partition, path, backend_headers,
                                    concurrency,
-                                   client_chunk_size=client_chunk_size)
+                                   client_chunk_size=client_chunk_size,
+                                   hedge=hedge)
         res = handler.get_working_response(req)
 
         if not res:
@@ -1831,6 +2011,77 @@ class Controller(object):
 
         return res
 
+    def _get_container_listing(self, req, account, container, headers=None,
+                               params=None):
+        """
+        Fetch a JSON listing of a container directly from its container
+        servers, bypassing any middleware. With an ``X-Backend-Record-Type:
+        shard`` header the container's shard ranges are listed instead of
+        its objects.
+
+        :param req: the original client request
+        :param account: the unquoted account name
+        :param container: the unquoted container name
+        :param headers: headers to send to the container servers
+        :param params: query parameters to send to the container servers
+        :returns: a tuple of (response, list of dicts); the list is None if
+                  the listing could not be fetched
+        """
+        params = dict(params or {})
+        params['format'] = 'json'
+        path = '/v1/%s/%s' % (account, container)
+        subreq_env = make_pre_authed_env(
+            req.environ, 'GET', path, query_string=urlencode(params),
+            swift_source='SH')
+        subreq = Request.blank(quote(path), environ=subreq_env,
+                               headers=headers)
+        part = self.app.container_ring.get_part(account, container)
+        node_iter = self.app.iter_nodes(self.app.container_ring, part)
+        resp = self.GETorHEAD_base(
+            subreq, _('Container'), node_iter, part,
+            subreq.swift_entity_path)
+        if not is_success(resp.status_int):
+            return resp, None
+        if resp.status_int == HTTP_NO_CONTENT:
+            return resp, []
+        try:
+            return resp, json.loads(resp.body)
+        except ValueError:
+            self.app.logger.error(
+                _('Invalid JSON listing from container %(path)s'),
+                {'path': path})
+            return resp, None
+
+    def _get_shard_ranges(self, req, account, container, includes=None):
+        """
+        Fetch the shard ranges of a sharded container.
+
+        :param req: the original client request
+        :param account: the unquoted account name of the root container
+        :param container: the unquoted name of the root container
+        :param includes: only fetch the shard range that includes this
+                         object name
+        :returns: a list of ShardRange instances, or None if they could not
+                  be fetched
+        """
+        params = {}
+        if includes is not None:
+            params['includes'] = includes
+        resp, listing = self._get_container_listing(
+            req, account, container,
+            headers={'X-Backend-Record-Type': 'shard'}, params=params)
+        if listing is None or \
+                resp.headers.get('X-Backend-Record-Type') != 'shard':
+            return None
+        try:
+            return [ShardRange.from_dict(shard_range)
+                    for shard_range in listing]
+        except (ValueError, TypeError, KeyError):
+            self.app.logger.error(
+                _('Invalid shard ranges from container %(path)s'),
+                {'path': '/%s/%s' % (account, container)})
+            return None
+
     def is_origin_allowed(self, cors_info, origin):
         """
         Is the given Origin allowed to make requests to this resource
@@ -14,18 +14,23 @@
 # limitations under the License.
 
 from swift import gettext_ as _
+import json
 import time
 
+from eventlet import GreenPile
 from six.moves.urllib.parse import unquote
-from swift.common.utils import public, csv_append, Timestamp
+from swift.common.utils import public, csv_append, Timestamp, \
+    config_true_value, close_if_possible, prefix_upper_bound
 from swift.common.constraints import check_metadata
 from swift.common import constraints
-from swift.common.http import HTTP_ACCEPTED, is_success
+from swift.common.http import HTTP_ACCEPTED, HTTP_NO_CONTENT, is_success
+from swift.common.request_helpers import get_listing_content_type, \
+    container_listing_xml_iter
 from swift.proxy.controllers.base import Controller, delay_denial, \
     cors_validation, set_info_cache, clear_info_cache
 from swift.common.storage_policy import POLICIES
 from swift.common.swob import HTTPBadRequest, HTTPForbidden, \
-    HTTPNotFound
+    HTTPNotFound, HTTPServiceUnavailable
 
 
 class ContainerController(Controller):
@@ -117,12 +122,266 @@ class ContainerController(Controller):
                 # Don't cache this. It doesn't reflect the state of the
                 # container, just that the user can't access it.
                 return aresp
+        if req.method == 'GET' and is_success(resp.status_int) and \
+                resp.headers.get('X-Backend-Sharding-State') in (
+                    'sharding', 'sharded'):
+            resp = self._get_from_shards(req, resp)
         if not req.environ.get('swift_owner', False):
             for key in self.app.swift_owner_headers:
                 if key in resp.headers:
                     del resp.headers[key]
         return resp
 
+    def _get_from_shards(self, req, resp):
+        """
+        Build the listing of a sharded container from the listings of its
+        shards, visiting just enough shards, in namespace order, to fill the
+        requested limit. While the container is still sharding, the rows
+        that have yet to be moved out of the root are merged in.
+
+        A ``prefix_stats`` listing is built by
+        :meth:`_get_prefix_stats_from_shards` instead.
+
+        :param req: the client's GET request
+        :param resp: the root container's response, which provides the
+                     headers of the returned listing
+        :returns: a swob.Response
+        """
+        shard_ranges = self._get_shard_ranges(
+            req, self.account_name, self.container_name)
+        if shard_ranges is None:
+            return HTTPServiceUnavailable(request=req)
+        if not shard_ranges:
+            # the container has stopped being sharded since it answered
+            return resp
+        close_if_possible(resp.app_iter)
+
+        params = dict(req.params)
+        params.pop('format', None)
+        marker = params.get('marker', '')
+        end_marker = params.get('end_marker', '')
+        prefix = params.get('prefix', params.get('path', ''))
+        reverse = config_true_value(params.get('reverse'))
+        limit = constraints.CONTAINER_LISTING_LIMIT
+        if params.get('limit', '').isdigit():
+            limit = min(limit, int(params['limit']))
+        if reverse:
+            shard_ranges.reverse()
+        if config_true_value(resp.headers.get('X-Backend-Prefix-Stats')):
+            objects = self._get_prefix_stats_from_shards(
+                req, resp, shard_ranges, params, limit)
+            if objects is None:
+                return HTTPServiceUnavailable(request=req)
+            return self._set_listing_body(req, resp, objects)
+
+        def shard_listing_params():
+            for shard_range in shard_ranges:
+                if prefix and not shard_range.overlaps(
+                        prefix[:-1], prefix_upper_bound(prefix)):
+                    continue
+                # names in the shard are lower < name <= upper
+                upper = shard_range.upper and shard_range.upper + '\x00'
+                shard_params = dict(params)
+                if reverse:
+                    if marker and shard_range.lower >= marker:
+                        continue
+                    if end_marker and upper and upper <= end_marker:
+                        break
+                    shard_params['marker'] = min(marker or upper,
+                                                 upper or marker)
+                    shard_params['end_marker'] = max(end_marker,
+                                                     shard_range.lower)
+                else:
+                    if marker and upper and upper <= marker:
+                        continue
+                    if end_marker and shard_range.lower >= end_marker:
+                        break
+                    shard_params['marker'] = max(marker, shard_range.lower)
+                    shard_params['end_marker'] = min(end_marker or upper,
+                                                     upper or end_marker)
+                yield shard_range, shard_params
+
+        objects = []
+        shard_iter = shard_listing_params()
+        while len(objects) < limit:
+            batch = self._next_shard_batch(shard_iter, limit - len(objects))
+            if not batch:
+                break
+            for shard_range, listing in self._get_shard_listings(
+                    req, batch, limit - len(objects)):
+                if listing is None:
+                    self.app.logger.error(
+                        _('Failed to get listing of shard %(shard)s of '
+                          'container %(path)s'),
+                        {'shard': shard_range.name,
+                         'path': req.swift_entity_path})
+                    return HTTPServiceUnavailable(request=req)
+                for record in listing:
+                    # a pseudo-directory may span more than one shard
+                    if objects and 'subdir' in record and \
+                            objects[-1].get('subdir') == record['subdir']:
+                        continue
+                    objects.append(record)
+
+        if resp.headers.get('X-Backend-Sharding-State') == 'sharding':
+            root_resp, listing = self._get_container_listing(
+                req, self.account_name, self.container_name,
+                params=dict(params, limit=str(limit)))
+            if listing is None:
+                self.app.logger.error(
+                    _('Failed to get listing of sharding container '
+                      '%(path)s'), {'path': req.swift_entity_path})
+                return HTTPServiceUnavailable(request=req)
+            # a row may be in both the root and a shard while it's being
+            # moved; the shard's copy wins
+            merged = dict((record.get('name', record.get('subdir')), record)
+                          for record in listing + objects)
+            objects = [merged[name]
+                       for name in sorted(merged, reverse=reverse)]
+
+        return self._set_listing_body(req, resp, objects[:limit])
+
+    def _get_prefix_stats_from_shards(self, req, resp, shard_ranges, params,
+                                      limit):
+        """
+        Build the ``prefix_stats`` listing of a sharded container. A
+        pseudo-folder may span several shards, and those of the names in a
+        shard may sort before its lower bound, so every shard that may hold
+        names in the requested namespace is asked for its stats with the
+        client's markers, and the counts and bytes of each pseudo-folder are
+        added up. While the container is still sharding, the stats of the
+        rows that have yet to be moved out of the root are added too; a row
+        that is being moved may briefly be counted twice.
+
+        :param req: the client's GET request
+        :param resp: the root container's response
+        :param shard_ranges: the container's shard ranges, in listing order
+        :param params: the listing's query parameters
+        :param limit: the most pseudo-folders to list
+        :returns: a list of dicts, or None if a listing could not be fetched
+        """
+        prefix = params.get('prefix', '')
+        reverse = config_true_value(params.get('reverse'))
+        # every pseudo-folder listed sorts after this, and a shard only
+        # holds pseudo-folders that sort before or at its upper bound
+        lower = params.get('end_marker' if reverse else 'marker', '')
+        shards = [
+            (shard_range, dict(params)) for shard_range in shard_ranges
+            if not (lower and shard_range.upper and
+                    shard_range.upper <= lower) and
+            not (prefix and not shard_range.overlaps(
+                prefix[:-1], prefix_upper_bound(prefix)))]
+
+        listings = []
+        concurrency = self.app.shard_listing_concurrency
+        for i in range(0, len(shards), concurrency):
+            for shard_range, listing in self._get_shard_listings(
+                    req, shards[i:i + concurrency], limit):
+                if listing is None:
+                    self.app.logger.error(
+                        _('Failed to get prefix stats of shard %(shard)s of '
+                          'container %(path)s'),
+                        {'shard': shard_range.name,
+                         'path': req.swift_entity_path})
+                    return None
+                listings.append(listing)
+        if resp.headers.get('X-Backend-Sharding-State') == 'sharding':
+            root_resp, listing = self._get_container_listing(
+                req, self.account_name, self.container_name,
+                params=dict(params, limit=str(limit)))
+            if listing is None:
+                self.app.logger.error(
+                    _('Failed to get prefix stats of sharding container '
+                      '%(path)s'), {'path': req.swift_entity_path})
+                return None
+            listings.append(listing)
+
+        # each listing has the first limit pseudo-folders of its shard, so
+        # the first limit of the totals are complete
+        totals = {}
+        for listing in listings:
+            for record in listing:
+                total = totals.setdefault(record['subdir'], {
+                    'subdir': record['subdir'], 'count': 0, 'bytes': 0})
+                total['count'] += record['count']
+                total['bytes'] += record['bytes']
+        return [totals[subdir]
+                for subdir in sorted(totals, reverse=reverse)[:limit]]
+
+    def _set_listing_body(self, req, resp, objects):
+        """
+        Set a listing built by the proxy as the body of the root container's
+        response, in the format the client asked for.
+
+        :returns: the response
+        """
+        out_content_type = get_listing_content_type(req)
+        if out_content_type == 'application/json':
+            resp.body = json.dumps(objects)
+        elif out_content_type.endswith('/xml'):
+            resp.body = ''.join(container_listing_xml_iter(
+                self.container_name, objects))
+        elif objects:
+            resp.body = '\n'.join(
+                record.get('name', record.get('subdir')).encode('utf-8')
+                for record in objects) + '\n'
+        else:
+            resp.status = HTTP_NO_CONTENT
+            resp.body = ''
+        return resp
+
+    def _next_shard_batch(self, shard_iter, remaining):
+        """
+        Take the next shards to list at the same time: as many as the
+        shards' reported object counts suggest will fill the remaining
+        limit, up to shard_listing_concurrency of them.
+
+        :param shard_iter: an iterator of (ShardRange, params) tuples, in the
+                           order the shards are to be listed
+        :param remaining: the number of objects still wanted
+        :returns: a list of (ShardRange, params) tuples
+        """
+        batch = []
+        estimate = 0
+        while len(batch) < self.app.shard_listing_concurrency and \
+                (not batch or estimate < remaining):
+            try:
+                shard_range, params = next(shard_iter)
+            except StopIteration:
+                break
+            batch.append((shard_range, params))
+            estimate += shard_range.object_count
+        return batch
+
+    def _get_shard_listings(self, req, batch, remaining):
+        """
+        List a batch of shards, concurrently if there is more than one.
+
+        :param req: the client's GET request
+        :param batch: a list of (ShardRange, params) tuples
+        :param remaining: the most objects to list from each shard
+        :returns: a list of (ShardRange, listing) tuples in the order of the
+                  batch; a listing is None if it could not be fetched
+        """
+        def get_listing(shard_range, params, logger_thread_locals):
+            self.app.logger.thread_locals = logger_thread_locals
+            params['limit'] = str(remaining)
+            shard_resp, listing = self._get_container_listing(
+                req, shard_range.account, shard_range.container,
+                params=params)
+            return shard_range, listing
+
+        if len(batch) == 1:
+            shard_range, params = batch[0]
+            return [get_listing(shard_range, params,
+                                self.app.logger.thread_locals)]
+        self.app.logger.increment('shard_listing.concurrent')
+        pile = GreenPile(len(batch))
+        for shard_range, params in batch:
+            pile.spawn(get_listing, shard_range, params,
+                       self.app.logger.thread_locals)
+        return list(pile)
+
     @public
     @delay_denial
     @cors_validation
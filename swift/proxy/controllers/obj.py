@@ -38,7 +38,7 @@ from hashlib import md5
 from swift import gettext_ as _
 
 from greenlet import GreenletExit
-from eventlet import GreenPile
+from eventlet import GreenPile, spawn
 from eventlet.queue import Queue
 from eventlet.timeout import Timeout
 
@@ -47,7 +47,8 @@ from swift.common.utils import (
     GreenAsyncPile, GreenthreadSafeIterator, Timestamp,
     normalize_delete_at_timestamp, public, get_expirer_container,
     document_iters_to_http_response_body, parse_content_range,
-    quorum_size, reiterate, close_if_possible, safe_json_loads)
+    quorum_size, reiterate, close_if_possible, safe_json_loads,
+    ShardRange, find_shard_range, tpool_reraise)
 from swift.common.bufferedhttp import http_connect
 from swift.common.constraints import check_metadata, check_object_creation
 from swift.common import constraints
@@ -72,7 +73,7 @@ from swift.common.swob import HTTPAccepted, HTTPBadRequest, HTTPNotFound, \
     HTTPUnprocessableEntity, Response, HTTPException, \
     HTTPRequestedRangeNotSatisfiable, Range, HTTPInternalServerError
 from swift.common.request_helpers import update_etag_is_at_header, \
-    resolve_etag_is_at_header
+    resolve_etag_is_at_header, trace_span, trace_span_add
 
 
 def check_content_type(req):
@@ -226,6 +227,8 @@ class BaseObjectController(Controller):
         error_response = check_metadata(req, 'object')
         if error_response:
             return error_response
+        container_partition, container_nodes = self._get_update_target(
+            req, container_info)
 
         req, delete_at_container, delete_at_part, \
             delete_at_nodes = self._config_obj_expiration(req)
@@ -245,6 +248,65 @@ class BaseObjectController(Controller):
             delete_at_container, delete_at_part, delete_at_nodes)
         return self._post_object(req, obj_ring, partition, headers)
 
+    def _get_update_shard(self, req):
+        """
+        Find the shard of this request's container whose range includes the
+        object. The container's shard ranges are cached in the request
+        environment and in memcache for ``recheck_container_existence``
+        seconds.
+
+        :param req: the client request
+        :returns: a ShardRange, or None if it cannot be found
+        """
+        cache_key = 'shard-updating/%s/%s' % (self.account_name,
+                                              self.container_name)
+        infocache = req.environ.setdefault('swift.infocache', {})
+        memcache = getattr(self.app, 'memcache', None) or \
+            req.environ.get('swift.cache')
+        shard_ranges = infocache.get(cache_key)
+        if shard_ranges is None and memcache:
+            cached = memcache.get(cache_key)
+            if cached is not None:
+                shard_ranges = [ShardRange.from_dict(shard_range)
+                                for shard_range in cached]
+        if shard_ranges is None:
+            shard_ranges = self._get_shard_ranges(
+                req, self.account_name, self.container_name)
+            if shard_ranges is None:
+                return None
+            if memcache:
+                memcache.set(
+                    cache_key, [dict(shard_range)
+                                for shard_range in shard_ranges],
+                    time=self.app.recheck_container_existence)
+        infocache[cache_key] = shard_ranges
+        return find_shard_range(self.object_name, shard_ranges)
+
+    def _get_update_target(self, req, container_info):
+        """
+        Find the container that the object servers should update for this
+        request: the container itself, unless it is sharding or sharded, in
+        which case the shard that holds the object's listing. When an update is
+        directed to a shard the ``X-Backend-Container-Path`` request header
+        is set to the shard container's path.
+
+        :param req: the client request
+        :param container_info: the container's info
+        :returns: a tuple of (container partition, container nodes)
+        """
+        partition = container_info['partition']
+        nodes = container_info['nodes']
+        if container_info.get('sharding_state') not in ('sharding',
+                                                        'sharded'):
+            return partition, nodes
+        shard_range = self._get_update_shard(req)
+        if shard_range is None:
+            # the root's sharder will move the update to the right shard
+            return partition, nodes
+        req.headers['X-Backend-Container-Path'] = shard_range.name
+        return self.app.container_ring.get_nodes(
+            shard_range.account, shard_range.container)
+
     def _backend_requests(self, req, n_outgoing,
                           container_partition, containers,
                           delete_at_container=None, delete_at_partition=None,
@@ -665,6 +727,8 @@ class BaseObjectController(Controller):
             return error_response
 
         self._update_x_timestamp(req)
+        container_partition, container_nodes = self._get_update_target(
+            req, container_info)
 
         def reader():
             try:
@@ -725,6 +789,8 @@ class BaseObjectController(Controller):
             req.headers['X-Timestamp'] = req_timestamp.internal
         else:
             req.headers['X-Timestamp'] = Timestamp(time.time()).internal
+        container_partition, container_nodes = self._get_update_target(
+            req, container_info)
 
         headers = self._backend_requests(
             req, len(nodes), container_partition, container_nodes)
@@ -736,10 +802,10 @@ class ReplicatedObjectController(BaseObjectController):
 
     def _get_or_head_response(self, req, node_iter, partition, policy):
         concurrency = self.app.get_object_ring(policy.idx).replica_count \
-            if self.app.concurrent_gets else 1
+            if self.app.concurrent_gets or self.app.hedged_gets else 1
         resp = self.GETorHEAD_base(
             req, _('Object'), node_iter, partition,
-            req.swift_entity_path, concurrency)
+            req.swift_entity_path, concurrency, hedge=self.app.hedged_gets)
         return resp
 
     def _make_putter(self, node, part, req, headers):
@@ -867,7 +933,8 @@ class ReplicatedObjectController(BaseObjectController):
             self._check_failure_put_connections(putters, req, min_conns)
 
             # transfer data
-            self._transfer_data(req, data_source, putters, nodes)
+            with trace_span(req.environ, 'transfer_data'):
+                self._transfer_data(req, data_source, putters, nodes)
 
             # get responses
             statuses, reasons, bodies, etags = \
@@ -915,9 +982,17 @@ class ECAppIter(object):
         headers in the GET response from the object server.
 
     :param logger: a logger
+
+    :param read_ahead_segments: how many segments' fragments to read ahead
+        of the decoder from each backend, and, when decoding in the thread
+        pool, how many segments to decode at once
+
+    :param decode_in_threadpool: if True, segments are decoded in native
+        threads rather than on the hub
     """
     def __init__(self, path, policy, internal_parts_iters, range_specs,
-                 fa_length, obj_length, logger):
+                 fa_length, obj_length, logger, read_ahead_segments=1,
+                 decode_in_threadpool=False):
         self.path = path
         self.policy = policy
         self.internal_parts_iters = internal_parts_iters
@@ -926,10 +1001,15 @@ class ECAppIter(object):
         self.obj_length = obj_length if obj_length is not None else 0
         self.boundary = ''
         self.logger = logger
+        self.read_ahead_segments = read_ahead_segments
+        self.decode_in_threadpool = decode_in_threadpool
 
         self.mime_boundary = None
         self.learned_content_type = None
         self.stashed_iter = None
+        # traced requests get the total time spent decoding as a span
+        self.req_env = {}
+        self.decode_time = 0.0
 
     def close(self):
         # close down the stashed iter first so the ContextPool can
@@ -939,6 +1019,12 @@ class ECAppIter(object):
             self.stashed_iter.close()
         for it in self.internal_parts_iters:
             close_if_possible(it)
+        self._add_decode_span()
+
+    def _add_decode_span(self):
+        if self.decode_time:
+            trace_span_add(self.req_env, 'ec_decode', self.decode_time)
+            self.decode_time = 0.0
 
     def kickoff(self, req, resp):
         """
@@ -954,6 +1040,7 @@ class ECAppIter(object):
         :raises: HTTPException on error
         """
         self.mime_boundary = resp.boundary
+        self.req_env = req.environ
 
         self.stashed_iter = reiterate(self._real_iter(req, resp.headers))
 
@@ -1244,8 +1331,32 @@ class ECAppIter(object):
 
     def _decode_segments_from_fragments(self, fragment_iters):
         # Decodes the fragments from the object servers and yields one
-        # segment at a time.
-        queues = [Queue(1) for _junk in range(len(fragment_iters))]
+        # segment at a time. Up to read_ahead_segments fragments are
+        # buffered from each object server, and as many segments may be
+        # decoding in the thread pool at once; segments are yielded in
+        # order as their decodes finish.
+        queues = [Queue(self.read_ahead_segments)
+                  for _junk in range(len(fragment_iters))]
+        decoding = collections.deque()
+
+        def decode(fragments):
+            # a decode error is handed back rather than raised, to be raised
+            # in turn by whoever is yielding the segments
+            decode_start = time.time()
+            try:
+                segment = self.policy.pyeclib_driver.decode(fragments)
+            except ECDriverError as err:
+                segment = err
+            return segment, time.time() - decode_start
+
+        def check_decoded(segment, elapsed):
+            self.decode_time += elapsed
+            if isinstance(segment, ECDriverError):
+                self.logger.error(
+                    _("Error decoding fragments for %r"), self.path,
+                    exc_info=(type(segment), segment, None))
+                raise segment
+            return segment
 
         def put_fragments_in_queue(frag_iter, queue):
             try:
@@ -1264,7 +1375,7 @@ class ECAppIter(object):
                 self.logger.exception(_("Exception fetching fragments for"
                                         " %r"), self.path)
             finally:
-                queue.resize(2)  # ensure there's room
+                queue.resize(self.read_ahead_segments + 1)  # ensure room
                 queue.put(None)
                 frag_iter.close()
 
@@ -1287,14 +1398,16 @@ class ECAppIter(object):
                 # connection.
                 if not all(fragments):
                     break
-                try:
-                    segment = self.policy.pyeclib_driver.decode(fragments)
-                except ECDriverError:
-                    self.logger.exception(_("Error decoding fragments for"
-                                            " %r"), self.path)
-                    raise
+                if self.decode_in_threadpool:
+                    decoding.append(spawn(tpool_reraise, decode, fragments))
+                    if len(decoding) >= self.read_ahead_segments:
+                        yield check_decoded(*decoding.popleft().wait())
+                    continue
 
-                yield segment
+                yield check_decoded(*decode(fragments))
+            while decoding:
+                yield check_decoded(*decoding.popleft().wait())
+            self._add_decode_span()
 
     def app_iter_range(self, start, end):
         return self
@@ -1747,17 +1860,38 @@ class MIMEPutter(Putter):
                    mime_boundary, multiphase=need_multiphase)
 
 
-def chunk_transformer(policy, nstreams):
+def chunk_transformer(policy, nstreams, batch_segments=1,
+                      encode_in_threadpool=False):
+    """
+    A coroutine that takes chunks of an object's data and returns the
+    fragments of it destined for each of nstreams nodes, or None while too
+    little data has been buffered to encode. Sending it an empty chunk
+    flushes out the rest of the data.
+
+    :param policy: the EC storage policy of the object
+    :param nstreams: the number of nodes the fragments are destined for
+    :param batch_segments: how many segments to buffer before encoding them
+    :param encode_in_threadpool: if True, each batch of segments is encoded
+        in a native thread while the caller goes on to buffer the next one,
+        so fragments are returned one batch later
+    """
     segment_size = policy.ec_segment_size
+    batch_size = segment_size * batch_segments
+
+    def encode_segments(segments):
+        return [policy.pyeclib_driver.encode(segment)
+                for segment in segments]
 
     buf = collections.deque()
     total_buf_len = 0
+    # the greenthread encoding the previous batch in the threadpool
+    encoding = None
 
     chunk = yield
     while chunk:
         buf.append(chunk)
         total_buf_len += len(chunk)
-        if total_buf_len >= segment_size:
+        if total_buf_len >= batch_size:
             chunks_to_encode = []
             # extract as many chunks as we can from the input buffer
             while total_buf_len >= segment_size:
@@ -1773,10 +1907,15 @@ def chunk_transformer(policy, nstreams):
                     total_buf_len -= len(piece)
                 chunks_to_encode.append(''.join(pieces))
 
-            frags_by_byte_order = []
-            for chunk_to_encode in chunks_to_encode:
-                frags_by_byte_order.append(
-                    policy.pyeclib_driver.encode(chunk_to_encode))
+            if encode_in_threadpool:
+                previous, encoding = encoding, spawn(
+                    tpool_reraise, encode_segments, chunks_to_encode)
+                if previous is None:
+                    chunk = yield None
+                    continue
+                frags_by_byte_order = previous.wait()
+            else:
+                frags_by_byte_order = encode_segments(chunks_to_encode)
             # Sequential calls to encode() have given us a list that
             # looks like this:
             #
@@ -1797,11 +1936,16 @@ def chunk_transformer(policy, nstreams):
             chunk = yield None
 
     # Now we've gotten an empty chunk, which indicates end-of-input.
-    # Take any leftover bytes and encode them.
+    # Take any batch still being encoded and any leftover bytes, cut on the
+    # same segment boundaries as an unbatched encode, and return their
+    # fragments.
+    frags_by_byte_order = encoding.wait() if encoding is not None else []
     last_bytes = ''.join(buf)
-    if last_bytes:
-        last_frags = policy.pyeclib_driver.encode(last_bytes)
-        yield last_frags
+    frags_by_byte_order.extend(encode_segments(
+        [last_bytes[i:i + segment_size]
+         for i in range(0, len(last_bytes), segment_size)]))
+    if frags_by_byte_order:
+        yield [''.join(frags) for frags in zip(*frags_by_byte_order)]
     else:
         yield [''] * nstreams
 
@@ -2176,6 +2320,13 @@ class ECObjectController(BaseObjectController):
         if req.range:
             orig_range = req.range
             range_specs = self._convert_range(req, policy)
+            if self.app.ec_data_fragments_first and policy.ec_systematic:
+                # With every data fragment to hand, a systematic scheme
+                # decodes by concatenating them, so try the primaries that
+                # hold data before those that hold parity; parity is only
+                # fetched, and decoded from, when a data fragment is missing.
+                node_iter.primary_nodes.sort(
+                    key=lambda node: node['index'] >= policy.ec_ndata)
 
         safe_iter = GreenthreadSafeIterator(node_iter)
         # Sending the request concurrently to all nodes, and responding
@@ -2260,7 +2411,9 @@ class ECObjectController(BaseObjectController):
                 [parts_iter for
                  _getter, parts_iter in best_bucket.get_responses()],
                 range_specs, fa_length, obj_length,
-                self.app.logger)
+                self.app.logger,
+                read_ahead_segments=self.app.ec_decode_read_ahead_segments,
+                decode_in_threadpool=self.app.ec_decode_in_threadpool)
             resp = Response(
                 request=req,
                 headers=resp_headers,
@@ -2363,7 +2516,9 @@ class ECObjectController(BaseObjectController):
         This method was added in the PUT method extraction change
         """
         bytes_transferred = 0
-        chunk_transform = chunk_transformer(policy, len(nodes))
+        chunk_transform = chunk_transformer(
+            policy, len(nodes), self.app.ec_encode_batch_segments,
+            self.app.ec_encode_in_threadpool)
         chunk_transform.send(None)
         chunk_hashers = collections.defaultdict(md5)
 
@@ -2617,8 +2772,9 @@ class ECObjectController(BaseObjectController):
             # meet all the correct conditions set in the request
             self._check_failure_put_connections(putters, req, min_conns)
 
-            self._transfer_data(req, policy, data_source, putters,
-                                nodes, min_conns, etag_hasher)
+            with trace_span(req.environ, 'transfer_data'):
+                self._transfer_data(req, policy, data_source, putters,
+                                    nodes, min_conns, etag_hasher)
             # The durable state will propagate in a replicated fashion; if
             # one fragment is durable then the reconstructor will spread the
             # durable status around.
@@ -13,11 +13,13 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+from collections import deque
+import math
 import mimetypes
 import os
 import socket
 from swift import gettext_ as _
-from random import shuffle
+from random import random, shuffle
 from time import time
 import functools
 import sys
@@ -32,7 +34,9 @@ from swift.common.ring import Ring
 from swift.common.utils import cache_from_env, get_logger, \
     get_remote_client, split_path, config_true_value, generate_trans_id, \
     affinity_key_function, affinity_locality_predicate, list_from_csv, \
-    register_swift_info
+    register_swift_info, LRUCache
+from swift.common.bufferedhttp import ConnectionPool
+from swift.common.request_helpers import RequestTrace, trace_span
 from swift.common.constraints import check_utf8, valid_api_version
 from swift.proxy.controllers import AccountController, ContainerController, \
     ObjectControllerRouter, InfoController
@@ -44,6 +48,11 @@ from swift.common.swob import HTTPBadRequest, HTTPForbidden, \
 from swift.common.exceptions import APIVersionError
 
 
+# how many recent object GET/HEAD response times the hedge delay is taken
+# from, and how many new ones it takes to recompute it
+HEDGE_TIMING_SAMPLES = 1000
+HEDGE_MIN_TIMING_SAMPLES = 50
+
 # List of entry points for mandatory middlewares.
 #
 # Fields:
@@ -112,6 +121,25 @@ class Application(object):
         self.recheck_account_existence = \
             int(conf.get('recheck_account_existence',
                          DEFAULT_RECHECK_ACCOUNT_EXISTENCE))
+        # account and container info is also kept in a small worker-local
+        # cache in front of memcache; it is disabled by default
+        info_cache_size = int(conf.get('local_info_cache_size', 0))
+        if info_cache_size > 0:
+            self.info_cache = LRUCache(
+                maxsize=info_cache_size,
+                maxtime=float(conf.get('local_info_cache_ttl', 1)))
+        else:
+            self.info_cache = None
+        # keep-alive connections to the backend servers may be pooled and
+        # reused by later requests without a body; disabled by default
+        if config_true_value(conf.get('backend_keepalive', 'no')):
+            self.backend_pool = ConnectionPool(
+                max_idle_per_node=int(
+                    conf.get('backend_max_idle_per_node', 8)),
+                idle_timeout=float(conf.get('backend_idle_timeout', 30)),
+                logger=self.logger)
+        else:
+            self.backend_pool = None
         self.allow_account_management = \
             config_true_value(conf.get('allow_account_management', 'no'))
         self.container_ring = container_ring or Ring(swift_dir,
@@ -152,10 +180,51 @@ class Application(object):
         self.node_timings = {}
         self.timing_expiry = int(conf.get('timing_expiry', 300))
         self.sorting_method = conf.get('sorting_method', 'shuffle').lower()
+        self._node_latencies = {}
+        self.latency_smoothing = float(conf.get('latency_smoothing', 0.3))
+        if not 0 < self.latency_smoothing <= 1:
+            raise ValueError('latency_smoothing must be greater than 0 and '
+                             'at most 1')
         self.concurrent_gets = \
             config_true_value(conf.get('concurrent_gets'))
         self.concurrency_timeout = float(conf.get('concurrency_timeout',
                                                   self.conn_timeout))
+        # a sample of requests may be traced, recording where their time
+        # went in the proxy-logging access log line; disabled by default
+        self.trace_sample_rate = float(conf.get('trace_sample_rate', 0))
+        if not 0 <= self.trace_sample_rate <= 1:
+            raise ValueError('trace_sample_rate must be between 0 and 1')
+        self.trace_response_header = config_true_value(
+            conf.get('trace_response_header', 'no'))
+        # EC PUT data may be encoded a batch of segments at a time, off the
+        # eventlet hub in a native thread
+        self.ec_encode_batch_segments = \
+            int(conf.get('ec_encode_batch_segments', 1))
+        if self.ec_encode_batch_segments < 1:
+            raise ValueError('ec_encode_batch_segments must be at least 1')
+        self.ec_encode_in_threadpool = config_true_value(
+            conf.get('ec_encode_in_threadpool', 'no'))
+        self.ec_decode_read_ahead_segments = \
+            int(conf.get('ec_decode_read_ahead_segments', 1))
+        if self.ec_decode_read_ahead_segments < 1:
+            raise ValueError(
+                'ec_decode_read_ahead_segments must be at least 1')
+        self.ec_decode_in_threadpool = config_true_value(
+            conf.get('ec_decode_in_threadpool', 'no'))
+        self.ec_data_fragments_first = config_true_value(
+            conf.get('ec_data_fragments_first', 'no'))
+        self.shard_listing_concurrency = \
+            int(conf.get('shard_listing_concurrency', 1))
+        if self.shard_listing_concurrency < 1:
+            raise ValueError('shard_listing_concurrency must be at least 1')
+        self.hedged_gets = config_true_value(conf.get('hedged_gets'))
+        self.hedge_percentile = float(conf.get('hedge_percentile', 95))
+        if not 0 < self.hedge_percentile <= 100:
+            raise ValueError('hedge_percentile must be greater than 0 and '
+                             'at most 100')
+        self._get_timings = deque(maxlen=HEDGE_TIMING_SAMPLES)
+        self._hedge_delay = None
+        self._new_get_timings = 0
         value = conf.get('request_node_count', '2 * replicas').lower().split()
         if len(value) == 1:
             rnc_value = int(value[0])
@@ -387,6 +456,9 @@ class Application(object):
                 return HTTPMethodNotAllowed(request=req, headers={
                     'Allow': ', '.join(controller.allowed_methods)})
             handler = getattr(controller, req.method)
+            if self.trace_sample_rate and \
+                    random() < self.trace_sample_rate:
+                req.environ.setdefault('swift.trace', RequestTrace())
 
             old_authorize = None
             if 'swift.authorize' in req.environ:
@@ -395,7 +467,8 @@ class Application(object):
                 # again. If not authorized, we return the denial unless the
                 # controller's method indicates it'd like to gather more
                 # information and try again later.
-                resp = req.environ['swift.authorize'](req)
+                with trace_span(req.environ, 'authorize'):
+                    resp = req.environ['swift.authorize'](req)
                 if not resp:
                     # No resp means authorized, no delayed recheck required.
                     old_authorize = req.environ['swift.authorize']
@@ -408,10 +481,20 @@ class Application(object):
             # gets mutated during handling.  This way logging can display the
             # method the client actually sent.
             req.environ.setdefault('swift.orig_req_method', req.method)
+            # reseller admins are shown the trace of every request
+            show_trace = self.trace_response_header and \
+                req.environ.get('reseller_request') is True
+            if show_trace:
+                req.environ.setdefault('swift.trace', RequestTrace())
             try:
                 if old_authorize:
                     req.environ.pop('swift.authorize', None)
-                return handler(req)
+                with trace_span(req.environ, 'handler'):
+                    resp = handler(req)
+                if show_trace:
+                    resp.headers['X-Proxy-Trace'] = \
+                        str(req.environ['swift.trace'])
+                return resp
             finally:
                 if old_authorize:
                     req.environ['swift.authorize'] = old_authorize
@@ -426,7 +509,10 @@ class Application(object):
         Sorts nodes in-place (and returns the sorted list) according to
         the configured strategy. The default "sorting" is to randomly
         shuffle the nodes. If the "timing" strategy is chosen, the nodes
-        are sorted according to the stored timing data.
+        are sorted according to the stored timing data. If the "latency"
+        strategy is chosen, the nodes are ordered by their expected latency
+        using power-of-two-choices, so the slowest node always goes last
+        but the fastest doesn't take every request.
         '''
         # In the case of timing sorting, shuffling ensures that close timings
         # (ie within the rounding resolution) won't prefer one over another.
@@ -441,6 +527,17 @@ class Application(object):
             nodes.sort(key=key_func)
         elif self.sorting_method == 'affinity':
             nodes.sort(key=self.read_affinity_sort_key)
+        elif self.sorting_method == 'latency':
+            now = time()
+            remaining = [(self._expected_latency(node, now), node)
+                         for node in nodes]
+            del nodes[:]
+            while len(remaining) > 1:
+                # the better of two randomly chosen nodes goes next; the
+                # loser is compared again with another random node
+                index = 0 if remaining[0][0] <= remaining[1][0] else 1
+                nodes.append(remaining.pop(index)[1])
+            nodes.extend(node for _junk, node in remaining)
         return nodes
 
     def set_node_timing(self, node, timing):
@@ -450,6 +547,97 @@ class Application(object):
         timing = round(timing, 3)  # sort timings to the millisecond
         self.node_timings[node['ip']] = (timing, now + self.timing_expiry)
 
+    def record_get_timing(self, timing):
+        """
+        Note how long an object GET or HEAD took to get response headers
+        from a node; used to pick the delay before hedging requests.
+
+        :param timing: seconds from starting the request until the response
+                       headers were read
+        """
+        if not self.hedged_gets:
+            return
+        self._get_timings.append(timing)
+        self._new_get_timings += 1
+
+    def get_hedge_delay(self):
+        """
+        :returns: how long to wait for a node to respond to an object GET or
+                  HEAD before sending the request to another node as well:
+                  the hedge_percentile of recent response times, or
+                  concurrency_timeout until enough have been seen
+        """
+        if len(self._get_timings) < HEDGE_MIN_TIMING_SAMPLES:
+            return self.concurrency_timeout
+        if self._hedge_delay is None or \
+                self._new_get_timings >= HEDGE_MIN_TIMING_SAMPLES:
+            timings = sorted(self._get_timings)
+            index = int(math.ceil(
+                len(timings) * self.hedge_percentile / 100.0)) - 1
+            self._hedge_delay = timings[max(0, index)]
+            self._new_get_timings = 0
+        return self._hedge_delay
+
+    def _expected_latency(self, node, now):
+        """
+        Estimate how long a request to the node will take, from the moving
+        average of its recent response times and the requests this worker
+        already has outstanding to it. Nodes without recent samples are
+        estimated at 0 so they get tried.
+        """
+        stats = self._node_latencies.get(self._error_limit_node_key(node))
+        if not stats or stats['last_sample'] + self.timing_expiry < now:
+            return 0.0
+        return stats['latency'] * (stats['outstanding'] + 1)
+
+    def start_node_request(self, node):
+        """
+        Note that a request to a node has been started; used by the
+        "latency" sorting method.
+
+        :param node: dictionary of the node the request is sent to
+        """
+        if self.sorting_method != 'latency':
+            return
+        node_key = self._error_limit_node_key(node)
+        stats = self._node_latencies.setdefault(
+            node_key, {'latency': 0.0, 'outstanding': 0, 'last_sample': 0})
+        stats['outstanding'] += 1
+
+    def end_node_request(self, node, latency):
+        """
+        Note that a request to a node has finished and fold its latency into
+        the node's exponentially weighted moving average; used by the
+        "latency" sorting method.
+
+        :param node: dictionary of the node the request was sent to
+        :param latency: seconds from starting the request until the
+                        response headers were read
+        """
+        if self.sorting_method != 'latency':
+            return
+        stats = self._node_latencies.get(self._error_limit_node_key(node))
+        if stats is None:
+            return
+        stats['outstanding'] = max(0, stats['outstanding'] - 1)
+        now = time()
+        if stats['last_sample'] + self.timing_expiry < now:
+            stats['latency'] = latency
+        else:
+            stats['latency'] += \
+                self.latency_smoothing * (latency - stats['latency'])
+        stats['last_sample'] = now
+
+    def get_node_latencies(self):
+        """
+        :returns: a dict mapping "ip:port/device" to the node's moving
+                  average latency and outstanding requests
+        """
+        return dict(
+            (node_key, {'latency': round(stats['latency'], 6),
+                        'outstanding': stats['outstanding']})
+            for node_key, stats in self._node_latencies.items())
+
     def _error_limit_node_key(self, node):
         return "{ip}:{port}/{device}".format(**node)
 
@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+# Copyright (c) 2010-2016 OpenStack Foundation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Measure the CPU time spent merging large batches of rows into a container
+DB, with the DB hash folded in per batch (the default) and, for comparison,
+one row at a time by the DB's triggers.
+
+Usage: db_merge.py [--rows N] [--batch N] [--repeat N]
+"""
+
+from contextlib import contextmanager
+from optparse import OptionParser
+import os
+import shutil
+import tempfile
+import time
+
+from swift.common.db import chexor, chexor_batch
+from swift.common.utils import Timestamp
+from swift.container.backend import ContainerBroker
+
+
+@contextmanager
+def _per_row_hash_updates(conn):
+    yield
+
+
+def make_items(start, count, timestamp):
+    return [{'name': 'a/c/obj-%08d' % i,
+             'created_at': Timestamp(timestamp + i).internal,
+             'size': i, 'content_type': 'application/octet-stream',
+             'etag': 'd41d8cd98f00b204e9800998ecf8427e', 'deleted': 0,
+             'storage_policy_index': 0}
+            for i in range(start, start + count)]
+
+
+def time_merges(db_dir, rows, batch, per_row):
+    broker = ContainerBroker(os.path.join(db_dir, 'bench.db'),
+                             account='a', container='c')
+    broker.initialize(Timestamp(1).internal, 0)
+    if per_row:
+        broker._batched_hash_updates = _per_row_hash_updates
+    elapsed = 0.0
+    # insert every row, then overwrite every row, which deletes the old ones
+    for timestamp in (1, rows + 1):
+        for start in range(0, rows, batch):
+            items = make_items(start, min(batch, rows - start), timestamp)
+            begin = time.clock()
+            broker.merge_items(items)
+            elapsed += time.clock() - begin
+    info = broker.get_replication_info()
+    os.unlink(broker.db_file)
+    return elapsed, info['hash']
+
+
+def time_hash_folds(rows):
+    items = [('a/c/obj-%08d' % i, Timestamp(i).internal)
+             for i in range(rows)]
+    begin = time.clock()
+    hash_ = '0' * 32
+    for name, timestamp in items:
+        hash_ = chexor(hash_, name, timestamp)
+    per_row = time.clock() - begin
+    begin = time.clock()
+    batched = chexor_batch('0' * 32, items)
+    assert batched == hash_
+    return per_row, time.clock() - begin
+
+
+def main():
+    parser = OptionParser(usage=__doc__.strip().splitlines()[-1])
+    parser.add_option('--rows', type='int', default=100000,
+                      help='rows to merge (default %default)')
+    parser.add_option('--batch', type='int', default=10000,
+                      help='rows per merge_items call (default %default)')
+    parser.add_option('--repeat', type='int', default=3,
+                      help='best of this many runs (default %default)')
+    options, args = parser.parse_args()
+
+    per_row, batched = time_hash_folds(options.rows)
+    print('chexor x %d: %.3fs, chexor_batch: %.3fs (%.1fx)' % (
+        options.rows, per_row, batched, per_row / batched))
+
+    db_dir = tempfile.mkdtemp()
+    try:
+        results = {}
+        hashes = set()
+        for per_row in (True, False):
+            runs = [time_merges(db_dir, options.rows, options.batch, per_row)
+                    for _ in range(options.repeat)]
+            results[per_row] = min(elapsed for elapsed, _ in runs)
+            hashes.update(hash_ for _, hash_ in runs)
+        # both ways of maintaining the hash agree
+        assert len(hashes) == 1
+        print('merge_items of %d rows in batches of %d, inserted then '
+              'overwritten:' % (options.rows, options.batch))
+        print('  per-row hash updates: %.3fs CPU' % results[True])
+        print('  batched hash updates: %.3fs CPU (%.0f%% less)' % (
+            results[False],
+            100.0 * (results[True] - results[False]) / results[True]))
+    finally:
+        shutil.rmtree(db_dir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+# Copyright (c) 2010-2016 OpenStack Foundation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Measure how fast a proxy worker erasure codes object uploads, feeding
+client-sized chunks through the proxy's chunk_transformer from a number of
+concurrent uploads, with segments encoded one at a time in the worker's own
+thread (the default) and in batches in the native thread pool.
+
+Usage: ec_encode.py [--size MB] [--uploads N] [--batch N] [--ec-type TYPE]
+"""
+
+from optparse import OptionParser
+import time
+
+import eventlet
+
+from swift.common.storage_policy import ECStoragePolicy
+from swift.proxy.controllers.obj import chunk_transformer
+
+CLIENT_CHUNK_SIZE = 65536
+
+
+def upload(policy, nstreams, size, batch_segments, encode_in_threadpool):
+    chunk = 'x' * CLIENT_CHUNK_SIZE
+    transformer = chunk_transformer(policy, nstreams, batch_segments,
+                                    encode_in_threadpool)
+    transformer.send(None)
+    sent = 0
+    while sent < size:
+        transformer.send(chunk)
+        sent += len(chunk)
+        # let the other uploads read their next chunk, as a worker reading
+        # from its clients' sockets would
+        eventlet.sleep()
+    transformer.send('')
+
+
+def time_uploads(policy, size, uploads, batch_segments,
+                 encode_in_threadpool):
+    nstreams = policy.ec_ndata + policy.ec_nparity
+    pool = eventlet.GreenPool(uploads)
+    begin = time.time()
+    for _ in range(uploads):
+        pool.spawn(upload, policy, nstreams, size, batch_segments,
+                   encode_in_threadpool)
+    pool.waitall()
+    return time.time() - begin
+
+
+def main():
+    parser = OptionParser(usage=__doc__.strip().splitlines()[-1])
+    parser.add_option('--size', type='int', default=1024,
+                      help='MB per upload (default %default)')
+    parser.add_option('--uploads', type='int', default=4,
+                      help='concurrent uploads (default %default)')
+    parser.add_option('--batch', type='int', default=4,
+                      help='segments per batch in the thread pool '
+                      '(default %default)')
+    parser.add_option('--ec-type', default='liberasurecode_rs_vand',
+                      help='EC scheme (default %default)')
+    options, args = parser.parse_args()
+
+    policy = ECStoragePolicy(0, 'bench', ec_type=options.ec_type,
+                             ec_ndata=10, ec_nparity=4)
+    size = options.size * 1024 * 1024
+    total_mb = options.size * options.uploads
+    print('%d uploads of %d MB, %s 10+4, %d byte segments:' % (
+        options.uploads, options.size, options.ec_type,
+        policy.ec_segment_size))
+    for batch_segments, encode_in_threadpool in (
+            (1, False), (options.batch, False), (1, True),
+            (options.batch, True)):
+        elapsed = time_uploads(policy, size, options.uploads,
+                               batch_segments, encode_in_threadpool)
+        print('  batch of %d, %s: %.1f MB/s' % (
+            batch_segments,
+            'thread pool' if encode_in_threadpool else 'in the worker',
+            total_mb / elapsed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+# Copyright (c) 2010-2016 OpenStack Foundation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Measure MemcacheRing against local stand-ins for memcached that answer
+after a simulated network delay: sets and gets with and without noreply,
+and a multi-key get of keys spread over every server, one key at a time
+and with get_multi() asking the servers in parallel.
+
+Usage: memcache_client.py [--ops N] [--servers N] [--latency SECONDS]
+"""
+
+from optparse import OptionParser
+import time
+
+import eventlet
+from eventlet.green import socket
+
+from swift.common.memcached import MemcacheRing
+
+
+def serve_memcached(sock, latency):
+    """
+    A memcached stand-in for the text protocol's set, get and delete that
+    waits latency seconds before sending each reply.
+    """
+    cache = {}
+
+    def handle(conn):
+        fp = conn.makefile()
+        while True:
+            line = fp.readline()
+            if not line:
+                break
+            parts = line.split()
+            reply = None
+            if parts[0] == 'set':
+                value = fp.read(int(parts[4]) + 2)[:-2]
+                cache[parts[1]] = (parts[2], value)
+                reply = 'STORED\r\n'
+            elif parts[0] == 'get':
+                reply = ''.join(
+                    'VALUE %s %s %d\r\n%s\r\n' % (
+                        key, cache[key][0], len(cache[key][1]),
+                        cache[key][1])
+                    for key in parts[1:] if key in cache) + 'END\r\n'
+            elif parts[0] == 'delete':
+                reply = ('DELETED\r\n' if cache.pop(parts[1], None)
+                         else 'NOT_FOUND\r\n')
+            if reply and parts[-1] != 'noreply':
+                eventlet.sleep(latency)
+                fp.write(reply)
+                fp.flush()
+        conn.close()
+
+    while True:
+        conn, _junk = sock.accept()
+        eventlet.spawn(handle, conn)
+
+
+def start_servers(count, latency):
+    servers = []
+    for _junk in range(count):
+        sock = socket.socket()
+        sock.bind(('127.0.0.1', 0))
+        sock.listen(50)
+        eventlet.spawn(serve_memcached, sock, latency)
+        servers.append('127.0.0.1:%d' % sock.getsockname()[1])
+    return servers
+
+
+def time_sets_and_gets(servers, ops, noreply):
+    memcache = MemcacheRing(servers, noreply=noreply)
+    begin = time.time()
+    for i in range(ops):
+        memcache.set('key-%d' % i, {'count': i})
+    for i in range(ops):
+        assert memcache.get('key-%d' % i) == {'count': i}
+    return time.time() - begin
+
+
+def time_multi_key_get(servers, ops, keys_per_get, parallel):
+    memcache = MemcacheRing(servers)
+    keys = ['key-%d' % i for i in range(keys_per_get)]
+    for key in keys:
+        memcache.set(key, key)
+    begin = time.time()
+    for _junk in range(ops // keys_per_get):
+        if parallel:
+            values = memcache.get_multi(keys)
+        else:
+            values = [memcache.get(key) for key in keys]
+        assert values == keys
+    return time.time() - begin
+
+
+def main():
+    parser = OptionParser(usage=__doc__.strip().splitlines()[-1])
+    parser.add_option('--ops', type='int', default=2000,
+                      help='sets and gets to make (default %default)')
+    parser.add_option('--servers', type='int', default=4,
+                      help='memcached stand-ins (default %default)')
+    parser.add_option('--latency', type='float', default=0.0005,
+                      help='delay before each reply (default %default)')
+    options, args = parser.parse_args()
+
+    servers = start_servers(options.servers, options.latency)
+    print('%d memcached stand-ins answering after %.1fms:' % (
+        options.servers, options.latency * 1000))
+    for noreply in (False, True):
+        elapsed = time_sets_and_gets(servers, options.ops, noreply)
+        print('  %d sets then gets, noreply %s: %.0f ops/s' % (
+            options.ops, 'on' if noreply else 'off',
+            2 * options.ops / elapsed))
+    for parallel in (False, True):
+        elapsed = time_multi_key_get(servers, options.ops, 16, parallel)
+        print('  %d keys read 16 at a time, %s: %.0f keys/s' % (
+            options.ops,
+            'get_multi() in parallel' if parallel else 'one get() each',
+            options.ops / elapsed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+# Copyright (c) 2010-2016 OpenStack Foundation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Measure how fast an object server worker reads large objects off disk while
+it also serves small ones, and how long the small GETs wait behind the large,
+with the default reads, with read-ahead hints, with reads in the thread pool
+and with both. The objects are dropped from the page cache before each run.
+
+Usage: object_get.py [--large MB] [--large-gets N] [--small-gets N] [options]
+"""
+
+from hashlib import md5
+from optparse import OptionParser
+import os
+import shutil
+import tempfile
+import time
+
+import eventlet
+
+from swift.common import utils
+from swift.common.storage_policy import POLICIES
+from swift.common.utils import Timestamp, drop_buffer_cache
+from swift.obj.diskfile import DiskFileManager
+
+SMALL_SIZE = 4096
+
+
+def make_object(mgr, name, size):
+    df = mgr.get_diskfile('sda', '0', 'a', 'c', name, POLICIES.legacy)
+    data = os.urandom(min(size, 1024 * 1024))
+    timestamp = Timestamp(time.time())
+    with df.create(size=size) as writer:
+        etag = md5()
+        written = 0
+        while written < size:
+            chunk = data[:size - written]
+            writer.write(chunk)
+            etag.update(chunk)
+            written += len(chunk)
+        writer.put({'ETag': etag.hexdigest(),
+                    'X-Timestamp': timestamp.internal,
+                    'Content-Length': str(size)})
+        writer.commit(timestamp)
+    return name
+
+
+def evict(mgr, names):
+    for name in names:
+        df = mgr.get_diskfile('sda', '0', 'a', 'c', name, POLICIES.legacy)
+        with df.open():
+            drop_buffer_cache(df._fp.fileno(), 0,
+                              os.fstat(df._fp.fileno()).st_size)
+
+
+def get(mgr, name, latencies=None):
+    begin = time.time()
+    df = mgr.get_diskfile('sda', '0', 'a', 'c', name, POLICIES.legacy)
+    with df.open():
+        reader = df.reader()
+    size = 0
+    for chunk in reader:
+        size += len(chunk)
+        # let the other GETs have a turn, as sending to a client would
+        eventlet.sleep()
+    if latencies is not None:
+        latencies.append(time.time() - begin)
+    return size
+
+
+def time_gets(mgr, large_names, small_names):
+    latencies = []
+    pool = eventlet.GreenPool(len(large_names) + 1)
+    begin = time.time()
+    large_gets = [pool.spawn(get, mgr, name) for name in large_names]
+
+    def small_gets():
+        for name in small_names:
+            get(mgr, name, latencies)
+            eventlet.sleep(0.001)
+    pool.spawn(small_gets)
+    large_bytes = sum(gt.wait() for gt in large_gets)
+    elapsed = time.time() - begin
+    pool.waitall()
+    latencies.sort()
+    return (large_bytes / elapsed / 1024 / 1024,
+            latencies[len(latencies) // 2] * 1000,
+            latencies[int(len(latencies) * 0.99)] * 1000)
+
+
+def main():
+    parser = OptionParser(usage=__doc__.strip().splitlines()[-1])
+    parser.add_option('--devices', default=None,
+                      help='directory to put the objects in (default a '
+                      'temporary directory)')
+    parser.add_option('--large', type='int', default=64,
+                      help='MB per large object (default %default)')
+    parser.add_option('--large-gets', type='int', default=4,
+                      help='concurrent large GETs (default %default)')
+    parser.add_option('--small-gets', type='int', default=200,
+                      help='small GETs, one after another (default '
+                      '%default)')
+    parser.add_option('--read-ahead', type='int', default=4096,
+                      help='disk_read_ahead_size in KB (default %default)')
+    parser.add_option('--threadpool-read', type='int', default=1024,
+                      help='disk_threadpool_read_size in KB (default '
+                      '%default)')
+    options, args = parser.parse_args()
+
+    utils.HASH_PATH_SUFFIX = 'bench'
+    devices = tempfile.mkdtemp(dir=options.devices)
+    try:
+        os.mkdir(os.path.join(devices, 'sda'))
+        mgr = DiskFileManager({'devices': devices, 'mount_check': 'false'},
+                              utils.get_logger({}))
+        large_names = [make_object(mgr, 'large-%d' % i,
+                                   options.large * 1024 * 1024)
+                       for i in range(options.large_gets)]
+        small_names = [make_object(mgr, 'small-%d' % i, SMALL_SIZE)
+                       for i in range(options.small_gets)]
+        print('%d GETs of %d MB objects, with %d GETs of %d byte objects:' % (
+            options.large_gets, options.large, options.small_gets,
+            SMALL_SIZE))
+        for read_ahead, threadpool_read in (
+                (0, 0), (options.read_ahead, 0),
+                (0, options.threadpool_read),
+                (options.read_ahead, options.threadpool_read)):
+            mgr.disk_read_ahead_size = read_ahead * 1024
+            mgr.disk_threadpool_read_size = threadpool_read * 1024
+            evict(mgr, large_names + small_names)
+            rate, p50, p99 = time_gets(mgr, large_names, small_names)
+            print('  read-ahead %5d KB, thread pool reads %5d KB: '
+                  '%7.1f MB/s, small GETs p50 %6.2f ms p99 %6.2f ms' % (
+                      read_ahead, threadpool_read, rate, p50, p99))
+    finally:
+        shutil.rmtree(devices, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+# Copyright (c) 2010-2016 OpenStack Foundation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+Measure the CPU time spent on timestamps: parsing and sorting them one at a
+time and with parse_timestamps, merging rows with content-type and metadata
+timestamps into a container DB, and cleaning up hash dirs with several files
+each.
+
+Usage: timestamps.py [--count N] [--rows N] [--dirs N] [--repeat N]
+"""
+
+from optparse import OptionParser
+import os
+import shutil
+import tempfile
+import time
+
+from swift.common import utils
+from swift.common.utils import Timestamp, encode_timestamps, \
+    parse_timestamps
+from swift.container.backend import ContainerBroker
+from swift.obj.diskfile import DiskFileManager
+
+BASE_TIME = 1402444821.72589
+
+
+def best_of(repeat, func, *args):
+    times = []
+    for _ in range(repeat):
+        begin = time.clock()
+        func(*args)
+        times.append(time.clock() - begin)
+    return min(times)
+
+
+def time_parsing(count, repeat):
+    values = [Timestamp(BASE_TIME + i * 0.00037, offset=i % 3).internal
+              for i in range(count)]
+    one_at_a_time = best_of(
+        repeat, lambda: sorted(Timestamp(value) for value in values))
+    batched = best_of(repeat, lambda: sorted(parse_timestamps(values)))
+    return one_at_a_time, batched
+
+
+def make_items(rows, timestamp):
+    items = []
+    for i in range(rows):
+        ts_data = Timestamp(timestamp + i)
+        ts_meta = Timestamp(ts_data, delta=i % 7)
+        items.append({'name': 'a/c/obj-%08d' % i,
+                      'created_at': encode_timestamps(ts_data, ts_meta,
+                                                      ts_meta),
+                      'size': i, 'content_type': 'application/octet-stream',
+                      'etag': 'd41d8cd98f00b204e9800998ecf8427e',
+                      'deleted': 0, 'storage_policy_index': 0})
+    return items
+
+
+def time_merges(db_dir, rows, repeat):
+    times = []
+    for _ in range(repeat):
+        broker = ContainerBroker(os.path.join(db_dir, 'bench.db'),
+                                 account='a', container='c')
+        broker.initialize(Timestamp(1).internal, 0)
+        elapsed = 0.0
+        # insert every row, then merge older and newer copies of every row,
+        # which compares the timestamps of each with the existing one
+        for timestamp in (BASE_TIME, BASE_TIME - rows, BASE_TIME + rows):
+            items = make_items(rows, timestamp)
+            begin = time.clock()
+            broker.merge_items(items)
+            elapsed += time.clock() - begin
+        os.unlink(broker.db_file)
+        times.append(elapsed)
+    return min(times)
+
+
+def make_hash_dirs(devices, dirs):
+    hash_dirs = []
+    for i in range(dirs):
+        hash_dir = os.path.join(devices, 'sda', 'objects', '0', 'abc',
+                                '%032x' % i)
+        os.makedirs(hash_dir)
+        # an overwritten .data and its .meta, the current .data and two
+        # .metas, of which only the newest is kept
+        for offset, ext in ((0, '.data'), (1, '.meta'), (2, '.data'),
+                            (3, '.meta'), (4, '.meta')):
+            open(os.path.join(hash_dir, Timestamp(
+                BASE_TIME + i + offset).internal + ext), 'w').close()
+        hash_dirs.append(hash_dir)
+    return hash_dirs
+
+
+def time_cleanups(devices, dirs, repeat):
+    mgr = DiskFileManager({'devices': devices, 'mount_check': 'false'},
+                          utils.get_logger({}))
+    times = []
+    for _ in range(repeat):
+        hash_dirs = make_hash_dirs(devices, dirs)
+        begin = time.clock()
+        for hash_dir in hash_dirs:
+            mgr.cleanup_ondisk_files(hash_dir)
+        times.append(time.clock() - begin)
+        shutil.rmtree(os.path.join(devices, 'sda'))
+    return min(times)
+
+
+def main():
+    parser = OptionParser(usage=__doc__.strip().splitlines()[-1])
+    parser.add_option('--count', type='int', default=100000,
+                      help='timestamps to parse and sort (default %default)')
+    parser.add_option('--rows', type='int', default=20000,
+                      help='rows to merge (default %default)')
+    parser.add_option('--dirs', type='int', default=10000,
+                      help='hash dirs to clean up (default %default)')
+    parser.add_option('--repeat', type='int', default=3,
+                      help='best of this many runs (default %default)')
+    options, args = parser.parse_args()
+
+    one_at_a_time, batched = time_parsing(options.count, options.repeat)
+    print('parse and sort %d timestamps: Timestamp(): %.3fs CPU, '
+          'parse_timestamps: %.3fs CPU' % (
+              options.count, one_at_a_time, batched))
+
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        print('merge_items of %d rows, inserted then merged twice: '
+              '%.3fs CPU' % (options.rows,
+                             time_merges(tmp_dir, options.rows,
+                                         options.repeat)))
+        print('cleanup_ondisk_files of %d hash dirs of 5 files: '
+              '%.3fs CPU' % (options.dirs,
+                             time_cleanups(tmp_dir, options.dirs,
+                                           options.repeat)))
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+if __name__ == '__main__':
+    main()
@@ -35,7 +35,7 @@ import base64
 from swift.account.backend import AccountBroker
 from swift.common.utils import Timestamp
 from test.unit import patch_policies, with_tempdir, make_timestamp_iter
-from swift.common.db import DatabaseConnectionError
+from swift.common.db import DatabaseConnectionError, chexor
 from swift.common.storage_policy import StoragePolicy, POLICIES
 
 from test.unit.common import test_db
@@ -766,6 +766,23 @@ class TestAccountBroker(unittest.TestCase):
         self.assertEqual(['a', 'b', 'c'],
                          sorted([rec['name'] for rec in items]))
 
+    def test_merge_items_hash(self):
+        broker = AccountBroker(':memory:', account='a')
+        broker.initialize(Timestamp('1').internal)
+        items = [{'name': name, 'put_timestamp': Timestamp(i).internal,
+                  'delete_timestamp': '0', 'object_count': i,
+                  'bytes_used': i, 'deleted': 0,
+                  'storage_policy_index': POLICIES.default.idx}
+                 for i, name in enumerate(('a', 'b', 'c', 'a'), 1)]
+        broker.merge_items(items)
+        expected = '0' * 32
+        for row in broker.get_items_since(-1, 1000):
+            expected = chexor(expected, row['name'], '-'.join(
+                str(row[key]) for key in ('put_timestamp', 'delete_timestamp',
+                                          'object_count', 'bytes_used')))
+        self.assertEqual(3, len(broker.get_items_since(-1, 1000)))
+        self.assertEqual(expected, broker.get_replication_info()['hash'])
+
     def test_merge_items_overwrite_unicode(self):
         snowman = u'\N{SNOWMAN}'.encode('utf-8')
         broker1 = AccountBroker(':memory:', account='a')
@@ -20,12 +20,13 @@ import unittest
 import mock
 from six.moves.configparser import NoSectionError, NoOptionError
 
+from swift.common import memcached
 from swift.common.middleware import memcache
 from swift.common.memcached import MemcacheRing
 from swift.common.swob import Request
 from swift.common.wsgi import loadapp
 
-from test.unit import with_tempdir, patch_policies
+from test.unit import with_tempdir, patch_policies, debug_logger
 
 
 class FakeApp(object):
@@ -159,6 +160,7 @@ class TestCacheMiddleware(unittest.TestCase):
         self.assertEqual(app.memcache_servers, '127.0.0.1:11211')
         self.assertEqual(app.memcache._allow_pickle, False)
         self.assertEqual(app.memcache._allow_unpickle, False)
+        self.assertEqual(app.memcache._noreply, '')
         self.assertEqual(
             app.memcache._client_cache['127.0.0.1:11211'].max_size, 2)
 
@@ -170,12 +172,14 @@ class TestCacheMiddleware(unittest.TestCase):
                 FakeApp(),
                 {'memcache_servers': '6.7.8.9:10',
                  'memcache_serialization_support': '0',
-                 'memcache_max_connections': '5'})
+                 'memcache_max_connections': '5',
+                 'noreply': 'yes'})
         finally:
             memcache.ConfigParser = orig_parser
         self.assertEqual(app.memcache_servers, '6.7.8.9:10')
         self.assertEqual(app.memcache._allow_pickle, True)
         self.assertEqual(app.memcache._allow_unpickle, True)
+        self.assertEqual(app.memcache._noreply, ' noreply')
         self.assertEqual(
             app.memcache._client_cache['6.7.8.9:10'].max_size, 5)
 
@@ -386,6 +390,64 @@ class TestCacheMiddleware(unittest.TestCase):
         self.assertEqual(memcache_ring._tries, 4)
         self.assertEqual(memcache_ring._io_timeout, 1.0)
 
+    def test_parse_servers(self):
+        self.assertEqual(
+            (['1.2.3.4:5', '[::1]:11211', '6.7.8.9'],
+             {'[::1]:11211': 2, '6.7.8.9': 3}),
+            memcache.parse_servers('1.2.3.4:5, [::1]:11211/2,,6.7.8.9/3'))
+        self.assertRaises(ValueError, memcache.parse_servers, '1.2.3.4/x')
+        self.assertRaises(ValueError, memcache.parse_servers, '1.2.3.4/0')
+
+    @with_tempdir
+    def test_reload_servers(self, tempdir):
+        conf_path = os.path.join(tempdir, 'memcache.conf')
+        with open(conf_path, 'w') as f:
+            f.write('[memcache]\nmemcache_servers = 1.2.3.4:5, 1.2.3.5:5\n')
+        app = memcache.MemcacheMiddleware(
+            FakeApp(), {'swift_dir': tempdir, 'reload_interval': '15'})
+        app.logger = debug_logger()
+        memcache_ring = app.memcache
+        self.assertEqual(['1.2.3.4:5', '1.2.3.5:5'],
+                         sorted(memcache_ring._client_cache))
+        req = Request.blank('/something')
+
+        with open(conf_path, 'w') as f:
+            f.write('[memcache]\nmemcache_servers = 1.2.3.5:5, '
+                    '1.2.3.6:5/2\n')
+        os.utime(conf_path, (0, 0))
+        # not until the interval is up
+        app(req.environ, start_response)
+        self.assertEqual(['1.2.3.4:5', '1.2.3.5:5'],
+                         sorted(memcache_ring._client_cache))
+        app.next_reload = 0
+        resp = app(req.environ, start_response)
+        self.assertIs(memcache_ring, resp['swift.cache'])
+        self.assertEqual(['1.2.3.5:5', '1.2.3.6:5'],
+                         sorted(memcache_ring._client_cache))
+        self.assertEqual(
+            2 * memcached.NODE_WEIGHT,
+            list(memcache_ring._ring.values()).count('1.2.3.6:5'))
+
+        # a bad file leaves the servers as they were
+        with open(conf_path, 'w') as f:
+            f.write('[memcache]\nmemcache_servers = 1.2.3.7:5/x\n')
+        os.utime(conf_path, (1, 1))
+        app.next_reload = 0
+        app(req.environ, start_response)
+        self.assertEqual(['1.2.3.5:5', '1.2.3.6:5'],
+                         sorted(memcache_ring._client_cache))
+        self.assertIn('Unable to reload memcache servers',
+                      app.logger.get_lines_for_level('error')[0])
+
+    def test_no_reload_of_inline_servers(self):
+        app = memcache.MemcacheMiddleware(
+            FakeApp(), {'memcache_servers': '1.2.3.4:5',
+                        'reload_interval': '15'})
+        app.next_reload = 0
+        with mock.patch.object(app, 'reload_servers') as mock_reload:
+            app(Request.blank('/something').environ, start_response)
+        self.assertFalse(mock_reload.called)
+
     @with_tempdir
     def test_real_memcache_config(self, tempdir):
         proxy_config = """
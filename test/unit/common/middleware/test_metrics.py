@@ -0,0 +1,105 @@
+# Copyright (c) 2010-2016 OpenStack Foundation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from swift.common import utils
+from swift.common.swob import Request, Response
+from swift.common.middleware import metrics
+
+
+class FakeApp(object):
+    def __call__(self, env, start_response):
+        req = Request(env)
+        return Response(request=req, body='FAKE APP')(
+            env, start_response)
+
+
+class TestMetrics(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.metrics_path = os.path.join(self.tempdir, 'metrics')
+        self.got_statuses = []
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir, ignore_errors=True)
+
+    def get_app(self, app, global_conf, **local_conf):
+        factory = metrics.filter_factory(global_conf, **local_conf)
+        return factory(app)
+
+    def start_response(self, status, headers):
+        self.got_statuses.append(status)
+
+    def test_metrics(self):
+        conf = {'log_metrics': 'yes', 'log_metrics_path': self.metrics_path}
+        logger = utils.get_logger(conf, 'proxy-server')
+        logger.increment('errors')
+        logger.timing('GET.timing', 12)
+        # another worker's snapshot
+        os.mkdir(self.metrics_path)
+        with open(os.path.join(self.metrics_path,
+                               '%d.json' % os.getppid()), 'w') as fp:
+            json.dump({'counters': {'proxy-server.errors': 2}}, fp)
+
+        app = self.get_app(FakeApp(), conf)
+        req = Request.blank('/metrics')
+        resp = req.get_response(app)
+        self.assertEqual(200, resp.status_int)
+        self.assertEqual('text/plain; version=0.0.4',
+                         resp.headers['Content-Type'])
+        lines = resp.body.splitlines()
+        self.assertIn('swift_proxy_server_errors 3', lines)
+        self.assertIn('swift_proxy_server_GET_timing_count 1', lines)
+        self.assertIn('swift_proxy_server_GET_timing_sum 12.000', lines)
+
+    def test_no_metrics(self):
+        app = self.get_app(FakeApp(), {},
+                           log_metrics_path=self.metrics_path)
+        resp = Request.blank('/metrics').get_response(app)
+        self.assertEqual(200, resp.status_int)
+        self.assertEqual('', resp.body)
+        self.assertFalse(os.path.exists(self.metrics_path))
+
+    def test_metrics_pass(self):
+        req = Request.blank('/', environ={'REQUEST_METHOD': 'GET'})
+        app = self.get_app(FakeApp(), {})
+        resp = app(req.environ, self.start_response)
+        self.assertEqual(['200 OK'], self.got_statuses)
+        self.assertEqual(resp, ['FAKE APP'])
+
+    def test_allowed_ips(self):
+        app = self.get_app(FakeApp(), {},
+                           log_metrics_path=self.metrics_path,
+                           allowed_ips='10.0.0.5, 10.0.0.6')
+        for addr in ('10.0.0.5', '10.0.0.6'):
+            req = Request.blank('/metrics', remote_addr=addr)
+            self.assertEqual(200, req.get_response(app).status_int)
+        req = Request.blank('/metrics', remote_addr='10.0.0.7')
+        self.assertEqual(403, req.get_response(app).status_int)
+        # other paths are not restricted
+        req = Request.blank('/', remote_addr='10.0.0.7')
+        resp = req.get_response(app)
+        self.assertEqual(200, resp.status_int)
+        self.assertEqual('FAKE APP', resp.body)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -23,6 +23,7 @@ from six.moves.urllib.parse import unquote
 from test.unit import FakeLogger
 from swift.common.utils import get_logger, split_path
 from swift.common.middleware import proxy_logging
+from swift.common.request_helpers import RequestTrace
 from swift.common.swob import Request, Response
 from swift.common import constraints
 from swift.common.storage_policy import StoragePolicy
@@ -803,6 +804,29 @@ class TestProxyLogging(unittest.TestCase):
         log_parts = self._log_parts(app)
         self.assertEqual(log_parts[17], 'one%2Cand%20two')
 
+    def test_log_info_trace(self):
+        app = proxy_logging.ProxyLoggingMiddleware(FakeApp(), {})
+        app.access_logger = FakeLogger()
+        req = Request.blank('/', environ={'REQUEST_METHOD': 'GET'})
+        req.environ['swift.log_info'] = ['one']
+        req.environ['swift.trace'] = RequestTrace()
+        req.environ['swift.trace'].add('authorize', 0.001)
+        req.environ['swift.trace'].add('handler', 0.25)
+        list(app(req.environ, start_response))
+        log_parts = self._log_parts(app)
+        self.assertEqual(
+            unquote(log_parts[17]),
+            'one,trace:authorize:0.0010/handler:0.2500')
+        self.assertEqual(['one'], req.environ['swift.log_info'])
+
+        # an empty trace isn't logged
+        app.access_logger = FakeLogger()
+        req = Request.blank('/', environ={'REQUEST_METHOD': 'GET'})
+        req.environ['swift.trace'] = RequestTrace()
+        list(app(req.environ, start_response))
+        log_parts = self._log_parts(app)
+        self.assertEqual(log_parts[17], '-')
+
     def test_log_auth_token(self):
         auth_token = 'b05bf940-0464-4c0e-8c70-87717d2d73e8'
 
@@ -23,6 +23,8 @@ from eventlet import spawn, Timeout, listen
 
 from swift.common import bufferedhttp
 
+from test.unit import debug_logger
+
 
 class MockHTTPSConnection(object):
 
@@ -95,6 +97,158 @@ class TestBufferedHTTP(unittest.TestCase):
                 if err:
                     raise Exception(err)
 
+    def _serve(self, bindsock, responses_per_conn):
+        # answers requests on each accepted connection in turn, then closes
+        # it; returns the request lines seen on each connection
+        seen = []
+        try:
+            with Timeout(3):
+                for count in responses_per_conn:
+                    sock, addr = bindsock.accept()
+                    fp = sock.makefile()
+                    requests = []
+                    for _ in range(count):
+                        requests.append(fp.readline())
+                        line = fp.readline()
+                        while line and line != '\r\n':
+                            requests.append(line.split(':')[0].lower())
+                            line = fp.readline()
+                        fp.write('HTTP/1.1 200 OK\r\nContent-Length: 8\r\n'
+                                 '\r\nRESPONSE')
+                        fp.flush()
+                    seen.append(requests)
+                    fp.close()
+                    sock.close()
+        except BaseException as err:
+            return err
+        return seen
+
+    def test_connection_pool_reuses_connections(self):
+        bindsock = listen(('127.0.0.1', 0))
+        port = bindsock.getsockname()[1]
+        event = spawn(self._serve, bindsock, [2])
+        logger = debug_logger()
+        pool = bufferedhttp.ConnectionPool(logger=logger)
+        bodies = []
+        with Timeout(3):
+            for path in ('/a', '/b'):
+                conn = bufferedhttp.http_connect(
+                    '127.0.0.1', port, 'dev', 1, 'GET', path,
+                    {'Connection': 'close'}, pool=pool)
+                resp = conn.getresponse()
+                bodies.append(resp.read())
+        seen = event.wait()
+        if isinstance(seen, BaseException):
+            raise Exception(seen)
+        self.assertEqual(['RESPONSE', 'RESPONSE'], bodies)
+        # both requests went over the one connection, without the header
+        # that would have made the server close it
+        self.assertEqual(['GET /dev/1/a HTTP/1.1\r\n',
+                          'GET /dev/1/b HTTP/1.1\r\n'],
+                         [line for line in seen[0] if line.startswith('GET')])
+        self.assertNotIn('connection', seen[0])
+        self.assertEqual((1, 1), (pool.hits, pool.misses))
+        self.assertEqual({'backend_pool.hit': 1, 'backend_pool.miss': 1},
+                         logger.get_increment_counts())
+        pool.close()
+
+    def test_connection_pool_replays_on_closed_connection(self):
+        bindsock = listen(('127.0.0.1', 0))
+        port = bindsock.getsockname()[1]
+        # the server closes the first connection after one request
+        event = spawn(self._serve, bindsock, [1, 1])
+        pool = bufferedhttp.ConnectionPool()
+        bodies = []
+        with Timeout(3):
+            for path in ('/a', '/b'):
+                conn = bufferedhttp.http_connect(
+                    '127.0.0.1', port, 'dev', 1, 'HEAD', path, pool=pool)
+                resp = conn.getresponse()
+                bodies.append(resp.read())
+                self.assertEqual(200, resp.status)
+        seen = event.wait()
+        if isinstance(seen, BaseException):
+            raise Exception(seen)
+        self.assertEqual(['', ''], bodies)
+        self.assertEqual(['HEAD /dev/1/a HTTP/1.1\r\n'], seen[0][:1])
+        self.assertEqual(['HEAD /dev/1/b HTTP/1.1\r\n'], seen[1][:1])
+        self.assertEqual(1, pool.hits)
+
+    def test_connection_pool_only_replays_reads(self):
+        bindsock = listen(('127.0.0.1', 0))
+        port = bindsock.getsockname()[1]
+        # the server closes the connection after one request
+        event = spawn(self._serve, bindsock, [1])
+        pool = bufferedhttp.ConnectionPool()
+        with Timeout(3):
+            conn = bufferedhttp.http_connect(
+                '127.0.0.1', port, 'dev', 1, 'HEAD', '/a', pool=pool)
+            resp = conn.getresponse()
+            resp.read()
+            resp.close()
+            seen = event.wait()
+            if isinstance(seen, BaseException):
+                raise Exception(seen)
+            # a DELETE may have been acted upon, so it isn't sent again
+            conn = bufferedhttp.http_connect(
+                '127.0.0.1', port, 'dev', 1, 'DELETE', '/a', pool=pool)
+            self.assertTrue(conn._reused)
+            self.assertRaises((bufferedhttp.httplib.BadStatusLine,
+                               socket.error),
+                              conn.getresponse)
+        bindsock.close()
+
+    def test_connection_pool_response_not_read_is_not_pooled(self):
+        pool = bufferedhttp.ConnectionPool()
+        conn = pool.connect('127.0.0.1', 6200)
+        resp = bufferedhttp.BufferedHTTPResponse(mock.MagicMock())
+        resp._pooled_conn = conn
+        resp.will_close = False
+        resp.chunked = False
+        resp.length = 8
+        self.assertFalse(resp.reusable)
+        resp.close()
+        self.assertEqual({}, pool._idle)
+        resp.length = 0
+        self.assertFalse(resp.reusable)  # already closed
+        resp._pooled_conn = conn
+        self.assertTrue(resp.reusable)
+        resp.will_close = True
+        self.assertFalse(resp.reusable)
+
+    def test_connection_pool_limits_and_reaping(self):
+        pool = bufferedhttp.ConnectionPool(max_idle_per_node=2,
+                                           idle_timeout=10)
+        conns = [pool.connect('127.0.0.1', 6200) for _ in range(3)]
+        for conn in conns:
+            conn.sock = mock.MagicMock()
+        with mock.patch('swift.common.bufferedhttp.time.time',
+                        return_value=100):
+            for conn in conns:
+                pool.put(conn)
+        # only max_idle_per_node are kept
+        self.assertEqual([conns[0], conns[1]],
+                         [c for t, c in pool._idle[('127.0.0.1', 6200)]])
+        self.assertIsNone(conns[2].sock)
+        with mock.patch('swift.common.bufferedhttp.time.time',
+                        return_value=105):
+            self.assertIs(conns[1], pool.get('127.0.0.1', 6200))
+            pool.put(conns[1])
+        # idle connections are reaped once they time out
+        with mock.patch('swift.common.bufferedhttp.time.time',
+                        return_value=112):
+            pool.reap()
+        self.assertEqual([conns[1]],
+                         [c for t, c in pool._idle[('127.0.0.1', 6200)]])
+        self.assertIsNone(conns[0].sock)
+        with mock.patch('swift.common.bufferedhttp.time.time',
+                        return_value=120):
+            conn = pool.get('127.0.0.1', 6200)
+        self.assertNotIn(conn, conns)
+        self.assertIsNone(conns[1].sock)
+        self.assertFalse(pool._idle[('127.0.0.1', 6200)])
+        self.assertEqual((1, 1), (pool.hits, pool.misses))
+
     def test_nonstr_header_values(self):
         origHTTPSConnection = bufferedhttp.HTTPSConnection
         bufferedhttp.HTTPSConnection = MockHTTPSConnection
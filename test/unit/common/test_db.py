@@ -36,9 +36,9 @@ from six.moves import range
 import swift.common.db
 from swift.common.constraints import \
     MAX_META_VALUE_LENGTH, MAX_META_COUNT, MAX_META_OVERALL_SIZE
-from swift.common.db import chexor, dict_factory, get_db_connection, \
-    DatabaseBroker, DatabaseConnectionError, DatabaseAlreadyExists, \
-    GreenDBConnection, PICKLE_PROTOCOL
+from swift.common.db import chexor, chexor_batch, dict_factory, \
+    get_db_connection, DatabaseBroker, DatabaseConnectionError, \
+    DatabaseAlreadyExists, GreenDBConnection, PICKLE_PROTOCOL
 from swift.common.utils import normalize_timestamp, mkdirs, Timestamp
 from swift.common.exceptions import LockTimeout
 from swift.common.swob import HTTPException
@@ -117,6 +117,21 @@ class TestChexor(unittest.TestCase):
 
         self.assertEqual(hash_, other_hash)
 
+    def test_chexor_batch(self):
+        ts = (normalize_timestamp(ts) for ts in
+              itertools.count(int(time.time())))
+        objects = [('frank', next(ts)), (u'\u2603', next(ts)),
+                   ('bob', next(ts)), ('frank', next(ts))]
+        old = 'd41d8cd98f00b204e9800998ecf8427e'
+        hash_ = old
+        for obj in objects:
+            hash_ = chexor(hash_, *obj)
+        self.assertEqual(hash_, chexor_batch(old, objects))
+        self.assertEqual(hash_, chexor_batch(old, reversed(objects)))
+        self.assertEqual(old, chexor_batch(old, []))
+        self.assertEqual('0' * 32, chexor_batch('0', objects * 2))
+        self.assertRaises(Exception, chexor_batch, old, [(None, next(ts))])
+
 
 class TestGreenDBConnection(unittest.TestCase):
 
@@ -1015,6 +1015,12 @@ class TestDBReplicator(unittest.TestCase):
         rpc.merge_items(fake_broker, args)
         self.assertEqual(fake_broker.args, args)
 
+    def test_get_range_digests_with_bad_input(self):
+        rpc = db_replicator.ReplicatorRpc('/', '/', FakeBroker, False)
+        for args in ([], [None], ['ranges'], [[['a', 'b', 'c']]]):
+            resp = rpc.get_range_digests(FakeBroker(), args)
+            self.assertEqual(400, resp.status_int)
+
     def test_merge_syncs(self):
         rpc = db_replicator.ReplicatorRpc('/', '/', FakeBroker, False)
         fake_broker = FakeBroker()
@@ -1381,6 +1387,9 @@ def attach_fake_replication_rpc(rpc, replicate_hook=None):
                 replicate_hook(op, *sync_args)
             return resp
 
+        def close(self):
+            pass
+
     return FakeReplConnection
 
 
@@ -449,6 +449,55 @@ class TestDirectClient(unittest.TestCase):
         self.assertEqual(err.http_status, 500)
         self.assertTrue('DELETE' in str(err))
 
+    def test_direct_get_container_shard_ranges(self):
+        shard_ranges = [{'name': '.shards_a/c1', 'lower': '', 'upper': 'm'}]
+        headers = {'X-Backend-Record-Type': 'shard'}
+        with mocked_http_conn(200, headers,
+                              json.dumps(shard_ranges)) as conn:
+            resp_headers, resp = \
+                direct_client.direct_get_container_shard_ranges(
+                    self.node, self.part, self.account, self.container,
+                    includes='o')
+        self.assertEqual(conn.method, 'GET')
+        self.assertEqual(conn.path, self.container_path)
+        self.assertEqual('shard', conn.req_headers['X-Backend-Record-Type'])
+        self.assertIn('includes=o', conn.query_string)
+        self.assertEqual(shard_ranges, resp)
+
+        # a container server that doesn't know about shard ranges
+        with mocked_http_conn(200, {}, '[{"name": "o"}]') as conn:
+            resp_headers, resp = \
+                direct_client.direct_get_container_shard_ranges(
+                    self.node, self.part, self.account, self.container)
+        self.assertEqual([], resp)
+
+        with mocked_http_conn(503) as conn:
+            with self.assertRaises(ClientException) as cm:
+                direct_client.direct_get_container_shard_ranges(
+                    self.node, self.part, self.account, self.container)
+        self.assertEqual(503, cm.exception.http_status)
+
+    def test_direct_put_container_shard_ranges(self):
+        shard_ranges = [{'name': '.shards_a/c1', 'lower': '', 'upper': 'm'}]
+        with mocked_http_conn(202) as conn:
+            direct_client.direct_put_container_shard_ranges(
+                self.node, self.part, self.account, self.container,
+                shard_ranges)
+        self.assertEqual(conn.method, 'PUT')
+        self.assertEqual(conn.path, self.container_path)
+        self.assertEqual('shard', conn.req_headers['X-Backend-Record-Type'])
+        self.assertIn('X-Timestamp', conn.req_headers)
+        body = json.dumps(shard_ranges)
+        self.assertEqual(str(len(body)), conn.req_headers['Content-Length'])
+        self.assertEqual(md5(body).hexdigest(), conn.etag.hexdigest())
+
+        with mocked_http_conn(404) as conn:
+            with self.assertRaises(ClientException) as cm:
+                direct_client.direct_put_container_shard_ranges(
+                    self.node, self.part, self.account, self.container,
+                    shard_ranges)
+        self.assertEqual(404, cm.exception.http_status)
+
     def test_direct_put_container_object(self):
         headers = {'x-foo': 'bar'}
 
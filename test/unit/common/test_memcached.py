@@ -20,6 +20,7 @@ from collections import defaultdict
 from hashlib import md5
 import logging
 import socket
+import struct
 import time
 import unittest
 from uuid import uuid4
@@ -458,6 +459,60 @@ class TestMemcached(unittest.TestCase):
             ('some_key2', 'some_key1', 'not_exists'), 'multi_key'),
             [[4, 5, 6], [1, 2, 3], None])
 
+    def test_noreply(self):
+        memcache_client = memcached.MemcacheRing(['1.2.3.4:11211'],
+                                                 noreply=True)
+        mock = MockMemcached()
+        memcache_client._client_cache['1.2.3.4:11211'] = MockedMemcachePool(
+            [(mock, mock)] * 2)
+        cache_key = md5('some_key').hexdigest()
+
+        # nothing is waited for, or left to be read, after a noreply write
+        memcache_client.set('some_key', [1, 2, 3])
+        self.assertEqual(mock.cache, {cache_key: ('2', '0', '[1, 2, 3]')})
+        self.assertEqual('', mock.outbuf)
+        memcache_client.set_multi(
+            {'some_key1': [4, 5, 6], 'some_key2': [7, 8, 9]}, 'multi_key')
+        self.assertEqual('', mock.outbuf)
+        self.assertEqual(memcache_client.get('some_key'), [1, 2, 3])
+        self.assertEqual(
+            memcache_client.get_multi(('some_key2', 'some_key1'), 'multi_key'),
+            [[7, 8, 9], [4, 5, 6]])
+        memcache_client.delete('some_key')
+        self.assertEqual('', mock.outbuf)
+        self.assertEqual(memcache_client.get('some_key'), None)
+        # incr needs its answer
+        self.assertEqual(memcache_client.incr('some_key', delta=5), 5)
+
+    def test_get_multi_across_servers(self):
+        servers = ['1.2.3.4:11211', '1.2.3.5:11211']
+        memcache_client = memcached.MemcacheRing(servers)
+        mocks = {}
+        for server in servers:
+            mocks[server] = MockMemcached()
+            memcache_client._client_cache[server] = MockedMemcachePool(
+                [(mocks[server], mocks[server])] * 2)
+        keys = ['some_key%d' % i for i in range(10)]
+        for i, key in enumerate(keys):
+            memcache_client.set(key, i)
+        # sanity: the keys live on both servers
+        for mock in mocks.values():
+            self.assertTrue(mock.cache)
+
+        for mock in mocks.values():
+            mock.sendall = MagicMock(side_effect=mock.sendall)
+        self.assertEqual(memcache_client.get_multi(keys + ['not_exists']),
+                         list(range(10)) + [None])
+        # one get went to each server
+        for mock in mocks.values():
+            self.assertEqual(1, mock.sendall.call_count)
+
+        mocks[servers[0]].down = True
+        values = memcache_client.get_multi(keys)
+        self.assertEqual(
+            [None if mocks[servers[0]].cache.get(md5(key).hexdigest())
+             else i for i, key in enumerate(keys)], values)
+
     def test_serialization(self):
         memcache_client = memcached.MemcacheRing(['1.2.3.4:11211'],
                                                  allow_pickle=True)
@@ -543,6 +598,95 @@ class TestMemcached(unittest.TestCase):
             connections.get_nowait()
             self.assertTrue(connections.empty())
 
+    def test_set_servers(self):
+        servers = ['1.2.3.4:11211', '1.2.3.5:11211', '1.2.3.6:11211']
+        memcache_client = memcached.MemcacheRing(servers)
+        # fixed keys, so the number that move is always the same
+        keys = [md5('key-%d' % i).hexdigest() for i in range(1000)]
+        before = dict((key, memcache_client._servers_for(key))
+                      for key in keys)
+        self.assertEqual(set([3]), set(len(s) for s in before.values()))
+        kept_pool = memcache_client._client_cache['1.2.3.5:11211']
+
+        new_servers = ['1.2.3.5:11211', '1.2.3.6:11211', '1.2.3.7:11211']
+        memcache_client.set_servers(new_servers)
+        self.assertEqual(sorted(new_servers),
+                         sorted(memcache_client._client_cache))
+        self.assertEqual(sorted(new_servers), sorted(memcache_client._errors))
+        self.assertIs(kept_pool,
+                      memcache_client._client_cache['1.2.3.5:11211'])
+        # most keys on the servers that are kept stay there
+        moved = 0
+        for key in keys:
+            server = memcache_client._servers_for(key)[0]
+            self.assertIn(server, new_servers)
+            if before[key][0] != '1.2.3.4:11211':
+                moved += server != before[key][0]
+        self.assertLess(moved, len(keys) / 3)
+
+        # connections to a dropped server are closed, not pooled
+        mock = MockMemcached()
+        memcache_client._return_conn('1.2.3.4:11211', mock, mock)
+        self.assertTrue(mock.close_called)
+
+    def test_set_servers_while_getting_conns(self):
+        servers = ['1.2.3.4:11211', '1.2.3.5:11211']
+        memcache_client = memcached.MemcacheRing(servers)
+        mock = MockMemcached()
+        for server in servers:
+            memcache_client._client_cache[server] = MockedMemcachePool(
+                [(mock, mock)] * 2)
+        key = md5('some_key').hexdigest()
+        first, second = memcache_client._servers_for(key)
+        conns = memcache_client._get_conns(key)
+        self.assertEqual(first, next(conns)[0])
+        # the second server is dropped before the caller moves on to it
+        memcache_client.set_servers([first])
+        with patch('swift.common.memcached.logging') as mock_logging:
+            self.assertEqual([], list(conns))
+        # it is skipped rather than counted as an error
+        self.assertFalse(mock_logging.exception.called)
+        self.assertFalse(mock_logging.error.called)
+
+    def test_weights(self):
+        servers = ['1.2.3.4:11211', '1.2.3.5:11211']
+        for ketama in (False, True):
+            memcache_client = memcached.MemcacheRing(
+                servers, weights={'1.2.3.4:11211': 3}, ketama=ketama)
+            points = defaultdict(int)
+            for server in memcache_client._ring.values():
+                points[server] += 1
+            self.assertEqual(3 * points['1.2.3.5:11211'],
+                             points['1.2.3.4:11211'])
+        # an unweighted server has the points it always had
+        memcache_client = memcached.MemcacheRing(servers)
+        self.assertEqual(memcached.NODE_WEIGHT * 2,
+                         len(memcache_client._ring))
+
+    def test_ketama(self):
+        servers = ['1.2.3.4:11211', '1.2.3.5:11211', '1.2.3.6:11211']
+        memcache_client = memcached.MemcacheRing(servers, ketama=True)
+        self.assertEqual(memcached.KETAMA_POINTS * 3,
+                         len(memcache_client._ring))
+        # every point is the first four bytes of an md5, taken as a
+        # little-endian int, of a server and a counter
+        digest = md5('1.2.3.5:11211-0').digest()
+        point = struct.unpack('<I', digest[:4])[0]
+        self.assertEqual('1.2.3.5:11211', memcache_client._ring[point])
+        # and a key goes to the first point at or after its own
+        key = digest.encode('hex')
+        self.assertEqual('1.2.3.5:11211',
+                         memcache_client._servers_for(key)[0])
+        later = [p for p in memcache_client._sorted if p > point][0]
+        key = struct.pack('<I', point + 1).encode('hex')
+        self.assertEqual(memcache_client._ring[later],
+                         memcache_client._servers_for(key)[0])
+        # the continuum wraps around
+        key = struct.pack('<I', 2 ** 32 - 1).encode('hex')
+        self.assertEqual(
+            memcache_client._ring[memcache_client._sorted[0]],
+            memcache_client._servers_for(key)[0])
+
     def test_connection_pool_timeout(self):
         orig_conn_pool = memcached.MemcacheConnPool
         try:
@@ -0,0 +1,213 @@
+# Copyright (c) 2010-2016 OpenStack Foundation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+import eventlet
+import mock
+
+from swift.common import metrics
+
+
+class TestHistogram(unittest.TestCase):
+
+    def test_buckets(self):
+        # the buckets cover every timing, without gaps or overlaps
+        upper = 0
+        for index in range(400):
+            lower, next_upper = metrics.bucket_bounds(index)
+            self.assertEqual(upper, lower)
+            self.assertLess(lower, next_upper)
+            self.assertEqual(index, metrics.bucket_index(
+                (lower + next_upper) / 2))
+            upper = next_upper
+        self.assertEqual(0, metrics.bucket_index(-1))
+
+    def test_quantiles(self):
+        histogram = metrics.Histogram()
+        self.assertEqual(0, histogram.quantile(0.5))
+        timings = [random.expovariate(0.1) for _ in range(10000)]
+        for timing in timings:
+            histogram.record(timing)
+        self.assertEqual(10000, histogram.count)
+        self.assertAlmostEqual(sum(timings), histogram.sum)
+        timings.sort()
+        for q in (0.5, 0.9, 0.99, 0.999):
+            expected = timings[int(q * 10000) - 1]
+            self.assertAlmostEqual(expected, histogram.quantile(q),
+                                   delta=expected / 25 + 0.001)
+
+    def test_merge_and_round_trip(self):
+        histogram = metrics.Histogram()
+        other = metrics.Histogram()
+        for timing in range(100):
+            histogram.record(timing)
+            other.record(timing + 100)
+        other = metrics.Histogram.from_dict(
+            json.loads(json.dumps(other.to_dict())))
+        histogram.merge(other)
+        self.assertEqual(200, histogram.count)
+        self.assertEqual(sum(range(200)), histogram.sum)
+        self.assertAlmostEqual(100, histogram.quantile(0.5), delta=4)
+
+
+class TestMetricsRegistry(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tempdir, 'metrics')
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir, ignore_errors=True)
+
+    def test_record_and_dump(self):
+        registry = metrics.MetricsRegistry(self.path)
+        registry.record('proxy-server.errors', 1, 'c')
+        registry.record('proxy-server.errors', 2, 'c')
+        registry.record('proxy-server.GET.timing', 12.5, 'ms')
+        # nothing is written until it's time to
+        self.assertFalse(os.path.exists(self.path))
+        with mock.patch('time.time', return_value=registry.next_dump):
+            registry.record('proxy-server.GET.timing', 2.5, 'ms')
+        snapshots = metrics.load_snapshots(self.path)
+        self.assertEqual(1, len(snapshots))
+        counters, histograms = metrics.merge_snapshots(snapshots)
+        self.assertEqual({'proxy-server.errors': 3}, counters)
+        self.assertEqual(['proxy-server.GET.timing'], list(histograms))
+        self.assertEqual(2, histograms['proxy-server.GET.timing'].count)
+        self.assertEqual(15, histograms['proxy-server.GET.timing'].sum)
+
+    def test_idle_process_dumps(self):
+        with mock.patch.object(metrics, 'DUMP_INTERVAL', 0.01):
+            registry = metrics.MetricsRegistry(self.path)
+            registry.record('proxy-server.errors', 1, 'c')
+            registry.record('proxy-server.errors', 1, 'c')
+            # nothing more is recorded, but the snapshot is still written
+            for _ in range(100):
+                if os.path.exists(self.path):
+                    break
+                eventlet.sleep(0.01)
+            counters, histograms = metrics.merge_snapshots(
+                metrics.load_snapshots(self.path))
+            self.assertEqual({'proxy-server.errors': 2}, counters)
+            # the greenthread stops once it finds itself in a forked child
+            with mock.patch('os.getpid', return_value=-1):
+                eventlet.sleep(0.05)
+
+    def test_forked_process_starts_afresh(self):
+        registry = metrics.MetricsRegistry(self.path)
+        registry.record('proxy-server.errors', 1, 'c')
+        with mock.patch('os.getpid', return_value=registry.pid + 1):
+            registry.record('proxy-server.GET.timing', 12.5, 'ms')
+        self.assertEqual({}, registry.counters)
+        self.assertEqual(['proxy-server.GET.timing'],
+                         list(registry.histograms))
+
+    def test_get_metrics_registry(self):
+        registry = metrics.get_metrics_registry(self.path)
+        self.assertIs(registry, metrics.get_metrics_registry(self.path))
+        self.assertIsNot(registry, metrics.get_metrics_registry(
+            self.path + '2'))
+
+    def test_load_snapshots_of_live_processes(self):
+        os.mkdir(self.path)
+        live_pid = os.getpid()
+        dead_pid = 2 ** 22 + 1
+        for pid in (live_pid, dead_pid):
+            with open(os.path.join(self.path, '%d.json' % pid), 'w') as fp:
+                json.dump({'counters': {'errors': pid}}, fp)
+        with open(os.path.join(self.path, '%d.json.tmp' % live_pid),
+                  'w') as fp:
+            fp.write('{')
+
+        def fake_kill(pid, sig):
+            if pid == dead_pid:
+                raise OSError(3, 'No such process')
+        with mock.patch('os.kill', fake_kill):
+            snapshots = metrics.load_snapshots(self.path)
+        # the dead process's metrics are kept in the retired snapshot
+        self.assertEqual([{'counters': {'errors': live_pid}},
+                          {'counters': {'errors': dead_pid},
+                           'histograms': {}}], snapshots)
+        self.assertEqual(['.lock', '%d.json' % live_pid,
+                          '%d.json.tmp' % live_pid, 'retired.json'],
+                         sorted(os.listdir(self.path)))
+        self.assertEqual([], metrics.load_snapshots(self.path + '2'))
+
+    def test_counters_of_exited_processes_are_kept(self):
+        os.mkdir(self.path)
+        pids = [2 ** 22 + 1, 2 ** 22 + 2, 2 ** 22 + 3]
+        alive = set(pids)
+        for pid in pids:
+            histogram = metrics.Histogram()
+            histogram.record(pid % 10)
+            with open(os.path.join(self.path, '%d.json' % pid), 'w') as fp:
+                json.dump(metrics._make_snapshot(
+                    {'errors': 1}, {'GET.timing': histogram}), fp)
+
+        def fake_kill(pid, sig):
+            if pid not in alive:
+                raise OSError(3, 'No such process')
+
+        def totals():
+            with mock.patch('os.kill', fake_kill):
+                return metrics.merge_snapshots(
+                    metrics.load_snapshots(self.path))
+
+        counters, histograms = totals()
+        self.assertEqual({'errors': 3}, counters)
+        self.assertEqual(3, histograms['GET.timing'].count)
+        # the totals don't go down as processes exit, one at a time or
+        # several at once
+        alive.discard(pids[0])
+        for expected_alive in (2, 0):
+            counters, histograms = totals()
+            self.assertEqual({'errors': 3}, counters)
+            self.assertEqual(3, histograms['GET.timing'].count)
+            self.assertEqual(18, histograms['GET.timing'].sum)
+            self.assertEqual(expected_alive, len([
+                filename for filename in os.listdir(self.path)
+                if filename[0].isdigit()]))
+            alive.clear()
+
+    def test_render(self):
+        histogram = metrics.Histogram()
+        for timing in (1, 2, 3, 4):
+            histogram.record(timing)
+        self.assertEqual(
+            '# TYPE swift_proxy_server_errors counter\n'
+            'swift_proxy_server_errors 3\n'
+            '# TYPE swift_proxy_server_object_GET_200_timing summary\n'
+            'swift_proxy_server_object_GET_200_timing{quantile="0.5"} '
+            '2.016\n'
+            'swift_proxy_server_object_GET_200_timing{quantile="0.9"} '
+            '4.032\n'
+            'swift_proxy_server_object_GET_200_timing{quantile="0.99"} '
+            '4.032\n'
+            'swift_proxy_server_object_GET_200_timing{quantile="0.999"} '
+            '4.032\n'
+            'swift_proxy_server_object_GET_200_timing_sum 10.000\n'
+            'swift_proxy_server_object_GET_200_timing_count 4\n',
+            metrics.render({'proxy-server.errors': 3},
+                           {'proxy-server.object.GET.200.timing': histogram}))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -16,13 +16,17 @@
 """Tests for swift.common.request_helpers"""
 
 import unittest
+
+import mock
+
 from swift.common.swob import Request, HTTPException, HeaderKeyDict
 from swift.common.storage_policy import POLICIES, EC_POLICY, REPL_POLICY
 from swift.common.request_helpers import is_sys_meta, is_user_meta, \
     is_sys_or_user_meta, strip_sys_meta_prefix, strip_user_meta_prefix, \
     remove_items, copy_header_subset, get_name_and_placement, \
     http_response_to_document_iters, is_object_transient_sysmeta, \
-    update_etag_is_at_header, resolve_etag_is_at_header
+    update_etag_is_at_header, resolve_etag_is_at_header, RequestTrace, \
+    trace_span, trace_span_add
 
 from test.unit import patch_policies
 from test.unit.common.test_utils import FakeResponse
@@ -353,3 +357,29 @@ class TestHTTPResponseToDocumentIters(unittest.TestCase):
         do_test()
         metadata = dict((k.upper(), v) for k, v in metadata.items())
         do_test()
+
+    def test_trace_spans(self):
+        env = {}
+        # requests that aren't being traced record nothing
+        with trace_span(env, 'untraced'):
+            pass
+        trace_span_add(env, 'untraced', 1)
+        self.assertEqual({}, env)
+
+        env['swift.trace'] = RequestTrace()
+        with mock.patch('swift.common.request_helpers.time.time',
+                        side_effect=[10.0, 10.25]):
+            with trace_span(env, 'get_info.container'):
+                pass
+        trace_span_add(env, 'connect.10.0.0.1:6200', 0.00125)
+        with self.assertRaises(ValueError):
+            with mock.patch('swift.common.request_helpers.time.time',
+                            side_effect=[11.0, 11.5]):
+                with trace_span(env, 'failed'):
+                    raise ValueError()
+        self.assertEqual([('get_info.container', 0.25),
+                          ('connect.10.0.0.1:6200', 0.00125),
+                          ('failed', 0.5)], env['swift.trace'].spans)
+        self.assertEqual(
+            'get_info.container:0.2500/connect.10.0.0.1:6200:0.0013/'
+            'failed:0.5000', str(env['swift.trace']))
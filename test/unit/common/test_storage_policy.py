@@ -1277,6 +1277,16 @@ class TestStoragePolicies(unittest.TestCase):
                 # pyeclib_driver.get_segment_info is called only once
                 self.assertEqual(1, fake.call_count)
 
+    def test_ec_systematic(self):
+        policy = ECStoragePolicy(
+            0, 'ec2-1', ec_type=DEFAULT_TEST_EC_TYPE,
+            ec_ndata=2, ec_nparity=1, object_ring=FakeRing(replicas=3))
+        self.assertTrue(policy.ec_systematic)
+        # the data can't be read straight out of a non-systematic
+        # scheme's fragments
+        policy._ec_type = 'shss'
+        self.assertFalse(policy.ec_systematic)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -15,7 +15,7 @@
 
 """Tests for swift.common.utils"""
 from __future__ import print_function
-from test.unit import temptree, debug_logger
+from test.unit import temptree, debug_logger, with_tempdir
 
 import ctypes
 import contextlib
@@ -35,6 +35,7 @@ import json
 import math
 
 import six
+from six.moves import cPickle as pickle
 from six import BytesIO, StringIO
 from six.moves.queue import Queue, Empty
 from six.moves import range
@@ -806,6 +807,53 @@ class TestTimestamp(unittest.TestCase):
         self.assertIn(ts_0, d)  # sanity
         self.assertIn(ts_0_also, d)
 
+    def test_slots(self):
+        ts = utils.Timestamp('1402444821.72589_0000000000000012')
+        self.assertEqual(140244482172589, ts.raw)
+        self.assertEqual(0x12, ts.offset)
+        self.assertEqual(1402444821.72589, ts.timestamp)
+        self.assertFalse(hasattr(ts, '__dict__'))
+        with self.assertRaises(AttributeError):
+            ts.timestamp = 1
+
+    def test_pickle(self):
+        ts = utils.Timestamp('1402444821.72589_0000000000000012')
+        for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+            copied = pickle.loads(pickle.dumps(ts, protocol))
+            self.assertEqual(ts.internal, copied.internal)
+        # Timestamps pickled before they had __slots__ can still be read
+        old = utils.Timestamp.__new__(utils.Timestamp)
+        old.__setstate__({'timestamp': 1402444821.72589, 'offset': 0x12,
+                          'raw': 140244482172589})
+        self.assertEqual(ts.internal, old.internal)
+
+    def test_parse_timestamps(self):
+        values = ['1402444821.72589', '1402444821.72589_000000000000000a',
+                  '1402444821.725891', '1402444821.7', '0000000000.00001']
+        timestamps = utils.parse_timestamps(values)
+        self.assertEqual([utils.Timestamp(v) for v in values], timestamps)
+        self.assertEqual(['1402444821.72589',
+                          '1402444821.72589_000000000000000a',
+                          '1402444821.72589', '1402444821.70000',
+                          '0000000000.00001'],
+                         [ts.internal for ts in timestamps])
+        self.assertEqual([], utils.parse_timestamps([]))
+        for bad in ('', 'x', '-000000001.00000', '1402444821.72589_x',
+                    '99999999999.00000', '1.0_10000000000000000'):
+            self.assertRaises(ValueError, utils.parse_timestamps,
+                              ['1402444821.72589', bad])
+            self.assertRaises(ValueError, utils.Timestamp, bad)
+
+    def test_compare_timestamps(self):
+        older = utils.Timestamp('1402444821.72589')
+        newer = utils.Timestamp(older, offset=1)
+        self.assertEqual(
+            [-1, 0, 1, -1, 1],
+            utils.compare_timestamps(
+                [older, older, newer, older.internal, '1402444822.00000'],
+                [newer, older.internal, older, newer.internal, newer]))
+        self.assertEqual([], utils.compare_timestamps([], []))
+
 
 class TestTimestampEncoding(unittest.TestCase):
 
@@ -4351,6 +4399,34 @@ class TestStatsdLogging(unittest.TestCase):
         self.assertEqual(logger.logger.statsd_client._sample_rate_factor,
                          0.81)
 
+    @with_tempdir
+    def test_get_logger_metrics(self, tempdir):
+        conf = {'log_metrics': 'on', 'log_metrics_path': tempdir}
+        logger = utils.get_logger(conf, 'some-name')
+        statsd_client = logger.logger.statsd_client
+        self.assertIs(utils.get_metrics_registry(tempdir),
+                      statsd_client.metrics)
+        self.assertIsNone(statsd_client._target)
+        statsd_client._open_socket = mock.MagicMock()
+        logger.increment('tribbles', sample_rate=0.1)
+        logger.timing('lag', 12)
+        self.assertFalse(statsd_client._open_socket.called)
+
+        # metrics are recorded whether or not they are sent to StatsD
+        conf['log_statsd_host'] = 'some.host.com'
+        logger = utils.get_logger(conf, 'some-name')
+        statsd_client = logger.logger.statsd_client
+        mock_socket = MockUdpSocket()
+        statsd_client._open_socket = lambda *_: mock_socket
+        statsd_client.random = lambda: 0.5
+        logger.increment('tribbles', sample_rate=0.1)
+        logger.timing('lag', 12)
+        self.assertEqual([b'some-name.lag:12|ms'],
+                         [payload for payload, _ in mock_socket.sent])
+        registry = statsd_client.metrics
+        self.assertEqual({'some-name.tribbles': 2}, registry.counters)
+        self.assertEqual(2, registry.histograms['some-name.lag'].count)
+
     def test_ipv4_or_ipv6_hostname_defaults_to_ipv4(self):
         def stub_getaddrinfo_both_ipv4_and_ipv6(host, port, family, *rest):
             if family == socket.AF_INET:
@@ -4535,6 +4611,112 @@ class TestStatsdLogging(unittest.TestCase):
             suffix = suffix.encode('utf-8')
         self.assertTrue(payload.endswith(suffix), payload)
 
+    def test_aggregated_metrics(self):
+        logger = utils.get_logger({
+            'log_statsd_host': 'some.host.com',
+            'log_statsd_flush_interval': '0.5',
+        }, 'some-name')
+        statsd_client = logger.logger.statsd_client
+        self.assertEqual(0.5, statsd_client._flush_interval)
+        self.assertEqual(utils.STATSD_MAX_PACKET_SIZE,
+                         statsd_client._max_packet_size)
+        mock_socket = MockUdpSocket()
+        statsd_client._open_socket = lambda *_: mock_socket
+        statsd_client.random = lambda: 0.1
+
+        with mock.patch.object(utils.eventlet, 'spawn_n') as mock_spawn:
+            logger.increment('tribbles')
+            logger.update_stats('tribbles', 5)
+            logger.decrement('tribbles', sample_rate=0.5)
+            logger.timing('lag', 12)
+            logger.timing('lag', 7)
+            logger.update_stats('tribbles', 3)
+        # nothing is sent until the flush
+        self.assertEqual([], mock_socket.sent)
+        # by the greenthread started with the first metric
+        self.assertEqual(
+            [mock.call(statsd_client._flush_periodically, os.getpid())],
+            mock_spawn.call_args_list)
+
+        statsd_client.flush()
+        self.assertEqual(1, len(mock_socket.sent))
+        payload, target = mock_socket.sent[0]
+        self.assertEqual(('some.host.com', 8125), target)
+        self.assertEqual(['some-name.lag:12|ms', 'some-name.lag:7|ms',
+                          'some-name.tribbles:-1|c|@0.5',
+                          'some-name.tribbles:9|c'],
+                         sorted(payload.split(b'\n')))
+        statsd_client.flush()
+        self.assertEqual(1, len(mock_socket.sent))
+
+    def test_aggregated_metrics_flushed_by_size(self):
+        logger = utils.get_logger({
+            'log_statsd_host': 'some.host.com',
+            'log_statsd_flush_interval': '10',
+            'log_statsd_max_packet_size': '100',
+        }, 'some-name')
+        statsd_client = logger.logger.statsd_client
+        mock_socket = MockUdpSocket()
+        statsd_client._open_socket = lambda *_: mock_socket
+        # each line is 25 bytes, with its newline
+        with mock.patch.object(utils.eventlet, 'spawn_n'):
+            for i in range(3):
+                logger.timing('metric%d' % i, 100)
+            self.assertEqual([], mock_socket.sent)
+            logger.timing('metric3', 100)
+        self.assertEqual(
+            [(b'some-name.metric%d:100|ms\n' * 4)[:-1] % (0, 1, 2, 3)],
+            [payload for payload, _ in mock_socket.sent])
+
+        # a flush splits the lines over as many packets as they need
+        mock_socket.sent = []
+        statsd_client._max_packet_size = 60
+        for i in range(5):
+            logger.timing('metric%d' % i, 100)
+        statsd_client.flush()
+        self.assertEqual(
+            # flushed once the third line made the buffer too big...
+            [b'some-name.metric0:100|ms\nsome-name.metric1:100|ms',
+             b'some-name.metric2:100|ms',
+             # ...and then by the call to flush
+             b'some-name.metric3:100|ms\nsome-name.metric4:100|ms'],
+            [payload for payload, _ in mock_socket.sent])
+
+    def test_flush_periodically(self):
+        logger = utils.get_logger({
+            'log_statsd_host': 'some.host.com',
+            'log_statsd_flush_interval': '0.01',
+        }, 'some-name')
+        statsd_client = logger.logger.statsd_client
+        mock_socket = MockUdpSocket()
+        statsd_client._open_socket = lambda *_: mock_socket
+        logger.increment('tribbles')
+        for _ in range(100):
+            if mock_socket.sent:
+                break
+            eventlet.sleep(0.01)
+        self.assertEqual([(b'some-name.tribbles:1|c',
+                           ('some.host.com', 8125))], mock_socket.sent)
+        # the greenthread stops once it finds itself in a forked child...
+        with mock.patch('os.getpid', return_value=-1):
+            eventlet.sleep(0.05)
+        logger.increment('tribbles')
+        eventlet.sleep(0.05)
+        self.assertEqual(1, len(mock_socket.sent))
+        # ...where the next metric starts another, and drops the metrics
+        # buffered before the fork, which the parent sends
+        statsd_client._flusher_pid = -1
+        logger.timing('lag', 12)
+        logger.increment('tribbles')
+        for _ in range(100):
+            if len(mock_socket.sent) > 1:
+                break
+            eventlet.sleep(0.01)
+        self.assertEqual([b'some-name.lag:12|ms', b'some-name.tribbles:1|c'],
+                         sorted(mock_socket.sent[1][0].split(b'\n')))
+        with mock.patch('os.getpid', return_value=-1):
+            eventlet.sleep(0.05)
+
     def test_timing_stats(self):
         class MockController(object):
             def __init__(self, status):
@@ -5526,6 +5708,32 @@ class TestLRUCache(unittest.TestCase):
             f(i)
         self.assertEqual(f.size(), 4)
 
+    def test_direct_get_set_and_pop(self):
+        cache = utils.LRUCache(maxsize=2, maxtime=30)
+        self.assertIsNone(cache.get('a'))
+        cache.set_cache(1, 'a')
+        cache.set_cache(2, 'b')
+        self.assertEqual(1, cache.get('a'))
+        # resetting a key replaces it rather than using up another slot
+        cache.set_cache(3, 'b')
+        self.assertEqual(2, len(cache.mapping))
+        self.assertEqual(3, cache.get('b'))
+        # 'a' is now least recently used
+        cache.set_cache(4, 'c')
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(3, cache.get('b'))
+        self.assertEqual(4, cache.get('c'))
+        cache.pop_cache('b')
+        cache.pop_cache('missing')
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(['c'], [k[0] for k in cache.mapping])
+
+        the_future = time.time() + 31
+        with patch('time.time', lambda: the_future):
+            self.assertIsNone(cache.get('c'))
+        # timed out members are dropped
+        self.assertEqual({}, cache.mapping)
+
 
 class TestSpliterator(unittest.TestCase):
     def test_string(self):
@@ -5956,6 +6164,181 @@ class TestPairs(unittest.TestCase):
                               (50, 60)]))
 
 
+class TestPrefixUpperBound(unittest.TestCase):
+    def test_prefix_upper_bound(self):
+        self.assertEqual('b', utils.prefix_upper_bound('a'))
+        self.assertEqual('ab', utils.prefix_upper_bound('aa'))
+        self.assertEqual('b', utils.prefix_upper_bound('a\xff'))
+        self.assertEqual('a\xff\x01',
+                         utils.prefix_upper_bound('a\xff\x00'))
+        # there is nothing after every string starting with these
+        self.assertEqual('', utils.prefix_upper_bound(''))
+        self.assertEqual('', utils.prefix_upper_bound('\xff\xff'))
+
+
+class TestCoalesceChunks(unittest.TestCase):
+    def test_coalesce_chunks(self):
+        pieces = ['a', 'bb', 'ccc', 'dddd', 'e']
+        self.assertEqual(list(utils.coalesce_chunks(pieces, 3)),
+                         ['abb', 'ccc', 'dddd', 'e'])
+        self.assertEqual(list(utils.coalesce_chunks(pieces, 100)),
+                         ['abbcccdddde'])
+        self.assertEqual(list(utils.coalesce_chunks(pieces, 1)), pieces)
+
+    def test_coalesce_chunks_empty(self):
+        self.assertEqual(list(utils.coalesce_chunks([])), [])
+        self.assertEqual(list(utils.coalesce_chunks(iter(['']))), [''])
+
+    def test_coalesce_chunks_is_lazy(self):
+        consumed = []
+
+        def gen():
+            for piece in ('aa', 'bb', 'cc'):
+                consumed.append(piece)
+                yield piece
+
+        it = utils.coalesce_chunks(gen(), 4)
+        self.assertEqual(next(it), 'aabb')
+        self.assertEqual(consumed, ['aa', 'bb'])
+        self.assertEqual(next(it), 'cc')
+
+    def test_coalesced_app_iter(self):
+        pieces = ['a', 'bb', 'ccc', 'dddd', 'e']
+        # output that fits in one chunk can be sent with a Content-Length
+        self.assertEqual(utils.coalesced_app_iter(pieces, 100),
+                         ['abbcccdddde'])
+        self.assertEqual(utils.coalesced_app_iter([]), [])
+
+        # longer output is streamed
+        closed = []
+
+        def gen():
+            try:
+                for piece in pieces:
+                    yield piece
+            finally:
+                closed.append(True)
+
+        app_iter = utils.coalesced_app_iter(gen(), 3)
+        self.assertNotIsInstance(app_iter, list)
+        self.assertEqual(next(iter(app_iter)), 'abb')
+        app_iter.close()
+        self.assertEqual([True], closed)
+        self.assertEqual(list(utils.coalesced_app_iter(pieces, 3)),
+                         ['abb', 'ccc', 'dddd', 'e'])
+
+
+class TestShardRange(unittest.TestCase):
+    def test_create(self):
+        ts = utils.Timestamp(1234)
+        sr = utils.ShardRange.create('a', 'c', 'lower', 'upper', ts)
+        self.assertTrue(sr.name.startswith('.shards_a/c-'))
+        self.assertEqual('.shards_a', sr.account)
+        self.assertEqual(('a', 'c'), utils.get_shard_root(sr.account,
+                                                          sr.container))
+        self.assertEqual(ts, sr.timestamp)
+        self.assertEqual(ts, sr.meta_timestamp)
+        self.assertEqual((0, 0), (sr.object_count, sr.bytes_used))
+        self.assertFalse(sr.deleted)
+        # the name is unique to the bounds and timestamp
+        self.assertNotEqual(sr.name, utils.ShardRange.create(
+            'a', 'c', 'lower', 'upper', utils.Timestamp(1235)).name)
+        self.assertNotEqual(sr.name, utils.ShardRange.create(
+            'a', 'c', 'lower', 'uppest', ts).name)
+
+    def test_bounds(self):
+        sr = utils.ShardRange('.shards_a/c', 0, 'b', 'd')
+        self.assertNotIn('a', sr)
+        self.assertNotIn('b', sr)
+        self.assertIn('b\x00', sr)
+        self.assertIn('c', sr)
+        self.assertIn('d', sr)
+        self.assertNotIn('d\x00', sr)
+        unbounded = utils.ShardRange('.shards_a/c', 0)
+        self.assertIn('anything', unbounded)
+        self.assertIn('z', utils.ShardRange('.shards_a/c', 0, lower='y'))
+        self.assertNotIn('z', utils.ShardRange('.shards_a/c', 0, upper='y'))
+        with self.assertRaises(ValueError):
+            utils.ShardRange('.shards_a/c', 0, 'd', 'b')
+        with self.assertRaises(ValueError):
+            utils.ShardRange('.shards_a/c', 0, 'b', 'b')
+
+    def test_overlaps(self):
+        sr = utils.ShardRange('.shards_a/c', 0, 'b', 'd')
+        self.assertTrue(sr.overlaps('', ''))
+        self.assertTrue(sr.overlaps('a', 'c'))
+        self.assertTrue(sr.overlaps('c', 'z'))
+        self.assertTrue(sr.overlaps('c', ''))
+        self.assertFalse(sr.overlaps('d', 'z'))
+        self.assertFalse(sr.overlaps('', 'b'))
+        self.assertTrue(sr.overlaps('', 'b\x00'))
+
+    def test_unicode(self):
+        sr = utils.ShardRange(u'.shards_a/c', 0, u'\xe9', u'\xf8')
+        self.assertEqual('\xc3\xa9', sr.lower)
+        self.assertEqual('\xc3\xb8', sr.upper)
+        self.assertIn(u'\xf0'.encode('utf-8'), sr)
+
+    def test_dict_round_trip(self):
+        sr = utils.ShardRange('.shards_a/c', utils.Timestamp(1), 'b', 'd',
+                              object_count=3, bytes_used=4,
+                              meta_timestamp=utils.Timestamp(2))
+        expected = {'name': '.shards_a/c', 'lower': 'b', 'upper': 'd',
+                    'timestamp': utils.Timestamp(1).internal,
+                    'object_count': 3, 'bytes_used': 4,
+                    'meta_timestamp': utils.Timestamp(2).internal,
+                    'deleted': 0}
+        self.assertEqual(expected, dict(sr))
+        self.assertEqual(sr, utils.ShardRange.from_dict(
+            json.loads(json.dumps(dict(sr)))))
+        copied = sr.copy(deleted=True)
+        self.assertTrue(copied.deleted)
+        self.assertNotEqual(sr, copied)
+        self.assertFalse(sr.deleted)
+
+    def test_equality_ignores_class_identity(self):
+        # reloading the utils module makes a new, different ShardRange class
+        attrs = dict((key, value)
+                     for key, value in vars(utils.ShardRange).items()
+                     if key not in utils.ShardRange.__slots__)
+        reloaded_cls = type('ShardRange', (object,), attrs)
+        self.assertIsNot(reloaded_cls, utils.ShardRange)
+        sr = utils.ShardRange('.shards_a/c', utils.Timestamp(1), 'b', 'd')
+        reloaded = reloaded_cls('.shards_a/c', utils.Timestamp(1), 'b', 'd')
+        self.assertEqual(sr, reloaded)
+        self.assertEqual(reloaded, sr)
+        self.assertFalse(sr != reloaded)
+        self.assertNotEqual(sr, reloaded_cls('.shards_a/c',
+                                             utils.Timestamp(2), 'b', 'd'))
+        # other types are never equal
+        self.assertNotEqual(sr, dict(sr))
+        self.assertNotEqual(sr, None)
+        self.assertFalse(sr == 'b')
+
+    def test_get_shard_root(self):
+        self.assertIsNone(utils.get_shard_root('a', 'c'))
+        self.assertIsNone(utils.get_shard_root('.shards_a', 'c'))
+        self.assertIsNone(utils.get_shard_root('a', 'c-%s' % ('0' * 32)))
+        self.assertEqual(('a', 'c-d'), utils.get_shard_root(
+            '.shards_a', 'c-d-%s' % ('f' * 32)))
+
+    def test_find_and_sort_shard_ranges(self):
+        ranges = [utils.ShardRange('.shards_a/c3', 0, 'm', ''),
+                  utils.ShardRange('.shards_a/c1', 0, '', 'f'),
+                  utils.ShardRange('.shards_a/c2', 0, 'f', 'm')]
+        self.assertEqual(['.shards_a/c1', '.shards_a/c2', '.shards_a/c3'],
+                         [sr.name for sr in utils.sort_shard_ranges(ranges)])
+        self.assertEqual('.shards_a/c1',
+                         utils.find_shard_range('a', ranges).name)
+        self.assertEqual('.shards_a/c1',
+                         utils.find_shard_range('f', ranges).name)
+        self.assertEqual('.shards_a/c2',
+                         utils.find_shard_range('f\x00', ranges).name)
+        self.assertEqual('.shards_a/c3',
+                         utils.find_shard_range('z', ranges).name)
+        self.assertIsNone(utils.find_shard_range('z', ranges[1:]))
+
+
 class TestSocketStringParser(unittest.TestCase):
     def test_socket_string_parser(self):
         default = 1337
@@ -440,6 +440,40 @@ class TestWSGI(unittest.TestCase):
         self.assertTrue(_wsgi.server.called)
         args, kwargs = _wsgi.server.call_args
         self.assertEqual(kwargs.get('capitalize_response_headers'), False)
+        self.assertTrue(kwargs['keepalive'])
+
+    def test_run_server_keepalive_disabled(self):
+        config = """
+        [DEFAULT]
+        swift_dir = TEMPDIR
+        keepalive = no
+
+        [pipeline:main]
+        pipeline = proxy-server
+
+        [app:proxy-server]
+        use = egg:swift#proxy
+        """
+
+        contents = dedent(config)
+        with temptree(['proxy-server.conf']) as t:
+            conf_file = os.path.join(t, 'proxy-server.conf')
+            with open(conf_file, 'w') as f:
+                f.write(contents.replace('TEMPDIR', t))
+            _fake_rings(t)
+            with mock.patch('swift.proxy.server.Application.'
+                            'modify_wsgi_pipeline'), \
+                    mock.patch('swift.common.wsgi.wsgi') as _wsgi, \
+                    mock.patch('swift.common.wsgi.eventlet'), \
+                    mock.patch('swift.common.wsgi.inspect'):
+                conf = wsgi.appconfig(conf_file)
+                logger = logging.getLogger('test')
+                sock = listen(('localhost', 0))
+                wsgi.run_server(conf, logger, sock)
+
+        self.assertTrue(_wsgi.server.called)
+        args, kwargs = _wsgi.server.call_args
+        self.assertFalse(kwargs['keepalive'])
 
     def test_run_server_conf_dir(self):
         config_dir = {
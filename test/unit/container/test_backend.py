@@ -30,8 +30,9 @@ import json
 
 from swift.container.backend import ContainerBroker, \
     update_new_item_from_existing
-from swift.common.utils import Timestamp, encode_timestamps
+from swift.common.utils import Timestamp, encode_timestamps, ShardRange
 from swift.common.storage_policy import POLICIES
+from swift.common.db import chexor
 
 import mock
 
@@ -1087,6 +1088,213 @@ class TestContainerBroker(unittest.TestCase):
         self.assertEqual(info['reported_object_count'], 2)
         self.assertEqual(info['reported_bytes_used'], 1123)
 
+    def test_merge_shard_ranges(self):
+        broker = ContainerBroker(':memory:', account='a', container='c')
+        broker.initialize(Timestamp('1').internal, 0)
+        ts = make_timestamp_iter()
+        self.assertEqual([], broker.get_shard_ranges())
+        self.assertFalse(broker.is_sharded())
+
+        # the table is created on demand
+        t1, t2, t3 = next(ts), next(ts), next(ts)
+        sr1 = ShardRange('.shards_a/c1', t1, '', 'm')
+        sr2 = ShardRange('.shards_a/c2', t1, 'm', '')
+        broker.merge_shard_ranges([sr2, sr1])
+        self.assertEqual([sr1, sr2], broker.get_shard_ranges())
+        self.assertTrue(broker.is_sharded())
+        self.assertEqual('sharded', broker.get_sharding_state())
+
+        # newer stats win, without changing the bounds
+        broker.merge_shard_ranges([sr1.copy(object_count=5, bytes_used=6,
+                                            meta_timestamp=t2)])
+        sr1_stats = sr1.copy(object_count=5, bytes_used=6, meta_timestamp=t2)
+        self.assertEqual([sr1_stats, sr2], broker.get_shard_ranges())
+        # ...and older stats lose
+        broker.merge_shard_ranges([sr1.copy(object_count=1, bytes_used=1)])
+        self.assertEqual([sr1_stats, sr2], broker.get_shard_ranges())
+
+        # newer bounds win, without losing newer stats
+        broker.merge_shard_ranges([sr1.copy(upper='n', timestamp=t3,
+                                            meta_timestamp=t1)])
+        sr1_moved = sr1_stats.copy(upper='n', timestamp=t3)
+        self.assertEqual([sr1_moved, sr2], broker.get_shard_ranges())
+
+        # deleted ranges are hidden unless asked for
+        broker.merge_shard_ranges([sr2.copy(deleted=True,
+                                            timestamp=next(ts))])
+        self.assertEqual([sr1_moved], broker.get_shard_ranges())
+        self.assertEqual([sr1_moved, sr2.name], [
+            sr if sr.deleted is False else sr.name
+            for sr in broker.get_shard_ranges(include_deleted=True)])
+
+    def test_get_shard_ranges_filters(self):
+        broker = ContainerBroker(':memory:', account='a', container='c')
+        broker.initialize(Timestamp('1').internal, 0)
+        ranges = [ShardRange('.shards_a/c%d' % i, 1, lower, upper)
+                  for i, (lower, upper) in enumerate(
+                      (('', 'f'), ('f', 'm'), ('m', '')))]
+        broker.merge_shard_ranges(ranges)
+        self.assertEqual(ranges[1:2], broker.get_shard_ranges(includes='g'))
+        self.assertEqual(ranges[0:1], broker.get_shard_ranges(includes='f'))
+        self.assertEqual(ranges[1:], broker.get_shard_ranges(marker='g'))
+        self.assertEqual(ranges[:2], broker.get_shard_ranges(end_marker='g'))
+        self.assertEqual(ranges[1:2], broker.get_shard_ranges(
+            marker='g', end_marker='h'))
+
+    def test_sharded_root_info(self):
+        broker = ContainerBroker(':memory:', account='a', container='c')
+        broker.initialize(Timestamp('1').internal, 0)
+        broker.put_object('o', Timestamp(2).internal, 1, 'text/plain',
+                          EMPTY_ETAG)
+        self.assertFalse(broker.empty())
+        broker.delete_object('o', Timestamp(3).internal)
+        self.assertTrue(broker.empty())
+        broker.merge_shard_ranges([
+            ShardRange('.shards_a/c1', 1, '', 'm', object_count=3,
+                       bytes_used=30),
+            ShardRange('.shards_a/c2', 1, 'm', '', object_count=4,
+                       bytes_used=40)])
+        info = broker.get_info()
+        self.assertEqual(7, info['object_count'])
+        self.assertEqual(70, info['bytes_used'])
+        self.assertFalse(broker.empty())
+
+        # a shard doesn't add up the stats of any shard ranges it holds
+        shard = ContainerBroker(':memory:', account='.shards_a',
+                                container='c-%s' % ('0' * 32))
+        shard.initialize(Timestamp('1').internal, 0)
+        shard.merge_shard_ranges([
+            ShardRange('.shards_a/c1', 1, '', 'm', object_count=3)])
+        self.assertEqual(0, shard.get_info()['object_count'])
+        self.assertFalse(shard.is_root_container())
+        self.assertTrue(broker.is_root_container())
+
+    def test_get_sharding_state(self):
+        broker = ContainerBroker(':memory:', account='a', container='c')
+        broker.initialize(Timestamp('1').internal, 0)
+        broker.put_object('o', Timestamp(2).internal, 1, 'text/plain',
+                          EMPTY_ETAG)
+        self.assertEqual('unsharded', broker.get_sharding_state())
+        broker.merge_shard_ranges([ShardRange('.shards_a/c1', 1, '', '')])
+        # the root still holds a row that is yet to be moved
+        self.assertEqual('sharding', broker.get_sharding_state())
+        broker.delete_object('o', Timestamp(3).internal)
+        broker.get_info()
+        self.assertEqual('sharded', broker.get_sharding_state())
+
+        # once worked out by get_info, the state costs no more queries
+        with mock.patch.object(broker, 'get_shard_ranges') as mock_get:
+            self.assertEqual('sharded', broker.get_sharding_state())
+        self.assertFalse(mock_get.called)
+
+    def test_find_shard_boundaries(self):
+        broker = ContainerBroker(':memory:', account='a', container='c')
+        broker.initialize(Timestamp('1').internal, 0)
+        for i in range(10):
+            broker.put_object('o%02d' % i, Timestamp(2).internal, 0,
+                              'text/plain', EMPTY_ETAG)
+        broker.delete_object('o05', Timestamp(3).internal)
+        # deleted objects are not counted
+        self.assertEqual(['o02', 'o06'], broker.find_shard_boundaries(3))
+        self.assertEqual(['o03'], broker.find_shard_boundaries(4))
+        self.assertEqual([], broker.find_shard_boundaries(5))
+        self.assertEqual(['o06'], broker.find_shard_boundaries(2, 'o03',
+                                                               'o09'))
+        self.assertEqual([], broker.find_shard_boundaries(2, 'o06', 'o08'))
+
+    def test_get_and_remove_objects(self):
+        broker = ContainerBroker(':memory:', account='a', container='c')
+        broker.initialize(Timestamp('1').internal, 0)
+        for i in range(5):
+            broker.put_object('o%d' % i, Timestamp(2).internal, i,
+                              'text/plain', EMPTY_ETAG)
+        broker.delete_object('o2', Timestamp(3).internal)
+        rows = broker.get_objects('o0', 'o3', 10)
+        self.assertEqual(['o1', 'o2', 'o3'], [row['name'] for row in rows])
+        self.assertEqual([0, 1, 0], [row['deleted'] for row in rows])
+        self.assertEqual(['o1', 'o3'], [
+            row['name'] for row in broker.get_objects(
+                'o0', 'o3', 10, include_deleted=False)])
+        self.assertEqual(['o3', 'o4'], [
+            row['name'] for row in broker.get_objects('o2', '', 10)])
+        self.assertEqual(['o0'], [
+            row['name'] for row in broker.get_objects('', '', 1)])
+
+        # rows can be merged into another container
+        other = ContainerBroker(':memory:', account='a', container='d')
+        other.initialize(Timestamp('1').internal, 0)
+        other.merge_items([dict(row) for row in rows])
+        self.assertEqual(['o1', 'o3'], [
+            row[0] for row in other.list_objects_iter(10, '', '', '', '')])
+
+        broker.remove_objects([row['ROWID'] for row in rows])
+        self.assertEqual(['o0', 'o4'], [
+            row[0] for row in broker.list_objects_iter(10, '', '', '', '')])
+        info = broker.get_info()
+        self.assertEqual(2, info['object_count'])
+        self.assertEqual(4, info['bytes_used'])
+
+    def test_list_prefix_stats(self):
+        broker = ContainerBroker(':memory:', account='a', container='c')
+        broker.initialize(Timestamp('1').internal, 0)
+        ts = make_timestamp_iter()
+        for name, size in (('a/1', 1), ('a/2', 2), ('a/b/3', 4),
+                           ('b/1', 8), ('c', 16), ('d/1', 32)):
+            broker.put_object(name, next(ts).internal, size, 'text/plain',
+                              EMPTY_ETAG)
+        # there are no stats until the table is built
+        self.assertIsNone(broker.list_prefix_stats(100, '', None, None))
+        self.assertFalse(broker.has_prefix_stats())
+        self.assertTrue(broker.enable_prefix_stats())
+        self.assertFalse(broker.enable_prefix_stats())
+        self.assertTrue(broker.has_prefix_stats())
+        self.assertEqual(broker.list_prefix_stats(100, '', None, None),
+                         [('a/', 3, 7), ('b/', 1, 8), ('d/', 1, 32)])
+        # a prefix that ends in '\xff' has no upper bound
+        self.assertEqual(broker.list_prefix_stats(100, '', None, 'd\xff'),
+                         [])
+        self.assertEqual(broker.list_prefix_stats(100, '', None, '\xff'),
+                         [])
+
+        # then it is maintained as objects come and go
+        broker.put_object('a/2', next(ts).internal, 64, 'text/plain',
+                          EMPTY_ETAG)
+        broker.put_object('e/1', next(ts).internal, 128, 'text/plain',
+                          EMPTY_ETAG)
+        broker.delete_object('b/1', next(ts).internal)
+        broker.delete_object('d/2', next(ts).internal)
+        self.assertEqual(broker.list_prefix_stats(100, '', None, None),
+                         [('a/', 3, 69), ('d/', 1, 32), ('e/', 1, 128)])
+
+        # reclaiming deleted rows does not change the aggregates
+        broker.reclaim(next(ts).internal, next(ts).internal)
+        self.assertEqual(broker.list_prefix_stats(100, '', None, None),
+                         [('a/', 3, 69), ('d/', 1, 32), ('e/', 1, 128)])
+
+        # the usual listing parameters are supported
+        self.assertEqual(broker.list_prefix_stats(1, '', None, None),
+                         [('a/', 3, 69)])
+        self.assertEqual(broker.list_prefix_stats(100, 'a/', None, None),
+                         [('d/', 1, 32), ('e/', 1, 128)])
+        self.assertEqual(broker.list_prefix_stats(100, '', 'e/', None),
+                         [('a/', 3, 69), ('d/', 1, 32)])
+        self.assertEqual(broker.list_prefix_stats(100, '', None, 'd'),
+                         [('d/', 1, 32)])
+        self.assertEqual(
+            broker.list_prefix_stats(100, '', None, None, reverse=True),
+            [('e/', 1, 128), ('d/', 1, 32), ('a/', 3, 69)])
+        self.assertEqual(
+            broker.list_prefix_stats(100, 'e/', 'a/', None, reverse=True),
+            [('d/', 1, 32)])
+
+        # other policies are counted separately
+        broker.put_object('a/1', next(ts).internal, 256, 'text/plain',
+                          EMPTY_ETAG, storage_policy_index=1)
+        self.assertEqual(broker.list_prefix_stats(100, '', 'b', None),
+                         [('a/', 3, 69)])
+        self.assertEqual(broker.list_prefix_stats(
+            100, '', None, None, storage_policy_index=1), [('a/', 1, 256)])
+
     def test_list_objects_iter(self):
         # Test ContainerBroker.list_objects_iter
         broker = ContainerBroker(':memory:', account='a', container='c')
@@ -1784,6 +1992,112 @@ class TestContainerBroker(unittest.TestCase):
         self.assertEqual(len(items), 1)
         self.assertEqual(items[0]['name'], 'b')
 
+    def test_merge_items_batched_hash(self):
+        broker = ContainerBroker(':memory:', account='a', container='c')
+        broker.initialize(Timestamp('1').internal, 0)
+
+        def expected_hash():
+            # the rows folded into the hash one at a time
+            hash_ = '0' * 32
+            for row in broker.get_items_since(-1, 100):
+                hash_ = chexor(hash_, row['name'], row['created_at'])
+            return hash_
+
+        items = [{'name': 'o%d' % i, 'created_at': Timestamp(i).internal,
+                  'size': 0, 'content_type': 'text/plain', 'etag': 'etag',
+                  'deleted': 0, 'storage_policy_index': 0}
+                 for i in range(1, 20)]
+        broker.merge_items([dict(item) for item in items[1::2]])
+        self.assertEqual(expected_hash(),
+                         broker.get_replication_info()['hash'])
+        # overwrites delete old rows as well as adding new ones
+        updates = [dict(item, created_at=Timestamp(100 + i).internal)
+                   for i, item in enumerate(items[::3])]
+        broker.merge_items([dict(item) for item in items[::2]] + updates)
+        info = broker.get_replication_info()
+        self.assertEqual(expected_hash(), info['hash'])
+        self.assertNotEqual('0' * 32, info['hash'])
+        # removing every row brings the hash back to where it started
+        broker.remove_objects(
+            [item['ROWID'] for item in broker.get_items_since(-1, 100)])
+        self.assertEqual('0' * 32, broker.get_replication_info()['hash'])
+        # the triggers fold rows into the hash again outside of a batch
+        with broker.get() as conn:
+            conn.execute('''
+                INSERT INTO object (name, created_at, size, content_type,
+                    etag, deleted)
+                VALUES ('o1', '1', 0, 'text/plain', 'etag', 0)''')
+            conn.commit()
+        self.assertEqual(chexor('0' * 32, 'o1', '1'),
+                         broker.get_replication_info()['hash'])
+
+    def test_batched_hash_updates_error(self):
+        broker = ContainerBroker(':memory:', account='a', container='c')
+        broker.initialize(Timestamp('1').internal, 0)
+        with broker.get() as conn:
+            with self.assertRaises(ValueError):
+                with broker._batched_hash_updates(conn):
+                    conn.execute('''
+                        INSERT INTO object (name, created_at, size,
+                            content_type, etag, deleted)
+                        VALUES ('o', '1', 0, 'text/plain', 'etag', 0)''')
+                    raise ValueError('boom')
+            conn.rollback()
+        broker.put_object('o', Timestamp(2).internal, 0, 'text/plain',
+                          'etag')
+        self.assertEqual(chexor('0' * 32, 'o', Timestamp(2).internal),
+                         broker.get_replication_info()['hash'])
+
+    def test_get_range_digests(self):
+        broker1 = ContainerBroker(':memory:', account='a', container='c')
+        broker1.initialize(Timestamp('1').internal, 0)
+        broker2 = ContainerBroker(':memory:', account='a', container='c')
+        broker2.initialize(Timestamp('1').internal, 0)
+        names = ['o%02d' % i for i in range(20)]
+        for name in names:
+            broker1.put_object(name, Timestamp(1).internal, 0,
+                               'text/plain', 'etag')
+        # the same rows added in a different order
+        for name in reversed(names):
+            broker2.put_object(name, Timestamp(1).internal, 0,
+                               'text/plain', 'etag')
+        ranges = [('', 'o09'), ('o09', '')]
+        digests = broker1.get_range_digests(ranges)
+        self.assertEqual([10, 10], [count for _junk, count in digests])
+        self.assertEqual(digests, broker2.get_range_digests(ranges))
+        broker2.put_object('o15', Timestamp(2).internal, 0,
+                           'text/plain', 'etag')
+        digests2 = broker2.get_range_digests(ranges)
+        self.assertEqual(digests[0], digests2[0])
+        self.assertNotEqual(digests[1], digests2[1])
+        self.assertEqual([['%032x' % 0, 0]],
+                         broker1.get_range_digests([('o19', '')]))
+        # the rows are read in chunks without changing the digests
+        for chunk_size in (1, 3, 10):
+            self.assertEqual(digests, broker1.get_range_digests(
+                ranges, chunk_size=chunk_size))
+
+    def test_split_name_range(self):
+        broker = ContainerBroker(':memory:', account='a', container='c')
+        broker.initialize(Timestamp('1').internal, 0)
+        for i in range(10):
+            broker.put_object('o%d' % i, Timestamp(1).internal, 0,
+                              'text/plain', 'etag')
+        self.assertEqual([('', 'o4'), ('o4', '')],
+                         broker.split_name_range('', '', 2))
+        self.assertEqual([('o1', 'o3'), ('o3', 'o5'), ('o5', 'o7')],
+                         broker.split_name_range('o1', 'o7', 3))
+        self.assertEqual([('o8', '')], broker.split_name_range('o8', '', 2))
+        # more parts are made if need be to hold no more than max_rows
+        self.assertEqual([('', 'o4'), ('o4', '')],
+                         broker.split_name_range('', '', 2, max_rows=5))
+        self.assertEqual([('', 'o2'), ('o2', 'o5'), ('o5', 'o8'), ('o8', '')],
+                         broker.split_name_range('', '', 2, max_rows=3))
+        self.assertEqual(['o4', 'o5'], [
+            item['name'] for item in broker.get_items_in_range('o3', '', 2)])
+        self.assertEqual(['o9'], [
+            item['name'] for item in broker.get_items_in_range('o8', '', 2)])
+
     def test_sync_merging(self):
         # exercise the DatabaseBroker sync functions a bit
         broker1 = ContainerBroker(':memory:', account='a', container='c')
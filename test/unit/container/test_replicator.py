@@ -28,6 +28,7 @@ from swift.container.reconciler import (
     MISPLACED_OBJECTS_ACCOUNT, get_reconciler_container_name)
 from swift.common.utils import Timestamp, encode_timestamps
 from swift.common.storage_policy import POLICIES
+from swift.common.swob import HTTPServerError
 
 from test.unit.common import test_db_replicator
 from test.unit import patch_policies, make_timestamp_iter, FakeLogger
@@ -362,6 +363,166 @@ class TestReplicatorSync(test_db_replicator.TestReplicatorSync):
         self.assertEqual(len(remote_names), 101)
         self.assertEqual(remote_broker.get_info()['object_count'], 101)
 
+    def _setup_diverged_brokers(self, local_names, remote_names):
+        ts = (Timestamp(t).internal for t in
+              itertools.count(int(time.time())))
+        put_timestamp = next(ts)
+        broker = self._get_broker('a', 'c', node_index=0)
+        broker.initialize(put_timestamp, POLICIES.default.idx)
+        remote_broker = self._get_broker('a', 'c', node_index=1)
+        remote_broker.initialize(put_timestamp, POLICIES.default.idx)
+        for name in sorted(set(local_names) | set(remote_names)):
+            timestamp = next(ts)
+            for db, names in ((broker, local_names),
+                              (remote_broker, remote_names)):
+                if name in names:
+                    db.put_object(
+                        name, timestamp, 0, 'content-type', 'etag',
+                        storage_policy_index=db.storage_policy_index)
+        return broker, remote_broker
+
+    def test_digest_sync(self):
+        names = ['o%03d' % i for i in range(200)]
+        # the remote is missing a handful of rows...
+        missing = set(['o007', 'o100', 'o101', 'o199'])
+        # ...and has plenty of rows of its own
+        extra = ['x%03d' % i for i in range(400)]
+        broker, remote_broker = self._setup_diverged_brokers(
+            names, [n for n in names if n not in missing] + extra)
+        sent = []
+        digest_requests = []
+
+        def capture_merge_items(op, *args):
+            if op == 'get_range_digests':
+                digest_requests.append(args[0])
+            if op == 'merge_items':
+                sent.extend(item['name'] for item in args[0])
+                # rows aren't sent in ROWID order, so there's no source
+                self.assertIsNone(args[1])
+        db_replicator.ReplConnection = \
+            test_db_replicator.attach_fake_replication_rpc(
+                self.rpc, replicate_hook=capture_merge_items)
+        part, node = self._get_broker_part_node(remote_broker)
+        # there are too many rows to send them all in max_diffs requests
+        daemon = replicator.ContainerReplicator(
+            {'per_diff': 10, 'max_diffs': 6, 'digest_sync': 'yes',
+             'digest_fanout': 4})
+        daemon._rsync_db = mock.MagicMock(
+            side_effect=AssertionError('unexpected rsync'))
+        info = broker.get_replication_info()
+        self.assertTrue(daemon._repl_to_node(node, broker, part, info))
+        self.assertEqual(1, daemon.stats['digest'])
+        self.assertEqual(0, daemon.stats['remote_merge'])
+        self.assertTrue(missing.issubset(sent))
+        # only the rows of the few ranges that differ were sent
+        self.assertLess(len(sent), 4 * 10)
+        # the db was split up front, and no request asked for the digests
+        # of more than per_diff * max_diffs local rows
+        self.assertGreater(len(digest_requests), 1)
+        for batch in digest_requests:
+            self.assertNotEqual([['', '']], batch)
+            if len(batch) > 1:
+                self.assertLessEqual(sum(
+                    count for _junk, count in
+                    broker.get_range_digests(batch)), 10 * 6)
+        remote_names = set(item[0] for item in
+                           remote_broker.list_objects_iter(
+                               1000, '', '', '', ''))
+        self.assertEqual(set(names) | set(extra), remote_names)
+        # the sync points have moved on
+        self.assertEqual(info['max_row'], broker.get_sync(
+            remote_broker.get_info()['id'], incoming=False))
+        self.assertEqual(info['max_row'], remote_broker.get_sync(info['id']))
+        # so next time around they're in sync
+        info = broker.get_replication_info()
+        daemon = replicator.ContainerReplicator({'digest_sync': 'yes'})
+        self.assertTrue(daemon._repl_to_node(node, broker, part, info))
+        self.assertEqual(1, daemon.stats['no_change'])
+
+    def test_digest_sync_falls_back_to_rsync(self):
+        names = ['o%03d' % i for i in range(100)]
+        broker, remote_broker = self._setup_diverged_brokers(
+            names, names[:10])
+
+        class OldReplicatorRpc(replicator.ContainerReplicatorRpc):
+            def get_range_digests(self, broker, args):
+                # as a server that doesn't know the op would respond
+                return HTTPServerError()
+
+        rpc = OldReplicatorRpc(self.root, self.datadir, self.backend, False)
+        db_replicator.ReplConnection = \
+            test_db_replicator.attach_fake_replication_rpc(rpc)
+        part, node = self._get_broker_part_node(remote_broker)
+        daemon = replicator.ContainerReplicator(
+            {'per_diff': 10, 'digest_sync': 'yes'})
+        with mock.patch.object(daemon, '_rsync_db',
+                               return_value=True) as mock_rsync:
+            info = broker.get_replication_info()
+            self.assertTrue(daemon._repl_to_node(node, broker, part, info))
+        self.assertEqual(1, daemon.stats['digest'])
+        self.assertEqual(1, daemon.stats['remote_merge'])
+        self.assertEqual('rsync_then_merge',
+                         mock_rsync.call_args[1]['replicate_method'])
+
+    def test_digest_sync_timeout_falls_back_to_rsync(self):
+        names = ['o%03d' % i for i in range(100)]
+        broker, remote_broker = self._setup_diverged_brokers(
+            names, names[:10])
+
+        FakeReplConnection = \
+            test_db_replicator.attach_fake_replication_rpc(self.rpc)
+        closed = []
+
+        class SlowReplConnection(FakeReplConnection):
+            def replicate(self, op, *args):
+                if op == 'get_range_digests':
+                    # as ReplConnection does when the request times out
+                    return None
+                return super(SlowReplConnection, self).replicate(op, *args)
+
+            def close(self):
+                closed.append(True)
+
+        db_replicator.ReplConnection = SlowReplConnection
+        part, node = self._get_broker_part_node(remote_broker)
+        daemon = replicator.ContainerReplicator(
+            {'per_diff': 10, 'digest_sync': 'yes'}, logger=FakeLogger())
+        with mock.patch.object(daemon, '_rsync_db',
+                               return_value=True) as mock_rsync:
+            info = broker.get_replication_info()
+            self.assertTrue(daemon._repl_to_node(node, broker, part, info))
+        self.assertEqual(1, daemon.stats['digest'])
+        self.assertEqual(1, daemon.stats['remote_merge'])
+        self.assertEqual('rsync_then_merge',
+                         mock_rsync.call_args[1]['replicate_method'])
+        warnings = daemon.logger.get_lines_for_level('warning')
+        self.assertEqual(1, len(warnings))
+        self.assertIn('No response syncing', warnings[0])
+        # the connection that timed out isn't reused
+        self.assertEqual([True], closed)
+
+    def test_digest_sync_capped(self):
+        names = ['o%03d' % i for i in range(100)]
+        broker, remote_broker = self._setup_diverged_brokers(
+            names, names[::2])
+        part, node = self._get_broker_part_node(remote_broker)
+        daemon = replicator.ContainerReplicator(
+            {'per_diff': 10, 'max_diffs': 2, 'digest_sync': 'yes'})
+        # only max_diffs batches of rows are sent per pass
+        info = broker.get_replication_info()
+        self.assertFalse(daemon._repl_to_node(node, broker, part, info))
+        self.assertEqual(1, daemon.stats['diff_capped'])
+        self.assertLess(remote_broker.get_info()['object_count'], 100)
+        passes = 1
+        while not daemon._repl_to_node(node, broker, part, info):
+            passes += 1
+            self.assertLess(passes, 10)
+        self.assertGreaterEqual(daemon.stats['digest'], passes)
+        self.assertEqual(0, daemon.stats['diff'])
+        remote_names = [item[0] for item in remote_broker.list_objects_iter(
+            1000, '', '', '', '')]
+        self.assertEqual(names, remote_names)
+
     def test_sync_status_change(self):
         # setup a local container
         broker = self._get_broker('a', 'c', node_index=0)
@@ -1037,6 +1198,25 @@ class TestReplicatorSync(test_db_replicator.TestReplicatorSync):
         self.assertEqual(1, len(log_lines))
         self.assertIn('Failed to update sync_store', log_lines[0])
 
+    def test_post_replicate_hook_builds_prefix_stats(self):
+        ts_iter = make_timestamp_iter()
+        broker = self._get_broker('a', 'c', node_index=0)
+        broker.initialize(next(ts_iter).internal, POLICIES.default.idx)
+        broker.put_object('d/o', next(ts_iter).internal, 3, 'text/plain',
+                          'etag')
+        info = broker.get_replication_info()
+        daemon = replicator.ContainerReplicator({})
+        daemon.sync_store = mock.MagicMock()
+        daemon._post_replicate_hook(broker, info, [])
+        self.assertIsNone(broker.list_prefix_stats(10, '', None, None))
+
+        daemon = replicator.ContainerReplicator(
+            {'allow_prefix_stats': 'true'})
+        daemon.sync_store = mock.MagicMock()
+        daemon._post_replicate_hook(broker, info, [])
+        self.assertEqual([('d/', 1, 3)],
+                         broker.list_prefix_stats(10, '', None, None))
+
     def test_update_sync_store(self):
         klass = 'swift.container.sync_store.ContainerSyncStore'
         daemon = replicator.ContainerReplicator({})
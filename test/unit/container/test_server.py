@@ -13,6 +13,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import functools
 import operator
 import os
 import mock
@@ -24,6 +25,7 @@ from tempfile import mkdtemp
 from test.unit import FakeLogger
 from time import gmtime
 from xml.dom import minidom
+from xml.etree.cElementTree import Element, SubElement, tostring
 import time
 import random
 
@@ -40,7 +42,8 @@ import swift.container
 from swift.container import server as container_server
 from swift.common import constraints
 from swift.common.utils import (Timestamp, mkdirs, public, replication,
-                                storage_directory, lock_parent_directory)
+                                storage_directory, lock_parent_directory,
+                                ShardRange, coalesced_app_iter)
 from test.unit import fake_http_connect, debug_logger
 from swift.common.storage_policy import (POLICIES, StoragePolicy)
 from swift.common.request_helpers import get_sys_meta_prefix
@@ -335,10 +338,11 @@ class TestContainerController(unittest.TestCase):
         req.content_length = 0
         resp = server_handler.OPTIONS(req)
         self.assertEqual(200, resp.status_int)
-        for verb in 'OPTIONS GET POST PUT DELETE HEAD REPLICATE'.split():
+        for verb in 'OPTIONS GET POST PUT DELETE HEAD REPLICATE ' \
+                'UPDATE'.split():
             self.assertTrue(
                 verb in resp.headers['Allow'].split(', '))
-        self.assertEqual(len(resp.headers['Allow'].split(', ')), 7)
+        self.assertEqual(len(resp.headers['Allow'].split(', ')), 8)
         self.assertEqual(resp.headers['Server'],
                          (self.controller.server_type + '/' + swift_version))
 
@@ -1585,6 +1589,68 @@ class TestContainerController(unittest.TestCase):
         resp = req.get_response(self.controller)
         self.assertEqual(resp.status_int, 404)
 
+    def test_UPDATE(self):
+        ts = (Timestamp(t).internal for t in itertools.count(1))
+        for container in ('c1', 'c2'):
+            req = Request.blank('/sda1/p/a/%s' % container, method='PUT',
+                                headers={'X-Timestamp': next(ts)})
+            self.assertEqual(201, req.get_response(self.controller).status_int)
+
+        def put_headers(size=None):
+            headers = {'X-Timestamp': next(ts)}
+            if size is not None:
+                headers.update({'X-Size': size, 'X-Content-Type': 'text/plain',
+                                'X-Etag': 'x'})
+            req = Request.blank('/', headers=headers)
+            self._update_object_put_headers(req)
+            return dict(req.headers)
+
+        updates = [
+            {'op': 'PUT', 'account': 'a', 'container': 'c1', 'obj': 'o1',
+             'headers': put_headers(1)},
+            {'op': 'PUT', 'account': 'a', 'container': 'c1',
+             'obj': u'\N{SNOWMAN}', 'headers': put_headers(2)},
+            {'op': 'PUT', 'account': 'a', 'container': 'c2', 'obj': 'o1',
+             'headers': put_headers(4)},
+            {'op': 'DELETE', 'account': 'a', 'container': 'c1', 'obj': 'o1',
+             'headers': put_headers()},
+            # no such container
+            {'op': 'PUT', 'account': 'a', 'container': 'c3', 'obj': 'o1',
+             'headers': put_headers(8)},
+            # bad updates
+            {'op': 'PUT', 'account': 'a', 'container': 'c1', 'obj': 'o2',
+             'headers': {}},
+            {'op': 'POST', 'account': 'a', 'container': 'c1', 'obj': 'o2',
+             'headers': {}},
+            {'op': 'PUT', 'account': 'a', 'container': 'c1'},
+            'junk',
+        ]
+        req = Request.blank('/sda1/p', method='UPDATE',
+                            body=json.dumps(updates))
+        resp = req.get_response(self.controller)
+        self.assertEqual(200, resp.status_int)
+        self.assertEqual([201, 201, 201, 204, 404, 400, 400, 400, 400],
+                         json.loads(resp.body))
+
+        for container, names, size in (
+                ('c1', [u'\N{SNOWMAN}'], 2), ('c2', ['o1'], 4)):
+            req = Request.blank('/sda1/p/a/%s' % container, method='GET',
+                                query_string='format=json')
+            resp = req.get_response(self.controller)
+            listing = json.loads(resp.body)
+            self.assertEqual(names, [obj['name'] for obj in listing])
+            self.assertEqual(size, sum(obj['bytes'] for obj in listing))
+
+        for body in ('not json', '{}'):
+            req = Request.blank('/sda1/p', method='UPDATE', body=body)
+            self.assertEqual(400, req.get_response(self.controller).status_int)
+
+    def test_UPDATE_insufficient_storage(self):
+        self.controller = container_server.ContainerController(
+            {'devices': self.testdir, 'mount_check': 'true'})
+        req = Request.blank('/sda-null/p', method='UPDATE', body='[]')
+        self.assertEqual(507, req.get_response(self.controller).status_int)
+
     def test_object_update_with_offset(self):
         ts = (Timestamp(t).internal for t in
               itertools.count(int(time.time())))
@@ -2602,6 +2668,303 @@ class TestContainerController(unittest.TestCase):
               "content_type": "text/plain",
               "last_modified": "1970-01-01T00:00:01.000000"}])
 
+    def test_GET_xml_empty_container(self):
+        req = Request.blank(
+            '/sda1/p/a/c', environ={'REQUEST_METHOD': 'PUT',
+                                    'HTTP_X_TIMESTAMP': '0'})
+        resp = req.get_response(self.controller)
+        self.assertEqual(resp.status_int, 201)
+        req = Request.blank('/sda1/p/a/c?format=xml',
+                            environ={'REQUEST_METHOD': 'GET'})
+        resp = req.get_response(self.controller)
+        self.assertEqual(resp.status_int, 200)
+        self.assertEqual(
+            resp.body, '<?xml version="1.0" encoding="UTF-8"?>\n'
+            '<container name="c" />')
+
+    def test_GET_xml_matches_elementtree(self):
+        container = 'c&<"\xe2\x98\x83">'
+        req = Request.blank(
+            '/sda1/p/a/%s' % container,
+            environ={'REQUEST_METHOD': 'PUT', 'HTTP_X_TIMESTAMP': '0'})
+        resp = req.get_response(self.controller)
+        self.assertEqual(resp.status_int, 201)
+        objects = (('a&b<c>"d"', 'text/plain'),
+                   ('sub/\xe2\x98\x83', 'text/plain'),
+                   ('sub/x', 'text/plain'),
+                   ('z\xe2\x98\x83', ''))
+        for name, content_type in objects:
+            req = Request.blank(
+                '/sda1/p/a/%s/%s' % (container, name),
+                environ={
+                    'REQUEST_METHOD': 'PUT', 'HTTP_X_TIMESTAMP': '1',
+                    'HTTP_X_CONTENT_TYPE': content_type, 'HTTP_X_ETAG': 'x',
+                    'HTTP_X_SIZE': 0})
+            self._update_object_put_headers(req)
+            resp = req.get_response(self.controller)
+            self.assertEqual(resp.status_int, 201)
+
+        doc = Element('container', name=container.decode('utf-8'))
+        obj = SubElement(doc, 'object')
+        for field, value in (('name', objects[0][0]), ('hash', 'x'),
+                             ('bytes', '0'), ('content_type', 'text/plain'),
+                             ('last_modified', '1970-01-01T00:00:01.000000')):
+            SubElement(obj, field).text = value.decode('utf-8')
+        sub = SubElement(doc, 'subdir', name=u'sub/')
+        SubElement(sub, 'name').text = u'sub/'
+        obj = SubElement(doc, 'object')
+        for field, value in (('name', objects[3][0]), ('hash', 'x'),
+                             ('bytes', '0'), ('content_type', ''),
+                             ('last_modified', '1970-01-01T00:00:01.000000')):
+            SubElement(obj, field).text = value.decode('utf-8')
+        expected = tostring(doc, encoding='UTF-8').replace(
+            "<?xml version='1.0' encoding='UTF-8'?>",
+            '<?xml version="1.0" encoding="UTF-8"?>', 1)
+
+        req = Request.blank('/sda1/p/a/%s?format=xml&delimiter=/' % container,
+                            environ={'REQUEST_METHOD': 'GET'})
+        resp = req.get_response(self.controller)
+        self.assertEqual(resp.status_int, 200)
+        self.assertEqual(resp.body, expected)
+
+    def test_GET_listing_is_streamed(self):
+        req = Request.blank(
+            '/sda1/p/a/c', environ={'REQUEST_METHOD': 'PUT',
+                                    'HTTP_X_TIMESTAMP': '0'})
+        resp = req.get_response(self.controller)
+        for i in range(3):
+            req = Request.blank(
+                '/sda1/p/a/c/%s' % i,
+                environ={
+                    'REQUEST_METHOD': 'PUT', 'HTTP_X_TIMESTAMP': '1',
+                    'HTTP_X_CONTENT_TYPE': 'text/plain', 'HTTP_X_ETAG': 'x',
+                    'HTTP_X_SIZE': 0})
+            self._update_object_put_headers(req)
+            resp = req.get_response(self.controller)
+            self.assertEqual(resp.status_int, 201)
+
+        for fmt in ('json', 'xml'):
+            req = Request.blank('/sda1/p/a/c?format=%s' % fmt,
+                                environ={'REQUEST_METHOD': 'GET'})
+            resp = self.controller.GET(req)
+            self.assertEqual(resp.status_int, 200)
+            # a listing that fits in one chunk has a Content-Length...
+            self.assertEqual(resp.content_length, len(resp.body))
+
+            # ...but a longer one is streamed
+            req = Request.blank('/sda1/p/a/c?format=%s' % fmt,
+                                environ={'REQUEST_METHOD': 'GET'})
+            with mock.patch.object(
+                    container_server, 'coalesced_app_iter',
+                    functools.partial(coalesced_app_iter, chunk_size=16)):
+                resp = self.controller.GET(req)
+            self.assertEqual(resp.status_int, 200)
+            self.assertIsNone(resp.content_length)
+            self.assertFalse(isinstance(resp.app_iter, (list, tuple)))
+
+        req = Request.blank('/sda1/p/a/c?format=json',
+                            environ={'REQUEST_METHOD': 'GET'})
+        resp = req.get_response(self.controller)
+        self.assertEqual(
+            json.loads(resp.body),
+            [{"name": str(i), "hash": "x", "bytes": 0,
+              "content_type": "text/plain",
+              "last_modified": "1970-01-01T00:00:01.000000"}
+             for i in range(3)])
+
+    def test_GET_prefix_stats(self):
+        req = Request.blank(
+            '/sda1/p/a/c', environ={'REQUEST_METHOD': 'PUT',
+                                    'HTTP_X_TIMESTAMP': '0'})
+        resp = req.get_response(self.controller)
+        for name, size in (('US/TX', 1), ('US/OK/B', 2), ('EU/FR', 4),
+                           ('top', 8)):
+            req = Request.blank(
+                '/sda1/p/a/c/%s' % name,
+                environ={
+                    'REQUEST_METHOD': 'PUT', 'HTTP_X_TIMESTAMP': '1',
+                    'HTTP_X_CONTENT_TYPE': 'text/plain', 'HTTP_X_ETAG': 'x',
+                    'HTTP_X_SIZE': size})
+            self._update_object_put_headers(req)
+            resp = req.get_response(self.controller)
+            self.assertEqual(resp.status_int, 201)
+
+        # disabled by default, so the param is ignored
+        req = Request.blank('/sda1/p/a/c?prefix_stats=true',
+                            environ={'REQUEST_METHOD': 'GET'})
+        resp = req.get_response(self.controller)
+        self.assertEqual(resp.body, 'EU/FR\nUS/OK/B\nUS/TX\ntop\n')
+        self.assertNotIn('X-Backend-Prefix-Stats', resp.headers)
+
+        # the stats aren't there until the replicator has built them
+        self.controller.allow_prefix_stats = True
+        req = Request.blank('/sda1/p/a/c?prefix_stats=true',
+                            environ={'REQUEST_METHOD': 'GET'})
+        resp = req.get_response(self.controller)
+        self.assertEqual(resp.status_int, 503)
+
+        self.controller._get_container_broker(
+            'sda1', 'p', 'a', 'c').enable_prefix_stats()
+        req = Request.blank('/sda1/p/a/c?prefix_stats=true',
+                            environ={'REQUEST_METHOD': 'GET'})
+        resp = req.get_response(self.controller)
+        self.assertEqual(resp.status_int, 200)
+        self.assertEqual(resp.body, 'EU/\nUS/\n')
+        self.assertEqual(resp.headers['X-Backend-Prefix-Stats'], 'true')
+
+        req = Request.blank('/sda1/p/a/c?prefix_stats=true&format=json',
+                            environ={'REQUEST_METHOD': 'GET'})
+        resp = req.get_response(self.controller)
+        self.assertEqual(resp.status_int, 200)
+        self.assertEqual(json.loads(resp.body),
+                         [{'subdir': 'EU/', 'count': 1, 'bytes': 4},
+                          {'subdir': 'US/', 'count': 2, 'bytes': 3}])
+
+        req = Request.blank(
+            '/sda1/p/a/c?prefix_stats=true&format=json&marker=EU/',
+            environ={'REQUEST_METHOD': 'GET'})
+        resp = req.get_response(self.controller)
+        self.assertEqual(json.loads(resp.body),
+                         [{'subdir': 'US/', 'count': 2, 'bytes': 3}])
+
+        req = Request.blank('/sda1/p/a/c?prefix_stats=true&format=xml',
+                            environ={'REQUEST_METHOD': 'GET'})
+        resp = req.get_response(self.controller)
+        self.assertEqual(
+            resp.body, '<?xml version="1.0" encoding="UTF-8"?>\n'
+            '<container name="c">'
+            '<subdir name="EU/"><name>EU/</name><bytes>4</bytes>'
+            '<count>1</count></subdir>'
+            '<subdir name="US/"><name>US/</name><bytes>3</bytes>'
+            '<count>2</count></subdir></container>')
+
+        req = Request.blank('/sda1/p/a/c?prefix_stats=true&prefix=X',
+                            environ={'REQUEST_METHOD': 'GET'})
+        resp = req.get_response(self.controller)
+        self.assertEqual(resp.status_int, 204)
+
+    def test_GET_prefix_stats_conf(self):
+        self.assertFalse(self.controller.allow_prefix_stats)
+        controller = container_server.ContainerController(
+            {'devices': self.testdir, 'mount_check': 'false',
+             'allow_prefix_stats': 'true'})
+        self.assertTrue(controller.allow_prefix_stats)
+
+    def test_PUT_GET_shard_ranges(self):
+        req = Request.blank(
+            '/sda1/p/a/c', environ={'REQUEST_METHOD': 'PUT',
+                                    'HTTP_X_TIMESTAMP': '0'})
+        resp = req.get_response(self.controller)
+        self.assertEqual(resp.status_int, 201)
+        shard_headers = {'X-Backend-Record-Type': 'shard',
+                         'X-Timestamp': Timestamp(1).internal}
+
+        # nothing to see yet
+        req = Request.blank('/sda1/p/a/c', method='GET',
+                            headers=shard_headers)
+        resp = req.get_response(self.controller)
+        self.assertEqual(resp.status_int, 200)
+        self.assertEqual('shard', resp.headers['X-Backend-Record-Type'])
+        self.assertEqual([], json.loads(resp.body))
+        req = Request.blank('/sda1/p/a/c', method='HEAD')
+        resp = req.get_response(self.controller)
+        self.assertNotIn('X-Backend-Sharding-State', resp.headers)
+
+        ranges = [ShardRange('.shards_a/c1', Timestamp(1), '', 'm',
+                             object_count=2, bytes_used=3),
+                  ShardRange('.shards_a/c2', Timestamp(1), 'm', '',
+                             object_count=4, bytes_used=5)]
+        req = Request.blank('/sda1/p/a/c', method='PUT',
+                            headers=shard_headers,
+                            body=json.dumps([dict(sr) for sr in ranges]))
+        resp = req.get_response(self.controller)
+        self.assertEqual(resp.status_int, 202)
+
+        req = Request.blank('/sda1/p/a/c', method='GET',
+                            headers=shard_headers)
+        resp = req.get_response(self.controller)
+        self.assertEqual(resp.status_int, 200)
+        self.assertEqual([dict(sr) for sr in ranges], json.loads(resp.body))
+        req = Request.blank('/sda1/p/a/c?includes=x', method='GET',
+                            headers=shard_headers)
+        resp = req.get_response(self.controller)
+        self.assertEqual([dict(ranges[1])], json.loads(resp.body))
+
+        # the root reports the stats of its shards
+        for method in ('HEAD', 'GET'):
+            req = Request.blank('/sda1/p/a/c', method=method)
+            resp = req.get_response(self.controller)
+            self.assertEqual('sharded',
+                             resp.headers['X-Backend-Sharding-State'])
+            self.assertEqual('6', resp.headers['X-Container-Object-Count'])
+            self.assertEqual('8', resp.headers['X-Container-Bytes-Used'])
+
+        # a sharded container with objects in its shards is not empty
+        req = Request.blank('/sda1/p/a/c', method='DELETE',
+                            headers={'X-Timestamp': Timestamp(2).internal})
+        resp = req.get_response(self.controller)
+        self.assertEqual(resp.status_int, 409)
+
+    def test_PUT_shard_ranges_errors(self):
+        shard_headers = {'X-Backend-Record-Type': 'shard',
+                         'X-Timestamp': Timestamp(1).internal}
+        req = Request.blank('/sda1/p/a/c', method='PUT',
+                            headers=shard_headers, body='[]')
+        resp = req.get_response(self.controller)
+        self.assertEqual(resp.status_int, 404)
+
+        req = Request.blank(
+            '/sda1/p/a/c', environ={'REQUEST_METHOD': 'PUT',
+                                    'HTTP_X_TIMESTAMP': '0'})
+        resp = req.get_response(self.controller)
+        self.assertEqual(resp.status_int, 201)
+        for body in ('not json', '{}', '[{"name": ".shards_a/c"}]',
+                     '[{"name": "s", "timestamp": "1", "lower": "b", '
+                     '"upper": "a"}]'):
+            req = Request.blank('/sda1/p/a/c', method='PUT',
+                                headers=shard_headers, body=body)
+            resp = req.get_response(self.controller)
+            self.assertEqual(resp.status_int, 400, body)
+
+    def test_sharding_state(self):
+        req = Request.blank(
+            '/sda1/p/a/c', environ={'REQUEST_METHOD': 'PUT',
+                                    'HTTP_X_TIMESTAMP': '0'})
+        self.assertEqual(req.get_response(self.controller).status_int, 201)
+        req = Request.blank(
+            '/sda1/p/a/c/o', method='PUT',
+            headers={'X-Timestamp': Timestamp(1).internal, 'X-Size': '0',
+                     'X-Content-Type': 'text/plain', 'X-Etag': 'x'})
+        self._update_object_put_headers(req)
+        self.assertEqual(req.get_response(self.controller).status_int, 201)
+        shard_range = ShardRange('.shards_a/c1', Timestamp(1), '', '')
+        req = Request.blank('/sda1/p/a/c', method='PUT',
+                            headers={'X-Backend-Record-Type': 'shard',
+                                     'X-Timestamp': Timestamp(1).internal},
+                            body=json.dumps([dict(shard_range)]))
+        self.assertEqual(req.get_response(self.controller).status_int, 202)
+
+        # the root's own row has yet to be moved to its shard
+        for method in ('HEAD', 'GET'):
+            req = Request.blank('/sda1/p/a/c', method=method)
+            resp = req.get_response(self.controller)
+            self.assertEqual('sharding',
+                             resp.headers['X-Backend-Sharding-State'])
+        req = Request.blank('/sda1/p/a/c?format=json')
+        resp = req.get_response(self.controller)
+        self.assertEqual(['o'], [obj['name'] for obj in json.loads(resp.body)])
+
+        req = Request.blank(
+            '/sda1/p/a/c/o', method='DELETE',
+            headers={'X-Timestamp': Timestamp(2).internal})
+        self._update_object_put_headers(req)
+        self.assertEqual(req.get_response(self.controller).status_int, 204)
+        for method in ('HEAD', 'GET'):
+            req = Request.blank('/sda1/p/a/c', method=method)
+            resp = req.get_response(self.controller)
+            self.assertEqual('sharded',
+                             resp.headers['X-Backend-Sharding-State'])
+
     def test_GET_insufficient_storage(self):
         self.controller = container_server.ContainerController(
             {'devices': self.testdir})
@@ -0,0 +1,292 @@
+# Copyright (c) 2010-2012 OpenStack Foundation
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+# implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import itertools
+import os
+import time
+import unittest
+from shutil import rmtree
+from tempfile import mkdtemp
+
+import mock
+
+from swift.common import utils
+from swift.common.utils import Timestamp, ShardRange, hash_path, \
+    storage_directory
+from swift.container import sharder
+from swift.container.backend import ContainerBroker, DATADIR
+
+from test.unit import FakeRing, debug_logger
+
+
+class TestContainerSharder(unittest.TestCase):
+
+    def setUp(self):
+        utils.HASH_PATH_SUFFIX = 'endcap'
+        utils.HASH_PATH_PREFIX = 'startcap'
+        self.testdir = mkdtemp()
+        self.devices = os.path.join(self.testdir, 'node')
+        os.mkdir(self.devices)
+        self.logger = debug_logger()
+        # the sharder stamps its own changes with the current time
+        self.ts_iter = (Timestamp(t) for t in
+                        itertools.count(int(time.time()) - 1000))
+        self.ring = FakeRing()
+
+    def tearDown(self):
+        rmtree(self.testdir, ignore_errors=True)
+
+    def _make_sharder(self, **conf_updates):
+        conf = {'devices': self.devices, 'mount_check': 'false',
+                'recon_cache_path': self.testdir}
+        conf.update(conf_updates)
+        container_sharder = sharder.ContainerSharder(conf, logger=self.logger)
+        container_sharder.ring = self.ring
+        return container_sharder
+
+    def _make_broker(self, account, container, names=()):
+        part, nodes = self.ring.get_nodes(account, container)
+        hsh = hash_path(account, container)
+        db_path = os.path.join(self.devices, 'sda',
+                               storage_directory(DATADIR, part, hsh),
+                               hsh + '.db')
+        broker = ContainerBroker(db_path, account=account,
+                                 container=container)
+        broker.initialize(next(self.ts_iter).internal, 0)
+        for name in names:
+            broker.put_object(name, next(self.ts_iter).internal, 1,
+                              'text/plain', 'etag')
+        return broker
+
+    def _get_broker(self, account, container):
+        part = self.ring.get_part(account, container)
+        hsh = hash_path(account, container)
+        return ContainerBroker(os.path.join(
+            self.devices, 'sda', storage_directory(DATADIR, part, hsh),
+            hsh + '.db'))
+
+    def _object_names(self, broker):
+        return [record[0] for record in broker.list_objects_iter(
+            100, '', None, None, None)]
+
+    def test_split_root(self):
+        names = ['o%02d' % i for i in range(10)]
+        broker = self._make_broker('a', 'c', names)
+        container_sharder = self._make_sharder(
+            auto_shard='true', shard_container_threshold='4',
+            shard_batch_size='3')
+        with mock.patch.object(container_sharder, '_is_leader',
+                               return_value=True), \
+                mock.patch.object(sharder,
+                                  'direct_put_container_shard_ranges') \
+                as mock_put:
+            container_sharder._process_broker(broker, 'sda')
+
+        shard_ranges = broker.get_shard_ranges()
+        self.assertEqual(['', 'o01', 'o03', 'o05', 'o07'],
+                         [sr.lower for sr in shard_ranges])
+        self.assertEqual(['o01', 'o03', 'o05', 'o07', ''],
+                         [sr.upper for sr in shard_ranges])
+        # the root's replicas all learn about the new shard ranges
+        self.assertEqual(3, mock_put.call_count)
+        for call in mock_put.call_args_list:
+            self.assertEqual(('a', 'c'), call[0][2:4])
+            self.assertEqual([dict(sr) for sr in shard_ranges],
+                             call[0][4])
+        # and every object row has moved to its shard
+        self.assertEqual([], self._object_names(broker))
+        moved = []
+        for shard_range in shard_ranges:
+            shard_broker = self._get_broker(shard_range.account,
+                                            shard_range.container)
+            shard_names = self._object_names(shard_broker)
+            for name in shard_names:
+                self.assertIn(name, shard_range)
+            moved.extend(shard_names)
+        self.assertEqual(names, moved)
+        self.assertEqual(10, container_sharder.stats['moved'])
+        self.assertEqual(1, container_sharder.stats['split'])
+
+    def test_split_root_with_prefix_stats(self):
+        names = ['d%d/o%02d' % (i // 4, i) for i in range(10)]
+        broker = self._make_broker('a', 'c', names)
+        broker.enable_prefix_stats()
+        container_sharder = self._make_sharder(
+            auto_shard='true', shard_container_threshold='4',
+            shard_batch_size='3')
+        with mock.patch.object(container_sharder, '_is_leader',
+                               return_value=True), \
+                mock.patch.object(sharder,
+                                  'direct_put_container_shard_ranges'):
+            container_sharder._process_broker(broker, 'sda')
+
+        shard_ranges = broker.get_shard_ranges()
+        self.assertEqual(5, len(shard_ranges))
+        # the shards keep the stats of their own rows from the start
+        totals = {}
+        for shard_range in shard_ranges:
+            shard_broker = self._get_broker(shard_range.account,
+                                            shard_range.container)
+            for prefix, count, bytes_used in shard_broker.list_prefix_stats(
+                    100, '', None, None):
+                totals[prefix] = totals.get(prefix, 0) + count
+        self.assertEqual({'d0/': 4, 'd1/': 4, 'd2/': 2}, totals)
+        self.assertEqual([], broker.list_prefix_stats(100, '', None, None))
+
+    def test_root_not_split_below_threshold_or_when_not_leader(self):
+        broker = self._make_broker('a', 'c', ['o1', 'o2', 'o3'])
+        container_sharder = self._make_sharder(
+            auto_shard='true', shard_container_threshold='4')
+        with mock.patch.object(container_sharder, '_is_leader',
+                               return_value=True), \
+                mock.patch.object(sharder,
+                                  'direct_put_container_shard_ranges') \
+                as mock_put:
+            container_sharder._process_broker(broker, 'sda')
+        broker.put_object('o4', next(self.ts_iter).internal, 1,
+                          'text/plain', 'etag')
+        with mock.patch.object(container_sharder, '_is_leader',
+                               return_value=False), \
+                mock.patch.object(sharder,
+                                  'direct_put_container_shard_ranges') \
+                as mock_put:
+            container_sharder._process_broker(broker, 'sda')
+        self.assertFalse(mock_put.called)
+        self.assertEqual([], broker.get_shard_ranges())
+        self.assertEqual(['o1', 'o2', 'o3', 'o4'],
+                         self._object_names(broker))
+
+    def test_shard_moves_misplaced_rows_and_reports_stats(self):
+        ts = next(self.ts_iter)
+        lower_range = ShardRange.create('a', 'c', '', 'm', ts)
+        upper_range = ShardRange.create('a', 'c', 'm', '', ts)
+        broker = self._make_broker(upper_range.account,
+                                   upper_range.container, ['b', 'n', 'z'])
+        container_sharder = self._make_sharder()
+        root_ranges = [dict(lower_range), dict(upper_range)]
+        with mock.patch.object(container_sharder, '_is_leader',
+                               return_value=True), \
+                mock.patch.object(sharder,
+                                  'direct_get_container_shard_ranges',
+                                  return_value=({}, root_ranges)), \
+                mock.patch.object(sharder,
+                                  'direct_put_container_shard_ranges') \
+                as mock_put:
+            container_sharder._process_broker(broker, 'sda')
+
+        self.assertEqual(['n', 'z'], self._object_names(broker))
+        lower_broker = self._get_broker(lower_range.account,
+                                        lower_range.container)
+        self.assertEqual(['b'], self._object_names(lower_broker))
+        self.assertEqual(3, mock_put.call_count)
+        reported = [ShardRange.from_dict(sr)
+                    for sr in mock_put.call_args[0][4]]
+        self.assertEqual(1, len(reported))
+        self.assertEqual(upper_range.name, reported[0].name)
+        self.assertEqual(upper_range.timestamp, reported[0].timestamp)
+        self.assertEqual(2, reported[0].object_count)
+        self.assertEqual(2, reported[0].bytes_used)
+        self.assertGreater(reported[0].meta_timestamp, ts)
+
+    def test_shard_no_stats_report_when_unchanged(self):
+        ts = next(self.ts_iter)
+        shard_range = ShardRange.create('a', 'c', '', '', ts)
+        broker = self._make_broker(shard_range.account,
+                                   shard_range.container, ['b'])
+        shard_range.object_count = shard_range.bytes_used = 1
+        container_sharder = self._make_sharder()
+        with mock.patch.object(container_sharder, '_is_leader',
+                               return_value=True), \
+                mock.patch.object(sharder,
+                                  'direct_get_container_shard_ranges',
+                                  return_value=({}, [dict(shard_range)])), \
+                mock.patch.object(sharder,
+                                  'direct_put_container_shard_ranges') \
+                as mock_put:
+            container_sharder._process_broker(broker, 'sda')
+        self.assertFalse(mock_put.called)
+        self.assertEqual(['b'], self._object_names(broker))
+
+    def test_orphan_shard_returns_rows_to_root(self):
+        shard_range = ShardRange.create('a', 'c', '', '', next(self.ts_iter))
+        broker = self._make_broker(shard_range.account,
+                                   shard_range.container, ['b', 'n'])
+        container_sharder = self._make_sharder()
+        with mock.patch.object(sharder,
+                               'direct_get_container_shard_ranges',
+                               return_value=({}, [])):
+            container_sharder._process_broker(broker, 'sda')
+        root_broker = self._get_broker('a', 'c')
+        self.assertEqual(['b', 'n'], self._object_names(root_broker))
+        self.assertTrue(broker.is_deleted())
+
+    def test_shard_skipped_when_root_unavailable(self):
+        shard_range = ShardRange.create('a', 'c', 'm', '', next(self.ts_iter))
+        broker = self._make_broker(shard_range.account,
+                                   shard_range.container, ['b', 'n'])
+        container_sharder = self._make_sharder()
+        with mock.patch.object(sharder,
+                               'direct_get_container_shard_ranges',
+                               side_effect=Exception('boom')):
+            container_sharder._process_broker(broker, 'sda')
+        self.assertEqual(['b', 'n'], self._object_names(broker))
+        self.assertEqual(3, len(self.logger.get_lines_for_level('warning')))
+
+    def test_shrink_waits_for_stats(self):
+        ts = next(self.ts_iter)
+        broker = self._make_broker('a', 'c')
+        shard_ranges = [ShardRange.create('a', 'c', '', 'm', ts),
+                        ShardRange.create('a', 'c', 'm', '', ts)]
+        broker.merge_shard_ranges(shard_ranges)
+        container_sharder = self._make_sharder(
+            auto_shard='true', shard_container_threshold='10',
+            shard_shrink_threshold='2')
+        with mock.patch.object(container_sharder, '_is_leader',
+                               return_value=True), \
+                mock.patch.object(sharder,
+                                  'direct_put_container_shard_ranges'):
+            container_sharder._process_broker(broker, 'sda')
+        self.assertEqual(shard_ranges, broker.get_shard_ranges())
+
+        # once both shards have reported, the small pair is merged
+        meta_ts = next(self.ts_iter)
+        broker.merge_shard_ranges([
+            shard_ranges[0].copy(object_count=1, meta_timestamp=meta_ts),
+            shard_ranges[1].copy(object_count=2, meta_timestamp=meta_ts)])
+        with mock.patch.object(container_sharder, '_is_leader',
+                               return_value=True), \
+                mock.patch.object(sharder,
+                                  'direct_put_container_shard_ranges'):
+            container_sharder._process_broker(broker, 'sda')
+        new_ranges = broker.get_shard_ranges()
+        self.assertEqual(1, len(new_ranges))
+        self.assertEqual(('', ''), (new_ranges[0].lower, new_ranges[0].upper))
+        self.assertEqual(3, new_ranges[0].object_count)
+        self.assertEqual(1, container_sharder.stats['shrunk'])
+
+    def test_run_once_dumps_recon(self):
+        self._make_broker('a', 'c', ['o1'])
+        container_sharder = self._make_sharder()
+        with mock.patch.object(sharder, 'whataremyips',
+                               return_value=['10.0.0.0']):
+            container_sharder.run_once()
+        self.assertEqual(1, container_sharder.stats['visited'])
+        self.assertEqual(0, container_sharder.stats['errors'])
+        self.assertTrue(os.path.exists(
+            os.path.join(self.testdir, 'container.recon')))
+
+
+if __name__ == '__main__':
+    unittest.main()
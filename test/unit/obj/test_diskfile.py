@@ -38,6 +38,7 @@ from contextlib import closing, contextmanager
 from gzip import GzipFile
 import pyeclib.ec_iface
 
+import eventlet
 from eventlet import hubs, timeout, tpool
 from swift.obj.diskfile import MD5_OF_EMPTY_STRING, update_auditor_status
 from test.unit import (FakeLogger, mock as unit_mock, temptree,
@@ -54,7 +55,8 @@ from swift.common.splice import splice
 from swift.common.exceptions import DiskFileNotExist, DiskFileQuarantined, \
     DiskFileDeviceUnavailable, DiskFileDeleted, DiskFileNotOpen, \
     DiskFileError, ReplicationLockTimeout, DiskFileCollision, \
-    DiskFileExpired, SwiftException, DiskFileNoSpace, DiskFileXattrNotSupported
+    DiskFileExpired, SwiftException, DiskFileNoSpace, \
+    DiskFileXattrNotSupported, DiskFileDeviceBusy
 from swift.common.storage_policy import (
     POLICIES, get_policy_string, StoragePolicy, ECStoragePolicy,
     BaseStoragePolicy, REPL_POLICY, EC_POLICY)
@@ -581,6 +583,54 @@ class TestDiskFileRouter(unittest.TestCase):
                 self.assertTrue(isinstance(manager, TestDiskFileManager))
 
 
+class TestDeviceIOExecutor(unittest.TestCase):
+
+    def setUp(self):
+        self._orig_tpool_exc = tpool.execute
+        tpool.execute = lambda f, *args, **kwargs: f(*args, **kwargs)
+
+    def tearDown(self):
+        tpool.execute = self._orig_tpool_exc
+
+    def test_run_in_thread(self):
+        executor = diskfile.DeviceIOExecutor(2, 0)
+        self.assertEqual(3, executor.run_in_thread(lambda a, b=0: a + b,
+                                                   1, b=2))
+        self.assertRaises(ZeroDivisionError, executor.run_in_thread,
+                          lambda: 1 / 0)
+        # the threads are given back
+        self.assertEqual(4, executor.force_run_in_thread(lambda: 4))
+        self.assertFalse(executor._semaphore.locked())
+        self.assertEqual(0, executor.queued)
+
+    def test_max_queued(self):
+        executor = diskfile.DeviceIOExecutor(1, 1)
+        unblock = eventlet.event.Event()
+        ran = []
+
+        def blocked(name):
+            unblock.wait()
+            ran.append(name)
+
+        running = eventlet.spawn(executor.run_in_thread, blocked, 'running')
+        eventlet.sleep(0)
+        queued = eventlet.spawn(executor.run_in_thread, blocked, 'queued')
+        eventlet.sleep(0)
+        self.assertEqual(1, executor.queued)
+        # the device is saturated
+        self.assertRaises(DiskFileDeviceBusy, executor.run_in_thread,
+                          blocked, 'refused')
+        forced = eventlet.spawn(executor.force_run_in_thread, blocked,
+                                'forced')
+        eventlet.sleep(0)
+        self.assertEqual(2, executor.queued)
+        unblock.send()
+        for gt in (running, queued, forced):
+            gt.wait()
+        self.assertEqual(['running', 'queued', 'forced'], ran)
+        self.assertEqual(0, executor.queued)
+
+
 class BaseDiskFileTestMixin(object):
     """
     Bag of helpers that are useful in the per-policy DiskFile test classes.
@@ -3349,6 +3399,172 @@ class DiskFileMixin(BaseDiskFileTestMixin):
                 pass
             self.assertTrue(goo.called)
 
+    def _spy_on_reads(self, reader):
+        reader._fp = mock.MagicMock(wraps=reader._fp)
+        return reader._fp.read
+
+    def test_reads_sized_to_object(self):
+        df = self._get_open_disk_file(fsize=1000, csize=65536)
+        self.assertEqual(0, self.df_mgr.disk_read_ahead_size)
+        self.assertEqual(0, self.df_mgr.disk_threadpool_read_size)
+        reader = df.reader()
+        mock_read = self._spy_on_reads(reader)
+        body = ''.join(reader)
+        self.assertEqual(reader._obj_size, len(body))
+        # a small object takes a single read
+        self.assertEqual([mock.call(reader._obj_size)],
+                         mock_read.call_args_list)
+        self.assertTrue(reader._read_to_eof)
+
+        df = self._get_open_disk_file(fsize=100000, csize=256)
+        reader = df.reader()
+        mock_read = self._spy_on_reads(reader)
+        self.assertEqual(reader._obj_size, len(''.join(reader)))
+        sizes = [args[0] for args, _ in mock_read.call_args_list]
+        self.assertEqual(reader._obj_size, sum(sizes))
+        self.assertEqual(set([256]), set(sizes[:-1]))
+
+    def test_reads_sized_to_range(self):
+        df = self._get_open_disk_file(fsize=100000, csize=256)
+        reader = df.reader()
+        reader._suppress_file_closing = True
+        mock_read = self._spy_on_reads(reader)
+        # the reads for a range well before the end stop at its end...
+        self.assertEqual(300, len(''.join(reader.app_iter_range(0, 300))))
+        read_stop = reader._get_read_stop(300)
+        self.assertGreaterEqual(read_stop, 300)
+        self.assertLess(read_stop, reader._obj_size)
+        self.assertEqual(read_stop, sum(
+            args[0] for args, _ in mock_read.call_args_list))
+        self.assertFalse(reader._read_to_eof)
+
+        # ...but go on to the end for one near the end
+        mock_read.reset_mock()
+        start = reader._obj_size - 300
+        self.assertEqual(290, len(''.join(reader.app_iter_range(
+            start, start + 290))))
+        self.assertEqual(300, sum(
+            args[0] for args, _ in mock_read.call_args_list))
+        reader._suppress_file_closing = False
+        reader.close()
+
+    def test_read_ahead(self):
+        self.conf['disk_read_ahead_size'] = '1024'
+        df = self._get_open_disk_file(fsize=100000, csize=256)
+        reader = df.reader()
+        fd = reader._fp.fileno()
+        with mock.patch('swift.obj.diskfile.fadvise') as mock_fadvise:
+            body = ''.join(reader)
+        self.assertEqual(reader._obj_size, len(body))
+        calls = mock_fadvise.call_args_list
+        self.assertEqual(mock.call(fd, 0, reader._obj_size,
+                                   utils.POSIX_FADV_SEQUENTIAL), calls[0])
+        # hints for the rest of the object, in windows of half the
+        # read-ahead size or so, that the reads never catch up with
+        read_ahead_to = 0
+        for call in calls[1:]:
+            self.assertEqual(
+                mock.call(fd, read_ahead_to, mock.ANY,
+                          utils.POSIX_FADV_WILLNEED), call)
+            read_ahead_to += call[0][2]
+            self.assertLessEqual(call[0][2], 1024)
+        self.assertEqual(reader._obj_size, read_ahead_to)
+        self.assertGreaterEqual(len(calls) - 1, reader._obj_size // 1024)
+
+        # small objects are left to the kernel
+        df = self._get_open_disk_file(fsize=100, csize=256)
+        with mock.patch('swift.obj.diskfile.fadvise') as mock_fadvise:
+            ''.join(df.reader())
+        self.assertFalse(mock_fadvise.called)
+
+    def test_threadpool_reads(self):
+        self.conf['disk_threadpool_read_size'] = '4096'
+        df = self._get_open_disk_file(fsize=100000, csize=256)
+        reader = df.reader()
+        with mock.patch('swift.obj.diskfile.tpool_reraise',
+                        side_effect=lambda f, *a: f(*a)) as mock_tpool:
+            body = ''.join(reader)
+        self.assertEqual(reader._obj_size, len(body))
+        sizes = [args[1] for args, _ in mock_tpool.call_args_list]
+        self.assertEqual(reader._obj_size, sum(sizes))
+        self.assertEqual(set([4096]), set(sizes[:-1]))
+
+        df = self._get_open_disk_file(fsize=100, csize=256)
+        with mock.patch('swift.obj.diskfile.tpool_reraise') as mock_tpool:
+            ''.join(df.reader())
+        self.assertFalse(mock_tpool.called)
+
+    def _spy_on_io_executor(self):
+        calls = []
+
+        def fake_run(method):
+            def run(executor, func, *args, **kwargs):
+                calls.append((method, getattr(func, '__name__', func)))
+                return func(*args, **kwargs)
+            return run
+
+        return calls, mock.patch.multiple(
+            diskfile.DeviceIOExecutor,
+            run_in_thread=fake_run('run_in_thread'),
+            force_run_in_thread=fake_run('force_run_in_thread'))
+
+    def test_io_executor(self):
+        df = self._simple_get_diskfile()
+        self.assertIsNone(df._io_executor)
+
+        self.conf['disk_io_threads_per_device'] = '2'
+        self.conf['disk_io_max_queued'] = '4'
+        self.df_router = diskfile.DiskFileRouter(self.conf, self.logger)
+        df = self._simple_get_diskfile()
+        executor = df._io_executor
+        self.assertIsInstance(executor, diskfile.DeviceIOExecutor)
+        self.assertEqual(4, executor.max_queued)
+        # one executor per device
+        self.assertIs(executor,
+                      self._simple_get_diskfile(obj='o2')._io_executor)
+        self.assertIsNot(executor, df.manager.get_io_executor('/other/dev'))
+
+        calls, patcher = self._spy_on_io_executor()
+        with patcher:
+            self._get_open_disk_file(fsize=1000)
+        self.assertEqual(('run_in_thread', '_write'), calls[0])
+        self.assertEqual(('force_run_in_thread', '_finalize_put'), calls[1])
+
+        del calls[:]
+        df = self._simple_get_diskfile()
+        with patcher:
+            with df.open():
+                reader = df.reader()
+            body = ''.join(reader)
+        self.assertEqual(reader._obj_size, len(body))
+        self.assertIn(('run_in_thread', 'read_metadata'), calls)
+        # reads wait for a thread, once the metadata has been read
+        self.assertIn(('force_run_in_thread', 'read'), calls)
+        self.assertNotIn(('run_in_thread', 'read'), calls)
+
+    def test_io_executor_busy(self):
+        self._get_open_disk_file(fsize=1000)
+        self.conf['disk_io_threads_per_device'] = '1'
+        self.df_router = diskfile.DiskFileRouter(self.conf, self.logger)
+        df = self._simple_get_diskfile()
+        with mock.patch.object(diskfile.DeviceIOExecutor, 'run_in_thread',
+                               side_effect=DiskFileDeviceBusy):
+            # not quarantined
+            self.assertRaises(DiskFileDeviceBusy, df.open)
+            with df.create() as writer:
+                self.assertRaises(DiskFileDeviceBusy, writer.write, 'a')
+        with df.open():
+            reader = df.reader()
+        self.assertEqual(reader._obj_size, len(''.join(reader)))
+
+        # an upload that has started carries on
+        calls, patcher = self._spy_on_io_executor()
+        with df.create() as writer, patcher:
+            writer.write('a')
+            writer.write('b')
+        self.assertEqual([('run_in_thread', '_write'),
+                          ('force_run_in_thread', '_write')], calls)
+
     def test_quarantine_valids(self):
 
         def verify(*args, **kwargs):
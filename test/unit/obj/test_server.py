@@ -36,7 +36,8 @@ import tempfile
 from collections import defaultdict
 from contextlib import contextmanager
 
-from eventlet import sleep, spawn, wsgi, listen, Timeout, tpool, greenthread
+from eventlet import sleep, spawn, wsgi, listen, Timeout, tpool, greenthread, \
+    GreenPool
 from eventlet.green import httplib
 
 from nose import SkipTest
@@ -61,7 +62,7 @@ from swift.common.splice import splice
 from swift.common.storage_policy import (StoragePolicy, ECStoragePolicy,
                                          POLICIES, EC_POLICY)
 from swift.common.exceptions import DiskFileDeviceUnavailable, \
-    DiskFileNoSpace, DiskFileQuarantined
+    DiskFileNoSpace, DiskFileQuarantined, DiskFileDeviceBusy
 
 
 def mock_time(*args, **kwargs):
@@ -170,6 +171,16 @@ class TestObjectController(unittest.TestCase):
         self.object_controller.get_diskfile = raise_disk_unavail
         self.check_all_api_methods(alt_res=507)
 
+    def test_device_busy(self):
+        conf = {'devices': self.testdir, 'mount_check': 'false',
+                'disk_io_threads_per_device': '1'}
+        self.object_controller = object_server.ObjectController(
+            conf, logger=debug_logger())
+        self.check_all_api_methods()
+        with mock.patch.object(diskfile.DeviceIOExecutor, 'run_in_thread',
+                               side_effect=DiskFileDeviceBusy):
+            self.check_all_api_methods(alt_res=503)
+
     def test_allowed_headers(self):
         dah = ['content-disposition', 'content-encoding', 'x-delete-at',
                'x-object-manifest', 'x-static-large-object']
@@ -4923,6 +4934,82 @@ class TestObjectController(unittest.TestCase):
             object_server.http_connect = orig_http_connect
             utils.HASH_PATH_PREFIX = _prefix
 
+    def _batched_async_updates(self, updates, *statuses, **kwargs):
+        # returns the bodies of the UPDATE requests and the updates saved for
+        # async update later
+        policy = POLICIES.legacy
+        saved = []
+
+        def fake_pickle_async_update(objdevice, account, container, obj,
+                                     data, timestamp, policy):
+            saved.append(obj)
+        diskfile_mgr = self.object_controller._diskfile_router[policy]
+        diskfile_mgr.pickle_async_update = fake_pickle_async_update
+        sent = []
+
+        def capture_send(conn, data):
+            sent.append(json.loads(data))
+
+        with mocked_http_conn(*statuses, give_send=capture_send,
+                              **kwargs) as fake_conn:
+            pool = GreenPool()
+            for host, partition, obj in updates:
+                pool.spawn(self.object_controller.async_update,
+                           'PUT', 'a', 'c', obj, host, partition, 'sdc1',
+                           {'x-timestamp': '1'}, 'sda1', policy)
+            with Timeout(1):
+                pool.waitall()
+        for request in fake_conn.requests:
+            self.assertEqual('UPDATE', request['method'])
+            self.assertEqual('application/json',
+                             request['headers']['Content-Type'])
+        return sent, saved
+
+    def test_async_update_batched(self):
+        self.object_controller.container_update_batch_window = 0.01
+        sent, saved = self._batched_async_updates(
+            [('1.2.3.4:5', '1', 'o1'), ('1.2.3.4:5', '1', 'o2'),
+             ('1.2.3.4:5', '2', 'o3'), ('1.2.3.4:5', '1', 'o4')],
+            200, 200,
+            body_iter=[json.dumps([201, 404, 201]), json.dumps([201])])
+        # one request per partition
+        self.assertEqual([['o1', 'o2', 'o4'], ['o3']],
+                         [[update['obj'] for update in body]
+                          for body in sent])
+        self.assertEqual({'op': 'PUT', 'account': 'a', 'container': 'c',
+                          'obj': 'o1',
+                          'headers': {'x-timestamp': '1',
+                                      'user-agent': 'object-server %s' %
+                                      os.getpid()}}, sent[0][0])
+        self.assertEqual(['o2'], saved)
+
+    def test_async_update_batch_size(self):
+        # a full batch goes at once
+        self.object_controller.container_update_batch_window = 10
+        self.object_controller.container_update_batch_size = 2
+        sent, saved = self._batched_async_updates(
+            [('1.2.3.4:5', '1', 'o1'), ('1.2.3.4:5', '1', 'o2')],
+            200, body=json.dumps([201, 201]))
+        self.assertEqual(1, len(sent))
+        self.assertEqual([], saved)
+
+    def test_async_update_batch_failed(self):
+        self.object_controller.container_update_batch_window = 0.01
+        updates = [('1.2.3.4:5', '1', 'o1'), ('1.2.3.4:5', '1', 'o2')]
+        for status in (405, 507):
+            sent, saved = self._batched_async_updates(updates, status)
+            self.assertEqual(1, len(sent))
+            self.assertEqual(['o1', 'o2'], sorted(saved))
+        # too few statuses
+        sent, saved = self._batched_async_updates(
+            updates, 200, body=json.dumps([201]))
+        self.assertEqual(['o2'], saved)
+        sent, saved = self._batched_async_updates(updates, 200, body='junk')
+        self.assertEqual(['o1', 'o2'], sorted(saved))
+        sent, saved = self._batched_async_updates(updates, -1)
+        self.assertEqual([], sent)
+        self.assertEqual(['o1', 'o2'], sorted(saved))
+
     def test_container_update_no_async_update(self):
         policy = random.choice(list(POLICIES))
         given_args = []
@@ -4980,6 +5067,73 @@ class TestObjectController(unittest.TestCase):
             'x-trans-id': '123',
             'referer': 'PUT http://localhost/sda1/0/a/c/o'}))
 
+    def test_container_update_to_shard(self):
+        container_updates = []
+
+        def capture_updates(ip, port, method, path, headers, *args, **kwargs):
+            container_updates.append((ip, port, method, path, headers))
+
+        shard = '.shards_a/c-%s' % ('0' * 32)
+        req = Request.blank(
+            '/sda1/0/a/c/o',
+            environ={'REQUEST_METHOD': 'PUT'},
+            headers={'X-Timestamp': 1,
+                     'X-Trans-Id': '123',
+                     'X-Container-Host': 'chost:cport',
+                     'X-Container-Partition': 'cpartition',
+                     'X-Container-Device': 'cdevice',
+                     'X-Backend-Container-Path': shard,
+                     'Content-Type': 'text/plain'}, body='')
+        with mocked_http_conn(200, give_connect=capture_updates) as fake_conn:
+            with fake_spawn():
+                resp = req.get_response(self.object_controller)
+        self.assertRaises(StopIteration, fake_conn.code_iter.next)
+        self.assertEqual(resp.status_int, 201)
+        self.assertEqual(len(container_updates), 1)
+        ip, port, method, path, headers = container_updates[0]
+        self.assertEqual(path, '/cdevice/cpartition/%s/o' % shard)
+
+        # a failed update is saved for the shard, too
+        given_args = []
+
+        def fake_pickle_async_update(*args):
+            given_args[:] = args
+
+        diskfile_mgr = self.object_controller._diskfile_router[POLICIES[0]]
+        diskfile_mgr.pickle_async_update = fake_pickle_async_update
+        req.headers['X-Timestamp'] = utils.Timestamp(2).internal
+        with mocked_http_conn(500):
+            with fake_spawn():
+                resp = req.get_response(self.object_controller)
+        self.assertEqual(resp.status_int, 201)
+        self.assertEqual(given_args[1:4], ['.shards_a', 'c-%s' % ('0' * 32),
+                                           'o'])
+
+    def test_container_update_bad_container_path(self):
+        given_args = []
+
+        def fake_async_update(*args):
+            given_args.extend(args)
+
+        self.object_controller.async_update = fake_async_update
+        req = Request.blank(
+            '/v1/a/c/o',
+            environ={'REQUEST_METHOD': 'PUT'},
+            headers={'X-Timestamp': 1,
+                     'X-Trans-Id': '1234',
+                     'X-Container-Host': 'chost:cport',
+                     'X-Container-Partition': 'cpartition',
+                     'X-Container-Device': 'cdevice',
+                     'X-Backend-Container-Path': 'no-container'})
+        self.object_controller.container_update(
+            'PUT', 'a', 'c', 'o', req, {
+                'x-size': '0', 'x-etag': 'd41d8cd98f00b204e9800998ecf8427e',
+                'x-content-type': 'text/plain', 'x-timestamp': '1'},
+            'sda1', POLICIES[0])
+        self.assertEqual(given_args, [])
+        self.assertEqual(1, len(
+            self.object_controller.logger.get_lines_for_level('error')))
+
     def test_PUT_container_update_overrides(self):
 
         def do_test(override_headers):
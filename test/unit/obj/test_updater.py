@@ -14,11 +14,13 @@
 # limitations under the License.
 
 import six.moves.cPickle as pickle
+import json
 import mock
 import os
 import unittest
 import random
 import itertools
+from collections import defaultdict
 from contextlib import closing
 from gzip import GzipFile
 from tempfile import mkdtemp
@@ -27,6 +29,7 @@ from test.unit import FakeLogger
 from time import time
 from distutils.dir_util import mkpath
 
+import eventlet
 from eventlet import spawn, Timeout, listen
 from six.moves import range
 
@@ -486,6 +489,277 @@ class TestObjectUpdater(unittest.TestCase):
         self.assertEqual(daemon.logger.get_increment_counts(),
                          {'successes': 1, 'unlinks': 1, 'async_pendings': 1})
 
+    def test_batched_updates(self):
+        ts = (normalize_timestamp(t) for t in
+              itertools.count(int(time())))
+        policy = POLICIES.get_by_index(0)
+        conf = {
+            'devices': self.devices_dir,
+            'mount_check': 'false',
+            'swift_dir': self.testdir,
+            'recon_cache_path': self.testdir,
+            'updates_per_request': '2',
+            'batch_concurrency': '2',
+        }
+        daemon = object_updater.ObjectUpdater(conf, logger=self.logger)
+        dfmanager = DiskFileManager(conf, daemon.logger)
+        objs = ['o%d' % i for i in range(5)]
+        # an older update of o0, which is superseded
+        updates = [('c0', 'o0')] + [('c%d' % (i % 2), obj)
+                                    for i, obj in enumerate(objs)]
+        for container, obj in updates:
+            data = {'op': 'PUT', 'account': 'a', 'container': container,
+                    'obj': obj, 'headers': {'x-timestamp': next(ts)}}
+            dfmanager.pickle_async_update(self.sda1, 'a', container, obj,
+                                          data, next(ts), policy)
+
+        requests = []
+
+        def fake_batch_update(node, part, items):
+            names = [item[3]['obj'] for item in items]
+            requests.append((node['id'], part, names))
+            # the update of o1 fails on one node
+            return [not (name == 'o1' and node['id'] == 1)
+                    for name in names]
+
+        with mock.patch.object(daemon, 'batch_update', fake_batch_update):
+            daemon.run_once()
+
+        # every update goes to every replica, at most 2 at a time
+        ring = daemon.get_container_ring()
+        sent = defaultdict(list)
+        for node_id, part, names in requests:
+            self.assertLessEqual(len(names), 2)
+            for name in names:
+                sent[name].append(node_id)
+        self.assertEqual(sorted(objs), sorted(sent))
+        for i, obj in enumerate(objs):
+            part, nodes = ring.get_nodes('a', 'c%d' % (i % 2))
+            self.assertEqual(sorted(node['id'] for node in nodes),
+                             sorted(sent[obj]))
+        self.assertEqual({'successes': 4, 'failures': 1, 'unlinks': 5,
+                          'async_pendings': 6},
+                         daemon.logger.get_increment_counts())
+
+        # only the failed update is left, with the replicas it got to
+        async_dir = os.path.join(self.sda1, get_async_dir(policy))
+        left = [os.path.join(async_dir, prefix, name)
+                for prefix in os.listdir(async_dir)
+                for name in os.listdir(os.path.join(async_dir, prefix))]
+        self.assertEqual(1, len(left))
+        update = pickle.load(open(left[0], 'rb'))
+        self.assertEqual('o1', update['obj'])
+        self.assertEqual([0, 2], sorted(update['successes']))
+
+        with open(os.path.join(self.testdir, 'object.recon')) as f:
+            stats = json.load(f)['object_updater_stats']['sda1']
+        self.assertEqual(6, stats['pending'])
+        self.assertEqual(4, stats['successes'])
+        self.assertEqual(1, stats['failures'])
+        self.assertGreater(stats['drain_rate'], 0)
+
+        # the next sweep only sends it to the replica that missed it
+        del requests[:]
+        with mock.patch.object(daemon, 'batch_update',
+                               lambda node, part, items: [True]):
+            daemon.run_once()
+        self.assertEqual([], os.listdir(async_dir))
+
+    def test_concurrent_updates(self):
+        ts = (normalize_timestamp(t) for t in
+              itertools.count(int(time())))
+        policy = POLICIES.get_by_index(0)
+        conf = {
+            'devices': self.devices_dir,
+            'mount_check': 'false',
+            'swift_dir': self.testdir,
+            'recon_cache_path': self.testdir,
+            'slowdown': '0',
+            'update_concurrency': '4',
+        }
+        daemon = object_updater.ObjectUpdater(conf, logger=self.logger)
+        dfmanager = DiskFileManager(conf, daemon.logger)
+        latest = {}
+        for obj in ['o%d' % i for i in range(8)] * 2:
+            # the second update of each object is the newer one
+            latest[obj] = next(ts)
+            data = {'op': 'PUT', 'account': 'a', 'container': 'c',
+                    'obj': obj, 'headers': {'x-timestamp': latest[obj]}}
+            dfmanager.pickle_async_update(self.sda1, 'a', 'c', obj,
+                                          data, latest[obj], policy)
+
+        sent = defaultdict(list)
+        in_flight = [0]
+        most_in_flight = [0]
+
+        def fake_object_update(node, part, op, obj, headers_out):
+            in_flight[0] += 1
+            most_in_flight[0] = max(most_in_flight[0], in_flight[0])
+            eventlet.sleep(0.01)
+            in_flight[0] -= 1
+            sent[obj.split('/')[-1]].append(headers_out['X-Timestamp'])
+            return True, node['id']
+
+        with mock.patch.object(daemon, 'object_update', fake_object_update):
+            daemon.run_once()
+
+        # each object's updates were sent to its three replicas, several
+        # objects at once, and only its latest update was sent
+        self.assertGreater(most_in_flight[0], 3)
+        self.assertLessEqual(most_in_flight[0], 4 * 3)
+        self.assertEqual(sorted(latest), sorted(sent))
+        for obj, timestamps in sent.items():
+            self.assertEqual([latest[obj]] * 3, timestamps)
+        self.assertEqual({'successes': 8, 'unlinks': 16,
+                          'async_pendings': 16},
+                         daemon.logger.get_increment_counts())
+        self.assertEqual([], os.listdir(
+            os.path.join(self.sda1, get_async_dir(policy))))
+
+    def test_concurrent_updates_slowdown(self):
+        ts = (normalize_timestamp(t) for t in
+              itertools.count(int(time())))
+        policy = POLICIES.get_by_index(0)
+        conf = {
+            'devices': self.devices_dir,
+            'mount_check': 'false',
+            'swift_dir': self.testdir,
+            'recon_cache_path': self.testdir,
+            'slowdown': '0.05',
+            'update_concurrency': '4',
+        }
+        daemon = object_updater.ObjectUpdater(conf, logger=self.logger)
+        dfmanager = DiskFileManager(conf, daemon.logger)
+        for obj in ['o%d' % i for i in range(8)]:
+            data = {'op': 'PUT', 'account': 'a', 'container': 'c',
+                    'obj': obj, 'headers': {'x-timestamp': next(ts)}}
+            dfmanager.pickle_async_update(self.sda1, 'a', 'c', obj,
+                                          data, next(ts), policy)
+
+        in_flight = [0]
+        most_in_flight = [0]
+
+        def fake_object_update(node, part, op, obj, headers_out):
+            in_flight[0] += 1
+            most_in_flight[0] = max(most_in_flight[0], in_flight[0])
+            eventlet.sleep(0.01)
+            in_flight[0] -= 1
+            return True, node['id']
+
+        slept = []
+
+        def fake_sleep(secs):
+            slept.append(secs)
+            eventlet.sleep(secs)
+
+        with mock.patch.object(daemon, 'object_update', fake_object_update), \
+                mock.patch.object(object_updater, 'sleep', fake_sleep):
+            with mock.patch.object(object_updater.time, 'sleep') \
+                    as mock_time_sleep:
+                daemon.run_once()
+        # every update sleeps in its own greenthread, without blocking the
+        # others, so several are still in flight at once
+        self.assertEqual([0.05] * 8, slept)
+        self.assertFalse(mock_time_sleep.called)
+        self.assertGreater(most_in_flight[0], 3)
+        self.assertEqual(8, daemon.logger.get_increment_counts()[
+            'successes'])
+
+    def test_container_rate_limit(self):
+        ts = (normalize_timestamp(t) for t in
+              itertools.count(int(time())))
+        policy = POLICIES.get_by_index(0)
+        conf = {
+            'devices': self.devices_dir,
+            'mount_check': 'false',
+            'swift_dir': self.testdir,
+            'recon_cache_path': self.testdir,
+            'slowdown': '0',
+            'update_concurrency': '4',
+            # no more than one update per container in a sweep
+            'max_objects_per_container_per_second': '0.001',
+        }
+        daemon = object_updater.ObjectUpdater(conf, logger=self.logger)
+        dfmanager = DiskFileManager(conf, daemon.logger)
+        for container, obj in [('hot', 'o0'), ('hot', 'o1'), ('hot', 'o2'),
+                               ('cold', 'o3')]:
+            data = {'op': 'PUT', 'account': 'a', 'container': container,
+                    'obj': obj, 'headers': {'x-timestamp': next(ts)}}
+            dfmanager.pickle_async_update(self.sda1, 'a', container, obj,
+                                          data, next(ts), policy)
+
+        sent = defaultdict(int)
+
+        def fake_object_update(node, part, op, obj, headers_out):
+            sent[obj.split('/')[2]] += 1
+            return True, node['id']
+
+        with mock.patch.object(daemon, 'object_update', fake_object_update):
+            daemon.run_once()
+        self.assertEqual({'hot': 3, 'cold': 3}, sent)
+        self.assertEqual({'successes': 2, 'unlinks': 2, 'skips': 2,
+                          'async_pendings': 4},
+                         daemon.logger.get_increment_counts())
+        with open(os.path.join(self.testdir, 'object.recon')) as f:
+            stats = json.load(f)['object_updater_stats']['sda1']
+        self.assertEqual(2, stats['skips'])
+
+        # the skipped updates are sent by later sweeps
+        for i in range(2):
+            with mock.patch.object(daemon, 'object_update',
+                                   fake_object_update):
+                daemon.run_once()
+        self.assertEqual({'hot': 9, 'cold': 3}, sent)
+        self.assertEqual([], os.listdir(
+            os.path.join(self.sda1, get_async_dir(policy))))
+
+    def test_batch_update(self):
+        conf = {
+            'devices': self.devices_dir,
+            'mount_check': 'false',
+            'swift_dir': self.testdir,
+        }
+        daemon = object_updater.ObjectUpdater(conf, logger=self.logger)
+        policy = POLICIES.get_by_index(1)
+        node = {'id': 0, 'ip': '127.0.0.1', 'port': 1, 'device': 'sda1'}
+        items = [(None, self.sda1, policy,
+                  {'op': 'PUT', 'account': 'a', 'container': 'c',
+                   'obj': 'o%d' % i, 'headers': {'x-timestamp': '1'}})
+                 for i in range(3)]
+        sent = []
+
+        def capture_send(conn, data):
+            sent.append(json.loads(data))
+
+        with mocked_http_conn(200, body=json.dumps([201, 404, 503]),
+                              give_send=capture_send) as fake_conn:
+            self.assertEqual([True, True, False],
+                             daemon.batch_update(node, 3, items))
+        self.assertEqual(1, len(fake_conn.requests))
+        self.assertEqual('UPDATE', fake_conn.requests[0]['method'])
+        self.assertEqual('/sda1/3', fake_conn.requests[0]['path'])
+        self.assertEqual(['o0', 'o1', 'o2'],
+                         [update['obj'] for update in sent[0]])
+        self.assertEqual('1', sent[0][0]['headers']['X-Timestamp'])
+        self.assertEqual(
+            '1', sent[0][0]['headers']['X-Backend-Storage-Policy-Index'])
+
+        # too few statuses, or a bad response
+        for status, body in ((200, json.dumps([201])), (200, 'junk'),
+                             (507, ''), (-1, '')):
+            with mocked_http_conn(status, body=body):
+                self.assertEqual([status == 200 and body != 'junk',
+                                  False, False],
+                                 daemon.batch_update(node, 3, items))
+
+        # old container servers get the updates one at a time
+        with mocked_http_conn(405, 201, 404, 503) as fake_conn:
+            self.assertEqual([True, True, False],
+                             daemon.batch_update(node, 3, items))
+        self.assertEqual(['UPDATE', 'PUT', 'PUT', 'PUT'],
+                         [req['method'] for req in fake_conn.requests])
+        self.assertEqual('/sda1/3/a/c/o1', fake_conn.requests[2]['path'])
+
 
 if __name__ == '__main__':
     unittest.main()
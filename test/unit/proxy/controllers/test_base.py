@@ -15,19 +15,25 @@
 
 import itertools
 from collections import defaultdict
+import time
 import unittest
+import eventlet
 import mock
+from swift.proxy.controllers import base
 from swift.proxy.controllers.base import headers_to_container_info, \
     headers_to_account_info, headers_to_object_info, get_container_info, \
     get_cache_key, get_account_info, get_info, get_object_info, \
-    Controller, GetOrHeadHandler, bytes_to_skip
+    Controller, GetOrHeadHandler, bytes_to_skip, clear_info_cache
 from swift.common.swob import Request, HTTPException, RESPONSE_REASONS
+from swift.common.bufferedhttp import BufferedHTTPResponse, \
+    ConnectionPool
 from swift.common import exceptions
-from swift.common.utils import split_path
+from swift.common.utils import split_path, LRUCache
 from swift.common.header_key_dict import HeaderKeyDict
 from swift.common.http import is_success
 from swift.common.storage_policy import StoragePolicy
-from test.unit import fake_http_connect, FakeRing, FakeMemcache
+from test.unit import fake_http_connect, FakeRing, FakeMemcache, \
+    debug_logger
 from swift.proxy import server as proxy_server
 from swift.common.request_helpers import (
     get_sys_meta_prefix, get_object_transient_sysmeta
@@ -322,6 +328,122 @@ class TestFuncs(unittest.TestCase):
         self.assertEqual(app.responses.stats['account'], 0)
         self.assertEqual(app.responses.stats['container'], 0)
 
+    def test_get_info_local_cache(self):
+        app = FakeApp()
+        app.logger = debug_logger()
+        app.info_cache = LRUCache(maxsize=10, maxtime=30)
+        memcache = FakeMemcache()
+        # the first lookup goes to the backend and fills every cache tier
+        info_c = get_info(app, {'swift.cache': memcache}, 'a', 'c')
+        self.assertEqual(info_c['bytes'], 6666)
+        self.assertEqual(app.responses.stats['account'], 1)
+        self.assertEqual(app.responses.stats['container'], 1)
+        self.assertEqual({'info_cache.account.miss': 1,
+                          'info_cache.container.miss': 1},
+                         app.logger.get_increment_counts())
+        self.assertIn('container/a/c', memcache.store)
+
+        # later requests are served locally, without touching memcache
+        mock_cache = mock.Mock()
+        env = {'swift.cache': mock_cache}
+        self.assertEqual(info_c, get_info(app, env, 'a', 'c'))
+        self.assertEqual([], mock_cache.mock_calls)
+        self.assertIn('container/a/c', env['swift.infocache'])
+        self.assertEqual(app.responses.stats['container'], 1)
+        self.assertEqual({'info_cache.account.miss': 1,
+                          'info_cache.container.miss': 1,
+                          'info_cache.container.hit': 1},
+                         app.logger.get_increment_counts())
+
+        # clearing the info cache also clears the local tier...
+        clear_info_cache(app, {'swift.cache': memcache}, 'a', 'c')
+        self.assertIsNone(app.info_cache.get('container/a/c'))
+        self.assertNotIn('container/a/c', memcache.store)
+        get_info(app, {'swift.cache': memcache}, 'a', 'c')
+        self.assertEqual(app.responses.stats['container'], 2)
+
+        # ...and a memcache hit refills it
+        app.info_cache.reset()
+        get_info(app, {'swift.cache': memcache}, 'a', 'c')
+        self.assertEqual(app.responses.stats['container'], 2)
+        self.assertEqual(info_c, get_info(
+            app, {'swift.cache': mock_cache}, 'a', 'c'))
+        self.assertEqual([], mock_cache.mock_calls)
+
+        # entries only live for the local cache's ttl
+        the_future = time.time() + 31
+        mock_cache.get.return_value = None
+        with mock.patch('time.time', lambda: the_future):
+            get_info(app, {'swift.cache': mock_cache}, 'a', 'c')
+        self.assertEqual([mock.call.get('container/a/c'),
+                          mock.call.get('account/a'),
+                          mock.call.set('account/a', mock.ANY, time=60),
+                          mock.call.set('container/a/c', mock.ANY, time=60)],
+                         mock_cache.mock_calls)
+        self.assertEqual(app.responses.stats['container'], 3)
+
+    def test_local_info_cache_config(self):
+        self.assertIsNone(self.app.info_cache)
+        app = proxy_server.Application(
+            {'local_info_cache_size': '100', 'local_info_cache_ttl': '2.5'},
+            FakeMemcache(), account_ring=FakeRing(),
+            container_ring=FakeRing())
+        self.assertEqual(100, app.info_cache.maxsize)
+        self.assertEqual(2.5, app.info_cache.maxtime)
+
+    def test_get_info_coalesces_concurrent_misses(self):
+        class SlowApp(FakeApp):
+            def __call__(self, environ, start_response):
+                eventlet.sleep(0.01)
+                return super(SlowApp, self).__call__(environ, start_response)
+
+        app = SlowApp()
+        app.logger = debug_logger()
+        envs = [{'swift.cache': FakeMemcache()} for _ in range(5)]
+        pool = eventlet.GreenPool()
+        infos = list(pool.imap(get_info, [app] * 5, envs, ['a'] * 5,
+                               ['c'] * 5))
+        # one HEAD each for the account and the container
+        self.assertEqual(1, app.responses.stats['account'])
+        self.assertEqual(1, app.responses.stats['container'])
+        for info in infos:
+            self.assertEqual(200, info['status'])
+            self.assertEqual(6666, info['bytes'])
+        for env in envs:
+            self.assertIn('account/a', env['swift.infocache'])
+            self.assertIn('container/a/c', env['swift.infocache'])
+        self.assertEqual({'info_fetch.account.coalesced': 4,
+                          'info_fetch.container.coalesced': 4},
+                         app.logger.get_increment_counts())
+        self.assertEqual({}, base._info_fetches)
+
+    def test_get_info_coalesced_fetch_fails(self):
+        class FlakyApp(FakeApp):
+            calls = 0
+
+            def __call__(self, environ, start_response):
+                self.calls += 1
+                eventlet.sleep(0.01)
+                if self.calls == 1:
+                    raise Exception('boom')
+                return super(FlakyApp, self).__call__(environ, start_response)
+
+        def do_get_info():
+            try:
+                return get_info(app, {}, 'a')
+            except Exception as err:
+                return err
+
+        app = FlakyApp()
+        pool = eventlet.GreenPool()
+        first = pool.spawn(do_get_info)
+        second = pool.spawn(get_info, app, {}, 'a')
+        self.assertEqual('boom', str(first.wait()))
+        # the waiter didn't get the failed fetch's result, but its own
+        self.assertEqual(6666, second.wait()['bytes'])
+        self.assertEqual(2, app.calls)
+        self.assertEqual({}, base._info_fetches)
+
     def test_get_container_info_swift_source(self):
         app = FakeApp()
         req = Request.blank("/v1/a/c", environ={'swift.cache': FakeCache()})
@@ -702,6 +824,112 @@ class TestFuncs(unittest.TestCase):
         self.assertEqual(resp.status, '404 Not Found')
         self.assertEqual(resp.body, 'Custom body')
 
+    def test_hedged_get(self):
+        app = proxy_server.Application(
+            {'hedged_gets': 'on', 'concurrency_timeout': '0.01'},
+            FakeMemcache(), account_ring=FakeRing(),
+            container_ring=FakeRing(), logger=debug_logger())
+        nodes = [{'ip': '10.0.0.%d' % i, 'port': 6200, 'device': 'sda'}
+                 for i in range(3)]
+        delays = {'10.0.0.0': 0.1, '10.0.0.1': 0, '10.0.0.2': 0}
+        closed = []
+
+        def fake_connect(ip, *args, **kwargs):
+            conn = mock.Mock()
+
+            def getresponse():
+                eventlet.sleep(delays[ip])
+                resp = mock.Mock(status=200, reason='OK')
+                resp.getheader.side_effect = lambda name, default=None: \
+                    default
+                resp.getheaders.return_value = [('Etag', 'abc')]
+                resp.nuke_from_orbit.side_effect = \
+                    lambda: closed.append(ip)
+                return resp
+            conn.getresponse.side_effect = getresponse
+            return conn
+
+        req = Request.blank('/v1/a/c/o')
+        with mock.patch('swift.proxy.controllers.base.http_connect',
+                        fake_connect):
+            handler = GetOrHeadHandler(app, req, 'Object', iter(nodes), 0,
+                                       '/a/c/o', {}, concurrency=3,
+                                       hedge=True)
+            source, node = handler._get_source_and_node()
+            # the first node was slow, so a hedge was sent to the second,
+            # which answered first
+            self.assertEqual(nodes[1], node)
+            self.assertEqual({'hedge.issued': 1, 'hedge.won': 1},
+                             app.logger.get_increment_counts())
+            # the loser's connection is closed once it answers
+            self.assertEqual([], closed)
+            eventlet.sleep(0.2)
+            self.assertEqual(['10.0.0.0'], closed)
+
+        # with the first node answering quickly, nothing is hedged
+        app.logger.clear()
+        delays['10.0.0.0'] = 0
+        with mock.patch('swift.proxy.controllers.base.http_connect',
+                        fake_connect):
+            handler = GetOrHeadHandler(app, req, 'Object', iter(nodes), 0,
+                                       '/a/c/o', {}, concurrency=3,
+                                       hedge=True)
+            source, node = handler._get_source_and_node()
+        self.assertEqual(nodes[0], node)
+        self.assertEqual({}, app.logger.get_increment_counts())
+
+    def test_close_swift_conn_releases_pooled_connection(self):
+        pool = ConnectionPool()
+        conn = pool.connect('127.0.0.1', 6200)
+        conn.sock = mock.MagicMock()
+
+        def pooled_response(length):
+            src = BufferedHTTPResponse(mock.MagicMock())
+            src._pooled_conn = conn
+            src.will_close = src.chunked = False
+            src.length = length
+            return src
+
+        # a response read to its end gives its connection back to the pool
+        base.close_swift_conn(pooled_response(0))
+        self.assertEqual([conn],
+                         [c for t, c in pool._idle[('127.0.0.1', 6200)]])
+        # any other has its socket closed
+        src = pooled_response(8)
+        real_socket = src._real_socket
+        base.close_swift_conn(src)
+        real_socket.close.assert_called_once_with()
+        self.assertEqual(1, len(pool._idle[('127.0.0.1', 6200)]))
+
+    def test_hedge_delay(self):
+        app = proxy_server.Application(
+            {'hedged_gets': 'on', 'concurrency_timeout': '0.5',
+             'hedge_percentile': '90'},
+            FakeMemcache(), account_ring=FakeRing(),
+            container_ring=FakeRing())
+        # concurrency_timeout is used until enough timings are known
+        for i in range(proxy_server.HEDGE_MIN_TIMING_SAMPLES - 1):
+            app.record_get_timing(0.01)
+        self.assertEqual(0.5, app.get_hedge_delay())
+        app.record_get_timing(0.2)
+        self.assertEqual(0.01, app.get_hedge_delay())
+        # and the delay is only recalculated every so often
+        for i in range(proxy_server.HEDGE_MIN_TIMING_SAMPLES - 1):
+            app.record_get_timing(0.2)
+        self.assertEqual(0.01, app.get_hedge_delay())
+        app.record_get_timing(0.2)
+        self.assertEqual(0.2, app.get_hedge_delay())
+
+        # nothing is recorded unless hedging is enabled
+        app = proxy_server.Application(
+            {}, FakeMemcache(), account_ring=FakeRing(),
+            container_ring=FakeRing())
+        app.record_get_timing(0.2)
+        self.assertEqual(0, len(app._get_timings))
+        self.assertRaises(ValueError, proxy_server.Application,
+                          {'hedge_percentile': '0'}, FakeMemcache(),
+                          account_ring=FakeRing(), container_ring=FakeRing())
+
     def test_range_fast_forward(self):
         req = Request.blank('/')
         handler = GetOrHeadHandler(None, req, None, None, None, None, {})
@@ -13,12 +13,14 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import json
 import mock
 import unittest
 
 from eventlet import Timeout
 
 from swift.common.swob import Request
+from swift.common.utils import ShardRange, Timestamp
 from swift.proxy import server as proxy_server
 from swift.proxy.controllers.base import headers_to_container_info
 from test.unit import fake_http_connect, FakeRing, FakeMemcache
@@ -270,6 +272,243 @@ class TestContainerController(TestRingBase):
         ]
         self._assert_responses('POST', POST_TEST_CASES)
 
+    def _shard_listing_responses(self, listings, object_count=0,
+                                 sharding_state='sharded'):
+        shard_ranges = [
+            ShardRange('.shards_a/c-lower', Timestamp(1), '', 'o2',
+                       object_count=object_count),
+            ShardRange('.shards_a/c-upper', Timestamp(1), 'o2', '',
+                       object_count=object_count),
+        ]
+        root_headers = {'X-Backend-Sharding-State': sharding_state,
+                        'X-Container-Object-Count': 4}
+        statuses = [200, 200] + [200] * len(listings)
+        headers = [root_headers,
+                   {'X-Backend-Record-Type': 'shard'}] + \
+            [{}] * len(listings)
+        bodies = ['[]', json.dumps([dict(sr) for sr in shard_ranges])] + \
+            [json.dumps(listing) for listing in listings]
+        return statuses, headers, bodies
+
+    def test_GET_sharded_container(self):
+        lower = [{'name': 'o1', 'hash': 'x', 'bytes': 1,
+                  'content_type': 'text/plain',
+                  'last_modified': '1970-01-01T00:00:01.000000'},
+                 {'name': 'o2', 'hash': 'x', 'bytes': 2,
+                  'content_type': 'text/plain',
+                  'last_modified': '1970-01-01T00:00:01.000000'}]
+        upper = [{'name': 'o3', 'hash': 'x', 'bytes': 3,
+                  'content_type': 'text/plain',
+                  'last_modified': '1970-01-01T00:00:01.000000'}]
+        statuses, headers, bodies = self._shard_listing_responses(
+            [lower, upper])
+        req = Request.blank('/v1/a/c?format=json')
+        with mocked_http_conn(*statuses, headers=headers,
+                              body_iter=bodies) as fake_conn:
+            resp = req.get_response(self.app)
+        self.assertEqual(200, resp.status_int)
+        self.assertEqual(lower + upper, json.loads(resp.body))
+        self.assertEqual('4', resp.headers['X-Container-Object-Count'])
+        requests = fake_conn.requests
+        self.assertTrue(requests[0]['path'].endswith('/a/c'))
+        self.assertEqual('shard',
+                         requests[1]['headers']['X-Backend-Record-Type'])
+        self.assertIn('/.shards_a/c-lower', requests[2]['path'])
+        self.assertIn('end_marker=o2%00', requests[2]['qs'])
+        self.assertIn('/.shards_a/c-upper', requests[3]['path'])
+        self.assertIn('marker=o2', requests[3]['qs'])
+
+    def test_GET_sharding_container(self):
+        def record(name, size=1):
+            return {'name': name, 'hash': 'x', 'bytes': size,
+                    'content_type': 'text/plain',
+                    'last_modified': '1970-01-01T00:00:01.000000'}
+
+        lower = [record('o1'), record('o3')]
+        upper = [record('o5')]
+        # the root still holds o2, and o3 is being moved to its shard
+        root = [record('o2'), record('o3', size=0)]
+        statuses, headers, bodies = self._shard_listing_responses(
+            [lower, upper, root], sharding_state='sharding')
+        req = Request.blank('/v1/a/c?format=json')
+        with mocked_http_conn(*statuses, headers=headers,
+                              body_iter=bodies) as fake_conn:
+            resp = req.get_response(self.app)
+        self.assertEqual(200, resp.status_int)
+        self.assertEqual([record('o1'), record('o2'), record('o3'),
+                          record('o5')], json.loads(resp.body))
+        self.assertEqual(5, len(fake_conn.requests))
+        self.assertTrue(fake_conn.requests[4]['path'].endswith('/a/c'))
+        self.assertIn('format=json', fake_conn.requests[4]['qs'])
+
+        # the root's rows count towards the limit
+        statuses, headers, bodies = self._shard_listing_responses(
+            [lower[:1], root[:1]], sharding_state='sharding')
+        req = Request.blank('/v1/a/c?limit=1&reverse=on')
+        with mocked_http_conn(*statuses, headers=headers,
+                              body_iter=bodies) as fake_conn:
+            resp = req.get_response(self.app)
+        self.assertEqual(200, resp.status_int)
+        self.assertEqual('o2\n', resp.body)
+        self.assertIn('limit=1', fake_conn.requests[3]['qs'])
+
+    def test_GET_sharded_container_prefix_stats(self):
+        shard_ranges = [
+            ShardRange('.shards_a/c-lower', Timestamp(1), '', 'd/m'),
+            ShardRange('.shards_a/c-upper', Timestamp(1), 'd/m', ''),
+        ]
+        # the d/ pseudo-folder spans both shards
+        lower = [{'subdir': 'c/', 'count': 1, 'bytes': 1},
+                 {'subdir': 'd/', 'count': 2, 'bytes': 20}]
+        upper = [{'subdir': 'd/', 'count': 3, 'bytes': 300},
+                 {'subdir': 'e/', 'count': 4, 'bytes': 4000}]
+        # and the root of a sharding container still holds some of it
+        root = [{'subdir': 'd/', 'count': 5, 'bytes': 50000}]
+
+        def do_test(sharding_state, listings, query):
+            root_headers = {'X-Backend-Sharding-State': sharding_state,
+                            'X-Backend-Prefix-Stats': 'true'}
+            statuses = [200, 200] + [200] * len(listings)
+            headers = [root_headers,
+                       {'X-Backend-Record-Type': 'shard'}] + \
+                [{}] * len(listings)
+            bodies = ['[]', json.dumps([dict(sr) for sr in shard_ranges])] + \
+                [json.dumps(listing) for listing in listings]
+            req = Request.blank('/v1/a/c?format=json&prefix_stats=true' +
+                                query)
+            with mocked_http_conn(*statuses, headers=headers,
+                                  body_iter=bodies) as fake_conn:
+                resp = req.get_response(self.app)
+            self.assertEqual(200, resp.status_int)
+            for request in fake_conn.requests[2:]:
+                self.assertIn('prefix_stats=true', request['qs'])
+            return json.loads(resp.body), fake_conn.requests
+
+        listing, requests = do_test('sharded', [lower, upper], '')
+        self.assertEqual([{'subdir': 'c/', 'count': 1, 'bytes': 1},
+                          {'subdir': 'd/', 'count': 5, 'bytes': 320},
+                          {'subdir': 'e/', 'count': 4, 'bytes': 4000}],
+                         listing)
+        self.assertEqual(4, len(requests))
+        # the shards' markers aren't clamped to their bounds
+        for request in requests[2:]:
+            self.assertNotIn('marker', request['qs'])
+
+        listing, requests = do_test('sharded', [lower[1:], upper[:1]],
+                                    '&marker=c/&limit=1')
+        self.assertEqual([{'subdir': 'd/', 'count': 5, 'bytes': 320}],
+                         listing)
+        for request in requests[2:]:
+            self.assertIn('marker=c%2F', request['qs'])
+            self.assertIn('limit=1', request['qs'])
+
+        # a shard that only holds names before the marker isn't asked
+        listing, requests = do_test('sharded', [upper[1:]], '&marker=d/m')
+        self.assertEqual([{'subdir': 'e/', 'count': 4, 'bytes': 4000}],
+                         listing)
+        self.assertEqual(3, len(requests))
+        self.assertIn('/.shards_a/c-upper', requests[2]['path'])
+
+        listing, requests = do_test('sharding', [lower, upper, root],
+                                    '&reverse=on')
+        self.assertEqual([{'subdir': 'e/', 'count': 4, 'bytes': 4000},
+                          {'subdir': 'd/', 'count': 10, 'bytes': 50320},
+                          {'subdir': 'c/', 'count': 1, 'bytes': 1}],
+                         listing)
+        self.assertTrue(requests[4]['path'].endswith('/a/c'))
+        self.assertIn('prefix_stats=true', requests[4]['qs'])
+
+    def test_GET_sharded_container_prefix(self):
+        statuses, headers, bodies = self._shard_listing_responses([[]])
+        # a prefix ending in '\xff' can't be incremented, but it still
+        # bounds the names from below
+        req = Request.blank('/v1/a/c?format=json&prefix=p%FF')
+        with mocked_http_conn(*statuses, headers=headers,
+                              body_iter=bodies) as fake_conn:
+            resp = req.get_response(self.app)
+        self.assertEqual(200, resp.status_int)
+        self.assertEqual([], json.loads(resp.body))
+        # the lower shard can't hold such names, so isn't asked
+        self.assertEqual(3, len(fake_conn.requests))
+        self.assertIn('/.shards_a/c-upper', fake_conn.requests[2]['path'])
+
+    def test_GET_sharded_container_limit(self):
+        lower = [{'name': 'o1', 'hash': 'x', 'bytes': 1,
+                  'content_type': 'text/plain',
+                  'last_modified': '1970-01-01T00:00:01.000000'}]
+        statuses, headers, bodies = self._shard_listing_responses([lower])
+        req = Request.blank('/v1/a/c?limit=1')
+        with mocked_http_conn(*statuses, headers=headers,
+                              body_iter=bodies) as fake_conn:
+            resp = req.get_response(self.app)
+        self.assertEqual(200, resp.status_int)
+        self.assertEqual('o1\n', resp.body)
+        # the upper shard is never asked for its listing
+        self.assertEqual(3, len(fake_conn.requests))
+        self.assertIn('limit=1', fake_conn.requests[2]['qs'])
+
+    def test_GET_sharded_container_concurrent(self):
+        self.app.shard_listing_concurrency = 2
+        lower = [{'name': 'o1', 'hash': 'x', 'bytes': 1,
+                  'content_type': 'text/plain',
+                  'last_modified': '1970-01-01T00:00:01.000000'}]
+        upper = [{'name': 'o3', 'hash': 'x', 'bytes': 3,
+                  'content_type': 'text/plain',
+                  'last_modified': '1970-01-01T00:00:01.000000'}]
+        statuses, headers, bodies = self._shard_listing_responses(
+            [lower, upper])
+        req = Request.blank('/v1/a/c?format=json&limit=2')
+        with mocked_http_conn(*statuses, headers=headers,
+                              body_iter=bodies) as fake_conn:
+            resp = req.get_response(self.app)
+        self.assertEqual(200, resp.status_int)
+        self.assertEqual(lower + upper, json.loads(resp.body))
+        # both shards were listed at once, each asked for the whole limit
+        shard_requests = fake_conn.requests[2:]
+        self.assertEqual(2, len(shard_requests))
+        self.assertEqual(
+            ['/.shards_a/c-lower', '/.shards_a/c-upper'],
+            sorted(r['path'][r['path'].index('/.shards'):]
+                   for r in shard_requests))
+        for request in shard_requests:
+            self.assertIn('limit=2', request['qs'])
+        self.assertEqual(
+            1, self.logger.get_increment_counts().get(
+                'shard_listing.concurrent'))
+
+    def test_GET_sharded_container_concurrent_uses_object_counts(self):
+        self.app.shard_listing_concurrency = 2
+        lower = [{'name': 'o1', 'hash': 'x', 'bytes': 1,
+                  'content_type': 'text/plain',
+                  'last_modified': '1970-01-01T00:00:01.000000'}]
+        # the lower shard is expected to fill the limit on its own
+        statuses, headers, bodies = self._shard_listing_responses(
+            [lower], object_count=5)
+        req = Request.blank('/v1/a/c?limit=1')
+        with mocked_http_conn(*statuses, headers=headers,
+                              body_iter=bodies) as fake_conn:
+            resp = req.get_response(self.app)
+        self.assertEqual(200, resp.status_int)
+        self.assertEqual('o1\n', resp.body)
+        self.assertEqual(3, len(fake_conn.requests))
+        self.assertNotIn('shard_listing.concurrent',
+                         self.logger.get_increment_counts())
+
+    def test_bad_shard_listing_concurrency(self):
+        self.assertRaises(ValueError, proxy_server.Application,
+                          {'shard_listing_concurrency': '0'}, FakeMemcache(),
+                          account_ring=FakeRing(),
+                          container_ring=self.container_ring)
+
+    def test_GET_sharded_container_shard_ranges_unavailable(self):
+        req = Request.blank('/v1/a/c')
+        statuses = [200] + [503] * (self.CONTAINER_REPLICAS * 2)
+        headers = [{'X-Backend-Sharding-State': 'sharded'}] + \
+            [{}] * (self.CONTAINER_REPLICAS * 2)
+        with mocked_http_conn(*statuses, headers=headers):
+            resp = req.get_response(self.app)
+        self.assertEqual(503, resp.status_int)
+
 
 @patch_policies(
     [StoragePolicy(0, 'zero', True, object_ring=FakeRing(replicas=4))])
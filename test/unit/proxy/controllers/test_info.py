@@ -162,6 +162,32 @@ class TestInfoController(unittest.TestCase):
         self.assertIn('quux', info['admin']['qux'])
         self.assertEqual(info['admin']['qux']['quux'], 'corge')
 
+    def test_get_admin_info_node_latency(self):
+        controller = self.get_controller(expose_info=True,
+                                         admin_key='secret-admin-key')
+        latencies = {'127.0.0.1:6010/sda': {'latency': 0.25,
+                                            'outstanding': 1}}
+        controller.app.sorting_method = 'latency'
+        controller.app.get_node_latencies.return_value = latencies
+        utils._swift_info = {'foo': {'bar': 'baz'}}
+        utils._swift_admin_info = {'qux': {'quux': 'corge'}}
+
+        expires = int(time.time() + 86400)
+        sig = utils.get_hmac('GET', '/info', expires, 'secret-admin-key')
+        path = '/info?swiftinfo_sig={sig}&swiftinfo_expires={expires}'.format(
+            sig=sig, expires=expires)
+        resp = controller.GET(Request.blank(
+            path, environ={'REQUEST_METHOD': 'GET'}))
+        self.assertEqual('200 OK', str(resp))
+        info = json.loads(resp.body)
+        self.assertEqual(latencies, info['admin']['node_latency'])
+
+        # which is only shown to admins
+        resp = controller.GET(Request.blank(
+            '/info', environ={'REQUEST_METHOD': 'GET'}))
+        self.assertEqual('200 OK', str(resp))
+        self.assertNotIn('admin', json.loads(resp.body))
+
     def test_head_admin_info(self):
         controller = self.get_controller(expose_info=True,
                                          admin_key='secret-admin-key')
@@ -591,6 +591,49 @@ class TestReplicatedObjController(BaseObjectControllerMixin,
             resp = req.get_response(self.app)
         self.assertEqual(resp.status_int, 201)
 
+    def _check_PUT_updates_shard(self, sharding_state):
+        self.app.container_info['sharding_state'] = sharding_state
+        shard_ranges = [
+            utils.ShardRange('.shards_a/c-lower', Timestamp(1), '', 'm'),
+            utils.ShardRange('.shards_a/c-upper', Timestamp(1), 'm', ''),
+        ]
+        self.app.memcache.set('shard-updating/a/c',
+                              [dict(sr) for sr in shard_ranges])
+        shard_part, shard_nodes = self.app.container_ring.get_nodes(
+            '.shards_a', 'c-upper')
+        req = swift.common.swob.Request.blank('/v1/a/c/o', method='PUT')
+        req.headers['content-length'] = '0'
+        put_headers = []
+
+        def capture_headers(ip, port, device, part, method, path, headers,
+                            **kwargs):
+            put_headers.append(headers)
+
+        with set_http_connect(201, 201, 201, give_connect=capture_headers):
+            resp = req.get_response(self.app)
+        self.assertEqual(resp.status_int, 201)
+        self.assertEqual(3, len(put_headers))
+        for headers in put_headers:
+            self.assertEqual('.shards_a/c-upper',
+                             headers['X-Backend-Container-Path'])
+            self.assertEqual(str(shard_part), headers['X-Container-Partition'])
+        self.assertEqual(
+            sorted('%(ip)s:%(port)s' % node for node in shard_nodes),
+            sorted(headers['X-Container-Host'] for headers in put_headers))
+        # the shard ranges are cached for the rest of the request
+        self.assertEqual(
+            [dict(sr) for sr in shard_ranges],
+            [dict(sr) for sr in
+             req.environ['swift.infocache']['shard-updating/a/c']])
+
+    def test_PUT_sharded_container_updates_shard(self):
+        self._check_PUT_updates_shard('sharded')
+
+    def test_PUT_sharding_container_updates_shard(self):
+        # the root's remaining rows are being moved: new ones go straight
+        # to the shards
+        self._check_PUT_updates_shard('sharding')
+
     def test_PUT_error_with_footers(self):
         footers_callback = make_footers_callback('')
         env = {'swift.callback.update_footers': footers_callback}
@@ -1666,6 +1709,47 @@ class TestECObjController(BaseObjectControllerMixin, unittest.TestCase):
         self.assertEqual(len(real_body), len(resp.body))
         self.assertEqual(real_body, resp.body)
 
+    def test_GET_with_body_decoded_in_threadpool(self):
+        self.app.ec_decode_read_ahead_segments = 3
+        self.app.ec_decode_in_threadpool = True
+        segment_size = self.policy.ec_segment_size
+        test_data = ('test' * segment_size)[:-333]
+        etag = md5(test_data).hexdigest()
+        ec_archive_bodies = self._make_ec_archive_bodies(test_data)
+        headers = {'X-Object-Sysmeta-Ec-Etag': etag,
+                   'X-Object-Sysmeta-Ec-Content-Length': len(test_data)}
+        responses = [(200, body, self._add_frag_index(i, headers))
+                     for i, body in enumerate(ec_archive_bodies)]
+        responses = responses[:self.policy.ec_ndata]
+        status_codes, body_iter, headers = zip(*responses)
+
+        req = swift.common.swob.Request.blank('/v1/a/c/o')
+        with set_http_connect(*status_codes, body_iter=body_iter,
+                              headers=headers), \
+                mock.patch('swift.proxy.controllers.obj.tpool_reraise',
+                           side_effect=utils.tpool_reraise) as mock_tpool:
+            resp = req.get_response(self.app)
+            self.assertEqual(resp.status_int, 200)
+            self.assertEqual(md5(resp.body).hexdigest(), etag)
+        # every segment was decoded in the thread pool
+        self.assertEqual(4, mock_tpool.call_count)
+
+        with set_http_connect(*status_codes, body_iter=body_iter,
+                              headers=headers), \
+                mock.patch.object(self.policy.pyeclib_driver, 'decode',
+                                  side_effect=ECDriverError('kaboom')):
+            resp = req.get_response(self.app)
+        # the first segment is decoded before the response starts
+        self.assertEqual(resp.status_int, 500)
+        error_lines = self.logger.get_lines_for_level('error')
+        self.assertIn('Error decoding fragments', error_lines[0])
+
+    def test_bad_ec_decode_read_ahead_segments(self):
+        self.assertRaises(ValueError, PatchedObjControllerApp,
+                          {'ec_decode_read_ahead_segments': '0'},
+                          FakeMemcache(), account_ring=FakeRing(),
+                          container_ring=FakeRing(), logger=self.logger)
+
     def test_PUT_simple(self):
         req = swift.common.swob.Request.blank('/v1/a/c/o', method='PUT',
                                               body='')
@@ -1918,6 +2002,75 @@ class TestECObjController(BaseObjectControllerMixin, unittest.TestCase):
 
         self.assertEqual(resp.status_int, 500)
 
+    def test_chunk_transformer(self):
+        segment_size = self.policy.ec_segment_size
+        body = ''.join(chr(i % 251) for i in range(segment_size * 7 // 2))
+        nstreams = self.replicas()
+
+        def transform(**kwargs):
+            transformer = obj.chunk_transformer(self.policy, nstreams,
+                                                **kwargs)
+            transformer.send(None)
+            archives = [''] * nstreams
+            for i in range(0, len(body), 1000):
+                frags = transformer.send(body[i:i + 1000])
+                if frags is not None:
+                    self.assertEqual(nstreams, len(frags))
+                    archives = [a + f for a, f in zip(archives, frags)]
+            frags = transformer.send('')
+            return [a + f for a, f in zip(archives, frags)]
+
+        expected = transform()
+        self.assertEqual(expected, transform(batch_segments=2))
+        with mock.patch('swift.proxy.controllers.obj.tpool_reraise',
+                        side_effect=utils.tpool_reraise) as mock_tpool:
+            self.assertEqual(expected, transform(
+                batch_segments=2, encode_in_threadpool=True))
+        # three whole segments in batches of two, then the last one and a
+        # half are encoded when flushed
+        self.assertEqual(1, mock_tpool.call_count)
+        with mock.patch('swift.proxy.controllers.obj.tpool_reraise',
+                        side_effect=utils.tpool_reraise) as mock_tpool:
+            self.assertEqual(expected, transform(encode_in_threadpool=True))
+        self.assertEqual(3, mock_tpool.call_count)
+
+    def test_chunk_transformer_empty(self):
+        transformer = obj.chunk_transformer(
+            self.policy, self.replicas(), encode_in_threadpool=True)
+        transformer.send(None)
+        self.assertEqual([''] * self.replicas(), transformer.send(''))
+
+    def test_bad_ec_encode_batch_segments(self):
+        self.assertRaises(ValueError, PatchedObjControllerApp,
+                          {'ec_encode_batch_segments': '0'}, FakeMemcache(),
+                          account_ring=FakeRing(),
+                          container_ring=FakeRing(), logger=self.logger)
+
+    def test_PUT_with_body_encoded_in_threadpool(self):
+        self.app.ec_encode_batch_segments = 2
+        self.app.ec_encode_in_threadpool = True
+        test_body = 'x' * (self.policy.ec_segment_size * 5 + 10)
+        req = swift.common.swob.Request.blank(
+            '/v1/a/c/o', method='PUT', body=test_body)
+        codes = [201] * self.replicas()
+        expect_headers = {
+            'X-Obj-Metadata-Footer': 'yes',
+            'X-Obj-Multiphase-Commit': 'yes'
+        }
+        put_requests = defaultdict(list)
+
+        def capture_body(conn, chunk):
+            put_requests[conn.connection_id].append(chunk)
+
+        with set_http_connect(*codes, expect_headers=expect_headers,
+                              give_send=capture_body), \
+                mock.patch('swift.proxy.controllers.obj.tpool_reraise',
+                           side_effect=utils.tpool_reraise) as mock_tpool:
+            resp = req.get_response(self.app)
+        self.assertEqual(resp.status_int, 201)
+        self.assertTrue(mock_tpool.called)
+        self.assertEqual(self.replicas(), len(put_requests))
+
     def test_PUT_with_body(self):
         segment_size = self.policy.ec_segment_size
         test_body = ('asdf' * segment_size)[:-10]
@@ -3264,6 +3417,51 @@ class TestECObjController(BaseObjectControllerMixin, unittest.TestCase):
         self.assertEqual(log_lines,
                          ['Problem with fragment response: ETag mismatch'] * 7)
 
+    def test_GET_range_data_fragments_first(self):
+        self.app.ec_data_fragments_first = True
+        fragment_size = self.policy.fragment_size
+        ec_stub = self._make_ec_object_stub()
+        frag_archives = ec_stub['frags']
+        headers = {
+            'Content-Type': 'text/plain',
+            'Content-Length': fragment_size,
+            'Content-Range': 'bytes 0-%s/%s' % (fragment_size - 1,
+                                                len(frag_archives[0])),
+            'X-Object-Sysmeta-Ec-Content-Length': len(ec_stub['body']),
+            'X-Object-Sysmeta-Ec-Etag': ec_stub['etag'],
+            'X-Timestamp': Timestamp(self._ts_iter.next()).normal,
+        }
+        missing = set()
+
+        def get_response(req):
+            # the fake ring's primaries are at 10.0.0.<frag index>
+            index = int(req['ip'].rsplit('.', 1)[1])
+            if index in missing:
+                return StubResponse(404)
+            return StubResponse(206, frag_archives[index][:fragment_size],
+                                headers, index)
+
+        req = swob.Request.blank('/v1/a/c/o', headers={'Range': 'bytes=0-3'})
+        with capture_http_requests(get_response) as log:
+            resp = req.get_response(self.app)
+        self.assertEqual(resp.status_int, 206)
+        self.assertEqual(resp.body, 'test')
+        # only the nodes holding data fragments were asked
+        self.assertEqual(
+            ['10.0.0.%d' % i for i in range(self.policy.ec_ndata)],
+            sorted((conn.req['ip'] for conn in log),
+                   key=lambda ip: int(ip.rsplit('.', 1)[1])))
+
+        # a missing data fragment is made up from parity
+        missing.add(0)
+        with capture_http_requests(get_response) as log:
+            resp = req.get_response(self.app)
+        self.assertEqual(resp.status_int, 206)
+        self.assertEqual(resp.body, 'test')
+        self.assertEqual(self.policy.ec_ndata + 1, len(log))
+        self.assertGreaterEqual(int(log[-1].req['ip'].rsplit('.', 1)[1]),
+                                self.policy.ec_ndata)
+
     def test_GET_mixed_success_with_range(self):
         fragment_size = self.policy.fragment_size
 
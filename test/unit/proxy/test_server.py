@@ -497,6 +497,7 @@ class TestController(unittest.TestCase):
 
     def test_get_account_info_returns_values_as_strings(self):
         app = mock.MagicMock()
+        app.info_cache = None
         app.memcache = mock.MagicMock()
         app.memcache.get = mock.MagicMock()
         app.memcache.get.return_value = {
@@ -522,6 +523,7 @@ class TestController(unittest.TestCase):
 
     def test_get_container_info_returns_values_as_strings(self):
         app = mock.MagicMock()
+        app.info_cache = None
         app.memcache = mock.MagicMock()
         app.memcache.get = mock.MagicMock()
         app.memcache.get.return_value = {
@@ -750,6 +752,171 @@ class TestProxyServer(unittest.TestCase):
                        {'ip': '127.0.0.1'}]
         self.assertEqual(res, exp_sorting)
 
+    def test_node_latency(self):
+        baseapp = proxy_server.Application({'sorting_method': 'latency',
+                                            'latency_smoothing': '0.5'},
+                                           FakeMemcache(),
+                                           container_ring=FakeRing(),
+                                           account_ring=FakeRing())
+        nodes = [{'ip': '127.0.0.%d' % i, 'port': 6010, 'device': 'sda'}
+                 for i in range(1, 4)]
+        for node, latency in zip(nodes, (0.3, 0.1, 0.2)):
+            baseapp.start_node_request(node)
+            baseapp.end_node_request(node, latency)
+        # the moving average takes the first sample as is, then smooths
+        baseapp.start_node_request(nodes[2])
+        baseapp.end_node_request(nodes[2], 0.4)
+        self.assertEqual({
+            '127.0.0.1:6010/sda': {'latency': 0.3, 'outstanding': 0},
+            '127.0.0.2:6010/sda': {'latency': 0.1, 'outstanding': 0},
+            '127.0.0.3:6010/sda': {'latency': 0.3, 'outstanding': 0},
+        }, baseapp.get_node_latencies())
+
+        # the slowest node always goes last; the fastest is first whenever
+        # it's one of the two nodes compared first
+        with mock.patch('swift.proxy.server.shuffle', lambda l: l):
+            self.assertEqual(
+                [nodes[1], nodes[0], nodes[2]],
+                baseapp.sort_nodes([nodes[0], nodes[1], nodes[2]]))
+            self.assertEqual(
+                [nodes[0], nodes[1], nodes[2]],
+                baseapp.sort_nodes([nodes[0], nodes[2], nodes[1]]))
+
+        # requests in flight make a node look slower
+        baseapp.start_node_request(nodes[1])
+        baseapp.start_node_request(nodes[1])
+        baseapp.start_node_request(nodes[1])
+        with mock.patch('swift.proxy.server.shuffle', lambda l: l):
+            self.assertEqual(
+                [nodes[0], nodes[2], nodes[1]],
+                baseapp.sort_nodes([nodes[0], nodes[1], nodes[2]]))
+        self.assertEqual(
+            3, baseapp.get_node_latencies()['127.0.0.2:6010/sda'][
+                'outstanding'])
+
+        # samples older than timing_expiry are forgotten
+        the_future = time.time() + baseapp.timing_expiry + 1
+        with mock.patch('swift.proxy.server.time', lambda: the_future), \
+                mock.patch('swift.proxy.server.shuffle', lambda l: l):
+            self.assertEqual(
+                [nodes[0], nodes[1], nodes[2]],
+                baseapp.sort_nodes([nodes[0], nodes[1], nodes[2]]))
+            baseapp.end_node_request(nodes[1], 0.5)
+        self.assertEqual(
+            {'latency': 0.5, 'outstanding': 2},
+            baseapp.get_node_latencies()['127.0.0.2:6010/sda'])
+
+    def test_node_latency_failed_requests(self):
+        baseapp = proxy_server.Application({'sorting_method': 'latency',
+                                            'node_timeout': '5'},
+                                           FakeMemcache(),
+                                           container_ring=FakeRing(),
+                                           account_ring=FakeRing())
+        req = Request.blank('/v1/account', environ={'REQUEST_METHOD': 'HEAD'})
+        baseapp.update_request(req)
+        with mocked_http_conn(Exception('boom'), Exception('boom'),
+                              Exception('boom')):
+            resp = baseapp.handle_request(req)
+        self.assertEqual(resp.status_int, 503)
+        latencies = baseapp.get_node_latencies()
+        self.assertEqual(3, len(latencies))
+        # the quick failures are counted as timeouts
+        for stats in latencies.values():
+            self.assertEqual({'latency': 5.0, 'outstanding': 0}, stats)
+
+    def test_node_latency_error_responses(self):
+        baseapp = proxy_server.Application({'sorting_method': 'latency',
+                                            'node_timeout': '5'},
+                                           FakeMemcache(),
+                                           container_ring=FakeRing(),
+                                           account_ring=FakeRing())
+        req = Request.blank('/v1/account', environ={'REQUEST_METHOD': 'HEAD'})
+        baseapp.update_request(req)
+        # the first node answers quickly, but with an error
+        with mocked_http_conn(507, 204):
+            resp = baseapp.handle_request(req)
+        self.assertEqual(resp.status_int, 204)
+        latencies = baseapp.get_node_latencies()
+        self.assertEqual(2, len(latencies))
+        good_key, failed_key = sorted(
+            latencies, key=lambda key: latencies[key]['latency'])
+        # is counted as a timeout, while the node that served the request
+        # gets its real latency
+        self.assertEqual({'latency': 5.0, 'outstanding': 0},
+                         latencies[failed_key])
+        self.assertLess(latencies[good_key]['latency'], 1.0)
+
+    def test_bad_latency_smoothing(self):
+        for value in ('0', '-1', '1.5'):
+            self.assertRaises(ValueError, proxy_server.Application,
+                              {'latency_smoothing': value}, FakeMemcache(),
+                              container_ring=FakeRing(),
+                              account_ring=FakeRing())
+
+    def test_trace(self):
+        baseapp = proxy_server.Application(
+            {'trace_sample_rate': '1', 'trace_response_header': 'yes'},
+            FakeMemcache(), container_ring=FakeRing(),
+            account_ring=FakeRing())
+        with save_globals():
+            set_http_connect(200, 200)
+            req = Request.blank('/v1/a/c', environ={'reseller_request': True})
+            resp = baseapp.handle_request(req)
+        self.assertEqual(200, resp.status_int)
+        trace = req.environ['swift.trace']
+        names = [name for name, duration in trace.spans]
+        self.assertEqual(['info_memcache', 'get_info.account'], names[:2])
+        self.assertTrue(names[2].startswith('connect.'))
+        self.assertTrue(names[3].startswith('first_byte.'))
+        self.assertEqual('handler', names[-1])
+        self.assertEqual(str(trace), resp.headers['X-Proxy-Trace'])
+
+        # only reseller admins see the trace
+        with save_globals():
+            set_http_connect(200, 200)
+            req = Request.blank('/v1/a/c')
+            resp = baseapp.handle_request(req)
+        self.assertIn('swift.trace', req.environ)
+        self.assertNotIn('X-Proxy-Trace', resp.headers)
+
+        # nothing is traced by default
+        baseapp = proxy_server.Application({}, FakeMemcache(),
+                                           container_ring=FakeRing(),
+                                           account_ring=FakeRing())
+        with save_globals():
+            set_http_connect(200, 200)
+            req = Request.blank('/v1/a/c', environ={'reseller_request': True})
+            resp = baseapp.handle_request(req)
+        self.assertNotIn('swift.trace', req.environ)
+        self.assertNotIn('X-Proxy-Trace', resp.headers)
+
+    def test_bad_trace_sample_rate(self):
+        for value in ('-0.1', '1.5'):
+            self.assertRaises(ValueError, proxy_server.Application,
+                              {'trace_sample_rate': value}, FakeMemcache(),
+                              container_ring=FakeRing(),
+                              account_ring=FakeRing())
+
+    def test_backend_keepalive(self):
+        baseapp = proxy_server.Application({}, FakeMemcache(),
+                                           container_ring=FakeRing(),
+                                           account_ring=FakeRing())
+        self.assertIsNone(baseapp.backend_pool)
+        baseapp = proxy_server.Application(
+            {'backend_keepalive': 'yes', 'backend_max_idle_per_node': '4',
+             'backend_idle_timeout': '5'}, FakeMemcache(),
+            container_ring=FakeRing(), account_ring=FakeRing())
+        pool = baseapp.backend_pool
+        self.assertEqual(4, pool.max_idle_per_node)
+        self.assertEqual(5, pool.idle_timeout)
+        self.assertIs(baseapp.logger, pool.logger)
+        with mock.patch('swift.proxy.controllers.base.http_connect') as \
+                mock_connect:
+            proxy_base.backend_connect(baseapp, '1.2.3.4', 6200, 'sda', 1,
+                                       'HEAD', '/a', headers={})
+        mock_connect.assert_called_once_with(
+            '1.2.3.4', 6200, 'sda', 1, 'HEAD', '/a', headers={}, pool=pool)
+
     def test_node_affinity(self):
         baseapp = proxy_server.Application({'sorting_method': 'affinity',
                                             'read_affinity': 'r1=1'},